@@ -24,12 +24,15 @@ from pisa.core.param import ParamSet
 from pisa.utils.comparisons import recursiveEquality
 from pisa.utils.log import logging
 from pisa.utils.fileio import to_file
-from pisa.utils.stats import METRICS_TO_MAXIMIZE, METRICS_TO_MINIMIZE
+from pisa.utils.parallel import ReplicaPool
+from pisa.utils.stats import (METRIC_GRADIENTS, METRICS_TO_MAXIMIZE,
+                              METRICS_TO_MINIMIZE)
 
 
-__all__ = ['MINIMIZERS_USING_SYMM_GRAD',
+__all__ = ['MINIMIZERS_USING_SYMM_GRAD', 'OCTANT_SCAN_POINTS',
            'set_minimizer_defaults', 'validate_minimizer_settings',
-           'Counter', 'Analysis']
+           'check_t23_octant', 'reflect_t23_into_range', 'Counter',
+           'Analysis']
 
 __author__ = 'J.L. Lanfranchi, P. Eller, S. Wren, E. Bourbeau'
 
@@ -52,6 +55,10 @@ MINIMIZERS_USING_SYMM_GRAD = ('l-bfgs-b', 'slsqp')
 """Minimizers that use symmetrical steps on either side of a point to compute
 gradients. See https://github.com/scipy/scipy/issues/4916"""
 
+OCTANT_SCAN_POINTS = 5
+"""Default number of theta23 values at which the metric is evaluated to decide
+whether a fit in the other octant is worthwhile, see `Analysis.fit_hypo`"""
+
 def merge_mapsets_together(mapset_list=None):
     '''Handle merging of multiple MapSets, when they come in
     the shape of a dict
@@ -321,6 +328,29 @@ def get_separate_t23_octant_params(hypo_maker, inflection_point) :
     return theta23_orig, theta23_case1, theta23_case2
 
 
+def reflect_t23_into_range(theta23, inflection_point, valid_range,
+                           tolerance=0.1*ureg.degree):
+    """Reflect a theta23 value about `inflection_point` (i.e., into the other
+    octant) and clip it to lie at least `tolerance` within `valid_range`.
+
+    Parameters
+    ----------
+    theta23 : quantity
+    inflection_point : quantity
+    valid_range : sequence of two quantities
+    tolerance : quantity
+
+    Returns
+    -------
+    reflected : quantity
+
+    """
+    reflected = 2*inflection_point - theta23
+    lower = valid_range[0] + tolerance
+    upper = valid_range[1] - tolerance
+    return min(max(reflected, lower), upper)
+
+
 # TODO: move this to a central location prob. in utils
 class Counter(object):
     """Simple counter object for use as a minimizer callback."""
@@ -335,6 +365,7 @@ class Counter(object):
 
     def __iadd__(self, inc):
         self._count += inc
+        return self
 
     def reset(self):
         """Reset counter"""
@@ -359,12 +390,55 @@ class Analysis(object):
     """
     def __init__(self):
         self._nit = 0
+        self._gradient_pool = None
+
+    def start_gradient_workers(self, hypo_maker, num_workers=None):
+        """Fork worker processes holding replicas of `hypo_maker`, which
+        are subsequently used by `fit_hypo_inner` to evaluate the perturbed
+        points of numerical gradients in parallel (the minimizer is then
+        passed the gradient as `jac`).
+
+        The replicas share the (read-only) event arrays of `hypo_maker`,
+        which are moved to shared memory until `stop_gradient_workers` is
+        called (see `Pipeline.share_arrays`), and the current params of
+        `hypo_maker` are sent to them along with every gradient evaluation,
+        so they can be reused across fits with the same `hypo_maker`.
+
+        Parameters
+        ----------
+        hypo_maker : Detectors or DistributionMaker
+            Fully set-up hypo maker; the workers are only used in fits with
+            this very object.
+
+        num_workers : int or None
+            Number of worker processes, ideally the number of free params
+            (or a divisor thereof). If None, default is
+            `pisa.OMP_NUM_THREADS`.
+
+        """
+        self.stop_gradient_workers()
+        self._gradient_pool = ReplicaPool(
+            obj=hypo_maker,
+            func=self._replica_minimizer_callable,
+            num_workers=num_workers,
+            shared=[hypo_maker]
+        )
+
+    def stop_gradient_workers(self):
+        """Shut down worker processes started by `start_gradient_workers`,
+        if any."""
+        if self._gradient_pool is not None:
+            self._gradient_pool.close()
+            self._gradient_pool = None
 
     def fit_hypo(self, data_dist, hypo_maker, hypo_param_selections, metric,
                  minimizer_settings, reset_free=True, 
                  check_octant=True, fit_octants_separately=True,
                  check_ordering=False, other_metrics=None,
-                 blind=False, pprint=True, external_priors_penalty=None):
+                 blind=False, pprint=True, external_priors_penalty=None,
+                 analytic_gradients=False, warm_start_octant=False,
+                 octant_skip_threshold=None,
+                 octant_scan_points=OCTANT_SCAN_POINTS):
         """Fitter "outer" loop: If `check_octant` is True, run
         `fit_hypo_inner` starting in each octant of theta23 (assuming that
         is a param in the `hypo_maker`). Otherwise, just run the inner
@@ -439,6 +513,32 @@ class Analysis(object):
             User defined prior penalty function. Adds an extra penalty
             to the metric that is minimized, depending on the input function.
 
+        analytic_gradients : bool
+            Pass the gradient of the metric to the minimizer, using analytic
+            derivatives where the stages provide them. See `fit_hypo_inner`.
+
+        warm_start_octant : bool
+            Start the fit in the other octant of theta23 from the best fit
+            found in the first octant (with theta23 reflected about 45 deg)
+            instead of from the nominal values of the free params, which
+            usually saves most of its minimizer iterations. Ignored for blind
+            fits.
+
+        octant_skip_threshold : None or float
+            If not None, the metric is first evaluated at `octant_scan_points`
+            values of theta23 spread over the other octant, with all other
+            params fixed at the first octant's best fit (a cheap scan in lieu
+            of profiling); the full fit in the other octant is only run (and
+            started at the best of these points) if the best scan point's
+            metric is within `octant_skip_threshold` of the first fit's.
+            Since the other params are not re-optimized in the scan, this is
+            a heuristic: choose the threshold large compared to the shift of
+            the metric expected from re-fitting them. Implies
+            `warm_start_octant`; ignored for blind fits.
+
+        octant_scan_points : int
+            Number of theta23 values of the scan, see `octant_skip_threshold`
+
 
         Returns
         -------
@@ -506,14 +606,25 @@ class Analysis(object):
                 other_metrics=other_metrics,
                 pprint=pprint,
                 blind=blind,
-                external_priors_penalty=external_priors_penalty
+                external_priors_penalty=external_priors_penalty,
+                analytic_gradients=analytic_gradients
             )
             
 
             # Decide whether fit for other octant is necessary
             if peforming_octant_check :
                 logging.debug('checking other octant of theta23')
-                if reset_free:
+                warm_start = (
+                    (warm_start_octant or octant_skip_threshold is not None)
+                    and not blind
+                )
+                if warm_start:
+                    # Nuisance params start where the first fit converged
+                    hypo_maker.update_params(deepcopy(ParamSet([
+                        param for param in best_fit_info['params'].free
+                        if param.name != 'theta23'
+                    ])))
+                elif reset_free:
                     hypo_maker.reset_free()
                 else:
                     for param in minimizer_start_params:
@@ -522,6 +633,11 @@ class Analysis(object):
                 #Determine new values for theta23 parameter in the other octant
                 if fit_octants_separately :
                     #Use with the second case
+                    if warm_start:
+                        theta23_case2.value = reflect_t23_into_range(
+                            best_fit_info['params'].theta23.value,
+                            inflection_point, theta23_case2.range
+                        )
                     hypo_maker.update_params(theta23_case2)
                 else :
                     # Hop to other octant by reflecting about 45 deg
@@ -529,6 +645,50 @@ class Analysis(object):
                     theta23.value = 2*inflection_point - theta23.value
                     hypo_maker.update_params(theta23)
 
+                skip_other_octant = False
+                if octant_skip_threshold is not None and not blind:
+                    theta23 = hypo_maker.params.theta23
+                    if theta23.value < inflection_point:
+                        octant = (theta23.range[0], inflection_point)
+                    else:
+                        octant = (inflection_point, theta23.range[1])
+                    scan_metric_val, scan_theta23 = self._scan_t23_octant(
+                        data_dist=data_dist,
+                        hypo_maker=hypo_maker,
+                        metric=metric,
+                        octant=octant,
+                        num_points=octant_scan_points,
+                        external_priors_penalty=external_priors_penalty
+                    )
+                    sign = -1 if metric[0] in METRICS_TO_MAXIMIZE else +1
+                    metric_gap = (
+                        sign*scan_metric_val - sign*best_fit_info['metric_val']
+                    )
+                    skip_other_octant = metric_gap > octant_skip_threshold
+                    if skip_other_octant:
+                        logging.debug(
+                            'Skipping fit in other octant of theta23: best'
+                            ' metric of scan is worse by %s than first fit',
+                            metric_gap
+                        )
+                    else:
+                        theta23.value = scan_theta23
+                        hypo_maker.update_params(theta23)
+
+            if peforming_octant_check and skip_other_octant:
+                # Keep the first fit; restore its params (and the theta23 range)
+                theta23_best = best_fit_info['params'].theta23.value
+                if fit_octants_separately:
+                    theta23_orig.value = theta23_best
+                    hypo_maker.update_params(theta23_orig)
+                    best_fit_info['params'].theta23.range = deepcopy(
+                        theta23_orig.range
+                    )
+                hypo_maker.update_params(
+                    deepcopy(best_fit_info['params'].free)
+                )
+
+            elif peforming_octant_check:
                 # Re-run minimizer starting at new point
                 new_fit_info = self.fit_hypo_inner(
                     hypo_maker=hypo_maker,
@@ -538,7 +698,8 @@ class Analysis(object):
                     other_metrics=other_metrics,
                     pprint=pprint,
                     blind=blind,
-                    external_priors_penalty=external_priors_penalty
+                    external_priors_penalty=external_priors_penalty,
+                    analytic_gradients=analytic_gradients
                 )
 
                 # Check to make sure these two fits were either side of 45
@@ -574,7 +735,8 @@ class Analysis(object):
                             other_metrics=other_metrics,
                             pprint=pprint,
                             blind=blind,
-                            external_priors_penalty=external_priors_penalty
+                            external_priors_penalty=external_priors_penalty,
+                            analytic_gradients=analytic_gradients
                         )
                         # Make sure the new octant is sensible
                         check_t23_octant(new_fit_info)
@@ -616,8 +778,52 @@ class Analysis(object):
 
         return best_fit_info, alternate_fits
 
+    def _scan_t23_octant(self, data_dist, hypo_maker, metric, octant,
+                         num_points, external_priors_penalty=None):
+        """Evaluate the metric at `num_points` values of theta23 spread evenly
+        over `octant`, and at its current value, keeping all other params
+        fixed.
+
+        Returns
+        -------
+        metric_val : float
+            Best metric value found
+        theta23 : quantity
+            Value of theta23 at which it was found
+
+        """
+        theta23 = hypo_maker.params.theta23
+        tolerance = (0.1*ureg.degree).to(theta23.units)
+        lower = (octant[0] + tolerance).m_as(theta23.units)
+        upper = (octant[1] - tolerance).m_as(theta23.units)
+        values = [theta23.value] + [
+            v * theta23.units for v in np.linspace(lower, upper, num_points)
+        ]
+        counter = Counter()
+        best = None
+        for value in values:
+            theta23.value = value
+            hypo_maker.update_params(theta23)
+            # returns the metric with sign flipped if it is to be maximized
+            signed_metric_val = self._minimizer_callable(
+                scaled_param_vals=hypo_maker.params.free._rescaled_values, # pylint: disable=protected-access
+                hypo_maker=hypo_maker,
+                data_dist=data_dist,
+                metric=metric,
+                counter=counter,
+                fit_history=[],
+                pprint=False,
+                blind=False,
+                external_priors_penalty=external_priors_penalty
+            )
+            if best is None or signed_metric_val < best[0]:
+                best = (signed_metric_val, value)
+        sign = -1 if metric[0] in METRICS_TO_MAXIMIZE else +1
+        return sign*best[0], best[1]
+
     def fit_hypo_inner(self, data_dist, hypo_maker, metric, minimizer_settings,
-                       other_metrics=None, pprint=True, blind=False, external_priors_penalty=None):
+                       other_metrics=None, pprint=True, blind=False, external_priors_penalty=None,
+                       analytic_gradients=False):
         """Fitter "inner" loop: Run an arbitrary scipy minimizer to modify
         hypo dist maker's free params until the data_dist is most likely to have
         come from this hypothesis.
@@ -649,6 +855,19 @@ class Analysis(object):
         external_priors_penalty : func
             User defined prior penalty function
 
+        analytic_gradients : bool
+            If True, the gradient of the metric is computed alongside the
+            metric and passed to the minimizer (as `jac`). Derivatives w.r.t.
+            params that all stages depending on them can differentiate (e.g.
+            hypersurface params, normalisations, Barr params) are computed
+            analytically; only the remaining free params are differentiated
+            numerically. Requires a `DistributionMaker` and a metric in
+            `pisa.utils.stats.METRIC_GRADIENTS`, otherwise the minimizer
+            falls back to its own finite differences.
+            Independently of this flag, if worker processes were started for
+            `hypo_maker` via `start_gradient_workers`, the numerical part of
+            the gradient is evaluated by these in parallel.
+
 
         Returns
         -------
@@ -727,6 +946,32 @@ class Analysis(object):
         fit_history = []
         fit_history.append(list(metric) + [v.name for v in hypo_maker.params.free])
 
+        args = (hypo_maker, data_dist, metric, counter, fit_history, pprint,
+                blind, external_priors_penalty)
+        if analytic_gradients and (
+                isinstance(hypo_maker, Detectors)
+                or metric[0] not in METRIC_GRADIENTS):
+            logging.warning(
+                'Analytic gradients are not available for metric %s and/or'
+                ' hypo maker of type %s; the minimizer will compute numerical'
+                ' gradients instead.', metric[0], type(hypo_maker).__name__
+            )
+            analytic_gradients = False
+        parallel_gradients = (
+            self._gradient_pool is not None
+            and self._gradient_pool.obj is hypo_maker
+        )
+        if analytic_gradients or parallel_gradients:
+            fun = self._minimizer_callable_with_gradient
+            jac = True
+            args += (
+                minimizer_settings['options']['value'].get('eps', 1e-8),
+                analytic_gradients
+            )
+        else:
+            fun = self._minimizer_callable
+            jac = None
+
         start_t = time.time()
 
         if pprint and not blind:
@@ -764,10 +1009,10 @@ class Analysis(object):
         # iterates, no matter what you do 
         #
         optimize_result = optimize.minimize(
-            fun=self._minimizer_callable,
+            fun=fun,
             x0=x0,
-            args=(hypo_maker, data_dist, metric, counter, fit_history, pprint,
-                  blind, external_priors_penalty),
+            args=args,
+            jac=jac,
             bounds=bounds,
             method=minimizer_settings['method']['value'],
             options=minimizer_settings['options']['value'],
@@ -1151,6 +1396,8 @@ class Analysis(object):
                                                metric=metric[0], metric_kwargs=metric_kwargs)
                         + hypo_maker.params.priors_penalty(metric=metric[0])
                     )
+            if external_priors_penalty is not None:
+                metric_val += external_priors_penalty(hypo_maker=hypo_maker, metric=metric[0])
         except Exception as e:
             if blind:
                 logging.error('Minimizer failed')
@@ -1189,6 +1436,185 @@ class Analysis(object):
             
         return sign*metric_val
 
+    def _minimizer_callable_with_gradient(self, scaled_param_vals, hypo_maker,
+                                          data_dist, metric, counter,
+                                          fit_history, pprint, blind,
+                                          external_priors_penalty=None,
+                                          fd_step=1e-8, analytic=True):
+        """Same as `_minimizer_callable` but additionally returns the gradient
+        of the (signed) metric w.r.t. the rescaled free params, for use with
+        `jac=True` in scipy.optimize minimizers.
+
+        If `analytic`, derivatives of the expected distribution w.r.t. params
+        that the stages can differentiate analytically (see
+        `DistributionMaker.get_output_gradients`) are combined with the
+        derivative of the metric w.r.t. the expected bin contents; prior
+        penalties (including `external_priors_penalty`) of these params are
+        differentiated numerically, which does not require evaluating the
+        pipelines. All other free params are
+        differentiated by forward finite differences of step `fd_step` (in
+        rescaled units) of the full metric. If worker processes were started
+        for `hypo_maker` (see `start_gradient_workers`), the perturbed points
+        are evaluated by these in parallel while the central point is
+        evaluated in this process.
+
+        Parameters
+        ----------
+        scaled_param_vals, hypo_maker, data_dist, metric, counter,
+        fit_history, pprint, blind, external_priors_penalty
+            See `_minimizer_callable`
+
+        fd_step : float
+            Step size for finite differences
+
+        analytic : bool
+            Whether to use analytic derivatives where available
+
+        Returns
+        -------
+        metric_val : float
+        gradient : numpy.ndarray
+
+        """
+        if isinstance(metric, str):
+            metric = [metric]
+        sign = -1 if metric[0] in METRICS_TO_MAXIMIZE else +1
+        args = (hypo_maker, data_dist, metric, counter, fit_history, pprint,
+                blind, external_priors_penalty)
+
+        scaled_param_vals = np.asarray(scaled_param_vals, dtype=np.float64)
+        free_params = hypo_maker.params.free
+        gradient = np.zeros(len(free_params), dtype=np.float64)
+
+        # Only the perturbed points need to be evaluated by the workers
+        # (which happens while the central point is evaluated here); this
+        # means that params that turn out to be differentiable analytically
+        # are perturbed as well, unless analytic derivatives are requested.
+        pool = self._gradient_pool
+        if pool is not None and pool.obj is not hypo_maker:
+            pool = None
+        if pool is not None and not analytic:
+            steps = np.where(scaled_param_vals + fd_step <= 1, fd_step, -fd_step)
+            perturbed_points = []
+            for i, step in enumerate(steps):
+                perturbed_vals = np.copy(scaled_param_vals)
+                perturbed_vals[i] += step
+                perturbed_points.append(perturbed_vals)
+            pool.submit(
+                perturbed_points,
+                args=(hypo_maker.params, data_dist, metric, Counter(), [],
+                      False, blind, external_priors_penalty)
+            )
+
+        metric_val = self._minimizer_callable(scaled_param_vals, *args)
+
+        if pool is not None and not analytic:
+            perturbed_vals = np.array(pool.collect())
+            counter += len(perturbed_vals)
+            gradient = (perturbed_vals - metric_val) / steps
+            return metric_val, gradient
+
+        # Analytic derivatives are only propagated for a single summed map
+        hypo_asimov_dist = hypo_maker.get_outputs(return_sum=True)
+        if (analytic and len(data_dist) == 1
+                and len(hypo_asimov_dist) == 1):
+            output_gradients = hypo_maker.get_output_gradients(free_params.names)
+        else:
+            output_gradients = OrderedDict()
+        if output_gradients:
+            d_metric_d_output = METRIC_GRADIENTS[metric[0]](
+                actual_values=data_dist.maps[0].nominal_values.ravel(),
+                expected_values=hypo_asimov_dist.maps[0].nominal_values.ravel()
+            )
+
+        numerical = [i for i, param in enumerate(free_params)
+                     if param.name not in output_gradients]
+        if pool is not None and numerical:
+            steps = np.where(scaled_param_vals[numerical] + fd_step <= 1,
+                             fd_step, -fd_step)
+            perturbed_points = []
+            for i, step in zip(numerical, steps):
+                perturbed_vals = np.copy(scaled_param_vals)
+                perturbed_vals[i] += step
+                perturbed_points.append(perturbed_vals)
+            perturbed_vals = pool.map(
+                perturbed_points,
+                args=(hypo_maker.params, data_dist, metric, Counter(), [],
+                      False, blind, external_priors_penalty)
+            )
+            counter += len(perturbed_vals)
+            gradient[numerical] = (np.array(perturbed_vals) - metric_val) / steps
+            numerical = []
+
+        for i, param in enumerate(free_params):
+            if param.name in output_gradients:
+                # output gradients are per unit of the param's own units
+                width = (param.range[1] - param.range[0]).m_as(param.value.units)
+                d_metric = width * np.sum(
+                    d_metric_d_output * output_gradients[param.name]
+                )
+                # priors only depend on the param itself
+                perturbed = deepcopy(param)
+                lo = max(scaled_param_vals[i] - fd_step, 0.)
+                hi = min(scaled_param_vals[i] + fd_step, 1.)
+                perturbed._rescaled_value = hi # pylint: disable=protected-access
+                d_prior = perturbed.prior_penalty(metric=metric[0])
+                perturbed._rescaled_value = lo # pylint: disable=protected-access
+                d_prior -= perturbed.prior_penalty(metric=metric[0])
+                if external_priors_penalty is not None:
+                    d_prior += self._external_priors_penalty_diff(
+                        hypo_maker, scaled_param_vals, i, lo, hi, metric[0],
+                        external_priors_penalty
+                    )
+                gradient[i] = sign * (d_metric + d_prior / (hi - lo))
+            elif i in numerical:
+                step = fd_step if scaled_param_vals[i] + fd_step <= 1 else -fd_step
+                perturbed_vals = np.copy(scaled_param_vals)
+                perturbed_vals[i] += step
+                gradient[i] = (
+                    self._minimizer_callable(perturbed_vals, *args) - metric_val
+                ) / step
+
+        # Leave the hypo maker at the requested point
+        hypo_maker._set_rescaled_free_params(scaled_param_vals) # pylint: disable=protected-access
+
+        return metric_val, gradient
+
+    @staticmethod
+    def _external_priors_penalty_diff(hypo_maker, scaled_param_vals, idx, lo,
+                                      hi, metric, external_priors_penalty):
+        """Difference of `external_priors_penalty` between setting the free
+        param `idx` of `hypo_maker` to the rescaled values `hi` and `lo`
+        (all other free params at `scaled_param_vals`); only sets params, the
+        pipelines are not evaluated"""
+        diff = 0.
+        for sign, val in ((+1, hi), (-1, lo)):
+            perturbed_vals = np.copy(scaled_param_vals)
+            perturbed_vals[idx] = val
+            hypo_maker._set_rescaled_free_params(perturbed_vals) # pylint: disable=protected-access
+            diff += sign * external_priors_penalty(hypo_maker=hypo_maker,
+                                                   metric=metric)
+        return diff
+
+    def _replica_minimizer_callable(self, hypo_maker, scaled_param_vals,
+                                    params, *args):
+        """Evaluate `_minimizer_callable` on a replica `hypo_maker` within a
+        worker process started by `start_gradient_workers`, after updating it
+        with the `params` of the original hypo maker.
+
+        Parameters
+        ----------
+        hypo_maker : Detectors or DistributionMaker
+            The worker's replica
+        scaled_param_vals : sequence of floats
+        params : ParamSet
+        *args
+            Remaining arguments of `_minimizer_callable`
+
+        """
+        hypo_maker.update_params(params)
+        return self._minimizer_callable(scaled_param_vals, hypo_maker, *args)
+
     def _minimizer_callback(self, xk): # pylint: disable=unused-argument
         """Passed as `callback` parameter to `optimize.minimize`, and is called
         after each iteration. Keeps track of number of iterations.
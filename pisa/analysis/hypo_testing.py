@@ -30,6 +30,7 @@ import numpy as np
 
 from pisa import ureg, _version, __version__
 from pisa.analysis.analysis import Analysis
+from pisa.analysis.pseudo_experiments import PseudoExperiments
 from pisa.core.distribution_maker import DistributionMaker
 from pisa.core.detectors import Detectors
 from pisa.core.map import MapSet
@@ -37,7 +38,6 @@ from pisa.utils.comparisons import normQuant
 from pisa.utils.fileio import from_file, get_valid_filename, mkdir, to_file
 from pisa.utils.hash import hash_obj
 from pisa.utils.log import logging
-from pisa.utils.random_numbers import get_random_state
 from pisa.utils.resources import find_resource
 from pisa.utils.stats import ALL_METRICS
 from pisa.utils.format import timediff, timestamp
@@ -546,6 +546,8 @@ class HypoTesting(Analysis):
 
         # Storage for most recent Asimov (un-fluctuated) distributions
         self.toy_data_asimov_dist = None
+        self._data_trials = None
+        self._fid_trials = None
         self.h0_fid_asimov_dist = h0_fid_asimov_dist
         self.h1_fid_asimov_dist = h1_fid_asimov_dist
 
@@ -556,6 +558,10 @@ class HypoTesting(Analysis):
         self.h0_fid_dist = None
         self.h1_fid_dist = None
 
+        # If not None, fits are logged to this dict (by label) instead of to
+        # files, see `pisa.analysis.trial_executor`
+        self.fit_log = None
+
         # Storage for most recent fiducial fit parameters
         self.h0_fit_to_h0_fid = None
         self.h0_fit_to_h1_fid = None
@@ -698,8 +704,16 @@ class HypoTesting(Analysis):
             if exc[0] is not None:
                 raise exc[0](exc[1]).with_traceback(exc[2])
 
-    def generate_data(self):
-        """Geneerate "data" distribution"""
+    def generate_data(self, values=None):
+        """Geneerate "data" distribution
+
+        Parameters
+        ----------
+        values : None or numpy.ndarray
+            Values of data trial `data_ind` as drawn by `data_trials` (e.g. in
+            another process); if None, they are drawn here
+
+        """
         logging.info('Generating %s distributions.', self.labels.data_disp)
         # Ambiguous whether we're dealing with Asimov or regular data if the
         # data set is provided for us, so just return it.
@@ -716,8 +730,22 @@ class HypoTesting(Analysis):
             return self.data_dist
 
         # Otherwise: Toy data (MC)...
+        self._produce_toy_data_asimov_dist()
 
-        # Produce Asimov dist if we don't already have it
+        if self.fluctuate_data:
+            assert self.data_ind is not None
+            trials = self.data_trials()
+            if values is None:
+                values = trials.get(self.data_ind)
+            self.data_dist = trials.to_maps(values)
+
+        else:
+            self.data_dist = self.toy_data_asimov_dist
+
+        return self.data_dist
+
+    def _produce_toy_data_asimov_dist(self):
+        """Produce Asimov dist if we don't already have it"""
         if self.toy_data_asimov_dist is None:
             self.data_maker.select_params(self.data_param_selections)
             self.toy_data_asimov_dist = (
@@ -726,32 +754,33 @@ class HypoTesting(Analysis):
             self.h0_fit_to_data = None
             self.h1_fit_to_data = None
 
-        if self.fluctuate_data:
-            assert self.data_ind is not None
-            # Random state for data trials is defined by:
-            #   * data vs fid-dist = 0  : data part (outer loop)
-            #   * data trial = data_ind : data trial number (use same for data
-            #                             and and fid data trials, since on the
-            #                             same data trial)
-            #   * fid trial = 0         : always 0 since data stays the same
-            #                             for all fid trials in this data trial
-            
-            if isinstance(self.toy_data_asimov_dist, Sequence):
-                self.data_dist = []
-                for i in range(len(self.toy_data_asimov_dist)):
-                    self.data_dist.append(self.toy_data_asimov_dist[i].fluctuate(
-                        method='poisson', random_state=get_random_state([0, self.data_ind, 0]))
-                    )
-            else:
-                data_random_state = get_random_state([0, self.data_ind, 0])             
-                self.data_dist = self.toy_data_asimov_dist.fluctuate(
-                    method='poisson', random_state=data_random_state
-                )
+    def data_trials(self):
+        """Poisson-fluctuated toy "data" distributions of all data trials,
+        drawn in batches from the toy data Asimov distribution (which is
+        produced if necessary).
 
-        else:
-            self.data_dist = self.toy_data_asimov_dist
+        Random states for data trials are defined by:
+          * data vs fid-dist = 0    : data part (outer loop)
+          * 0                       : the Asimov dist is the same for all
+                                      data trials
+          * batch of data_ind       : see `PseudoExperiments`
+        so a data trial only depends on its index `data_ind`.
 
-        return self.data_dist
+        Returns
+        -------
+        trials : PseudoExperiments
+
+        """
+        self._produce_toy_data_asimov_dist()
+        trials = self._data_trials
+        if trials is None or trials.asimov is not self.toy_data_asimov_dist:
+            trials = PseudoExperiments(
+                self.toy_data_asimov_dist, method='poisson',
+                num_trials=self.num_data_trials,
+                start_ind=self.data_start_ind, seeds=[0, 0]
+            )
+            self._data_trials = trials
+        return trials
 
     # TODO: use hashes to ensure fits aren't repeated that don't have to be?
     def fit_hypos_to_data(self):
@@ -764,7 +793,8 @@ class HypoTesting(Analysis):
         self.thisdata_dirpath = self.data_dirpath
         if self.fluctuate_data:
             self.thisdata_dirpath += '_' + format(self.data_ind, 'd')
-        mkdir(self.thisdata_dirpath)
+        if self.fit_log is None:
+            mkdir(self.thisdata_dirpath)
 
         # If h0 maker is same as data maker, we know the fit will end up with
         # the data maker's params. Set these param values and record them.
@@ -879,36 +909,54 @@ class HypoTesting(Analysis):
                      dirpath=self.thisdata_dirpath,
                      label=self.labels.h1_fit_to_data)
 
-    def produce_fid_data(self):
-        """Generate fiducial distribution"""
+    def fid_trials(self):
+        """Poisson-fluctuated fiducial distributions of all fiducial trials of
+        the current data trial, drawn in batches from the fiducial Asimov
+        distributions of both hypotheses.
+
+        Random states for fid trials are defined by:
+          * data vs fid-dist = 1    : fid data part (inner loop)
+          * data trial = data_ind   : data trial number
+          * batch of fid_ind        : see `PseudoExperiments`
+        so a fid trial only depends on `data_ind` and its index `fid_ind`.
+        The h0 and h1 distributions of a trial are drawn together, i.e. not
+        with the *exact* same random state.
+
+        Returns
+        -------
+        trials : PseudoExperiments
+            Trials are lists `[h0_fid_dist, h1_fid_dist]`
+
+        """
+        asimov = [self.h0_fid_asimov_dist, self.h1_fid_asimov_dist]
+        trials = self._fid_trials
+        if (trials is None or trials.seeds != [1, self.data_ind]
+                or any(a is not b for a, b in zip(trials.asimov, asimov))):
+            trials = PseudoExperiments(
+                asimov, method='poisson', num_trials=self.num_fid_trials,
+                start_ind=self.fid_start_ind, seeds=[1, self.data_ind]
+            )
+            self._fid_trials = trials
+        return trials
+
+    def produce_fid_data(self, values=None):
+        """Generate fiducial distribution
+
+        Parameters
+        ----------
+        values : None or numpy.ndarray
+            Values of fid trial `fid_ind` as drawn by `fid_trials` (e.g. in
+            another process); if None, they are drawn here
+
+        """
         logging.info('Generating %s distributions.', self.labels.fid_disp)
         # Retrieve event-rate maps for best fit to data with each hypo
 
         if self.fluctuate_fid:
-            # Random state for data trials is defined by:
-            #   * data vs fid-dist = 1     : fid data part (inner loop)
-            #   * data trial = data_ind    : data trial number (use same for
-            #                                data and and fid data trials,
-            #                                since on the same data trial)
-            #   * fid trial = fid_ind      : always 0 since data stays the same
-            #                                for all fid trials in this data
-            #                                trial
-            fid_random_state = get_random_state([1, self.data_ind,
-                                                 self.fid_ind])
-
-            # Fluctuate h0 fid Asimov
-            self.h0_fid_dist = self.h0_fid_asimov_dist.fluctuate(
-                method='poisson',
-                random_state=fid_random_state
-            )
-            # The state of `random_state` will be moved forward now as compared
-            # to what it was upon definition above. This is the desired
-            # behavior, so the *exact* same random state isn't used to
-            # fluctuate h1 as was used to fluctuate h0.
-            self.h1_fid_dist = self.h1_fid_asimov_dist.fluctuate(
-                method='poisson',
-                random_state=fid_random_state
-            )
+            trials = self.fid_trials()
+            if values is None:
+                values = trials.get(self.fid_ind)
+            self.h0_fid_dist, self.h1_fid_dist = trials.to_maps(values)
         else:
             self.h0_fid_dist = self.h0_fid_asimov_dist
             self.h1_fid_dist = self.h1_fid_asimov_dist
@@ -919,9 +967,7 @@ class HypoTesting(Analysis):
         """Fit hypotheses to fiducial distribution"""
         self.labels.derive_fid_fits_names(fid_ind=self.fid_ind)
 
-        fpath = os.path.join(self.thisdata_dirpath,
-                             self.labels.h0_fit_to_h0_fid + '.json.bz2')
-        if not os.path.isfile(fpath):
+        if not self.fit_is_logged(self.labels.h0_fit_to_h0_fid):
             # If fid isn't fluctuated, it's redundant to fit a hypo to a dist
             # it generated
             self.h0_maker.select_params(self.h0_param_selections)
@@ -974,9 +1020,7 @@ class HypoTesting(Analysis):
                          dirpath=self.thisdata_dirpath,
                          label=self.labels.h0_fit_to_h0_fid)
 
-        fpath = os.path.join(self.thisdata_dirpath,
-                             self.labels.h1_fit_to_h1_fid + '.json.bz2')
-        if not os.path.isfile(fpath):
+        if not self.fit_is_logged(self.labels.h1_fit_to_h1_fid):
             self.h1_maker.select_params(self.h1_param_selections)
             self.h1_maker.reset_free()
             if not self.fluctuate_fid:
@@ -1035,9 +1079,7 @@ class HypoTesting(Analysis):
 
         # Perform fits of one hypo to fid dist produced by other hypo
 
-        fpath = os.path.join(self.thisdata_dirpath,
-                             self.labels.h1_fit_to_h0_fid + '.json.bz2')
-        if not os.path.isfile(fpath):
+        if not self.fit_is_logged(self.labels.h1_fit_to_h0_fid):
             if ((not self.fluctuate_data) and (not self.fluctuate_fid)
                     and self.data_maker_is_h0_maker
                     and self.h0_param_selections == self.data_param_selections):
@@ -1086,9 +1128,7 @@ class HypoTesting(Analysis):
                          dirpath=self.thisdata_dirpath,
                          label=self.labels.h1_fit_to_h0_fid)
 
-        fpath = os.path.join(self.thisdata_dirpath,
-                             self.labels.h0_fit_to_h1_fid + '.json.bz2')
-        if not os.path.isfile(fpath):
+        if not self.fit_is_logged(self.labels.h0_fit_to_h1_fid):
             if ((not self.fluctuate_data) and (not self.fluctuate_fid)
                     and self.data_maker_is_h1_maker
                     and self.h1_param_selections == self.data_param_selections):
@@ -1534,6 +1574,14 @@ class HypoTesting(Analysis):
         logging.info('Run stop info written to: ' + self.run_info_fpath)
         logging.info('Total analysis run time: ' + dt_stamp)
 
+    def fit_is_logged(self, label):
+        """Whether the fit `label` of the current trial has been logged
+        already (e.g. by a previous, interrupted run)"""
+        if self.fit_log is not None:
+            return label in self.fit_log
+        return os.path.isfile(os.path.join(self.thisdata_dirpath,
+                                           label + '.json.bz2'))
+
     def log_fit(self, fit_info, dirpath, label):
         serialize = ['metric', 'metric_val', 'params', 'minimizer_time',
                      'detailed_metric_info', 'minimizer_metadata',
@@ -1559,6 +1607,9 @@ class HypoTesting(Analysis):
             if isinstance(v, ureg.Quantity):
                 v = str(v)
             info[k] = v
+        if self.fit_log is not None:
+            self.fit_log[label] = info
+            return
         to_file(info, os.path.join(dirpath, label + '.json.bz2'),
                 sort_keys=False)
 
@@ -1643,6 +1694,24 @@ class HypoTesting(Analysis):
         if h1:
             self.h1_maker.params.reset_free()
 
+    def _unique_makers(self):
+        makers = []
+        for maker in (self.data_maker, self.h0_maker, self.h1_maker):
+            if maker is not None and all(maker is not m for m in makers):
+                makers.append(maker)
+        return makers
+
+    def share_arrays(self):
+        """Move the read-only array data of all (distinct) makers into shared
+        memory before forking worker processes; see `Pipeline.share_arrays`"""
+        for maker in self._unique_makers():
+            maker.share_arrays()
+
+    def release_shared_arrays(self):
+        """Remove the files created by `share_arrays`"""
+        for maker in self._unique_makers():
+            maker.release_shared_arrays()
+
     def clear_data(self):
         """Clear the data distributions so that they are regenerated. This is
         needed for making multiple different data distributions (parameter
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""
+Generation of pseudo-experiments (fluctuated versions of an Asimov
+distribution) many trials at a time.
+
+Trials are drawn in batches as one (num_trials, n_bins) array covering the bins
+of all maps, and only turned into `Map`/`MapSet` objects when a consumer (e.g.
+a fit) asks for them. `pisa.analysis.hypo_testing.HypoTesting` draws its data
+and fiducial trials this way, and `pisa.analysis.trial_executor` streams the
+drawn values to the processes running the fits.
+"""
+
+
+from __future__ import absolute_import, division
+
+from collections.abc import Sequence
+
+import numpy as np
+
+from pisa.core.map import FLUCTUATION_METHODS, Map, MapSet, fluctuate_hist
+from pisa.utils.log import logging, set_verbosity
+from pisa.utils.random_numbers import get_random_state
+
+
+__all__ = ['DEFAULT_BATCH_SIZE', 'PseudoExperiments',
+           'test_PseudoExperiments']
+
+__license__ = '''Copyright (c) 2014-2020, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+DEFAULT_BATCH_SIZE = 1000
+"""Default number of trials drawn per batch"""
+
+
+class PseudoExperiments(object):
+    """Pseudo-experiments drawn from an Asimov distribution.
+
+    Parameters
+    ----------
+    asimov : Map, MapSet, or sequence thereof
+        Expectation (and uncertainties) to fluctuate; the maps of all
+        elements of a sequence are fluctuated together, as one trial
+
+    method : string
+        One of `pisa.core.map.FLUCTUATION_METHODS`, see `Map.fluctuate`
+
+    num_trials : int
+
+    batch_size : int, optional
+        Number of trials drawn per call to the random number generator; limits
+        the memory used to `batch_size` * n_bins values. Defaults to
+        `DEFAULT_BATCH_SIZE`.
+
+    random_state : None or type accepted by utils.random_numbers.get_random_state
+        Trials are drawn in order from a single random state, so the sequence
+        of trials is reproducible for a given `random_state` and `batch_size`
+
+    start_ind : int
+        Index assigned to the first trial
+
+    seeds : None or sequence of two int
+        Instead of from `random_state`, draw batch `k` of the trial indices
+        (i.e., trials `k*batch_size` to `(k+1)*batch_size - 1`, counted from
+        zero regardless of `start_ind`) from the random state
+        `get_random_state(list(seeds) + [k])`. Each trial then only depends
+        on its index (and `batch_size`), so trials can be drawn in any order
+        (see `get`) and split over separate jobs via `start_ind`.
+
+    Examples
+    --------
+    >>> trials = PseudoExperiments(asimov, 'poisson', num_trials=10000,
+    ...                            random_state=0)
+    >>> for trial_ind, values in trials:
+    ...     if np.sum(values) > threshold:
+    ...         fit(trials.to_maps(values))
+
+    """
+    def __init__(self, asimov, method, num_trials, batch_size=None,
+                 random_state=None, start_ind=0, seeds=None):
+        dists = asimov
+        if isinstance(asimov, (Map, MapSet)):
+            dists = [asimov]
+        if not (isinstance(dists, Sequence) and dists and all(
+                isinstance(dist, (Map, MapSet)) for dist in dists)):
+            raise TypeError('`asimov` must be a Map, MapSet, or sequence'
+                            ' thereof; got %s' % type(asimov))
+        maps = []
+        for dist in dists:
+            maps.extend([dist] if isinstance(dist, Map) else list(dist))
+        method = str(method).strip().lower().replace(' ', '')
+        if method not in FLUCTUATION_METHODS:
+            raise ValueError('`method` must be one of %s; got "%s"'
+                             % (FLUCTUATION_METHODS, method))
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZE
+        if int(num_trials) < 0 or int(batch_size) < 1:
+            raise ValueError('Invalid `num_trials` = %s or `batch_size` = %s'
+                             % (num_trials, batch_size))
+        if seeds is not None:
+            if random_state is not None:
+                raise ValueError('Specify either `random_state` or `seeds`')
+            seeds = [int(seed) for seed in seeds]
+
+        self.asimov = asimov
+        self.method = method
+        self.num_trials = int(num_trials)
+        self.batch_size = int(batch_size)
+        self.start_ind = int(start_ind)
+        self.random_state = get_random_state(random_state)
+        self.seeds = seeds
+
+        self._dists = dists
+        self._maps = maps
+        sizes = [m.size for m in maps]
+        self.bounds = np.concatenate([[0], np.cumsum(sizes)])
+        """Start/stop indices of each map's bins in a trial's values"""
+        self._nominal = [m.nominal_values.ravel() for m in maps]
+        self._sigma = [m.std_devs.ravel() for m in maps]
+        self._errors = None
+        self._batch = (None, None)
+
+    def __len__(self):
+        return self.num_trials
+
+    @property
+    def n_bins(self):
+        """int : total number of bins of all maps"""
+        return int(self.bounds[-1])
+
+    @property
+    def errors(self):
+        """numpy.ndarray : uncertainties of the fluctuated values of shape
+        (n_bins,); identical for all trials of a method"""
+        if self._errors is None:
+            self.draw(0)
+        return self._errors
+
+    def draw(self, num_trials):
+        """Draw the next `num_trials` trials from the random state.
+
+        Returns
+        -------
+        values : numpy.ndarray of shape (num_trials, n_bins)
+
+        """
+        values = np.empty((num_trials, self.n_bins), dtype=np.float64)
+        errors = np.empty(self.n_bins, dtype=np.float64)
+        for map_num, (nominal, sigma) in enumerate(zip(self._nominal,
+                                                       self._sigma)):
+            start, stop = self.bounds[map_num], self.bounds[map_num + 1]
+            values[:, start:stop], errors[start:stop] = fluctuate_hist(
+                nominal, sigma, method=self.method, num_trials=num_trials,
+                random_state=self.random_state
+            )
+        self._errors = errors
+        return values
+
+    def _seeded_batch(self, batch_num):
+        """Values of all trials of batch `batch_num` (see `seeds`); the last
+        batch drawn is kept"""
+        if self._batch[0] != batch_num:
+            logging.trace('Drawing %d %s trials', self.batch_size, self.method)
+            self.random_state = get_random_state(self.seeds + [batch_num])
+            self._batch = (batch_num, self.draw(self.batch_size))
+        return self._batch[1]
+
+    def get(self, trial_ind):
+        """Values of trial `trial_ind`, which can be requested in any order
+        (but are drawn a whole batch at a time); requires `seeds`.
+
+        Returns
+        -------
+        values : numpy.ndarray of shape (n_bins,)
+
+        """
+        if self.seeds is None:
+            raise ValueError('Random access to trials requires `seeds`')
+        if not self.start_ind <= trial_ind < self.start_ind + self.num_trials:
+            raise IndexError('Trial %d out of range' % trial_ind)
+        batch_num, row = divmod(trial_ind, self.batch_size)
+        return self._seeded_batch(batch_num)[row]
+
+    def batches(self):
+        """Generate all trials in batches of up to `batch_size`.
+
+        Yields
+        ------
+        first_ind : int
+            Index of the first trial in the batch
+
+        values : numpy.ndarray of shape (n_trials_in_batch, n_bins)
+
+        """
+        if self.seeds is not None:
+            trial_ind = self.start_ind
+            stop = self.start_ind + self.num_trials
+            while trial_ind < stop:
+                batch_num, row = divmod(trial_ind, self.batch_size)
+                num = min(self.batch_size - row, stop - trial_ind)
+                values = self._seeded_batch(batch_num)
+                yield trial_ind, values[row:row + num]
+                trial_ind += num
+            return
+        for offset in range(0, self.num_trials, self.batch_size):
+            num = min(self.batch_size, self.num_trials - offset)
+            logging.trace('Drawing %d %s trials', num, self.method)
+            yield self.start_ind + offset, self.draw(num)
+
+    def __iter__(self):
+        """Generate (trial index, values) one trial at a time, drawing them a
+        batch at a time behind the scenes"""
+        for first_ind, values in self.batches():
+            for num, row in enumerate(values):
+                yield first_ind + num, row
+
+    def iter_maps(self):
+        """Generate (trial index, Map or MapSet) one trial at a time"""
+        for trial_ind, values in self:
+            yield trial_ind, self.to_maps(values)
+
+    def to_maps(self, values):
+        """Wrap the values of a single trial into a Map or MapSet, or a list
+        thereof (of the same type and names as `asimov`).
+
+        Parameters
+        ----------
+        values : numpy.ndarray of shape (n_bins,)
+
+        Returns
+        -------
+        maps : Map, MapSet, or list thereof
+
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.n_bins,):
+            raise ValueError('Expected values of shape %s; got %s'
+                             % ((self.n_bins,), values.shape))
+        errors = self.errors
+        new_maps = []
+        for map_num, orig in enumerate(self._maps):
+            start, stop = self.bounds[map_num], self.bounds[map_num + 1]
+            new_maps.append(Map.from_trusted(
+                name=orig.name,
+                hist=values[start:stop].reshape(orig.shape),
+                binning=orig.binning,
+                error_hist=errors[start:stop].reshape(orig.shape),
+                tex=orig.tex,
+                full_comparison=orig.full_comparison
+            ))
+        fluct_dists = []
+        for dist in self._dists:
+            if isinstance(dist, Map):
+                fluct_dists.append(new_maps.pop(0))
+                continue
+            fluct_dists.append(MapSet(
+                maps=new_maps[:len(dist)], name=dist.name, tex=dist.tex,
+                hash=None, collate_by_name=dist.collate_by_name
+            ))
+            del new_maps[:len(dist)]
+        if isinstance(self.asimov, (Map, MapSet)):
+            return fluct_dists[0]
+        return fluct_dists
+
+
+def test_PseudoExperiments():
+    """Unit tests for PseudoExperiments"""
+    from pisa.core.binning import OneDimBinning, MultiDimBinning
+    from uncertainties import unumpy as unp
+
+    binning = MultiDimBinning([
+        OneDimBinning(name='energy', num_bins=4, is_log=True,
+                      domain=[1, 80], units='GeV'),
+        OneDimBinning(name='coszen', num_bins=3, is_lin=True,
+                      domain=[-1, 0])
+    ])
+    rand = np.random.RandomState(0)
+    hist0 = rand.uniform(50, 200, binning.shape)
+    hist1 = rand.uniform(50, 200, binning.shape)
+    hist1[1, 1] = np.nan
+    asimov = MapSet([
+        Map(name='a', hist=unp.uarray(hist0, np.sqrt(hist0)), binning=binning),
+        Map(name='b', hist=unp.uarray(hist1, np.sqrt(hist1)), binning=binning)
+    ])
+
+    for method in FLUCTUATION_METHODS:
+        trials = PseudoExperiments(asimov, method, num_trials=5000,
+                                   batch_size=700, random_state=0)
+        values = np.concatenate([v for _, v in trials.batches()])
+        assert values.shape == (5000, 2*binning.size)
+        assert np.all(np.isnan(values[:, binning.size + 4]))
+        nominal = np.concatenate([hist0.ravel(), hist1.ravel()])
+        valid = ~np.isnan(nominal)
+        pulls = (values[:, valid].mean(axis=0) - nominal[valid]) \
+                / np.sqrt(nominal[valid] / 5000)
+        assert np.all(np.abs(pulls) < 5), method
+
+        # same random state and batch size yield the same trials
+        trials = PseudoExperiments(asimov, method, num_trials=5000,
+                                   batch_size=700, random_state=0)
+        for trial_ind, row in trials:
+            if trial_ind in (0, 700, 4999):
+                assert np.array_equal(row, values[trial_ind], equal_nan=True)
+
+    # a single poisson trial equals the one from `MapSet.fluctuate`
+    trials = PseudoExperiments(asimov['a'], 'poisson', num_trials=1,
+                               random_state=3, start_ind=10)
+    (trial_ind, fluct_map), = list(trials.iter_maps())
+    assert trial_ind == 10
+    ref = asimov['a'].fluctuate('poisson', random_state=3)
+    assert np.array_equal(fluct_map.nominal_values, ref.nominal_values)
+    assert np.array_equal(fluct_map.std_devs, ref.std_devs)
+    assert fluct_map.name == 'a' and fluct_map.binning is binning
+
+    fluct_maps = PseudoExperiments(asimov, 'gauss', 1).to_maps(values[0])
+    assert fluct_maps.names == ['a', 'b']
+
+    # with `seeds`, trials only depend on their indices
+    trials = PseudoExperiments(asimov, 'poisson', num_trials=25, batch_size=10,
+                               seeds=[1, 7])
+    values = np.concatenate([v for _, v in trials.batches()])
+    assert values.shape == (25, 2*binning.size)
+    for start_ind, num_trials in [(5, 20), (13, 3), (24, 1)]:
+        part = PseudoExperiments(asimov, 'poisson', num_trials=num_trials,
+                                 batch_size=10, seeds=[1, 7],
+                                 start_ind=start_ind)
+        inds, rows = zip(*part)
+        assert list(inds) == list(range(start_ind, start_ind + num_trials))
+        assert np.array_equal(rows, values[start_ind:start_ind + num_trials],
+                              equal_nan=True)
+    for trial_ind in [21, 3, 4, 17]:
+        assert np.array_equal(trials.get(trial_ind), values[trial_ind],
+                              equal_nan=True)
+    other = PseudoExperiments(asimov, 'poisson', num_trials=25, batch_size=10,
+                              seeds=[0, 7])
+    assert not np.array_equal(other.get(0), values[0], equal_nan=True)
+
+    # sequences are fluctuated together
+    trials = PseudoExperiments([asimov['b'], asimov], 'poisson', num_trials=3,
+                               seeds=[1, 7])
+    fluct = trials.to_maps(trials.get(2))
+    assert isinstance(fluct, list) and len(fluct) == 2
+    assert fluct[0].name == 'b' and fluct[1].names == ['a', 'b']
+    assert np.array_equal(fluct[1]['a'].nominal_values.ravel(),
+                          trials.get(2)[binning.size:2*binning.size])
+
+    try:
+        trials.get(3)
+    except IndexError:
+        pass
+    else:
+        raise AssertionError('Trial out of range not rejected')
+
+    logging.info('<< PASS : test_PseudoExperiments >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_PseudoExperiments()
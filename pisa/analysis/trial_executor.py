@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+
+"""
+Parallel execution of the data and fiducial trials of a
+`pisa.analysis.hypo_testing.HypoTesting` analysis, with the fits of all trials
+recorded to a single append-only SQLite file.
+
+Each trial is recorded in one transaction once all of its fits are done, so
+the store always holds complete trials only; a crashed or interrupted run
+is resumed by running the same analysis against the same store, which skips
+all recorded trials with a single query (instead of scanning one file per
+fit on disk). Unless disabled, each recorded fit is also exported to the
+JSON file `HypoTesting` writes without a store, such that the results can be
+processed by `pisa.utils.postprocess` (and read into a
+`pisa.utils.fit_table.FitTable`) as usual.
+
+Pseudo-experiments (fluctuated data and fiducial distributions) are drawn in
+batches in the current process (see `HypoTesting.data_trials` and
+`HypoTesting.fid_trials`) while the trials are dispatched, and their values are
+sent along with the trials to wherever the fits run.
+
+Where trials run is decided by a backend: any object with a method
+`imap_unordered(obj, func, points, args=())` that evaluates
+`func(obj, point, *args)` for all `points` (on replicas of `obj`) and yields
+the results as they complete. `LocalPoolBackend` uses a pool of forked
+processes on the local machine, `SerialBackend` runs in the current process;
+other backends (e.g. submitting to a batch system) can be plugged in the same
+way.
+"""
+
+
+from __future__ import absolute_import, division
+
+from collections.abc import Sequence
+from collections import OrderedDict
+import os
+import pickle
+import sqlite3
+import sys
+import time
+
+from pisa.utils import jsons
+from pisa.utils.fileio import mkdir, to_file
+from pisa.utils.format import timediff
+from pisa.utils.log import logging, set_verbosity
+from pisa.utils.parallel import ReplicaPool
+
+
+__all__ = ['DATA_FITS_IND', 'TRIAL_STORE_FNAME', 'TrialStore',
+           'SerialBackend', 'LocalPoolBackend', 'TrialExecutor',
+           'test_TrialStore', 'test_LocalPoolBackend', 'test_TrialExecutor']
+
+__license__ = '''Copyright (c) 2014-2020, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+DATA_FITS_IND = -1
+"""Fiducial-trial index under which the fits to the data distribution of a
+data trial are recorded"""
+
+TRIAL_STORE_FNAME = 'trials.sqlite'
+"""Default file name of the trial store within the analysis' log directory"""
+
+
+class TrialStore(object):
+    """Append-only store of the fits of hypothesis-testing trials, backed by a
+    SQLite file.
+
+    A trial is identified by `(data_ind, fid_ind)` and consists of any number
+    of fits (the info logged by `HypoTesting.log_fit`, by label) plus an
+    optional pickled payload (e.g. distributions needed to run other trials).
+
+    Parameters
+    ----------
+    fpath : str
+        SQLite file, created if it does not exist
+
+    timeout : float
+        Seconds to wait for a lock held by another process
+
+    """
+    def __init__(self, fpath, timeout=60.):
+        self.fpath = fpath
+        self._conn = sqlite3.connect(fpath, timeout=timeout)
+        # Readers don't block the writer (and vice versa)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta'
+                ' (key TEXT PRIMARY KEY, value TEXT)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS trials'
+                ' (data_ind INTEGER, fid_ind INTEGER, time REAL, payload BLOB,'
+                ' PRIMARY KEY (data_ind, fid_ind))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS fits'
+                ' (data_ind INTEGER, fid_ind INTEGER, label TEXT, info TEXT,'
+                ' PRIMARY KEY (data_ind, fid_ind, label))'
+            )
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM trials').fetchone()[0]
+
+    def close(self):
+        """Close the connection to the file"""
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def check_meta(self, key, value):
+        """Record `value` under `key` if nothing is recorded yet; otherwise
+        make sure it is the recorded value.
+
+        Raises
+        ------
+        ValueError
+            If a different value is recorded, e.g. when trying to resume with
+            a different configuration
+
+        """
+        value = str(value)
+        with self._conn:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                self._conn.execute('INSERT INTO meta VALUES (?, ?)',
+                                   (key, value))
+            elif row[0] != value:
+                raise ValueError(
+                    'Store "%s" holds trials for %s = %s, not %s'
+                    % (self.fpath, key, row[0], value)
+                )
+
+    def append(self, records):
+        """Record complete trials, all in one transaction.
+
+        Parameters
+        ----------
+        records : sequence of (data_ind, fid_ind, fits, payload)
+            `fits` is a mapping from label to fit info (JSON-serializable);
+            `payload` is any pickle-able object or None
+
+        Raises
+        ------
+        ValueError
+            If any of the trials is recorded already
+
+        """
+        try:
+            with self._conn:
+                for data_ind, fid_ind, fits, payload in records:
+                    if payload is not None:
+                        payload = pickle.dumps(payload,
+                                               protocol=pickle.HIGHEST_PROTOCOL)
+                    self._conn.execute(
+                        'INSERT INTO trials VALUES (?, ?, ?, ?)',
+                        (data_ind, fid_ind, time.time(), payload)
+                    )
+                    self._conn.executemany(
+                        'INSERT INTO fits VALUES (?, ?, ?, ?)',
+                        [(data_ind, fid_ind, label, jsons.dumps(info, indent=None))
+                         for label, info in fits.items()]
+                    )
+        except sqlite3.IntegrityError as err:
+            raise ValueError('Trial(s) recorded already: %s' % err)
+
+    def completed(self):
+        """set of (data_ind, fid_ind) of all recorded trials"""
+        return set(self._conn.execute('SELECT data_ind, fid_ind FROM trials'))
+
+    def is_complete(self, data_ind, fid_ind):
+        """Whether trial (data_ind, fid_ind) is recorded"""
+        row = self._conn.execute(
+            'SELECT 1 FROM trials WHERE data_ind = ? AND fid_ind = ?',
+            (data_ind, fid_ind)
+        ).fetchone()
+        return row is not None
+
+    def payload(self, data_ind, fid_ind=DATA_FITS_IND):
+        """Unpickled payload of a recorded trial (None if it has none)"""
+        row = self._conn.execute(
+            'SELECT payload FROM trials WHERE data_ind = ? AND fid_ind = ?',
+            (data_ind, fid_ind)
+        ).fetchone()
+        if row is None:
+            raise KeyError('Trial (%d, %d) not recorded' % (data_ind, fid_ind))
+        if row[0] is None:
+            return None
+        return pickle.loads(row[0])
+
+    def fits(self, data_ind=None, fid_ind=None, label=None):
+        """Recorded fits, optionally selected by trial indices and/or label.
+
+        Returns
+        -------
+        fits : list of (data_ind, fid_ind, label, info)
+
+        """
+        conditions = []
+        values = []
+        for name, value in [('data_ind', data_ind), ('fid_ind', fid_ind),
+                            ('label', label)]:
+            if value is not None:
+                conditions.append('%s = ?' % name)
+                values.append(value)
+        query = 'SELECT data_ind, fid_ind, label, info FROM fits'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY data_ind, fid_ind, label'
+        return [(d, f, l, jsons.loads(info))
+                for d, f, l, info in self._conn.execute(query, values)]
+
+
+class SerialBackend(object):
+    """Run all trials one after the other in the current process"""
+    @staticmethod
+    def imap_unordered(obj, func, points, args=()):
+        """Yield `func(obj, point, *args)` for all `points`"""
+        for point in points:
+            yield func(obj, point, *args)
+
+
+class LocalPoolBackend(object):
+    """Run trials on a pool of worker processes forked from the current
+    process, each holding a replica of the analysis object (see
+    `pisa.utils.parallel.ReplicaPool`). If the analysis object has a method
+    `share_arrays` (as `HypoTesting` does), its read-only arrays are moved to
+    shared memory for as long as the workers run.
+
+    Parameters
+    ----------
+    num_workers : int or None
+        Defaults to the number of CPUs of the machine
+
+    """
+    def __init__(self, num_workers=None):
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.num_workers = int(num_workers)
+
+    def imap_unordered(self, obj, func, points, args=()):
+        """Yield `func(replica, point, *args)` for all `points` in order of
+        completion; `points` that are not a sequence are consumed lazily"""
+        num_workers = self.num_workers
+        if isinstance(points, Sequence):
+            if not points:
+                return
+            num_workers = min(num_workers, len(points))
+        shared = [obj] if hasattr(obj, 'share_arrays') else []
+        with ReplicaPool(obj, func, num_workers=num_workers,
+                         shared=shared) as pool:
+            for result in pool.imap_unordered(points, args=args):
+                yield result
+
+
+def _run_data_trial(hypo_testing, task, with_fid):
+    """Generate the data distribution of trial `data_ind` (from the values
+    drawn by the dispatching process, if fluctuated) and fit both hypotheses
+    to it; if `with_fid`, also run the (single, non-fluctuated) fiducial
+    trial."""
+    ht = hypo_testing
+    data_ind, values = task
+    ht.data_ind = data_ind
+    ht.fit_log = OrderedDict()
+    ht.generate_data(values=values)
+    ht.fit_hypos_to_data()
+    data_fits = ht.fit_log
+
+    fid_fits = None
+    if with_fid:
+        ht.fid_ind = ht.fid_start_ind
+        ht.fit_log = OrderedDict()
+        ht.produce_fid_data()
+        ht.fit_hypos_to_fid()
+        fid_fits = ht.fit_log
+
+    return (data_ind, data_fits, fid_fits,
+            (ht.h0_fid_asimov_dist, ht.h1_fid_asimov_dist))
+
+
+def _run_fid_trial(hypo_testing, task):
+    """Set the fiducial distributions of a data trial to the fluctuated values
+    drawn by the dispatching process and fit both hypotheses to each of
+    them"""
+    ht = hypo_testing
+    data_ind, fid_ind, (h0_fid_asimov_dist, h1_fid_asimov_dist), values = task
+    ht.data_ind = data_ind
+    ht.fid_ind = fid_ind
+    ht.h0_fid_asimov_dist = h0_fid_asimov_dist
+    ht.h1_fid_asimov_dist = h1_fid_asimov_dist
+    ht.fit_log = OrderedDict()
+    ht.produce_fid_data(values=values)
+    ht.fit_hypos_to_fid()
+    return data_ind, fid_ind, ht.fit_log
+
+
+class TrialExecutor(object):
+    """Run all trials of a `HypoTesting` analysis in parallel, recording the
+    fits of each trial to a `TrialStore` as soon as the trial completes.
+
+    Data trials are run first (their fits yield the fiducial Asimov
+    distributions), then all fiducial trials of all data trials. Random states
+    of the trials only depend on their indices, so results do not depend on
+    the backend or on the number of workers.
+
+    Parameters
+    ----------
+    hypo_testing : HypoTesting
+
+    store : None, str, or TrialStore
+        Defaults to `TRIAL_STORE_FNAME` within the analysis' log directory
+
+    backend : None or backend object
+        Defaults to `LocalPoolBackend()`; see module docstring
+
+    export_fits : bool
+        Also write each fit to `<label>.json.bz2` in the directory of its data
+        trial (as `HypoTesting` does when run without a store), such that
+        `pisa.utils.postprocess` can process the results
+
+    """
+    def __init__(self, hypo_testing, store=None, backend=None,
+                 export_fits=True):
+        if backend is None:
+            backend = LocalPoolBackend()
+        self.hypo_testing = hypo_testing
+        self.store = store
+        self.backend = backend
+        self.export_fits = export_fits
+
+    @property
+    def data_inds(self):
+        """range : indices of all data trials"""
+        ht = self.hypo_testing
+        return range(ht.data_start_ind, ht.data_start_ind + ht.num_data_trials)
+
+    @property
+    def fid_inds(self):
+        """range : indices of the fiducial trials of each data trial"""
+        ht = self.hypo_testing
+        return range(ht.fid_start_ind, ht.fid_start_ind + ht.num_fid_trials)
+
+    def run(self):
+        """Run all trials not yet recorded in the store.
+
+        Returns
+        -------
+        store : TrialStore
+
+        """
+        ht = self.hypo_testing
+        ht.analysis_start_time = time.time()
+        ht.setup_logging()
+        ht.write_config_summary()
+        ht.write_minimizer_settings()
+        ht.write_run_info()
+
+        if self.store is None:
+            self.store = os.path.join(ht.logroot, TRIAL_STORE_FNAME)
+        if isinstance(self.store, str):
+            self.store = TrialStore(self.store)
+        self.store.check_meta('config_hash', ht.config_hash)
+        self.store.check_meta('minimizer_settings', ht.minsettings_flabel)
+        logging.info('Recording trials to "%s"', self.store.fpath)
+
+        exc = (None, None, None)
+        try:
+            self._run_data_trials()
+            if ht.fluctuate_fid:
+                self._run_fid_trials()
+        except: # pylint: disable=bare-except
+            exc = sys.exc_info()
+            raise
+        finally:
+            ht.fit_log = None
+            ht.write_run_stop_info(exc=exc)
+
+        return self.store
+
+    def _record(self, records):
+        """Append `records` to the store and, if requested, export their
+        fits to JSON files"""
+        self.store.append(records)
+        if not self.export_fits:
+            return
+        ht = self.hypo_testing
+        for data_ind, _, fits, _ in records:
+            dirpath = ht.data_dirpath
+            if ht.fluctuate_data:
+                dirpath += '_' + format(data_ind, 'd')
+            mkdir(dirpath, warn=False)
+            for label, info in fits.items():
+                to_file(info, os.path.join(dirpath, label + '.json.bz2'),
+                        sort_keys=False, warn=False)
+
+    def _run_data_trials(self):
+        ht = self.hypo_testing
+        completed = self.store.completed()
+        with_fid = not ht.fluctuate_fid
+        # Without fluctuations, the single fiducial trial is run (and recorded)
+        # together with its data trial
+        check_ind = ht.fid_start_ind if with_fid else DATA_FITS_IND
+        todo = [data_ind for data_ind in self.data_inds
+                if (data_ind, check_ind) not in completed]
+        logging.info('Running %d of %d %s trials', len(todo),
+                     len(self.data_inds), ht.labels.data_disp)
+
+        if not todo:
+            return
+
+        # Draw the data distributions here, batch by batch as the trials are
+        # dispatched
+        trials = ht.data_trials() if ht.fluctuate_data else None
+        tasks = ((data_ind, None if trials is None else trials.get(data_ind))
+                 for data_ind in todo)
+
+        progress = _Progress(len(todo), ht.labels.data_disp)
+        results = self.backend.imap_unordered(
+            ht, _run_data_trial, tasks, args=(with_fid,)
+        )
+        for data_ind, data_fits, fid_fits, fid_asimov_dists in results:
+            records = [(data_ind, DATA_FITS_IND, data_fits,
+                        fid_asimov_dists if ht.fluctuate_fid else None)]
+            if with_fid:
+                records.append((data_ind, ht.fid_start_ind, fid_fits, None))
+            self._record(records)
+            ht.data_ind = data_ind
+            progress.update()
+
+    def _run_fid_trials(self):
+        ht = self.hypo_testing
+        completed = self.store.completed()
+        todo = OrderedDict()
+        for data_ind in self.data_inds:
+            fid_inds = [fid_ind for fid_ind in self.fid_inds
+                        if (data_ind, fid_ind) not in completed]
+            if fid_inds:
+                todo[data_ind] = fid_inds
+        num_todo = sum(len(fid_inds) for fid_inds in todo.values())
+        num_total = len(self.data_inds) * len(self.fid_inds)
+        logging.info('Running %d of %d %s trials', num_todo, num_total,
+                     ht.labels.fid_disp)
+        if not todo:
+            return
+
+        progress = _Progress(num_todo, ht.labels.fid_disp)
+        for data_ind, fid_ind, fits in self.backend.imap_unordered(
+                ht, _run_fid_trial, self._fid_tasks(todo)):
+            self._record([(data_ind, fid_ind, fits, None)])
+            ht.data_ind, ht.fid_ind = data_ind, fid_ind
+            progress.update()
+
+
+    def _fid_tasks(self, todo):
+        """Generate the fid trial tasks `(data_ind, fid_ind, fid Asimov
+        distributions, fluctuated values)`, drawing the values (of one data
+        trial at a time) batch by batch as the tasks are consumed"""
+        ht = self.hypo_testing
+        for data_ind, fid_inds in todo.items():
+            fid_asimov_dists = self.store.payload(data_ind)
+            ht.data_ind = data_ind
+            ht.h0_fid_asimov_dist, ht.h1_fid_asimov_dist = fid_asimov_dists
+            trials = ht.fid_trials()
+            for fid_ind in fid_inds:
+                yield data_ind, fid_ind, fid_asimov_dists, trials.get(fid_ind)
+
+
+class _Progress(object):
+    """Log number of completed trials and estimated time remaining"""
+    def __init__(self, num_total, label):
+        self.num_total = num_total
+        self.label = label
+        self.num_done = 0
+        self.t0 = time.time()
+
+    def update(self):
+        self.num_done += 1
+        dt = time.time() - self.t0
+        time_to_go = dt / self.num_done * (self.num_total - self.num_done)
+        logging.info(
+            '%d / %d %s trials completed, est time remaining: %s',
+            self.num_done, self.num_total, self.label,
+            timediff(time_to_go, sec_decimals=0, hms_always=True)
+        )
+
+
+def test_TrialStore():
+    """Unit tests for TrialStore"""
+    import tempfile
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = os.path.join(tmpdir, TRIAL_STORE_FNAME)
+        with TrialStore(fpath) as store:
+            store.check_meta('config_hash', 'abc')
+            fits = OrderedDict([
+                ('h0_fit', OrderedDict(metric_val=1.5, params={'x': '1 m'})),
+                ('h1_fit', OrderedDict(metric_val=np.float64(2.5),
+                                       detailed=np.arange(3.)))
+            ])
+            store.append([(0, DATA_FITS_IND, fits, {'dist': [1, 2]}),
+                          (0, 0, fits, None)])
+            store.append([(1, 3, fits, None)])
+            assert len(store) == 3
+            try:
+                store.append([(2, 0, fits, None), (1, 3, fits, None)])
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('Duplicate trial not detected')
+            # the failed transaction recorded nothing
+            assert not store.is_complete(2, 0)
+
+        # reopen, as when resuming
+        with TrialStore(fpath) as store:
+            store.check_meta('config_hash', 'abc')
+            try:
+                store.check_meta('config_hash', 'def')
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('Config mismatch not detected')
+            assert store.completed() == {(0, DATA_FITS_IND), (0, 0), (1, 3)}
+            assert store.is_complete(1, 3) and not store.is_complete(1, 0)
+            assert store.payload(0) == {'dist': [1, 2]}
+            assert store.payload(0, 0) is None
+            records = store.fits(data_ind=0, label='h1_fit')
+            assert [(d, f) for d, f, _, _ in records] \
+                    == [(0, DATA_FITS_IND), (0, 0)]
+            assert records[0][3]['metric_val'] == 2.5
+            assert np.all(np.array(records[0][3]['detailed']) == np.arange(3))
+            assert len(store.fits()) == 6
+
+    logging.info('<< PASS : test_TrialStore >>')
+
+
+def test_LocalPoolBackend():
+    """Unit tests for LocalPoolBackend and SerialBackend"""
+    class Replica(object):
+        """stands in for a HypoTesting object"""
+        def __init__(self):
+            self.offset = 10
+
+    def func(replica, point, scale):
+        """runtime depends on the point"""
+        time.sleep(0.01 * (point % 3))
+        return point, replica.offset + scale*point
+
+    points = list(range(20))
+    expected = [(p, 10 + 2*p) for p in points]
+    results = LocalPoolBackend(num_workers=4).imap_unordered(
+        Replica(), func, points, args=(2,)
+    )
+    assert sorted(results) == expected
+    results = SerialBackend().imap_unordered(Replica(), func, points, (2,))
+    assert list(results) == expected
+    assert not list(LocalPoolBackend().imap_unordered(Replica(), func, []))
+
+    class SharedReplica(Replica):
+        """stands in for a HypoTesting object sharing its arrays"""
+        def __init__(self):
+            super().__init__()
+            self.shared = False
+
+        def share_arrays(self):
+            self.shared = True
+
+        def release_shared_arrays(self):
+            self.shared = False
+
+    def shared_func(replica, point):
+        """returns sharing state seen by the worker"""
+        return point, replica.shared
+
+    replica = SharedReplica()
+    results = LocalPoolBackend(num_workers=2).imap_unordered(
+        replica, shared_func, points
+    )
+    assert sorted(results) == [(p, True) for p in points]
+    assert not replica.shared
+
+    logging.info('<< PASS : test_LocalPoolBackend >>')
+
+
+def test_TrialExecutor():
+    """Unit test running fluctuated data and fiducial trials through
+    TrialExecutor, with the pseudo-experiments drawn by the dispatching
+    process"""
+    import shutil
+    import tempfile
+
+    import numpy as np
+
+    from pisa.analysis.hypo_testing import HypoTesting
+    from pisa.core.binning import MultiDimBinning, OneDimBinning
+    from pisa.core.distribution_maker import DistributionMaker
+    from pisa.core.map import Map, MapSet
+
+    binning = MultiDimBinning([OneDimBinning(
+        name='energy', num_bins=5, is_log=True, domain=[1, 80], units='GeV'
+    )])
+
+    class ToyMaker(DistributionMaker):
+        """stands in for a DistributionMaker with fixed outputs"""
+        def __init__(self, scale): # pylint: disable=super-init-not-called
+            self._pipelines = []
+            self.outputs = MapSet([
+                Map(name='total', binning=binning,
+                    hist=scale * np.linspace(10, 50, binning.size))
+            ])
+
+        def select_params(self, selections, error_on_missing=True):
+            pass
+
+        def get_outputs(self, return_sum=False, **kwargs):
+            return self.outputs
+
+    def total(dist):
+        """total counts of a MapSet"""
+        return float(sum(np.sum(m.nominal_values) for m in dist))
+
+    class ToyHypoTesting(HypoTesting):
+        """fits only record the total counts of the fitted distributions"""
+        def fit_hypos_to_data(self):
+            self.fit_log['data'] = total(self.data_dist)
+            self.h0_fid_asimov_dist = self.h0_maker.outputs
+            self.h1_fid_asimov_dist = self.h1_maker.outputs
+
+        def fit_hypos_to_fid(self):
+            self.fit_log['h0_fid'] = total(self.h0_fid_dist)
+            self.fit_log['h1_fid'] = total(self.h1_fid_dist)
+
+    testdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for backend in [LocalPoolBackend(num_workers=3), SerialBackend()]:
+            ht = ToyHypoTesting(
+                logdir=testdir, minimizer_settings={}, data_is_data=False,
+                fluctuate_data=True, fluctuate_fid=True, metric='chi2',
+                h0_maker=ToyMaker(1), h1_maker=ToyMaker(2),
+                num_data_trials=3, num_fid_trials=4, data_start_ind=2,
+                fid_start_ind=1
+            )
+            store = TrialStore(os.path.join(testdir, '%d.sqlite'
+                                            % len(results)))
+            executor = TrialExecutor(ht, store=store, backend=backend,
+                                     export_fits=False)
+            executor._run_data_trials() # pylint: disable=protected-access
+            executor._run_fid_trials() # pylint: disable=protected-access
+            fits = store.fits()
+            store.close()
+            assert len(fits) == 3 + 3*4*2
+            results.append(fits)
+
+            # fits are to the same pseudo-experiments as when running the
+            # trials one by one via `HypoTesting`
+            for data_ind, fid_ind, label, info in fits:
+                ht.data_ind = data_ind
+                ht.generate_data()
+                if fid_ind == DATA_FITS_IND:
+                    assert info == total(ht.data_dist)
+                    continue
+                ht.fit_log = OrderedDict()
+                ht.fit_hypos_to_data()
+                ht.fid_ind = fid_ind
+                ht.produce_fid_data()
+                dist = ht.h0_fid_dist if label == 'h0_fid' else ht.h1_fid_dist
+                assert info == total(dist), (data_ind, fid_ind, label)
+
+        # ... and independent of the backend
+        assert results[0] == results[1]
+        data_totals = [info for _, _, _, info in results[0][:3]]
+        assert len(set(data_totals)) == 3
+    finally:
+        shutil.rmtree(testdir, ignore_errors=True)
+
+    logging.info('<< PASS : test_TrialExecutor >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_TrialStore()
+    test_LocalPoolBackend()
+    test_TrialExecutor()
@@ -11,7 +11,13 @@ from __future__ import absolute_import, print_function
 
 from collections.abc import Sequence
 from collections import OrderedDict
+from contextlib import contextmanager
 from itertools import chain
+import gc
+import os
+import tempfile
+import uuid
+import weakref
 
 import numpy as np
 from numba import SmartArray
@@ -47,6 +53,8 @@ class ContainerSet(object):
             self.add_container(container)
         self._data_specs = None
         self.data_specs = data_specs
+        self._shared_files = []
+        self._cleanup_registered = False
 
     def add_container(self, container):
         if container.name in self.names:
@@ -128,6 +136,125 @@ class ContainerSet(object):
         containers_to_be_iterated = [c for c in self.containers if not c.linked] + self.linked_containers
         return iter(containers_to_be_iterated)
 
+    def share_arrays(self, keys=None, exclude=('weights',), directory=None,
+                     prefix=None):
+        """Move array data of all containers into memory-mapped files, such
+        that other processes can attach to them zero-copy (see
+        `attach_shared_arrays`). The arrays in this set are replaced by
+        read-only views of the files.
+
+        The files are removed by `release_shared_arrays`, or at the latest
+        when this set is garbage collected or the creating process exits; see
+        also the context manager `shared_arrays`.
+
+        Only share data that is not modified after setup (e.g. event
+        properties and `initial_weights`); mutable arrays such as `weights`
+        must stay private to each process.
+
+        Parameters
+        ----------
+        keys : sequence of str or None
+            Keys of the arrays to share; if None, all array data present in
+            the containers
+
+        exclude : sequence of str
+            Keys never to share
+
+        directory : str or None
+            Where to place the files. If None, use `/dev/shm` if it exists
+            (i.e., RAM-backed shared memory) and the system's temporary
+            directory otherwise.
+
+        prefix : str or None
+            Prefix of the file names; if None, a unique prefix is generated
+
+        Returns
+        -------
+        manifest : OrderedDict
+            JSON-serializable description of the shared arrays (and scalar
+            data) per container, to be passed to `attach_shared_arrays`
+
+        """
+        if directory is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        if prefix is None:
+            prefix = 'pisa_%s' % uuid.uuid4().hex[:12]
+        if not self._cleanup_registered:
+            # also called at interpreter exit, but never in forked children
+            weakref.finalize(self, _remove_shared_files, self._shared_files,
+                             os.getpid())
+            self._cleanup_registered = True
+
+        manifest = OrderedDict()
+        for container in self.containers:
+            shared = OrderedDict()
+            container_keys = container.array_data.keys() if keys is None else keys
+            for key in container_keys:
+                if key in exclude or key not in container.array_data:
+                    continue
+                path = os.path.join(
+                    directory, '%s_%s_%s.npy' % (prefix, container.name, key)
+                )
+                array = container.array_data[key].get('host')
+                mmap = np.lib.format.open_memmap(
+                    path, mode='w+', dtype=array.dtype, shape=array.shape
+                )
+                mmap[...] = array
+                mmap.flush()
+                del mmap
+                self._shared_files.append(path)
+                container.array_data[key] = _attach_shared_array(path)
+                shared[key] = path
+            manifest[container.name] = OrderedDict([
+                ('code', container.code),
+                ('scalar_data', OrderedDict(container.scalar_data)),
+                ('array_data', shared),
+            ])
+        return manifest
+
+    def attach_shared_arrays(self, manifest):
+        """Attach (zero-copy, read-only) to arrays shared by another process
+        via `share_arrays`. Containers in `manifest` which are not yet in this
+        set are created (in events mode).
+
+        Parameters
+        ----------
+        manifest : Mapping
+            As returned by `share_arrays`
+
+        """
+        for name, spec in manifest.items():
+            if name in self.names:
+                container = self[name]
+            else:
+                container = Container(name, code=spec['code'], data_specs='events')
+                self.add_container(container)
+            for key, value in spec['scalar_data'].items():
+                container.add_scalar_data(key, value)
+            for key, path in spec['array_data'].items():
+                container.add_array_data(key, _attach_shared_array(path))
+
+    def release_shared_arrays(self):
+        """Remove the files created by `share_arrays`. Arrays already mapped
+        (in this or other processes) remain valid until they are released."""
+        _remove_shared_files(self._shared_files, os.getpid())
+
+    @contextmanager
+    def shared_arrays(self, **kwargs):
+        """Context manager sharing array data via `share_arrays` (which
+        `kwargs` are passed to) and removing the files again on exit.
+
+        Yields
+        ------
+        manifest : OrderedDict
+
+        """
+        manifest = self.share_arrays(**kwargs)
+        try:
+            yield manifest
+        finally:
+            self.release_shared_arrays()
+
     def get_mapset(self, key, error=None):
         """For a given key, get a PISA MapSet
 
@@ -149,6 +276,25 @@ class ContainerSet(object):
         return MapSet(name=self.name, maps=maps)
 
 
+def _remove_shared_files(paths, owner_pid):
+    """Remove (and forget) the files in the list `paths`; does nothing if not
+    called from the process `owner_pid` which created them"""
+    if os.getpid() != owner_pid:
+        return
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    del paths[:]
+
+
+def _attach_shared_array(path):
+    """Map a .npy file read-only into memory and wrap it (without copying)
+    in a SmartArray"""
+    return SmartArray(np.load(path, mmap_mode='r'), copy=False)
+
+
 class VirtualContainer(object):
     """
     Class providing a virtual container for linked individual containers
@@ -233,6 +379,10 @@ class Container(object):
         self.binned_data = OrderedDict()
         self.data_specs = data_specs
         self.linked = False
+        self.map_pool = {}
+        """(hist, binning) wrapped by the maps `get_map` returns, by key; the
+        hist views are reused as long as they refer to the current data
+        array"""
 
     @property
     def data_mode(self):
@@ -451,7 +601,7 @@ class Container(object):
                 return self.unroll_binning(key, out_binning)
         binning, data = self.binned_data[key]
         if out_binning is not None:
-            if not binning == out_binning:
+            if not (binning is out_binning or binning == out_binning):
                 raise ValueError(
                     f"Binning of stored '{key}' with shape {binning.shape} contradicts "
                     f"current output specification with shape {out_binning.shape}!"
@@ -483,15 +633,30 @@ class Container(object):
         return self.binned_data[key][0]
 
     def get_map(self, key, error=None):
-        """Return binned data in the form of a PISA map"""
+        """Return binned data in the form of a PISA map.
+
+        The map is built with `Map.from_trusted`, so its `hist` is a view of
+        the container's data (unless there are errors), i.e. it reflects the
+        latest values. Without errors, the same view is wrapped again for as
+        long as the container holds the same data array and binning; every
+        call returns a new map, such that changes to one (e.g. of its name)
+        do not affect the others.
+
+        """
         hist, binning = self.get_hist(key)
-        if error is not None:
-            error_hist = np.abs(self.get_hist(error)[0])
-        else:
-            error_hist = None
-        #binning = self.get_binning(key)
         assert hist.ndim == binning.num_dims
-        return Map(name=self.name, hist=hist, error_hist=error_hist, binning=binning)
+        if error is None:
+            pooled = self.map_pool.get(key)
+            if (pooled is not None and pooled[0].base is hist.base
+                    and pooled[1] is binning):
+                hist = pooled[0]
+            else:
+                self.map_pool[key] = (hist, binning)
+            error_hist = None
+        else:
+            error_hist = np.abs(self.get_hist(error)[0])
+        return Map.from_trusted(name=self.name, hist=hist,
+                                error_hist=error_hist, binning=binning)
 
 
 def test_container():
@@ -537,6 +702,17 @@ def test_container():
     assert np.allclose(h[0], diag, **ALLCLOSE_KW), f'test:\n{h[0]}\n!= ref:\n{diag}'
     assert h[1] == binning, f'test:\n{h[1]}\n!= ref:\n{binning}'
 
+    # maps wrap the data; each call returns an independent map
+    m = container.get_map('w')
+    assert np.allclose(m.hist, diag, **ALLCLOSE_KW)
+    bd *= 2
+    m2 = container.get_map('w')
+    assert m2 is not m and m2.hist is m.hist
+    assert np.allclose(m.hist, 2 * diag, **ALLCLOSE_KW)
+    m2.name = 'changed'
+    assert container.get_map('w').name == container.name
+    bd /= 2
+
     # augment to array repr again
     container.binned_to_array('w')
     a = container.get_array_data('w').get('host')
@@ -558,6 +734,57 @@ def test_container_set():
         raise Exception('identical containers added to a containerset, this should not be possible')
 
 
+def test_shared_arrays():
+    """Unit tests for sharing array data between ContainerSets"""
+    container = Container('test', code=12, data_specs='events')
+    container.add_array_data('x', np.linspace(0, 1, 100, dtype=FTYPE))
+    container.add_array_data('weights', np.ones(100, dtype=FTYPE))
+    container.add_scalar_data('flav', 1)
+    data = ContainerSet('data', [container])
+
+    manifest = data.share_arrays()
+    try:
+        assert list(manifest['test']['array_data'].keys()) == ['x']
+        x = container.array_data['x'].get('host')
+        assert np.allclose(x, np.linspace(0, 1, 100, dtype=FTYPE), **ALLCLOSE_KW)
+        assert not x.flags.writeable
+
+        other = ContainerSet('other')
+        other.attach_shared_arrays(manifest)
+        other_container = other['test']
+        assert other_container.code == 12
+        assert other_container.scalar_data['flav'] == 1
+        assert other_container.size == 100
+        other_x = other_container.array_data['x'].get('host')
+        assert np.all(other_x == x)
+        assert not other_x.flags.writeable
+        assert 'weights' not in other_container.array_data
+    finally:
+        data.release_shared_arrays()
+    for path in manifest['test']['array_data'].values():
+        assert not os.path.exists(path)
+
+    # context manager removes the files on exit
+    container = Container('test', code=12, data_specs='events')
+    container.add_array_data('x', np.linspace(0, 1, 100, dtype=FTYPE))
+    data = ContainerSet('data', [container])
+    with data.shared_arrays() as manifest:
+        path = manifest['test']['array_data']['x']
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
+
+    # files never released explicitly are removed along with the set
+    container = Container('test', code=12, data_specs='events')
+    container.add_array_data('x', np.linspace(0, 1, 100, dtype=FTYPE))
+    data = ContainerSet('data', [container])
+    path = data.share_arrays()['test']['array_data']['x']
+    assert os.path.exists(path)
+    del data, container
+    gc.collect()
+    assert not os.path.exists(path)
+
+
 if __name__ == '__main__':
     test_container()
     test_container_set()
+    test_shared_arrays()
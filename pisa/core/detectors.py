@@ -105,6 +105,17 @@ class Detectors(object):
         outputs = [distribution_maker.get_outputs(**kwargs) for distribution_maker in self]
         return outputs
 
+    def share_arrays(self, directory=None):
+        """Share the read-only array data of all distribution makers, see
+        `Pipeline.share_arrays`"""
+        return [distribution_maker.share_arrays(directory=directory)
+                for distribution_maker in self]
+
+    def release_shared_arrays(self):
+        """Remove the files created by `share_arrays`"""
+        for distribution_maker in self:
+            distribution_maker.release_shared_arrays()
+
     def update_params(self, params):
         for distribution_maker in self:
             distribution_maker.update_params(params)
@@ -10,6 +10,7 @@ from __future__ import absolute_import
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from collections import OrderedDict
 from collections.abc import Mapping
+from copy import deepcopy
 import inspect
 from itertools import product
 import os
@@ -17,7 +18,7 @@ import os
 import numpy as np
 
 from pisa import ureg
-from pisa.core.map import MapSet
+from pisa.core.map import Map, MapSet
 from pisa.core.pipeline import Pipeline
 from pisa.core.param import ParamSet
 from pisa.utils.config_parser import PISAConfigParser
@@ -68,6 +69,15 @@ class DistributionMaker(object):
         checked for consistency (you should use multiple `Detector`s if you
         have incompatible data sets).
 
+    cache_outputs : bool, optional
+        Keep the last (binned) outputs of each pipeline together with the
+        hash of its param values and the state of its stages, such that
+        `get_outputs` only re-runs the pipelines whose params changed (and
+        re-uses the others' contributions to the sum). Outputs are recomputed
+        after param selections change, stages are set up again or assigned
+        new data, but not if data are modified in place; call
+        `clear_outputs_cache` in that case. Off by default.
+
     Notes
     -----
     Free params with the same name in two pipelines are updated at the same
@@ -84,9 +94,11 @@ class DistributionMaker(object):
     intervals are non-physical.
 
     """
-    def __init__(self, pipelines, label=None, set_livetime_from_data=True):
+    def __init__(self, pipelines, label=None, set_livetime_from_data=True,
+                 cache_outputs=False):
 
         self.label = label
+        self.cache_outputs = cache_outputs
         self._source_code_hash = None
         self.metadata = OrderedDict()
 
@@ -176,6 +188,8 @@ class DistributionMaker(object):
 
             self._detector_name = name
 
+        self._outputs_cache = [None] * len(self._pipelines)
+
     def __iter__(self):
         return iter(self._pipelines)
 
@@ -201,30 +215,257 @@ class DistributionMaker(object):
 
         """
 
-        outputs = [pipeline.get_outputs(**kwargs) for pipeline in self] # pylint: disable=redefined-outer-name
+        outputs = [] # pylint: disable=redefined-outer-name
+        for idx, pipeline in enumerate(self):
+            key = self._outputs_cache_key(pipeline, kwargs)
+            cached = self._outputs_cache[idx]
+            if key is not None and cached is not None and cached['key'] == key:
+                outputs.append(cached['outputs'])
+                continue
+            logging.trace('Computing outputs of pipeline %d', idx)
+            output = pipeline.get_outputs(**kwargs)
+            if key is not None and isinstance(output, (MapSet, OrderedDict)):
+                output = self._detach_outputs(output)
+                # key for the state of the stages after running them
+                self._outputs_cache[idx] = dict(
+                    key=self._outputs_cache_key(pipeline, kwargs),
+                    outputs=output, sum=None
+                )
+            else:
+                self._outputs_cache[idx] = None
+            outputs.append(output)
 
         if return_sum:
-            
-            # Case where the output of a pipeline is a mapSet
-            if isinstance(outputs[0], MapSet):
-                outputs = sum([sum(x) for x in outputs]) # This produces a Map
-                outputs.name = sum_map_name
-                outputs.tex = sum_map_tex_name
-                outputs = MapSet(outputs) # final output must be a MapSet
-
-            # Case where the output of a pipeline is a dict of different MapSets
-            elif isinstance(outputs[0], OrderedDict):
-                output_dict = OrderedDict()
-                for key in outputs[0].keys():
-                    output_dict[key] = sum([sum(A[key]) for A in outputs]) # This produces a Map objects
-                    output_dict[key].name = sum_map_name
-                    output_dict[key].tex = sum_map_tex_name
-                    output_dict[key] = MapSet(output_dict[key])
-
-                outputs = output_dict
+            # sum up each pipeline's outputs only if they changed, then add up
+            # the per-pipeline sums
+            sums = []
+            for cached, output in zip(self._outputs_cache, outputs):
+                if cached is None:
+                    sums.append(self._sum_outputs(
+                        [output], sum_map_name, sum_map_tex_name
+                    ))
+                    continue
+                if cached['sum'] is None:
+                    cached['sum'] = self._sum_outputs(
+                        [output], sum_map_name, sum_map_tex_name
+                    )
+                sums.append(cached['sum'])
+            outputs = self._sum_outputs(sums, sum_map_name, sum_map_tex_name)
 
         return outputs
 
+    def clear_outputs_cache(self):
+        """Forget the cached outputs of all pipelines, such that the next call
+        to `get_outputs` re-runs all of them"""
+        self._outputs_cache = [None] * len(self._pipelines)
+
+    def _outputs_cache_key(self, pipeline, kwargs):
+        """Key identifying the outputs of `pipeline` for its current param
+        values, param selections, the state of its stages and the `kwargs`
+        passed to its `get_outputs`, or None if these outputs are not to be
+        cached.
+
+        The state of a stage consists of its data object and the hash of the
+        param values it last computed with, which is reset when the stage is
+        set up again (and differs from the current one after other stages'
+        param values were evaluated, e.g. by `get_outputs_batch`), such that
+        a key only matches if the stages still hold the outputs it refers to.
+
+        """
+        if not self.cache_outputs:
+            return None
+        if not all(isinstance(v, (str, bool, int, type(None)))
+                   for v in kwargs.values()):
+            return None
+        stage_states = tuple(
+            (id(getattr(stage, 'data', None)), getattr(stage, 'param_hash', None))
+            for stage in pipeline
+        )
+        return (pipeline.params.values_hash, tuple(pipeline.param_selections),
+                stage_states, tuple(sorted(kwargs.items())))
+
+    @staticmethod
+    def _detach_outputs(outputs):
+        """Copy the histograms (but not the binnings) of all maps in
+        `outputs`, such that they no longer share memory with the pipelines'
+        data"""
+        if isinstance(outputs, OrderedDict):
+            return OrderedDict(
+                (key, DistributionMaker._detach_outputs(val))
+                for key, val in outputs.items()
+            )
+        return MapSet(
+            [Map.from_trusted(name=m.name, hist=m.hist.copy(),
+                              binning=m.binning, hash=m.hash, tex=m.tex,
+                              full_comparison=m.full_comparison)
+             for m in outputs],
+            name=outputs.name, tex=outputs.tex, hash=outputs.hash,
+        )
+
+    def get_outputs_batch(self, param_matrix, rescaled=False, return_sum=False,
+                          sum_map_name='total', sum_map_tex_name='Total',
+                          **kwargs):
+        """Compute and return the outputs for many points in the space of the
+        free params in one sweep, e.g. for scans, MCMC ensembles or
+        finite-difference stencils.
+
+        Each pipeline only re-runs the stages that depend on params varying
+        within the batch, and evaluates all points at once where these stages
+        scale the weights multiplicatively (see `Pipeline.get_outputs_batch`).
+        Free params are reset to their current values afterwards.
+
+        Parameters
+        ----------
+        param_matrix : array of shape (K, N_free)
+            Values of the free params (in the order of `params.free`), one row
+            per point. Values are magnitudes in the units of the respective
+            params, unless `rescaled` is True.
+
+        rescaled : bool
+            Interpret values as [0, 1]-rescaled (see
+            `_set_rescaled_free_params`)
+
+        return_sum, sum_map_name, sum_map_tex_name
+            See `get_outputs`
+
+        **kwargs
+            Passed on to each pipeline's `get_outputs_batch` method.
+
+        Returns
+        -------
+        list of length K, each element as returned by `get_outputs`
+
+        """
+        free_params = self.params.free
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=np.float64))
+        if param_matrix.ndim != 2 or param_matrix.shape[1] != len(free_params):
+            raise ValueError(
+                '`param_matrix` must have shape (K, %d) for the free params %s;'
+                ' got shape %s.'
+                % (len(free_params), free_params.names, param_matrix.shape)
+            )
+
+        scratch_params = deepcopy(free_params) if rescaled else None
+        param_values = []
+        for row in param_matrix:
+            values = OrderedDict()
+            for idx, (param, value) in enumerate(zip(free_params, row)):
+                if rescaled:
+                    scratch = scratch_params[idx]
+                    scratch._rescaled_value = value # pylint: disable=protected-access
+                    values[param.name] = scratch.value
+                else:
+                    values[param.name] = value * param.units
+            param_values.append(values)
+
+        per_pipeline = [pipeline.get_outputs_batch(param_values, **kwargs)
+                        for pipeline in self]
+
+        outputs = []
+        for point_outputs in zip(*per_pipeline):
+            point_outputs = list(point_outputs)
+            if return_sum:
+                point_outputs = self._sum_outputs(
+                    point_outputs, sum_map_name, sum_map_tex_name
+                )
+            outputs.append(point_outputs)
+
+        return outputs
+
+    @staticmethod
+    def _sum_outputs(outputs, sum_map_name, sum_map_tex_name):
+        """Add up all maps in the outputs of all pipelines"""
+        # Case where the output of a pipeline is a mapSet
+        if isinstance(outputs[0], MapSet):
+            outputs = DistributionMaker._sum_maps(
+                [m for x in outputs for m in x], sum_map_name, sum_map_tex_name
+            )
+            outputs = MapSet(outputs) # final output must be a MapSet
+
+        # Case where the output of a pipeline is a dict of different MapSets
+        elif isinstance(outputs[0], OrderedDict):
+            output_dict = OrderedDict()
+            for key in outputs[0].keys():
+                output_dict[key] = MapSet(DistributionMaker._sum_maps(
+                    [m for A in outputs for m in A[key]],
+                    sum_map_name, sum_map_tex_name
+                ))
+
+            outputs = output_dict
+
+        return outputs
+
+    @staticmethod
+    def _sum_maps(maps, name, tex):
+        """Add up `maps` into a single, newly allocated histogram (instead of
+        building an intermediate Map for every addition)"""
+        binning = maps[0].binning
+        for m in maps[1:]:
+            if not (m.binning is binning or m.binning == binning):
+                # fall back to the checks and binning handling of `Map.__add__`
+                total = sum(maps)
+                total.name = name
+                total.tex = tex
+                return total
+        has_errors = any(m.hist.dtype == np.object_ for m in maps)
+        if has_errors:
+            hist = np.zeros(binning.shape, dtype=np.object_)
+        else:
+            hist = np.zeros(binning.shape,
+                            dtype=np.result_type(*[m.hist for m in maps]))
+        for m in maps:
+            hist += m.hist
+        return Map.from_trusted(
+            name=name, tex=tex, hist=hist, binning=binning,
+            full_comparison=any(m.full_comparison for m in maps),
+        )
+
+    def get_output_gradients(self, param_names):
+        """Analytic derivatives of the summed output of all pipelines w.r.t.
+        params, see `Pipeline.get_output_gradients`. Must be called after
+        `get_outputs` for the current param values.
+
+        Parameters
+        ----------
+        param_names : sequence of str
+
+        Returns
+        -------
+        gradients : OrderedDict
+            Flattened array of d(total output)/d(param) per bin for each param
+            in `param_names` that every pipeline depending on it can
+            differentiate analytically
+
+        """
+        gradients = OrderedDict()
+        numerical = set()
+        for pipeline in self:
+            pipeline_gradients = pipeline.get_output_gradients(param_names)
+            for name in param_names:
+                if name not in pipeline.params.names:
+                    continue
+                if name not in pipeline_gradients:
+                    numerical.add(name)
+                elif name in gradients:
+                    gradients[name] = gradients[name] + pipeline_gradients[name]
+                else:
+                    gradients[name] = pipeline_gradients[name]
+
+        for name in numerical:
+            gradients.pop(name, None)
+
+        return gradients
+
+    def share_arrays(self, directory=None):
+        """Share the read-only array data of all pipelines, see
+        `Pipeline.share_arrays`"""
+        return [pipeline.share_arrays(directory=directory) for pipeline in self]
+
+    def release_shared_arrays(self):
+        """Remove the files created by `share_arrays`"""
+        for pipeline in self:
+            pipeline.release_shared_arrays()
+
     def update_params(self, params):
         for pipeline in self:
             pipeline.update_params(params)
@@ -408,7 +649,8 @@ def test_DistributionMaker():
     # Instantiate with two pipelines: first has both nh/ih and iron/pyrolite
     # param selectors, while the second only has nh/ih param selectors.
     dm = DistributionMaker(
-        ['settings/pipeline/example.cfg', 'settings/pipeline/example.cfg']
+        ['settings/pipeline/example.cfg', 'settings/pipeline/example.cfg'],
+        cache_outputs=True
     )
 
     #current_mat = 'iron'
@@ -459,6 +701,53 @@ def test_DistributionMaker():
         #current_hier = new_hier
         #current_mat = new_mat
 
+    #
+    # Test: get_outputs_batch matches individual evaluations
+    #
+
+    free_params = dm.params.free
+    nominal = np.array([p.value.m for p in free_params])
+    rescaled = np.array(free_params._rescaled_values) # pylint: disable=protected-access
+    param_matrix = np.array([rescaled, 0.25 + 0.5 * rescaled, 0.5 + 0 * rescaled])
+    batch_outputs = dm.get_outputs_batch(param_matrix, rescaled=True, return_sum=True)
+    assert len(batch_outputs) == len(param_matrix)
+    for row, batch_output in zip(param_matrix, batch_outputs):
+        dm._set_rescaled_free_params(row) # pylint: disable=protected-access
+        output = dm.get_outputs(return_sum=True)
+        assert np.allclose(output.maps[0].nominal_values,
+                           batch_output.maps[0].nominal_values)
+    dm.set_free_params([value * p.units for value, p in zip(nominal, free_params)])
+
+    # Only the (multiplicative) aeff_scale varies: all points follow from one
+    # run of the pipeline
+    param_matrix = np.array([rescaled] * 3)
+    param_matrix[:, free_params.names.index('aeff_scale')] = [0.1, 0.4, 0.9]
+    batch_outputs = dm.get_outputs_batch(param_matrix, rescaled=True, return_sum=True)
+    for row, batch_output in zip(param_matrix, batch_outputs):
+        dm._set_rescaled_free_params(row) # pylint: disable=protected-access
+        output = dm.get_outputs(return_sum=True)
+        assert np.allclose(output.maps[0].nominal_values,
+                           batch_output.maps[0].nominal_values)
+        assert np.allclose(output.maps[0].std_devs,
+                           batch_output.maps[0].std_devs)
+    dm.set_free_params([value * p.units for value, p in zip(nominal, free_params)])
+
+    #
+    # Test: outputs of pipelines whose params did not change are re-used
+    #
+
+    total = dm.get_outputs(return_sum=True)
+    cached_output = dm._outputs_cache[1]['outputs'] # pylint: disable=protected-access
+    param = dm.pipelines[0].params.free[0]
+    param._rescaled_value = 0.3 # pylint: disable=protected-access
+    total = dm.get_outputs(return_sum=True)
+    assert dm._outputs_cache[1]['outputs'] is cached_output # pylint: disable=protected-access
+    dm.clear_outputs_cache()
+    assert np.allclose(total.maps[0].nominal_values,
+                       dm.get_outputs(return_sum=True).maps[0].nominal_values)
+    dm.set_free_params([value * p.units for value, p in zip(nominal, free_params)])
+    logging.info('<< PASS : test_DistributionMaker >>')
+
 
 def parse_args():
     """Get command line arguments"""
@@ -22,6 +22,7 @@ from pisa.core.binning import MultiDimBinning, OneDimBinning
 from pisa.core.map import Map, MapSet
 from pisa.utils import resources
 from pisa.utils.comparisons import normQuant, recursiveEquality
+from pisa.utils.cuts import compile_cut
 from pisa.utils.flavInt import (FlavIntData, FlavIntDataGroup,
                                 flavintGroupsFromString, NuFlavIntGroup)
 from pisa.utils.format import text2tex
@@ -311,33 +312,17 @@ class Events(FlavIntData):
 
         assert isinstance(keep_criteria, str)
 
+        # Parse the cut expression once for all flavints
+        cut = compile_cut(keep_criteria)
+
         #Only get the flavints for which we have data
         flavints_to_process = self.flavints_present
         flavints_processed = []
         remaining_data = {}
         for flavint in flavints_to_process:
-            #Get the evets for this flavor/interaction
-            data_dict = self[flavint]
-
-            field_names = data_dict.keys()
-
-            # TODO: handle unicode:
-            #  * translate crit to unicode (easiest to hack but could be
-            #    problematic elsewhere)
-            #  * translate field names to ascii (probably should be done at
-            #    the from_hdf stage?)
-
-            # Replace simple field names with full paths into the data that
-            # lives in this object
-            crit_str = keep_criteria
-            for field_name in field_names:
-                crit_str = crit_str.replace(
-                    field_name, 'self["%s"]["%s"]' %(flavint, field_name)
-                )
-            mask = eval(crit_str)
-            remaining_data[flavint] = (
-                {k : v[mask] for k, v in self[flavint].items()}
-            )
+            # Select the events for this flavor/interaction (copying each
+            # field once)
+            remaining_data[flavint] = cut.apply(self[flavint])
             flavints_processed.append(flavint)
 
         remaining_events = Events()
@@ -345,7 +330,7 @@ class Events(FlavIntData):
         remaining_events.metadata['cuts'].append(keep_criteria)
 
         for flavint in flavints_processed:
-            remaining_events[flavint] = deepcopy(remaining_data[flavint])
+            remaining_events[flavint] = remaining_data[flavint]
 
         return remaining_events
 
@@ -662,35 +647,19 @@ class Data(FlavIntDataGroup):
 
         logging.info("Applying cut to %s : %s", fig_to_process, keep_criteria)
 
+        cut = compile_cut(keep_criteria)
+
         fig_processed = []
         remaining_data = {}
         for fig in fig_to_process:
-            data_dict = self[fig]
-            field_names = data_dict.keys()
-
-            # TODO: handle unicode:
-            #  * translate crit to unicode (easiest to hack but could be
-            #    problematic elsewhere)
-            #  * translate field names to ascii (probably should be done at
-            #    the from_hdf stage?)
-
-            # Replace simple field names with full paths into the data that
-            # lives in this object
-            crit_str = (keep_criteria)
-            for field_name in field_names:
-                crit_str = crit_str.replace(
-                    field_name, 'self["%s"]["%s"]' % (fig, field_name)
-                )
-            mask = eval(crit_str)
-            remaining_data[fig] = {k: v[mask]
-                                   for k, v in self[fig].items()}
+            remaining_data[fig] = cut.apply(self[fig])
             fig_processed.append(fig)
 
         remaining_events = Events()
         remaining_events.metadata.update(deepcopy(self.metadata))
         remaining_events.metadata['cuts'].append(keep_criteria)
         for fig in fig_to_process:
-            remaining_events[fig] = deepcopy(remaining_data.pop(fig))
+            remaining_events[fig] = remaining_data.pop(fig)
 
         return remaining_events
 
@@ -11,6 +11,7 @@ import numpy as np
 
 from pisa import FTYPE
 from pisa.core.binning import OneDimBinning, MultiDimBinning
+from pisa.utils.cuts import compile_cut
 from pisa.utils.fileio import from_file
 from pisa.utils.log import logging
 
@@ -480,28 +481,18 @@ class EventsPi(OrderedDict):
         cut_data = EventsPi(name=self.name)
         cut_data.metadata = copy.deepcopy(self.metadata)
 
+        # Parse the cut expression (once for all containers)
+        cut = compile_cut(keep_criteria)
+
         # Loop over the data containers
         for key in self.keys():
-            cut_data[key] = {}
-
             # TODO Need to think about how to handle array, scalar and binned data
             # TODO Check for `events` data mode, or should this kind of logic
             # already be in the Container class?
-            variables = self[key].keys()
 
-            # Create the cut expression, and get the resulting mask
-            crit_str = keep_criteria
-            for variable_name in variables:
-                crit_str = crit_str.replace(
-                    variable_name, 'self["%s"]["%s"]' % (key, variable_name)
-                )
-            mask = eval(crit_str)  # pylint: disable=eval-used
-
-            # Fill a new container with the post-cut data
-            for variable_name in variables:
-                cut_data[key][variable_name] = copy.deepcopy(
-                    self[key][variable_name][mask]
-                )
+            # Fill a new container with the post-cut data (single copy of
+            # each variable)
+            cut_data[key] = cut.apply(self[key])
 
         # TODO update to GPUs?
 
@@ -43,8 +43,9 @@ from pisa.utils.random_numbers import get_random_state
 from pisa.utils import stats
 
 
-__all__ = ['type_error', 'reduceToHist', 'rebin', 'valid_nominal_values',
-           'Map', 'MapSet', 'test_Map', 'test_MapSet']
+__all__ = ['FLUCTUATION_METHODS', 'fluctuate_hist', 'type_error',
+           'reduceToHist', 'rebin', 'valid_nominal_values', 'Map', 'MapSet',
+           'test_Map', 'test_MapSet']
 
 __author__ = 'J.L. Lanfranchi'
 
@@ -73,6 +74,109 @@ __license__ = '''Copyright (c) 2014-2020, The IceCube Collaboration
 
 # TODO: move these utilities functions to a generic utils module?
 
+FLUCTUATION_METHODS = ('poisson', 'scaled_poisson', 'gauss', 'gauss+poisson')
+"""Methods for fluctuating bin counts, see `Map.fluctuate`"""
+
+
+def fluctuate_hist(nominal, sigma, method, num_trials=None, random_state=None,
+                   jumpahead=0):
+    """Draw fluctuated bin counts given their expectation `nominal` and
+    uncertainties `sigma`, optionally many trials with a single call.
+
+    Parameters
+    ----------
+    nominal, sigma : numpy.ndarray of same shape
+
+    method : string
+        One of `FLUCTUATION_METHODS`, see `Map.fluctuate`; case-insensitive
+        and whitespace is removed
+
+    num_trials : None or int
+        If None, draw a single trial of the shape of `nominal`; otherwise
+        draw `num_trials` trials stacked along a new first axis
+
+    random_state : None or type accepted by utils.random_numbers.get_random_state
+
+    jumpahead : int >= 0
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Shape of `nominal` or (num_trials,) + shape of `nominal`
+
+    errors : numpy.ndarray
+        Uncertainties of the fluctuated values; shape of `nominal` as they are
+        the same for all trials
+
+    """
+    orig = method
+    method = str(method).strip().lower().replace(' ', '')
+    if method not in FLUCTUATION_METHODS:
+        raise ValueError('unhandled `method` = %s' % orig)
+
+    random_state = get_random_state(random_state, jumpahead=jumpahead)
+    nominal = np.asarray(nominal, dtype=np.float64)
+    sigma = np.array(sigma, dtype=np.float64)
+    if num_trials is None:
+        values = np.empty_like(nominal)
+    else:
+        values = np.empty((num_trials,) + nominal.shape, dtype=np.float64)
+
+    with np.errstate(invalid='ignore'):
+        nan_at = np.isnan(nominal)
+        valid_mask = ~nan_at
+        # values of valid bins are drawn for all trials at once, trial-major
+        valid_shape = values[..., valid_mask].shape
+        expected = np.broadcast_to(nominal[valid_mask], valid_shape)
+
+        if method == 'poisson':
+            values[..., valid_mask] = poisson.rvs(
+                expected, random_state=random_state
+            )
+            errors = np.sqrt(nominal)
+
+        elif method == 'scaled_poisson':
+            zero_at = nominal == 0.
+            if np.any(sigma[valid_mask & ~zero_at] == 0.):
+                logging.warn(
+                    "Some bins have non-zero counts but no assiciated error! "
+                    "All errors will be set to their Poisson expectation now. "
+                    "To avoid this warning, call `set_poisson_errors()` on the "
+                    "map or set non-zero errors manually."
+                )
+                sigma[valid_mask] = np.sqrt(nominal[valid_mask])
+            variance_valid = sigma[valid_mask]**2
+
+            if np.allclose(variance_valid, nominal[valid_mask], **ALLCLOSE_KW):
+                scale_factor = 1.
+            else:
+                scale_factor = variance_valid/nominal[valid_mask]
+            values[..., valid_mask] = poisson.rvs(
+                expected/scale_factor, random_state=random_state
+            )
+            values[..., valid_mask] *= scale_factor
+            values[..., zero_at] = 0.
+            # the standard deviation is unchanged
+            sigma[nan_at] = np.nan
+            errors = sigma
+
+        else:
+            scale = np.broadcast_to(sigma[valid_mask], valid_shape)
+            gauss = norm.rvs(loc=expected, scale=scale,
+                             random_state=random_state)
+            if method == 'gauss+poisson':
+                values[..., valid_mask] = poisson.rvs(
+                    gauss, random_state=random_state
+                )
+            else:
+                values[..., valid_mask] = gauss
+            errors = np.sqrt(nominal)
+
+        values[..., nan_at] = np.nan
+
+    return values, errors
+
+
 def type_error(value):
     """Generic formulation of a TypeError that can be called throughout the
     code"""
@@ -326,6 +430,40 @@ class Map(object):
             self.set_errors(error_hist)
         self._normalize_values = True
 
+    @classmethod
+    def from_trusted(cls, name, hist, binning, error_hist=None, hash=None,
+                     tex=None, full_comparison=False):
+        """Fast constructor for internally produced maps (e.g. pipeline
+        outputs) that skips all validation and copying.
+
+        The caller guarantees that `binning` is a MultiDimBinning, that
+        `hist` (and `error_hist`) is a C-contiguous array of shape
+        `binning.shape`; `hist` is wrapped as is, so the map shares its
+        memory with the array passed in.
+
+        Parameters
+        ----------
+        See `Map`
+
+        Returns
+        -------
+        map : Map
+
+        """
+        new_map = cls.__new__(cls)
+        object.__setattr__(new_map, '_name', name)
+        object.__setattr__(new_map, '_tex', tex)
+        object.__setattr__(new_map, '_hash', hash)
+        object.__setattr__(new_map, '_full_comparison', full_comparison)
+        object.__setattr__(new_map, 'parent_indexer', None)
+        object.__setattr__(new_map, '_binning', binning)
+        if error_hist is None:
+            object.__setattr__(new_map, '_hist', hist)
+        else:
+            object.__setattr__(new_map, '_hist', unp.uarray(hist, error_hist))
+        object.__setattr__(new_map, '_normalize_values', True)
+        return new_map
+
     def __repr__(self):
         previous_precision = np.get_printoptions()['precision']
         np.set_printoptions(precision=18)
@@ -1003,112 +1141,13 @@ class Map(object):
         ..  [1] Bohm & Zech, "Statistics of weighted Poisson events and its applications" (2013),
             https://arxiv.org/abs/1309.1287
         """
-        orig = method
-        method = str(method).strip().lower().replace(' ', '')
-        if method == 'poisson':
-            random_state = get_random_state(random_state, jumpahead=jumpahead)
-            with np.errstate(invalid='ignore'):
-                orig_hist = self.nominal_values
-                nan_at = np.isnan(orig_hist)
-                valid_mask = ~nan_at
-
-                hist_vals = np.empty_like(orig_hist)
-                hist_vals[valid_mask] = poisson.rvs(
-                    orig_hist[valid_mask],
-                    random_state=random_state
-                )
-                hist_vals[nan_at] = np.nan
-
-                error_vals = np.empty_like(orig_hist)
-                error_vals[valid_mask] = np.sqrt(orig_hist[valid_mask])
-                error_vals[nan_at] = np.nan
-            return {'hist': unp.uarray(hist_vals, error_vals)}
-        
-        if method == 'scaled_poisson':
-            random_state = get_random_state(random_state, jumpahead=jumpahead)
-            with np.errstate(invalid='ignore'):
-                orig_hist = self.nominal_values
-                sigma = self.std_devs
-
-                nan_at = np.isnan(orig_hist)
-                zero_at = orig_hist == 0.
-                valid_mask = ~nan_at
-                if np.any(sigma[valid_mask & ~zero_at] == 0.):
-                    logging.warn(
-                        "Some bins have non-zero counts but no assiciated error! "
-                        "All errors will be set to their Poisson expectation now. "
-                        "To avoid this warning, call `set_poisson_errors()` on the "
-                        "map or set non-zero errors manually."
-                    )
-                    sigma[valid_mask] = np.sqrt(orig_hist[valid_mask])
-                variance_valid = sigma[valid_mask]**2
-
-                if np.allclose(variance_valid, orig_hist[valid_mask], **ALLCLOSE_KW):
-                    scale_factor = 1.
-                else:
-                    scale_factor = variance_valid/orig_hist[valid_mask]
-                poisson_lambda = orig_hist[valid_mask]/scale_factor
-
-                hist_vals = np.empty_like(orig_hist)
-                hist_vals[valid_mask] = poisson.rvs(
-                    poisson_lambda,
-                    random_state=random_state
-                )
-                hist_vals[valid_mask] *= scale_factor
-                hist_vals[nan_at] = np.nan
-                hist_vals[zero_at] = 0.
-                # the standard deviation is unchanged
-                sigma[nan_at] = np.nan
-            return {'hist': unp.uarray(hist_vals, sigma)}
-
-        elif method == 'gauss+poisson':
-            random_state = get_random_state(random_state, jumpahead=jumpahead)
-            with np.errstate(invalid='ignore'):
-                orig_hist = self.nominal_values
-                sigma = self.std_devs
-                nan_at = np.isnan(orig_hist)
-                valid_mask = ~nan_at
-                gauss = np.empty_like(orig_hist, dtype=np.float64)
-                gauss[valid_mask] = norm.rvs(
-                    loc=orig_hist[valid_mask], scale=sigma[valid_mask],
-                    random_state=random_state
-                )
-
-                hist_vals = np.empty_like(orig_hist, dtype=np.float64)
-                hist_vals[valid_mask] = poisson.rvs(
-                    gauss[valid_mask],
-                    random_state=random_state
-                )
-                hist_vals[nan_at] = np.nan
-
-                error_vals = np.empty_like(orig_hist, dtype=np.float64)
-                error_vals[valid_mask] = np.sqrt(orig_hist[valid_mask])
-                error_vals[nan_at] = np.nan
-            return {'hist': unp.uarray(hist_vals, error_vals)}
-
-        elif method == 'gauss':
-            random_state = get_random_state(random_state, jumpahead=jumpahead)
-            with np.errstate(invalid='ignore'):
-                orig_hist = self.nominal_values
-                sigma = self.std_devs
-                nan_at = np.isnan(orig_hist)
-                valid_mask = ~nan_at
-                hist_vals = np.empty_like(orig_hist, dtype=np.float64)
-                hist_vals[valid_mask] = norm.rvs(
-                    loc=orig_hist[valid_mask], scale=sigma[valid_mask],
-                    random_state=random_state
-                )
-                hist_vals[nan_at] = np.nan
-                error_vals = np.empty_like(orig_hist, dtype=np.float64)
-                error_vals[valid_mask] = np.sqrt(orig_hist[valid_mask])
-                error_vals[nan_at] = np.nan
-            return {'hist': unp.uarray(hist_vals, error_vals)}
-
-        elif method in ['', 'none']:
+        if str(method).strip().lower().replace(' ', '') in ['', 'none']:
             return {}
-
-        else:
-            raise ValueError('unhandled `method` = %s' % orig)
+        hist_vals, error_vals = fluctuate_hist(
+            self.nominal_values, self.std_devs, method=method,
+            random_state=random_state, jumpahead=jumpahead
+        )
+        return {'hist': unp.uarray(hist_vals, error_vals)}
 
     @property
     def shape(self):
@@ -7,8 +7,10 @@ functionality is built-in.
 from __future__ import absolute_import, division
 
 from collections import OrderedDict
+import numpy as np
 from numba import SmartArray
 
+from pisa import FTYPE
 from pisa.core.base_stage import BaseStage
 from pisa.core.binning import MultiDimBinning
 from pisa.core.container import ContainerSet
@@ -282,6 +284,68 @@ class PiStage(BaseStage):
         """Implement in services (subclasses of PiStage)"""
         pass
 
+    def get_log_gradients(self, param_names):
+        """Analytic derivatives of the logarithm of the weights w.r.t. params
+
+        Implement in services (subclasses of PiStage) that scale the weights
+        multiplicatively and can compute the derivatives cheaply. Must only be
+        called after the stage has been run for the current param values.
+
+        Parameters
+        ----------
+        param_names : sequence of str
+            Names of params of this stage for which derivatives are requested
+
+        Returns
+        -------
+        log_gradients : OrderedDict
+            Keys are param names, values are dicts mapping container names to
+            `(specs, d_log_weights)` tuples, where `specs` is "events", a
+            MultiDimBinning or None (`d_log_weights` is then a scalar applying
+            to the whole container). Derivatives are w.r.t. the magnitude of
+            the param in its own units (`param.units`). Params for which no
+            analytic derivative is available must be omitted, they are then
+            differentiated numerically.
+
+        """
+        return OrderedDict()
+
+    def get_weight_scales(self, param_values):
+        """Factors by which the weights change for a batch of param values
+
+        Implement in services (subclasses of PiStage) that scale the weights
+        multiplicatively, such that a batch of points (see
+        `Pipeline.get_outputs_batch`) can be evaluated in one go rather than
+        by running the stage once per point. Must only be called after the
+        stage has been run for the current param values.
+
+        Parameters
+        ----------
+        param_values : sequence of mappings
+            Each mapping holds values (quantities) of params of this stage for
+            one point; params that are not given keep their current value
+
+        Returns
+        -------
+        weight_scales : OrderedDict or None
+            Keys are container names, values are `(specs, scales)` tuples,
+            where `specs` is as for `get_log_gradients` and `scales` has the
+            points along its first axis (i.e. shape (K,) for `specs` None).
+            Scales are relative to the weights of the current run. None if
+            the stage cannot provide the scales for these params.
+
+        """
+        return None
+
+    def _batch_magnitudes(self, param_values, name, units):
+        """Magnitudes in `units` of param `name` for each mapping in
+        `param_values`, where it defaults to the current value"""
+        current = self.params[name].value
+        return np.array(
+            [values.get(name, current).m_as(units) for values in param_values],
+            dtype=FTYPE,
+        )
+
     def run(self, inputs=None):
         if not inputs is None:
             raise ValueError("PISA pi requires there not be any inputs.")
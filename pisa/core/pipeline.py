@@ -19,16 +19,21 @@ import os
 import traceback
 
 import numpy as np
+from numba import SmartArray
+from scipy import sparse
 
-from pisa import ureg
+from pisa import FTYPE, ureg
 from pisa.core.events import Data
 from pisa.core.map import Map, MapSet
 from pisa.core.param import ParamSet
 from pisa.core.base_stage import BaseStage
+from pisa.core.binning import MultiDimBinning
 from pisa.core.stage import Stage
 from pisa.core.pi_stage import PiStage
-from pisa.core.transform import TransformSet
+from pisa.core.transform import TransformSet, _flat_bin_indices
 from pisa.core.container import ContainerSet
+from pisa.core.translation import histogram, lookup
+from pisa.utils.cache import CacheBudget
 from pisa.utils.config_parser import PISAConfigParser, parse_pipeline_config
 from pisa.utils.fileio import mkdir
 from pisa.utils.hash import hash_obj
@@ -100,8 +105,17 @@ class Pipeline(object):
 
         self._stages = []
         self._detector_name = config.pop('detector_name', None)
+        cache_budget = config.pop('cache_budget', None)
         self._config = config
         self._init_stages()
+
+        self.cache_budget = None
+        """Memory budget shared by the memory caches of all stages, or None"""
+        if cache_budget is not None:
+            self.cache_budget = CacheBudget(**cache_budget)
+            for stage in self:
+                for cache in getattr(stage, 'memory_caches', []):
+                    cache.budget = self.cache_budget
         self._source_code_hash = None
 
     def index(self, stage_id):
@@ -388,6 +402,389 @@ class Pipeline(object):
 
         return outputs
 
+    def get_outputs_batch(self, param_values, output_mode=None,
+                          force_standard_output=True):
+        """Compute the outputs of the pipeline for a batch of param values in
+        one sweep.
+
+        Stages up to (but excluding) the first stage with params that vary
+        within the batch are run only once. If all stages depending on the
+        varying params scale the weights multiplicatively (see
+        `PiStage.get_weight_scales`, e.g. `aeff.pi_aeff`, `aeff.pi_weight`
+        and the flux systematics), the pipeline is run for the first set of
+        param values only and the outputs for all sets follow from the weights
+        of that run, scaled along an extra axis over the batch and histogrammed
+        at once. As for `get_output_gradients`, this assumes that the stages
+        after them are linear in the weights; events with vanishing weights in
+        the first run keep them.
+
+        Otherwise, the (apply) outputs of the remaining stages are saved and
+        restored for each set of param values, and only the stages from the
+        first one with varying params onwards are re-run for each of them;
+        batches whose params enter the first stage are then no faster than
+        repeated `get_outputs` calls. Param values are reset to their original
+        values afterwards.
+
+        Parameters
+        ----------
+        param_values : sequence of mappings
+            Each mapping holds param names and values (quantities) for one
+            evaluation; names which are not params of this pipeline are
+            ignored. All mappings must have the same names.
+
+        output_mode, force_standard_output
+            See `get_outputs`
+
+        Returns
+        -------
+        outputs : list
+            One output (see `get_outputs`) per element of `param_values`
+
+        """
+        param_values = list(param_values)
+        if len(param_values) == 0:
+            return []
+        names = [name for name in param_values[0] if name in self.params.names]
+        originals = OrderedDict((name, self.params[name].value) for name in names)
+        varying = set(
+            name for name in names
+            if any(values[name] != param_values[0][name] for values in param_values[1:])
+        )
+
+        first_varying = 0
+        if self.pisa_version == "pi":
+            for first_varying, stage in enumerate(self):
+                if varying.intersection(stage.params.names):
+                    break
+            else:
+                first_varying = len(self)
+
+        def set_values(values):
+            for stage in self:
+                for name in names:
+                    if name in stage.params.names:
+                        stage.params[name] = values[name]
+
+        def final_outputs():
+            return self.stages[-1].get_outputs(
+                output_mode=output_mode, force_standard_output=force_standard_output
+            )
+
+        outputs = []
+        try:
+            if first_varying == 0:
+                for values in param_values:
+                    set_values(values)
+                    outputs.append(deepcopy(self.get_outputs(
+                        output_mode=output_mode,
+                        force_standard_output=force_standard_output
+                    )))
+                return outputs
+
+            set_values(param_values[0])
+            for stage in self.stages[:first_varying]:
+                stage.run()
+
+            if first_varying == len(self):
+                output = final_outputs()
+                return [deepcopy(output) for _ in param_values]
+
+            snapshot = self._snapshot_apply_outputs(self.stages[first_varying:])
+            for stage in self.stages[first_varying:]:
+                stage.run()
+            outputs.append(deepcopy(final_outputs()))
+
+            binned = (output_mode or self.stages[-1].output_mode) == "binned"
+            if binned and force_standard_output:
+                weight_scales = self._batch_weight_scales(param_values, varying)
+                if weight_scales is not None:
+                    return self._scale_outputs(
+                        outputs[0], weight_scales, len(param_values)
+                    )
+
+            for values in param_values[1:]:
+                set_values(values)
+                self._restore_apply_outputs(snapshot)
+                for stage in self.stages[first_varying:]:
+                    stage.run()
+                outputs.append(deepcopy(final_outputs()))
+        finally:
+            set_values(originals)
+
+        return outputs
+
+    def _batch_weight_scales(self, param_values, varying):
+        """Collect the weight scales (see `PiStage.get_weight_scales`) for
+        `param_values` from all stages depending on the `varying` params;
+        None if any of them cannot provide them"""
+        final_stage = self.stages[-1]
+        if not (isinstance(final_stage, PiStage) and final_stage.output_mode == "binned"):
+            return None
+        weight_scales = []
+        for stage in self:
+            depends = [name for name in stage.params.names if name in varying]
+            if not depends:
+                continue
+            if not isinstance(stage, PiStage):
+                return None
+            stage_scales = stage.get_weight_scales([
+                OrderedDict((name, values[name]) for name in depends)
+                for values in param_values
+            ])
+            if stage_scales is None:
+                logging.trace(
+                    "No weight scales for params %s in stage %s.%s",
+                    depends, stage.stage_name, stage.service_name
+                )
+                return None
+            weight_scales.append(stage_scales)
+        return weight_scales
+
+    def _scale_outputs(self, output, weight_scales, num_points):
+        """Outputs for a batch of `num_points` points from the (binned)
+        `output` of the current run and the `weight_scales` of the stages for
+        these points (see `_batch_weight_scales`); scales of individual events
+        are histogrammed for all points at once"""
+        containers = OrderedDict(
+            (container.name, container)
+            for container in self.stages[-1].data.containers
+        )
+        maps = []
+        for output_map in output:
+            container = containers[output_map.name]
+            binning = output_map.binning
+            bin_scales = np.ones(binning.size)
+            event_scales = None
+            for stage_scales in weight_scales:
+                if container.name not in stage_scales:
+                    continue
+                specs, scales = stage_scales[container.name]
+                if specs is None:
+                    bin_scales = bin_scales * scales[:, np.newaxis]
+                    continue
+                if isinstance(specs, MultiDimBinning):
+                    if specs == binning:
+                        bin_scales = bin_scales * scales.reshape(num_points, -1)
+                        continue
+                    sample = [container.array_data[n] for n in specs.names]
+                    scales = np.stack([
+                        lookup(sample, SmartArray(s.astype(FTYPE)), specs).get("host")
+                        for s in scales.reshape(num_points, -1)
+                    ])
+                event_scales = scales if event_scales is None else event_scales * scales
+            bin_scales = np.broadcast_to(bin_scales, (num_points, binning.size))
+
+            # the error (if any) scales like the root of the sum of the squared
+            # weights
+            has_errors = output_map.hist.dtype == np.object_
+            nominal_values = output_map.nominal_values.ravel() * bin_scales
+            std_devs = output_map.std_devs.ravel() * np.abs(bin_scales)
+            if event_scales is not None:
+                sample = dict(
+                    (name, container.array_data[name].get("host"))
+                    for name in binning.names
+                )
+                flat_idx, in_range = _flat_bin_indices(binning, sample)
+                weights = container.array_data["weights"].get("host")[in_range]
+                event_scales = event_scales[:, in_range]
+                # (bins x events) matrix summing the events into the bins
+                summation = sparse.csr_matrix(
+                    (np.ones(len(weights)), (flat_idx[in_range], np.arange(len(weights)))),
+                    shape=(binning.size, len(weights)),
+                )
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    sums = summation.dot(np.stack([weights, weights**2], axis=1))
+                    nominal_values = nominal_values * np.where(
+                        sums[:, 0] != 0,
+                        summation.dot((weights * event_scales).T).T / sums[:, 0],
+                        0.,
+                    )
+                    std_devs = std_devs * np.sqrt(np.where(
+                        sums[:, 1] != 0,
+                        summation.dot((weights**2 * event_scales**2).T).T / sums[:, 1],
+                        0.,
+                    ))
+            maps.append([
+                Map.from_trusted(
+                    name=output_map.name,
+                    hist=np.ascontiguousarray(values.reshape(binning.shape)),
+                    binning=binning,
+                    error_hist=(np.ascontiguousarray(errors.reshape(binning.shape))
+                                if has_errors else None),
+                    tex=output_map.tex,
+                )
+                for values, errors in zip(nominal_values, std_devs)
+            ])
+
+        return [MapSet(name=output.name, maps=point_maps)
+                for point_maps in zip(*maps)]
+
+    def _snapshot_apply_outputs(self, stages):
+        """Copy the data that `stages` write to in their apply step"""
+        keys = set()
+        for stage in stages:
+            keys.update(stage.output_apply_keys)
+        snapshot = []
+        for container in self.stages[0].data:
+            for key in keys:
+                if key in container.array_data:
+                    snapshot.append((
+                        container, key, None,
+                        container.array_data[key].get("host").copy()
+                    ))
+                if key in container.binned_data:
+                    binning, hist = container.binned_data[key]
+                    snapshot.append((container, key, binning, hist.get("host").copy()))
+        return snapshot
+
+    @staticmethod
+    def _restore_apply_outputs(snapshot):
+        """Restore data saved by `_snapshot_apply_outputs`"""
+        for container, key, binning, values in snapshot:
+            if binning is None:
+                container.array_data[key] = SmartArray(values.copy())
+            else:
+                container.binned_data[key] = (binning, SmartArray(values.copy()))
+
+    def share_arrays(self, directory=None):
+        """Move the array data no stage writes to (event properties,
+        `initial_weights`, ...) into shared memory, such that processes
+        forked from this one (see `pisa.utils.parallel.ReplicaPool`) or
+        attaching to the files use the same physical memory; see
+        `ContainerSet.share_arrays`.
+
+        Arrays listed in any stage's `output_calc_keys` or
+        `output_apply_keys`, and `weights`, stay private.
+
+        Returns
+        -------
+        manifest : OrderedDict or None
+            None for pipelines without PI event data
+
+        """
+        if self.pisa_version != "pi" or not self.stages:
+            return None
+        written = {"weights"}
+        for stage in self:
+            written.update(stage.output_calc_keys)
+            written.update(stage.output_apply_keys)
+        return self.stages[0].data.share_arrays(
+            exclude=tuple(written), directory=directory
+        )
+
+    def release_shared_arrays(self):
+        """Remove the files created by `share_arrays`"""
+        if self.pisa_version == "pi" and self.stages:
+            self.stages[0].data.release_shared_arrays()
+
+    def get_output_gradients(self, param_names):
+        """Analytic derivatives of the binned pipeline output (summed over all
+        output maps) w.r.t. params.
+
+        Stages provide derivatives of the logarithm of the weights they
+        produce (see `PiStage.get_log_gradients`); as the weights are scaled
+        multiplicatively along the pipeline, these add up and are translated
+        to the output binning with the final weights. Must be called after
+        `get_outputs` for the current param values.
+
+        Parameters
+        ----------
+        param_names : sequence of str
+
+        Returns
+        -------
+        gradients : OrderedDict
+            Flattened array of d(output)/d(param) per bin for each param in
+            `param_names` which this pipeline depends on and for which all
+            stages depending on it can provide analytic derivatives
+
+        """
+        gradients = OrderedDict()
+        final_stage = self.stages[-1]
+        if not (isinstance(final_stage, PiStage) and final_stage.output_mode == "binned"):
+            return gradients
+        binning = final_stage.output_specs
+        output_key = final_stage.map_output_key or final_stage.output_apply_keys[0]
+
+        # Collect the contributions of all stages, dropping params that any
+        # stage depending on them cannot differentiate
+        contributions = OrderedDict(
+            (name, []) for name in param_names if name in self.params.names
+        )
+        for stage in self:
+            depends = [name for name in contributions if name in stage.params.names]
+            if not depends:
+                continue
+            if isinstance(stage, PiStage):
+                log_gradients = stage.get_log_gradients(depends)
+            else:
+                log_gradients = {}
+            for name in depends:
+                if name in log_gradients:
+                    contributions[name].append(log_gradients[name])
+                else:
+                    logging.trace(
+                        "No analytic gradient for param %s in stage %s.%s",
+                        name, stage.stage_name, stage.service_name
+                    )
+                    del contributions[name]
+
+        # The outputs (and histograms of the weights) of the current run are
+        # the same for all params
+        outputs = OrderedDict()
+        weight_hists = {}
+        if contributions:
+            for container in final_stage.data.containers:
+                outputs[container.name] = container.get_binned_data(
+                    output_key, binning
+                ).get("host")
+
+        for name, per_stage in contributions.items():
+            gradient = np.zeros(binning.size, dtype=FTYPE)
+            for container in final_stage.data.containers:
+                d_log_output = np.zeros(binning.size, dtype=FTYPE)
+                for per_container in per_stage:
+                    if container.name not in per_container:
+                        continue
+                    specs, d_log_weights = per_container[container.name]
+                    d_log_output += self._to_output_log_gradient(
+                        container, specs, d_log_weights, binning, weight_hists
+                    )
+                gradient += outputs[container.name] * d_log_output
+            gradients[name] = gradient
+
+        return gradients
+
+    @staticmethod
+    def _to_output_log_gradient(container, specs, d_log_weights, binning,
+                                weight_hists):
+        """Translate derivatives of the logarithm of the weights from the
+        representation `specs` to the output `binning`; histograms of the
+        weights are kept in `weight_hists` (by container name) for reuse"""
+        if specs is None:
+            return d_log_weights
+        if isinstance(specs, MultiDimBinning):
+            if specs == binning:
+                return d_log_weights
+            sample = [container.array_data[n] for n in specs.names]
+            d_log_weights = lookup(
+                sample, SmartArray(d_log_weights.astype(FTYPE)), specs
+            ).get("host")
+        # weighted average over the events ending up in each output bin
+        sample = [container.array_data[n] for n in binning.names]
+        weights = container.array_data["weights"]
+        numerator = histogram(
+            sample, SmartArray((weights.get("host") * d_log_weights).astype(FTYPE)),
+            binning, averaged=False
+        ).get("host")
+        if container.name not in weight_hists:
+            weight_hists[container.name] = histogram(
+                sample, weights, binning, averaged=False
+            ).get("host")
+        denominator = weight_hists[container.name]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denominator != 0, numerator / denominator, 0.)
+
     def update_params(self, params):
         """Update params for the pipeline.
 
@@ -448,6 +845,20 @@ class Pipeline(object):
             selections.update(stage.param_selections)
         return sorted(selections)
 
+    @property
+    def cache_stats(self):
+        """OrderedDict : statistics (see `MemoryCache.stats`) of each memory
+        cache of each stage, by stage name and cache name"""
+        stats = OrderedDict()
+        for stage in self:
+            caches = getattr(stage, 'memory_caches', [])
+            if caches:
+                stats[stage.stage_name] = OrderedDict(
+                    (name, cache.stats) for name, cache in
+                    zip(stage.memory_cache_names, caches)
+                )
+        return stats
+
     @property
     def stages(self):
         """list of Stage : stages in the pipeline"""
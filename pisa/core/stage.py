@@ -7,6 +7,7 @@ functionality is built-in.
 from __future__ import absolute_import, division, print_function
 
 import os
+import time
 
 from pisa import CACHE_DIR
 from pisa.core.base_stage import BaseStage
@@ -89,6 +90,10 @@ class Stage(BaseStage):
 
     transforms_cache_depth : int >= 0
 
+    memcache_max_bytes : None or int >= 0
+        Limit on the total size of the entries of each of the stage's memory
+        caches; see also `Pipeline` for a memory budget shared by all stages
+
     input_binning : None or interpretable as MultiDimBinning
 
     output_binning : None or interpretable as MultiDimBinning
@@ -140,6 +145,7 @@ class Stage(BaseStage):
         memcache_deepcopy=True,
         transforms_cache_depth=10,
         outputs_cache_depth=0,
+        memcache_max_bytes=None,
         input_binning=None,
         output_binning=None,
         debug_mode=None,
@@ -189,15 +195,19 @@ class Stage(BaseStage):
         self.full_hash = True
         """Whether to do full hashing if true, otherwise do fast hashing"""
 
+        self.memcache_max_bytes = memcache_max_bytes
+
         self.transforms_cache = MemoryCache(
             max_depth=self.transforms_cache_depth,
             is_lru=True,
             deepcopy=self.memcache_deepcopy,
+            max_bytes=self.memcache_max_bytes,
         )
         self.nominal_transforms_cache = MemoryCache(
             max_depth=self.transforms_cache_depth,
             is_lru=True,
             deepcopy=self.memcache_deepcopy,
+            max_bytes=self.memcache_max_bytes,
         )
 
         self.outputs_cache_depth = int(outputs_cache_depth)
@@ -212,6 +222,7 @@ class Stage(BaseStage):
                 max_depth=self.outputs_cache_depth,
                 is_lru=True,
                 deepcopy=self.memcache_deepcopy,
+                max_bytes=self.memcache_max_bytes,
             )
 
         self.disk_cache = disk_cache
@@ -335,15 +346,18 @@ class Stage(BaseStage):
 
         if recompute:
             self.nominal_transforms_computed = True
+            start_t = time.time()
             nominal_transforms = self._compute_nominal_transforms()
             if nominal_transforms is None:
                 # Invalidate hash value since found transforms
                 nominal_transforms_hash = None
             else:
                 nominal_transforms.hash = nominal_transforms_hash
-                self.nominal_transforms_cache[
-                    nominal_transforms_hash
-                ] = nominal_transforms
+                self.nominal_transforms_cache.set(
+                    nominal_transforms_hash,
+                    nominal_transforms,
+                    cost=time.time() - start_t,
+                )
                 if self.disk_cache is not None:
                     self.disk_cache[nominal_transforms_hash] = nominal_transforms
 
@@ -410,10 +424,13 @@ class Stage(BaseStage):
         else:
             self.transforms_computed = True
             logging.trace("computing transforms.")
+            start_t = time.time()
             transforms = self._compute_transforms()
             transforms.hash = transforms_hash
             if self.transforms_cache is not None:
-                self.transforms_cache[transforms_hash] = transforms
+                self.transforms_cache.set(
+                    transforms_hash, transforms, cost=time.time() - start_t
+                )
 
         self.check_transforms(transforms)
         self.transforms = transforms
@@ -516,6 +533,7 @@ class Stage(BaseStage):
             outputs = self.outputs_cache[outputs_hash]
         else:
             logging.trace("Need to compute outputs...")
+            start_t = time.time()
 
             if self.use_transforms:
                 self.get_transforms(
@@ -535,7 +553,9 @@ class Stage(BaseStage):
 
             # Store output to cache
             if self.outputs_cache is not None and outputs_hash is not None:
-                self.outputs_cache[outputs_hash] = outputs
+                self.outputs_cache.set(
+                    outputs_hash, outputs, cost=time.time() - start_t
+                )
 
         # Keep outputs for inspection later
         self.outputs = outputs
@@ -649,6 +669,21 @@ class Stage(BaseStage):
             self.events = events
             self._events_hash = events_hash
 
+    @property
+    def memory_cache_names(self):
+        """list of str : names of the attributes holding the stage's memory
+        caches"""
+        return [
+            name
+            for name in ("nominal_transforms_cache", "transforms_cache", "outputs_cache")
+            if getattr(self, name) is not None
+        ]
+
+    @property
+    def memory_caches(self):
+        """list of MemoryCache : the stage's memory caches"""
+        return [getattr(self, name) for name in self.memory_cache_names]
+
     def instantiate_disk_cache(self):
         """Instantiate a disk cache for use by the stage."""
         if isinstance(self.disk_cache, DiskCache):
@@ -1,7 +1,8 @@
 """
 Transform as base class for transformations, TransformSet for sets of Transform
-objects, and BinnedTensorTransform as an implementation of Transform for
-defining and applying linear transforms.
+objects, BinnedTensorTransform as an implementation of Transform for
+defining and applying linear transforms, and SparseBinnedTensorTransform for
+smearing kernels that are mostly zero (assembled with SparseKernelBuilder).
 """
 
 
@@ -19,6 +20,7 @@ import sys
 import tempfile
 
 import numpy as np
+from scipy import sparse, stats
 from uncertainties import unumpy as unp
 
 from pisa import ureg, HASH_SIGFIGS
@@ -30,7 +32,8 @@ from pisa.utils import jsons
 from pisa.utils.log import logging, set_verbosity
 
 
-__all__ = ['TransformSet', 'Transform', 'BinnedTensorTransform']
+__all__ = ['TransformSet', 'Transform', 'BinnedTensorTransform',
+           'SparseBinnedTensorTransform', 'SparseKernelBuilder']
 
 __author__ = 'J.L. Lanfranchi, P. Eller'
 
@@ -553,7 +556,7 @@ def _new_obj(original_function):
                 new_state[slot] = state_updates[slot]
             else:
                 new_state[slot] = deepcopy(getattr(self, slot))
-        return BinnedTensorTransform(**new_state)
+        return self.__class__(**new_state)
     return new_function
 
 
@@ -834,6 +837,38 @@ class BinnedTensorTransform(Transform):
     # given the (concatenated) input dimension and the dimension of the
     # transform kernel
 
+    def _get_input_array(self, inputs):
+        """Rebin, and sum or stack, the input maps the transform acts on.
+
+        Parameters
+        ----------
+        inputs : MapSet
+
+        Returns
+        -------
+        input_array : numpy.ndarray
+            Of the shape of `input_binning` if there is only one input or
+            inputs are summed; otherwise, inputs are stacked along an extra
+            first dimension
+
+        """
+        names = self.input_names
+        in0 = inputs[names[0]]
+
+        if self.num_inputs == 1:
+            return (in0.rebin(self.input_binning)).hist
+
+        # Stack inputs, sum inputs, *then* rebin (if necessary)
+        if self.sum_inputs:
+            input_array = np.sum([inputs[n].hist for n in names], axis=0)
+            return rebin(input_array, orig_binning=in0.binning,
+                         new_binning=self.input_binning)
+
+        # Rebin (if necessary) then stack
+        input_array = [(inputs[n].rebin(self.input_binning)).hist
+                       for n in names]
+        return np.stack(input_array, axis=0)
+
     def _apply(self, inputs):
         """Apply transforms to input maps to compute output maps.
 
@@ -889,23 +924,7 @@ class BinnedTensorTransform(Transform):
         # TODO: make sure all of these operations are compatible with
         # uncertainties module!
 
-        names = self.input_names
-        in0 = inputs[names[0]]
-
-        if self.num_inputs == 1:
-            input_array = (in0.rebin(self.input_binning)).hist
-
-        # Stack inputs, sum inputs, *then* rebin (if necessary)
-        elif self.sum_inputs:
-            input_array = np.sum([inputs[n].hist for n in names], axis=0)
-            input_array = rebin(input_array, orig_binning=in0.binning,
-                                new_binning=self.input_binning)
-
-        # Rebin (if necessary) then stack
-        else:
-            input_array = [(inputs[n].rebin(self.input_binning)).hist
-                           for n in names]
-            input_array = np.stack(input_array, axis=0)
+        input_array = self._get_input_array(inputs)
 
         # TODO: is logic kosher here?
 
@@ -970,6 +989,357 @@ class BinnedTensorTransform(Transform):
         return output
 
 
+class SparseBinnedTensorTransform(BinnedTensorTransform):
+    """
+    BinnedTensorTransform for smearing kernels (e.g. reconstruction
+    resolutions) that are zero outside of a band around the true bin.
+
+    The kernel is stored as a `scipy.sparse.csr_matrix` of shape (input size,
+    output size), where the input size is the size of the input binning (times
+    the number of inputs if these are stacked rather than summed) and the
+    output size is the size of the output binning. Applying the transform is a
+    single sparse vector-matrix product, so memory and operations scale with
+    the number of non-zero kernel elements rather than with the square of the
+    number of bins.
+
+    Uncertainties of the inputs (and of the kernel, if set) are propagated
+    linearly on plain float arrays rather than via the `uncertainties` module,
+    treating all input bins and kernel elements as uncorrelated.
+
+    Parameters
+    ----------
+    See BinnedTensorTransform; `xform_array` and `error_array` can in addition
+    be scipy.sparse matrices of shape (input size, output size).
+
+    Notes
+    -----
+    The `xform_array`, `nominal_values`, and `std_devs` attributes are
+    (re)computed as dense arrays of shape (input shape + output shape) on
+    access; use `xform_matrix` and `error_matrix` to avoid this.
+
+    Only smearing-type transforms are supported, i.e. element-by-element
+    multiplication should be done with BinnedTensorTransform.
+
+    """
+    _slots = tuple(list(BinnedTensorTransform._slots) +
+                   ['_error_matrix', '_sq_xform_matrix', '_sq_error_matrix'])
+
+    def __init__(self, input_names, output_name, input_binning, output_binning,
+                 xform_array, sum_inputs=False, error_array=None, tex=None,
+                 error_method=None, hash=None): # pylint: disable=redefined-builtin
+        self._error_matrix = None
+        self._sq_error_matrix = None
+        super().__init__(
+            input_names=input_names, output_name=output_name,
+            input_binning=input_binning, output_binning=output_binning,
+            xform_array=xform_array, sum_inputs=sum_inputs,
+            error_array=error_array, tex=tex, error_method=error_method,
+            hash=hash
+        )
+
+    @property
+    def hashable_state(self):
+        """OrderedDict : State of the objec that can be used for hashing"""
+        state = super(BinnedTensorTransform, self).hashable_state
+        for key, matrix in [('xform_array', self.xform_matrix),
+                            ('error_array', self.error_matrix)]:
+            if matrix is None:
+                state[key] = None
+                continue
+            state[key] = (matrix.shape, matrix.indptr, matrix.indices,
+                          normQuant(matrix.data, sigfigs=HASH_SIGFIGS))
+        return state
+
+    def _to_matrix(self, x):
+        """Convert a dense (nominal) array or a sparse matrix to a CSR
+        matrix of the shape (input size, output size)."""
+        if sparse.issparse(x):
+            matrix = sparse.csr_matrix(x, dtype=np.float64)
+        else:
+            x = np.asarray(x, dtype=np.float64)
+            matrix = sparse.csr_matrix(
+                x.reshape(-1, self.output_binning.size)
+            )
+        n_in, n_out = matrix.shape
+        if n_out != self.output_binning.size \
+                or n_in % self.input_binning.size != 0:
+            raise ValueError(
+                'Transform of shape %s incompatible with input binning of'
+                ' shape %s and output binning of shape %s'
+                % (x.shape, self.input_binning.shape,
+                   self.output_binning.shape)
+            )
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        return matrix
+
+    def _to_dense(self, matrix):
+        """Reshape a sparse matrix to a dense (input shape + output shape)
+        array"""
+        in_shape = self.input_binning.shape
+        if matrix.shape[0] != self.input_binning.size:
+            in_shape = (matrix.shape[0] // self.input_binning.size,) + in_shape
+        return matrix.toarray().reshape(in_shape + self.output_binning.shape)
+
+    def set_errors(self, error_array):
+        """Define the errors (standard deviations) of the kernel elements or
+        remove them by passing None.
+
+        Parameters
+        ----------
+        error_array : None, ndarray, or scipy.sparse matrix
+            Same shape as `xform_array` or `xform_matrix`; all-zero errors are
+            equivalent to None
+
+        """
+        self._sq_error_matrix = None
+        self._error_matrix = None
+        if error_array is None:
+            return
+        error_matrix = self._to_matrix(error_array)
+        assert error_matrix.shape == self.xform_matrix.shape
+        if error_matrix.nnz > 0:
+            self._error_matrix = error_matrix
+
+    @property
+    def xform_matrix(self):
+        """scipy.sparse.csr_matrix : nominal values of the kernel"""
+        return self._xform_array
+
+    @property
+    def error_matrix(self):
+        """None or scipy.sparse.csr_matrix : errors of the kernel"""
+        return self._error_matrix
+
+    @property
+    def xform_array(self):
+        """Numpy ndarray containing the (dense) transform"""
+        if self.error_matrix is None:
+            return self.nominal_values
+        return unp.uarray(self.nominal_values, self.std_devs)
+
+    @xform_array.setter
+    def xform_array(self, x):
+        error_array = None
+        if not sparse.issparse(x) and np.asarray(x).dtype == object:
+            error_array = unp.std_devs(x)
+            x = unp.nominal_values(x)
+        self._xform_array = self._to_matrix(x)
+        self._sq_xform_matrix = None
+        if error_array is not None:
+            self.set_errors(error_array)
+
+    @property
+    def nominal_values(self):
+        """numpy.ndarray : dense nominal transform values"""
+        return self._to_dense(self.xform_matrix)
+
+    @property
+    def std_devs(self):
+        """numpy.ndarray : dense standard deviations of the transform values
+        (zero if no errors are set)"""
+        if self.error_matrix is None:
+            return np.zeros_like(self.nominal_values)
+        return self._to_dense(self.error_matrix)
+
+    @property
+    def density(self):
+        """float : fraction of kernel elements that are non-zero"""
+        n_in, n_out = self.xform_matrix.shape
+        return self.xform_matrix.nnz / (n_in * n_out)
+
+    def _apply(self, inputs):
+        """Apply the sparse kernel to the input map(s).
+
+        Parameters
+        ----------
+        inputs : MapSet
+            Container class that must contain (at least) the maps to be
+            transformed.
+
+        Returns
+        -------
+        output : Map
+            Result of applying the transform to the input map(s).
+
+        """
+        self.validate_input(inputs)
+        input_array = self._get_input_array(inputs)
+        if input_array.size != self.xform_matrix.shape[0]:
+            raise ValueError(
+                'Unhandled shapes for input(s) "%s": %s and'
+                ' transform: %s.'
+                %(', '.join(self.input_names), input_array.shape,
+                  self.xform_matrix.shape)
+            )
+
+        input_array = input_array.ravel()
+        if input_array.dtype == object:
+            nominal = unp.nominal_values(input_array)
+            sigma = unp.std_devs(input_array)
+        else:
+            nominal = input_array
+            sigma = None
+
+        # (x K)_j = sum_i x_i K_ij
+        output = self.xform_matrix.T.dot(nominal)
+
+        variance = None
+        if sigma is not None:
+            if self._sq_xform_matrix is None:
+                self._sq_xform_matrix = self.xform_matrix.power(2)
+            variance = self._sq_xform_matrix.T.dot(sigma**2)
+        if self.error_matrix is not None:
+            if self._sq_error_matrix is None:
+                self._sq_error_matrix = self.error_matrix.power(2)
+            kernel_variance = self._sq_error_matrix.T.dot(nominal**2)
+            if variance is None:
+                variance = kernel_variance
+            else:
+                variance += kernel_variance
+
+        shape = self.output_binning.shape
+        error_hist = None
+        if variance is not None:
+            error_hist = np.sqrt(variance).reshape(shape)
+        return Map.from_trusted(name=self.output_name,
+                                hist=output.reshape(shape),
+                                binning=self.output_binning,
+                                error_hist=error_hist)
+
+
+class SparseKernelBuilder(object):
+    """Assemble the kernel of a `SparseBinnedTensorTransform` entry by entry,
+    without ever allocating the dense (input shape + output shape) array.
+
+    Entries are collected either as the outer product of one factor per
+    output dimension for a single input bin (`add_separable`, e.g. for
+    parameterized or KDE resolutions) or by histogramming events
+    (`add_events`); duplicate entries are summed by `tocsr`.
+
+    Parameters
+    ----------
+    input_binning, output_binning : MultiDimBinning
+        Binnings of the transform; event samples passed to `add_events` must
+        be in the units of these binnings
+
+    """
+    def __init__(self, input_binning, output_binning):
+        self.input_binning = input_binning
+        self.output_binning = output_binning
+        self._rows = []
+        self._cols = []
+        self._data = []
+
+    def _input_bin(self, input_index):
+        return np.ravel_multi_index(
+            tuple(input_index[name] for name in self.input_binning.names),
+            self.input_binning.shape
+        )
+
+    def add_separable(self, input_index, factors, threshold=0):
+        """Add the kernel row of a single input bin, given as the outer
+        product of one 1D array per output dimension.
+
+        Parameters
+        ----------
+        input_index : mapping
+            Bin index for each input dimension, by dimension name
+
+        factors : mapping
+            1D array with one value per bin for each output dimension, by
+            dimension name
+
+        threshold : float
+            Entries whose absolute value is not above `threshold` are dropped
+
+        """
+        indices = []
+        values = []
+        for dim in self.output_binning:
+            factor = np.asarray(factors[dim.name], dtype=np.float64)
+            assert factor.shape == (dim.num_bins,), dim.name
+            nonzero = np.flatnonzero(factor)
+            if nonzero.size == 0:
+                return
+            indices.append(nonzero)
+            values.append(factor[nonzero])
+        row_values = values[0]
+        for vals in values[1:]:
+            row_values = np.multiply.outer(row_values, vals)
+        row_values = row_values.ravel()
+        cols = np.ravel_multi_index(
+            tuple(np.meshgrid(*indices, indexing='ij')),
+            self.output_binning.shape
+        ).ravel()
+        keep = np.abs(row_values) > threshold
+        self._rows.append(
+            np.full(np.count_nonzero(keep), self._input_bin(input_index))
+        )
+        self._cols.append(cols[keep])
+        self._data.append(row_values[keep])
+
+    def add_events(self, input_sample, output_sample, weights=None):
+        """Add events to the kernel, binned like `numpy.histogramdd` does
+        (i.e., the last bin of each dimension includes its upper edge).
+
+        Parameters
+        ----------
+        input_sample, output_sample : mapping
+            Array of event values for each input and output dimension, by
+            dimension name
+
+        weights : None or array
+            Event weights; if None, each event counts one
+
+        """
+        rows, in_range = _flat_bin_indices(self.input_binning, input_sample)
+        cols, out_range = _flat_bin_indices(self.output_binning, output_sample)
+        in_range &= out_range
+        if weights is None:
+            weights = np.ones(in_range.size)
+        self._rows.append(rows[in_range])
+        self._cols.append(cols[in_range])
+        self._data.append(np.asarray(weights, dtype=np.float64)[in_range])
+
+    def tocsr(self):
+        """Return the kernel collected so far.
+
+        Returns
+        -------
+        kernel : scipy.sparse.csr_matrix
+            Of shape (input binning size, output binning size)
+
+        """
+        shape = (self.input_binning.size, self.output_binning.size)
+        if not self._data:
+            return sparse.csr_matrix(shape, dtype=np.float64)
+        kernel = sparse.coo_matrix(
+            (np.concatenate(self._data),
+             (np.concatenate(self._rows), np.concatenate(self._cols))),
+            shape=shape
+        ).tocsr()
+        kernel.sum_duplicates()
+        return kernel
+
+
+def _flat_bin_indices(binning, sample):
+    """Flat (C-order) indices into `binning` of the events in `sample` (a
+    mapping from dimension names to arrays), binned as `numpy.histogramdd`
+    does, and a mask of the events that fall within the binning"""
+    multi_index = []
+    in_range = None
+    for dim in binning:
+        edges = dim.bin_edges.magnitude
+        x = np.asarray(sample[dim.name])
+        idx = np.searchsorted(edges, x, side='right') - 1
+        idx[x == edges[-1]] = dim.num_bins - 1
+        valid = (idx >= 0) & (idx < dim.num_bins)
+        in_range = valid if in_range is None else in_range & valid
+        multi_index.append(np.where(valid, idx, 0))
+    return np.ravel_multi_index(multi_index, binning.shape), in_range
+
+
 def test_BinnedTensorTransform():
     """Unit tests for BinnedTensorTransform class"""
     binning = MultiDimBinning([
@@ -1060,6 +1430,189 @@ def test_BinnedTensorTransform():
     logging.info('<< PASS : test_TransformSet >>')
 
 
+def test_SparseBinnedTensorTransform():
+    """Unit tests for SparseBinnedTensorTransform class"""
+    binning = MultiDimBinning([
+        dict(name='energy', is_log=True, domain=(1, 80)*ureg.GeV, num_bins=10),
+        dict(name='coszen', is_lin=True, domain=(-1, 0), num_bins=5)
+    ])
+    rand = np.random.RandomState(0)
+
+    # Banded smearing kernel: each true bin only smears into its neighbours
+    kernel = rand.uniform(size=binning.shape + binning.shape)
+    e_ind, cz_ind = np.indices(binning.shape)
+    band = (
+        (np.abs(e_ind[:, :, None, None] - e_ind[None, None, :, :]) <= 1)
+        & (np.abs(cz_ind[:, :, None, None] - cz_ind[None, None, :, :]) <= 1)
+    )
+    kernel[~band] = 0
+
+    maps = []
+    for name in ['nue', 'numu']:
+        maps.append(Map(name=name, binning=binning,
+                        hist=rand.uniform(10, 100, binning.shape)))
+        maps[-1].set_poisson_errors()
+    inputs = MapSet(name='inputs', maps=maps)
+
+    for input_names, sum_inputs, xform_array in [
+            ('nue', False, kernel),
+            (['nue', 'numu'], True, kernel),
+            (['nue', 'numu'], False, np.stack([kernel, 2*kernel], axis=0))]:
+        kwargs = dict(input_names=input_names, output_name='out',
+                      input_binning=binning, output_binning=binning,
+                      xform_array=xform_array, sum_inputs=sum_inputs)
+        dense = BinnedTensorTransform(**kwargs).apply(inputs)
+        xform = SparseBinnedTensorTransform(**kwargs)
+        assert xform.xform_matrix.nnz == np.count_nonzero(xform_array)
+        assert np.array_equal(xform.xform_array, xform_array)
+        out = xform.apply(inputs)
+        assert out.name == 'out'
+        assert np.allclose(out.nominal_values, dense.nominal_values)
+        assert np.allclose(out.std_devs, dense.std_devs)
+
+        # same via TransformSet, and without input errors
+        out = TransformSet([xform]).apply(inputs)['out']
+        assert np.allclose(out.nominal_values, dense.nominal_values)
+        bare = MapSet([Map(name=m.name, binning=binning, hist=m.nominal_values)
+                       for m in inputs])
+        out = xform.apply(bare)
+        assert np.allclose(out.hist, dense.nominal_values)
+        assert out.hist.dtype != object
+
+    # Kernel errors are propagated like the uncertainties module does
+    kwargs = dict(input_names='nue', output_name='nue',
+                  input_binning=binning, output_binning=binning,
+                  xform_array=kernel, error_array=0.1*kernel)
+    dense = BinnedTensorTransform(**kwargs).apply(inputs)
+    xform = SparseBinnedTensorTransform(**kwargs)
+    out = xform.apply(inputs)
+    assert np.allclose(out.nominal_values, dense.nominal_values)
+    assert np.allclose(out.std_devs, dense.std_devs)
+    assert np.allclose(xform.std_devs, 0.1*kernel)
+
+    # Arithmetic keeps the sparse type
+    doubled = xform * 2
+    assert isinstance(doubled, SparseBinnedTensorTransform)
+    assert np.allclose(doubled.nominal_values, 2*kernel)
+
+    xform.set_errors(None)
+    assert xform.error_matrix is None
+
+    try:
+        SparseBinnedTensorTransform(
+            input_names='nue', output_name='nue', input_binning=binning,
+            output_binning=binning, xform_array=np.ones(binning.shape)
+        )
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Element-by-element transform not rejected')
+
+    testdir = tempfile.mkdtemp()
+    try:
+        t_file = os.path.join(testdir, 'sparse.json')
+        xform.to_json(t_file)
+        t_ = SparseBinnedTensorTransform.from_json(t_file)
+        assert t_ == xform
+        assert t_.xform_matrix.nnz == xform.xform_matrix.nnz
+    finally:
+        shutil.rmtree(testdir, ignore_errors=True)
+
+    logging.info('<< PASS : test_SparseBinnedTensorTransform >>')
+
+
+def test_SparseKernelBuilder():
+    """Unit tests for SparseKernelBuilder: kernels built sparse must equal
+    their dense counterparts and transform maps identically"""
+    in_binning = MultiDimBinning([
+        dict(name='true_energy', is_log=True, domain=(1, 80)*ureg.GeV,
+             num_bins=12),
+        dict(name='true_coszen', is_lin=True, domain=(-1, 1), num_bins=8)
+    ])
+    out_binning = MultiDimBinning([
+        dict(name='reco_coszen', is_lin=True, domain=(-1, 1), num_bins=8),
+        dict(name='reco_energy', is_log=True, domain=(1, 80)*ureg.GeV,
+             num_bins=12),
+        dict(name='pid', is_lin=True, domain=(0, 1), num_bins=2)
+    ])
+    rand = np.random.RandomState(0)
+    inputs = MapSet([Map(name='nue', binning=in_binning,
+                         hist=rand.uniform(10, 100, in_binning.shape))])
+    inputs['nue'].set_poisson_errors()
+
+    def check(dense_kernel, sparse_kernel):
+        """dense and sparse transforms of the same kernel agree"""
+        kwargs = dict(input_names='nue', output_name='nue',
+                      input_binning=in_binning, output_binning=out_binning)
+        dense = BinnedTensorTransform(xform_array=dense_kernel, **kwargs)
+        xform = SparseBinnedTensorTransform(xform_array=sparse_kernel,
+                                            **kwargs)
+        assert np.allclose(xform.nominal_values, dense_kernel, rtol=1e-12,
+                           atol=0)
+        assert xform.density < 0.5, xform.density
+        out_dense = dense.apply(inputs)
+        out = xform.apply(inputs)
+        assert np.allclose(out.nominal_values, out_dense.nominal_values,
+                           rtol=1e-12, atol=0)
+        assert np.allclose(out.std_devs, out_dense.std_devs, rtol=1e-12,
+                           atol=0)
+
+    # Separable (e.g. parameterized) resolutions: Gaussian smearing, dropping
+    # negligible tails
+    e_centers = in_binning.true_energy.weighted_centers.m
+    cz_centers = in_binning.true_coszen.weighted_centers.m
+    e_edges = out_binning.reco_energy.bin_edges.m
+    cz_edges = out_binning.reco_coszen.bin_edges.m
+    builder = SparseKernelBuilder(in_binning, out_binning)
+    dense_kernel = np.zeros(in_binning.shape + out_binning.shape)
+    for i, e_center in enumerate(e_centers):
+        for j, cz_center in enumerate(cz_centers):
+            e_fracs = np.diff(stats.norm.cdf(np.log(e_edges),
+                                             loc=np.log(e_center), scale=0.1))
+            cz_fracs = np.diff(stats.norm.cdf(cz_edges, loc=cz_center,
+                                              scale=0.05))
+            pid_fracs = np.array([0.3, 0.7])
+            builder.add_separable(
+                dict(true_coszen=j, true_energy=i),
+                dict(reco_energy=e_fracs, reco_coszen=cz_fracs, pid=pid_fracs),
+                threshold=1e-15
+            )
+            row = np.einsum('k,l,m->klm', cz_fracs, e_fracs, pid_fracs)
+            row[row <= 1e-15] = 0
+            dense_kernel[i, j] = row
+    check(dense_kernel, builder.tocsr())
+
+    # Histogrammed events (incl. events outside of the binning and on the
+    # upper edges)
+    num_events = 10000
+    true_e = np.exp(rand.uniform(0, np.log(90), num_events))
+    true_cz = rand.uniform(-1, 1, num_events)
+    true_cz[:10] = 1
+    events = dict(
+        true_energy=true_e, true_coszen=true_cz,
+        reco_energy=true_e * np.exp(rand.normal(0, 0.1, num_events)),
+        reco_coszen=np.clip(true_cz + rand.normal(0, 0.05, num_events), -1, 1),
+        pid=rand.uniform(0, 1, num_events)
+    )
+    weights = rand.uniform(0.5, 1.5, num_events)
+    builder = SparseKernelBuilder(in_binning, out_binning)
+    builder.add_events(
+        {name: events[name] for name in in_binning.names},
+        {name: events[name] for name in out_binning.names},
+        weights=weights
+    )
+    kernel_binning = in_binning * out_binning
+    dense_kernel, _ = np.histogramdd(
+        [events[name] for name in kernel_binning.names],
+        bins=[edges.m for edges in kernel_binning.bin_edges], weights=weights
+    )
+    check(dense_kernel, builder.tocsr())
+
+    logging.info('<< PASS : test_SparseKernelBuilder >>')
+
+
 if __name__ == "__main__":
     set_verbosity(1)
     test_BinnedTensorTransform()
+    test_SparseBinnedTensorTransform()
+    test_SparseKernelBuilder()
@@ -281,6 +281,21 @@ def parse_args(command, description):
             type=int, default=0,
             help='''Fluctated fiducial data index.'''
         )
+        parser.add_argument(
+            '--num-workers',
+            type=int, default=None,
+            help='''Run trials in parallel on this many local worker processes,
+            recording all fits to a single trial store (see --trial-store)
+            instead of one file per fit. Re-running the same command resumes
+            an interrupted run.'''
+        )
+        parser.add_argument(
+            '--trial-store',
+            type=str, default=None, metavar='FILE',
+            help='''SQLite file to record trials to when running with
+            --num-workers; defaults to "trials.sqlite" in the analysis' log
+            directory.'''
+        )
     # A blind analysis only makes sense when the possibility of actually
     # analysing data is available.
     if command not in (inj_param_scan, systematics_tests):
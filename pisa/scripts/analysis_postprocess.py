@@ -281,6 +281,11 @@ def parse_args(command, description):
             help='''The label(s) for the extra points above.'''
         )
 
+    parser.add_argument(
+        '--num-workers', type=int, default=None,
+        help='''Number of processes reading the fit files in parallel.
+        Defaults to the number of CPUs.'''
+    )
     parser.add_argument(
         '--outdir', metavar='DIR', type=str, default=None,
         help='''Store all output plots to this directory. This will make
@@ -349,7 +354,8 @@ def postproc_profile_scan(return_outputs=False):
         other_contours=init_args_d['other_contour'],
         pseudo_experiments=init_args_d['pseudo_experiments'],
         fluctuate_fid=fluctuate_fid,
-        fluctuate_data=fluctuate_data
+        fluctuate_data=fluctuate_data,
+        num_workers=init_args_d['num_workers']
     )
 
     # 1D profile scans
@@ -422,7 +428,8 @@ def postproc_discrete_hypo(return_outputs=False):
         fluctuate_fid=True,
         fluctuate_data=False,
         extra_points=init_args_d['extra_points'],
-        extra_points_labels=init_args_d['extra_points_labels']
+        extra_points_labels=init_args_d['extra_points_labels'],
+        num_workers=init_args_d['num_workers']
     )
 
     trial_nums = postprocessor.data_sets[
@@ -495,7 +502,8 @@ def postproc_inj_param_scan(return_outputs=False):
         fluctuate_data=False,
         extra_points=init_args_d['extra_points'],
         extra_points_labels=init_args_d['extra_points_labels'],
-        inj_param_units=init_args_d['inj_param_units']
+        inj_param_units=init_args_d['inj_param_units'],
+        num_workers=init_args_d['num_workers']
     )
 
     if len(postprocessor.data_sets) == 1:
@@ -554,7 +562,8 @@ def postproc_syst_tests(return_outputs=False):
         outdir=init_args_d['outdir'],
         formats=init_args_d['formats'],
         fluctuate_fid=False,
-        fluctuate_data=False
+        fluctuate_data=False,
+        num_workers=init_args_d['num_workers']
     )
 
     postprocessor.make_systtest_plots()
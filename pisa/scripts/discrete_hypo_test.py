@@ -7,6 +7,7 @@ Ment to be called from `pisa.scripts.analysis` as a subcommand.
 from __future__ import absolute_import, division
 
 from pisa.analysis.hypo_testing import HypoTesting
+from pisa.analysis.trial_executor import LocalPoolBackend, TrialExecutor
 from pisa.utils.scripting import normcheckpath
 
 
@@ -75,11 +76,20 @@ def discrete_hypo_test(return_outputs=False):
             ps_list = [x.strip().lower() for x in ps_str.split(',')]
         init_args_d[ps_name] = ps_list
 
+    num_workers = init_args_d.pop('num_workers')
+    trial_store = init_args_d.pop('trial_store')
+
     # Instantiate the analysis object
     hypo_testing = HypoTesting(**init_args_d)
 
     # Run the analysis
-    hypo_testing.run_analysis()
+    if num_workers is None:
+        hypo_testing.run_analysis()
+    else:
+        TrialExecutor(
+            hypo_testing, store=trial_store,
+            backend=LocalPoolBackend(num_workers=num_workers)
+        ).run()
 
     if return_outputs:
         return hypo_testing
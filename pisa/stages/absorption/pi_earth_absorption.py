@@ -148,14 +148,15 @@ class pi_earth_absorption(PiStage):
                                              'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                              'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
 
-        for container in self.data:
-            self.layers.calcLayers(container['true_coszen'].get('host'))
-            container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
-            container['distances'] = self.layers.distance.reshape((container.size, self.layers.max_layers))
+        # one table of layers for all containers, which only hold indices
+        containers = list(self.data)
+        layer_indices = self.layers.calcLayerTable(
+            [container['true_coszen'].get('host') for container in containers]
+        )
+        for container, layer_index in zip(containers, layer_indices):
+            container['layer_index'] = layer_index
             container['rho_int'] = np.empty((container.size), dtype=FTYPE)
-            
-            container['densities'].mark_changed(WHERE)
-            container['distances'].mark_changed(WHERE)
+
             container['rho_int'].mark_changed(WHERE)
         # don't forget to un-link everything again
         self.data.unlink_containers()
@@ -183,12 +184,17 @@ class pi_earth_absorption(PiStage):
                                              'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                              'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
 
+        # integrate once per row of the layer table
+        table_rho_int = np.empty(len(self.layers.table_coszen), dtype=FTYPE)
+        calculate_integrated_rho(self.layers.table_distance,
+                                 self.layers.table_density,
+                                 out=table_rho_int
+                                )
         for container in self.data:
-            calculate_integrated_rho(container['distances'].get(WHERE),
-                                     container['densities'].get(WHERE),
-                                     out=container['rho_int'].get(WHERE)
-                                    )
-            container['rho_int'].mark_changed(WHERE)
+            # binned data is always stored as floats
+            layer_index = container['layer_index'].get('host').astype(np.int64)
+            container['rho_int'].get('host')[:] = table_rho_int[layer_index]
+            container['rho_int'].mark_changed('host')
         # don't forget to un-link everything again
         self.data.unlink_containers()
 
@@ -4,6 +4,8 @@ PISA pi stage to apply effective area weights
 
 from __future__ import absolute_import, print_function, division
 
+from collections import OrderedDict
+
 from pisa.core.pi_stage import PiStage
 from pisa.utils import vectorizer
 from pisa.utils.profiler import profile
@@ -99,16 +101,77 @@ class pi_aeff(PiStage):  # pylint: disable=invalid-name
         nu_nc_norm = self.params.nu_nc_norm.m_as('dimensionless')
 
         for container in self.data:
-            scale = aeff_scale * livetime_s
-            if container.name in ['nutau_cc', 'nutaubar_cc']:
-                scale *= nutau_cc_norm
-            if 'nutau' in container.name:
-                scale *= nutau_norm
-            if 'nc' in container.name:
-                scale *= nu_nc_norm
+            scale = self._container_scale(
+                container.name, aeff_scale, livetime_s, nutau_cc_norm,
+                nutau_norm, nu_nc_norm
+            )
 
             vectorizer.imul_and_scale(
                 vals=container['weighted_aeff'],
                 scale=scale,
                 out=container['weights'],
             )
+
+    @staticmethod
+    def _container_scale(container_name, aeff_scale, livetime_s, nutau_cc_norm,
+                         nutau_norm, nu_nc_norm):
+        """Scale applied to the weights of the container `container_name`"""
+        scale = aeff_scale * livetime_s
+        if container_name in ['nutau_cc', 'nutaubar_cc']:
+            scale *= nutau_cc_norm
+        if 'nutau' in container_name:
+            scale *= nutau_norm
+        if 'nc' in container_name:
+            scale *= nu_nc_norm
+        return scale
+
+    def get_log_gradients(self, param_names):
+        # all params are pure normalisations, i.e. d(log(w))/d(p) = 1/p for the
+        # containers they apply to, with p in the units used by
+        # `apply_function`
+        log_gradients = OrderedDict()
+        for name in param_names:
+            param = self.params[name]
+            units = 'sec' if name == 'livetime' else 'dimensionless'
+            value = param.m_as(units)
+            if value == 0:
+                continue
+            # per unit of the param's own units
+            d_log_weights = (1. * param.value.units).m_as(units) / value
+            per_container = OrderedDict()
+            for container in self.data:
+                if name == 'nutau_cc_norm':
+                    applies = container.name in ['nutau_cc', 'nutaubar_cc']
+                elif name == 'nutau_norm':
+                    applies = 'nutau' in container.name
+                elif name == 'nu_nc_norm':
+                    applies = 'nc' in container.name
+                else:
+                    applies = True
+                per_container[container.name] = (
+                    None, d_log_weights if applies else 0.
+                )
+            log_gradients[name] = per_container
+        return log_gradients
+
+    def get_weight_scales(self, param_values):
+        # in the order of the arguments of `_container_scale`
+        units = OrderedDict([
+            ('aeff_scale', 'dimensionless'),
+            ('livetime', 'sec'),
+            ('nutau_cc_norm', 'dimensionless'),
+            ('nutau_norm', 'dimensionless'),
+            ('nu_nc_norm', 'dimensionless'),
+        ])
+        current = [self.params[name].m_as(u) for name, u in units.items()]
+        batch = [self._batch_magnitudes(param_values, name, u)
+                 for name, u in units.items()]
+        weight_scales = OrderedDict()
+        for container in self.data:
+            scale = self._container_scale(container.name, *current)
+            if scale == 0:
+                return None
+            weight_scales[container.name] = (
+                None, self._container_scale(container.name, *batch) / scale
+            )
+        return weight_scales
@@ -4,6 +4,8 @@ PISA pi stage to apply weights
 
 from __future__ import absolute_import, print_function, division
 
+from collections import OrderedDict
+
 from pisa.core.pi_stage import PiStage
 from pisa.utils import vectorizer
 from pisa.utils.profiler import profile
@@ -81,3 +83,34 @@ class pi_weight(PiStage):  # pylint: disable=invalid-name
                 scale=scale,
                 out=container['weights'],
             )
+
+    def get_log_gradients(self, param_names):
+        # both params are pure normalisations, i.e. d(log(w))/d(p) = 1/p, with
+        # p in the units used by `apply_function`
+        units = dict(weight_scale='dimensionless', livetime='sec')
+        log_gradients = OrderedDict()
+        for name in param_names:
+            param = self.params[name]
+            value = param.m_as(units[name])
+            if value == 0:
+                continue
+            # per unit of the param's own units
+            d_log_weights = (1. * param.value.units).m_as(units[name]) / value
+            log_gradients[name] = OrderedDict(
+                (container.name, (None, d_log_weights))
+                for container in self.data
+            )
+        return log_gradients
+
+    def get_weight_scales(self, param_values):
+        scale = (self.params.weight_scale.m_as('dimensionless')
+                 * self.params.livetime.m_as('sec'))
+        if scale == 0:
+            return None
+        scales = (
+            self._batch_magnitudes(param_values, 'weight_scale', 'dimensionless')
+            * self._batch_magnitudes(param_values, 'livetime', 'sec')
+        ) / scale
+        return OrderedDict(
+            (container.name, (None, scales)) for container in self.data
+        )
@@ -14,6 +14,7 @@ from pisa.utils import vectorizer
 from pisa.utils.profiler import profile
 from pisa.core.container import Container
 from pisa.core.events_pi import EventsPi
+from pisa.utils.fileio import from_file
 from pisa.utils.format import arg_str_seq_none, split
 
 
@@ -46,6 +47,12 @@ class simple_data_loader(PiStage):
         Must be in range [0.,1.], or disable by setting to `None`.
         Default in None.
 
+    shared_arrays : str or None
+        Path to a manifest file (see `share_arrays`) of events that another
+        process has loaded and shared; if set, the events are not loaded from
+        `events_file` but attached to zero-copy, and only the `weights` are
+        private to this process.
+
     Notes
     -----
     Looks for `initial_weights` fields in events file, which will serve
@@ -68,6 +75,7 @@ class simple_data_loader(PiStage):
                  calc_specs=None,
                  output_specs=None,
                  fraction_events_to_keep=None,
+                 shared_arrays=None,
                 ):
 
         # instantiation args that should not change
@@ -77,6 +85,7 @@ class simple_data_loader(PiStage):
         self.neutrinos = neutrinos
         self.required_metadata = required_metadata
         self.fraction_events_to_keep = fraction_events_to_keep
+        self.shared_arrays = shared_arrays
 
         # Handle list inputs
         self.events_file = split(self.events_file)
@@ -123,8 +132,12 @@ class simple_data_loader(PiStage):
                 ' unique.'
             )
 
-        self.load_events()
-        self.apply_cuts_to_events()
+        # keys of the arrays recorded from the events (to be shared)
+        self.event_keys = set()
+
+        if self.shared_arrays is None:
+            self.load_events()
+            self.apply_cuts_to_events()
 
     def load_events(self):
         '''Loads events from events file'''
@@ -184,6 +197,7 @@ class simple_data_loader(PiStage):
             # add the events data to the container
             for key, val in self.evts[name].items():
                 container.add_array_data(key, val)
+                self.event_keys.add(key)
 
             # create weights arrays:
             # * `initial_weights` as starting point (never modified)
@@ -207,6 +221,7 @@ class simple_data_loader(PiStage):
                     'initial_weights',
                     np.ones(container.size, dtype=FTYPE)
                 )
+            self.event_keys.add('initial_weights')
 
             # add neutrino flavor information for neutrino events
             #TODO Maybe add this directly into EventsPi
@@ -238,11 +253,49 @@ class simple_data_loader(PiStage):
                 container.array_to_binned('weights', self.output_specs)
 
 
+    def attach_shared_events(self):
+        '''Attach to the events shared by another process (instead of
+        loading them) and create the private `weights` arrays.
+        '''
+        manifest = from_file(self.shared_arrays)
+        if manifest['metadata'] is not None:
+            self.metadata = manifest['metadata']
+        self.data.attach_shared_arrays(manifest['containers'])
+        for name, spec in manifest['containers'].items():
+            self.event_keys.update(spec['array_data'].keys())
+            container = self.data[name]
+            container.add_array_data(
+                'weights',
+                np.ones(container.size, dtype=FTYPE)
+            )
+
+        if self.output_mode == 'binned':
+            for container in self.data:
+                container.array_to_binned('weights', self.output_specs)
+
+    def share_arrays(self, directory=None):
+        '''Move the event arrays (and `initial_weights`) into memory-mapped
+        files so other processes can attach to them via the `shared_arrays`
+        argument, see `ContainerSet.share_arrays`. The manifest returned has
+        to be written to a file (e.g. using `pisa.utils.fileio.to_file`).
+        Call `self.data.release_shared_arrays()` to remove the files once all
+        processes have attached.
+        '''
+        return dict(
+            metadata=getattr(self, 'metadata', None),
+            containers=self.data.share_arrays(
+                keys=sorted(self.event_keys), directory=directory
+            ),
+        )
+
     def setup_function(self):
-        '''Store event properties from events file at
-        service initialisation. Cf. `PiStage` docs.
+        '''Store event properties from events file (or attach to shared
+        ones) at service initialisation. Cf. `PiStage` docs.
         '''
-        self.record_event_properties()
+        if self.shared_arrays is None:
+            self.record_event_properties()
+        else:
+            self.attach_shared_events()
 
 
     @profile
@@ -105,20 +105,14 @@ class hyperplane(Stage):
     def _compute_transforms(self):
         """For the current parameter values, evaluate the fit function and
         write the resulting scaling into an x-form array"""
-        # TODO: use iterators to collapse nested loops
         transforms = []
+        sys_values = np.array([self.params[sys].magnitude
+                               for sys in self.sys_list])
         for input_name in self.input_names:
-            transform = None
-            sys_values = []
-            for sys in self.sys_list:
-                sys_values.append(self.params[sys].magnitude)
-            fit_params = self.fit_results[input_name]
-            shape = fit_params.shape[:-1]
-            if transform is None:
-                transform = np.ones(shape)
-            for idx in np.ndindex(*shape):
-                # At every point evaluate the function
-                transform[idx] *= fit_fun(sys_values, *fit_params[idx])
+            fit_params = np.asarray(self.fit_results[input_name])
+            # Evaluate `fit_fun` for all bins at once: offset + slopes . values
+            transform = fit_params[..., 0] + np.dot(fit_params[..., 1:],
+                                                    sys_values)
 
             xform = BinnedTensorTransform(
                 input_names=(input_name),
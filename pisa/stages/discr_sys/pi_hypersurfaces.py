@@ -10,6 +10,7 @@ PISA pi stage to apply hypersurface fits from discrete systematics parameterizat
 from __future__ import absolute_import, print_function, division
 
 import ast
+from collections import OrderedDict
 
 from numba import guvectorize
 import numpy as np
@@ -223,6 +224,44 @@ class pi_hypersurfaces(PiStage): # pylint: disable=invalid-name
         # Unlink the containers again
         self.data.unlink_containers()
 
+    def get_log_gradients(self, param_names):
+        # only the hypersurface params themselves can be differentiated; params
+        # in which the hypersurfaces are interpolated are left to the minimizer
+        param_names = [n for n in param_names if n in self.hypersurface_param_names]
+        log_gradients = OrderedDict((n, OrderedDict()) for n in param_names)
+        if not param_names:
+            return log_gradients
+
+        self.data.data_specs = self.calc_specs
+        if self.links is not None:
+            for key, val in self.links.items():
+                self.data.link_containers(key, val)
+
+        param_values = {sys_param_name: self.params[sys_param_name].m
+                        for sys_param_name in self.hypersurface_param_names}
+        if self.interpolated:
+            osc_params = {name: self.params[name] for name in self.inter_params}
+
+        for container in self.data:
+            if self.interpolated:
+                container_hs = self.hypersurfaces[container.name].get_hypersurface(**osc_params)
+            else:
+                container_hs = self.hypersurfaces[container.name]
+            container_grads = container_hs.evaluate_log_gradients(
+                param_values, param_names=param_names
+            )
+            for name, grad in container_grads.items():
+                # empty bins are not scaled (see `compute_function`)
+                grad = grad.reshape(container.size)
+                grad[~np.isfinite(grad)] = 0.
+                # linked containers share the same hypersurface
+                members = container.containers if hasattr(container, 'containers') else [container]
+                for member in members:
+                    log_gradients[name][member.name] = (self.calc_specs, grad)
+
+        self.data.unlink_containers()
+        return log_gradients
+
     @line_profile
     def apply_function(self):
 
@@ -75,6 +75,8 @@ class polyfits(Stage):
         )
         self.fit_results = None
         self.pnames = None
+        self.fit_funs = None
+        self.fit_coeffs = None
 
     def load_discr_sys(self, pnames):
         """Load the fit results from the file and make some check
@@ -93,6 +95,19 @@ class polyfits(Stage):
                 )
         self.pnames = pnames
 
+        # Compile the fit functions once, and store the coefficients with the
+        # coefficient index first such that each function can be evaluated
+        # for all bins at once
+        self.fit_funs = {}
+        self.fit_coeffs = {}
+        for pname in pnames:
+            self.fit_funs[pname] = eval(self.fit_results[pname]['function']) # pylint: disable=eval-used
+            for name in self.input_names:
+                fit_params = np.asarray(self.fit_results[pname][name])
+                self.fit_coeffs[(pname, name)] = tuple(
+                    np.moveaxis(fit_params, -1, 0)
+                )
+
     def _compute_nominal_transforms(self):
         # TODO: what is the mysterious logic here?
         pnames = [pname for pname in self.params.names if not
@@ -104,21 +119,18 @@ class polyfits(Stage):
     def _compute_transforms(self):
         """For the current parameter values, evaluate the fit function and
         write the resulting scaling into an x-form array"""
-        # TODO: use iterators to collapse nested loops
         transforms = []
         for name in self.input_names:
             transform = None
             for pname in self.pnames:
                 p_value = (self.params[pname].magnitude -
                            self.fit_results[pname]['nominal'])
-                fit_fun = eval(self.fit_results[pname]['function'])
-                fit_params = self.fit_results[pname][name]
-                shape = fit_params.shape[:-1]
+                factor = self._eval_fit_fun(pname, p_value,
+                                            self.fit_coeffs[(pname, name)])
                 if transform is None:
-                    transform = np.ones(shape)
-                for idx in np.ndindex(*shape):
-                    # At every point evaluate the function
-                    transform[idx] *= fit_fun(p_value, *fit_params[idx])
+                    transform = factor
+                else:
+                    transform = transform * factor
 
             xform = BinnedTensorTransform(
                 input_names=(name),
@@ -130,3 +142,20 @@ class polyfits(Stage):
             )
             transforms.append(xform)
         return TransformSet(transforms)
+
+    def _eval_fit_fun(self, pname, p_value, coeffs):
+        """Evaluate the fit function of `pname` at `p_value` for all bins,
+        given its coefficients `coeffs` (one array of bins per coefficient)"""
+        fit_fun = self.fit_funs[pname]
+        shape = coeffs[0].shape
+        try:
+            result = np.array(fit_fun(p_value, *coeffs), dtype=float)
+            if result.shape != shape:
+                result = np.broadcast_to(result, shape).copy()
+        except (TypeError, ValueError):
+            # Function is not written in terms of numpy operations (e.g. uses
+            # `math` or branches on values); evaluate it bin by bin from now on
+            fit_fun = np.vectorize(fit_fun, otypes=[float])
+            self.fit_funs[pname] = fit_fun
+            result = fit_fun(p_value, *coeffs)
+        return result
@@ -24,7 +24,7 @@ import scipy.interpolate as interpolate
 from pisa import numba_jit, ureg
 from pisa.core.map import Map, MapSet
 from pisa.core.stage import Stage
-from pisa.utils.resources import open_resource
+from pisa.utils.flux_weights import load_spline_arrays, read_flux_table
 from pisa.utils.log import logging
 from pisa.utils.profiler import profile
 
@@ -417,26 +417,6 @@ class honda(Stage): #pylint: disable=invalid-name
         flux_file = self.params.flux_file.value
         logging.debug("Loading atmospheric flux table %s", flux_file)
 
-        # columns in Honda files are in the same order
-        cols = ['energy'] + self.primaries
-
-        # Load the data table
-        table = np.genfromtxt(open_resource(flux_file),
-                              usecols=list(range(len(cols))))
-        mask = np.all(np.isnan(table) | np.equal(table, 0), axis=1)
-        table = table[~mask].T
-
-        flux_dict = dict(zip(cols, table))
-        for key in flux_dict.keys():
-            # There are 20 lines per zenith range
-            flux_dict[key] = np.array(np.split(flux_dict[key], 20))
-
-        # Set the zenith and energy range as they are in the tables
-        # The energy may change, but the zenith should always be
-        # 20 bins, full sky.
-        flux_dict['energy'] = flux_dict['energy'][0]
-        flux_dict['coszen'] = np.linspace(0.95, -0.95, 20)
-
         # Now get a spline representation of the flux table.
         logging.debug('Make spline representation of flux')
 
@@ -445,20 +425,18 @@ class honda(Stage): #pylint: disable=invalid-name
         if flux_mode == 'bisplrep':
             logging.debug('Doing quick bivariate spline interpolation')
 
-            # bisplrep needs this to be transposed.
-            # Not exactly sure why, but there you go!
-            for key in flux_dict.keys():
-                if key not in ('energy', 'coszen'):
-                    flux_dict[key] = flux_dict[key].T
+            # Fluxes of shape (cosZenith, azimuth, energy); the zenith should
+            # always be 20 bins, full sky.
+            energy, fluxes = read_flux_table(flux_file)
+            coszen = np.linspace(0.95, -0.95, 20)
 
             # do this in log of energy and log of flux (more stable)
-            log_e_mesh, cz_mesh = np.meshgrid(np.log10(flux_dict['energy']),
-                                              flux_dict['coszen'])
+            log_e_mesh, cz_mesh = np.meshgrid(np.log10(energy), coszen)
 
             self.spline_dict = {}
             for nutype in self.primaries:
                 # Get the logarithmic flux
-                log_flux = np.log10(flux_dict[nutype]).T
+                log_flux = np.log10(fluxes[nutype][:, 0, :])
                 # Get a spline representation
                 spline = interpolate.bisplrep(log_e_mesh, cz_mesh, log_flux,
                                               s=smooth)
@@ -466,63 +444,22 @@ class honda(Stage): #pylint: disable=invalid-name
                 self.spline_dict[nutype] = spline
 
         elif flux_mode == 'integral-preserving':
-            logging.debug('Doing this integral-preserving. Will take longer')
-
-            self.spline_dict = {}
+            logging.debug('Doing this integral-preserving.')
 
             # Do integral-preserving method as in IceCube's NuFlux
-            # This one will be based purely on SciPy rather than ROOT
-            # Stored splines will be 1D in integrated flux over energy
-            int_flux_dict = {}
-            # Energy and CosZenith bins needed for integral-preserving
-            # method must be the edges of those of the normal tables
-            # This will depend on the tables being loaded
-            if 'honda' in self.params.flux_file.value:
-                int_flux_dict['logenergy'] = np.linspace(-1.025, 4.025, 102)
-            else:
-                # Honda did a 3D calculation at the lower energies with
-                # smaller bins. Above this the calculation is 1D and the
-                # bin width doubles.
-                low_log_energy = np.linspace(-1, 1, 41)
-                high_log_energy = np.linspace(1.1, 4, 30)
-                int_flux_dict['logenergy'] = np.concatenate(
-                    [low_log_energy, high_log_energy]
-                )
-            int_flux_dict['coszen'] = np.linspace(-1, 1, 21)
+            # Stored splines will be 1D in integrated flux over energy, one
+            # for every table cosZenith value. The energy bins (and hence the
+            # bin widths in the integral) depend on the tables being loaded,
+            # since Bartol has a switch at 10 GeV where the bin widths double.
+            _, _, t, coeffs, k = load_spline_arrays(
+                flux_file, enpow=1, bartol='honda' not in flux_file
+            )
+            self.spline_dict = {}
             for nutype in self.primaries:
-                # spline_dict now wants to be a set of splines for
-                # every table cosZenith value.
-                splines = {}
-                cz_iter = 1
-                for energyfluxlist in flux_dict[nutype]:
-                    int_flux = []
-                    tot_flux = 0.0
-                    int_flux.append(tot_flux)
-                    for energyfluxval, energyval in zip(
-                            energyfluxlist,
-                            flux_dict['energy']):
-                        # Spline works best if you integrate flux * energy
-                        # Since this is the integrated flux it must also be
-                        # multiplied by bin width.
-                        if 'honda' in self.params.flux_file.value:
-                            # For honda this is easy, it's constant
-                            tot_flux += energyfluxval*energyval*0.05
-                        else:
-                            # For Bartol there is a switch at 10 GeV where
-                            # the bin widths double.
-                            if energyval < 10.0:
-                                tot_flux += energyfluxval*energyval*0.05
-                            else:
-                                tot_flux += energyfluxval*energyval*0.1
-                        int_flux.append(tot_flux)
-
-                    spline = interpolate.splrep(int_flux_dict['logenergy'],
-                                                int_flux, s=0)
-                    cz_value = '%.2f'%(1.05-cz_iter*0.1)
-                    splines[cz_value] = spline
-                    cz_iter += 1
-
-                self.spline_dict[nutype] = splines
+                self.spline_dict[nutype] = {
+                    '%.2f'%(0.95-cz_ind*0.1): (t, c, k)
+                    for cz_ind, c in enumerate(coeffs[nutype][:, 0])
+                }
 
     def load_3d_table(self, smooth=0.05):
         """Manipulate 3 dimensional flux tables.
@@ -540,52 +477,31 @@ class honda(Stage): #pylint: disable=invalid-name
         flux_file = self.params.flux_file.value
         logging.debug("Loading atmospheric flux table %s", flux_file)
 
-        # columns in Honda files are in the same order
-        cols = ['energy'] + self.primaries
-
-        # Load the data table
-        table = np.genfromtxt(open_resource(flux_file),
-                              usecols=list(range(len(cols))))
-        mask = np.all(np.isnan(table) | np.equal(table, 0), axis=1)
-        table = table[~mask].T
-
-        flux_dict = dict(zip(cols, table))
-        for key in flux_dict.keys():
-
-            # There are 20 lines per zenith range
-            coszenith_lists = np.array(np.split(flux_dict[key], 20))
-            azimuth_lists = []
-            for coszenith_list in coszenith_lists:
-                azimuth_lists.append(np.array(np.split(coszenith_list, 12)).T)
-            flux_dict[key] = np.array(azimuth_lists)
-            if key != 'energy':
-                flux_dict[key] = flux_dict[key].T
-
-        # Set the zenith and energy range
-        flux_dict['energy'] = flux_dict['energy'][0].T[0]
-        flux_dict['coszen'] = np.linspace(0.95, -0.95, 20)
-        flux_dict['azimuth'] = np.linspace(15, 345, 12)
-
         # Now get a spline representation of the flux table.
         logging.debug('Make spline representation of flux')
 
         flux_mode = self.params.flux_mode.value
+        azimuths = np.linspace(15, 345, 12)
 
         if flux_mode == 'bisplrep':
 
             logging.debug('Doing quick bsplrep spline interpolation in 3D')
+            # Fluxes of shape (cosZenith, azimuth, energy); the zenith should
+            # always be 20 bins and the azimuth 12 bins, full sky.
+            energy, fluxes = read_flux_table(flux_file, num_azimuth=12)
+            coszen = np.linspace(0.95, -0.95, 20)
+
             # do this in log of energy and log of flux (more stable)
-            log_e_mesh, cz_mesh = np.meshgrid(np.log10(flux_dict['energy']),
-                                              flux_dict['coszen'])
+            log_e_mesh, cz_mesh = np.meshgrid(np.log10(energy), coszen)
 
             self.spline_dict = {}
 
             for nutype in self.primaries:
                 self.spline_dict[nutype] = {}
                 # Make 1 2D bsplrep in E,CZ for each azimuth value
-                for az, f in zip(flux_dict['azimuth'], flux_dict[nutype]):
+                for az_ind, az in enumerate(azimuths):
                     # Get the logarithmic flux
-                    log_flux = np.log10(f.T)
+                    log_flux = np.log10(fluxes[nutype][:, az_ind, :])
                     # Get a spline representation
                     spline = interpolate.bisplrep(log_e_mesh, cz_mesh,
                                                   log_flux, s=smooth*4.)
@@ -595,46 +511,21 @@ class honda(Stage): #pylint: disable=invalid-name
 
         elif flux_mode == 'integral-preserving':
 
-            logging.debug('Doing this integral-preserving. Will take longer')
-
-            self.spline_dict = {}
+            logging.debug('Doing this integral-preserving.')
 
             # Do integral-preserving method as in IceCube's NuFlux
-            # This one will be based purely on SciPy rather than ROOT
-            # Stored splines will be 1D in integrated flux over energy
-            int_flux_dict = {}
-            # Energy and CosZenith bins needed for integral-preserving
-            # method must be the edges of those of the normal tables
-            int_flux_dict['logenergy'] = np.linspace(-1.025, 4.025, 102)
-            int_flux_dict['coszen'] = np.linspace(-1, 1, 21)
+            # Stored splines will be 1D in integrated flux over energy, one
+            # for every table cosZenith value and every table azimuth value.
+            _, _, t, coeffs, k = load_spline_arrays(
+                flux_file, num_azimuth=12, enpow=1
+            )
+            self.spline_dict = {}
             for nutype in self.primaries:
-                # spline_dict now wants to be a set of splines for
-                # every table cosZenith value.
-                # In 3D mode we have a set of these sets for every
-                # table azimuth value.
-                az_splines = {}
-                for az, f in zip(flux_dict['azimuth'], flux_dict[nutype]):
-                    splines = {}
-                    cz_iter = 1
-                    for energyfluxlist in f.T:
-                        int_flux = []
-                        tot_flux = 0.0
-                        int_flux.append(tot_flux)
-                        for energyfluxval, energyval \
-                                in zip(energyfluxlist, flux_dict['energy']):
-                            # Spline works best if you integrate flux * energy
-                            tot_flux += energyfluxval*energyval*0.05
-                            int_flux.append(tot_flux)
-
-                        spline = interpolate.splrep(int_flux_dict['logenergy'],
-                                                    int_flux, s=0)
-                        cz_value = '%.2f'%(1.05-cz_iter*0.1)
-                        splines[cz_value] = spline
-                        cz_iter += 1
-
-                    az_splines[az] = splines
-
-                self.spline_dict[nutype] = az_splines
+                self.spline_dict[nutype] = {
+                    az: {'%.2f'%(0.95-cz_ind*0.1): (t, c, k)
+                         for cz_ind, c in enumerate(coeffs[nutype][:, az_ind])}
+                    for az_ind, az in enumerate(azimuths)
+                }
 
     def _compute_outputs(self, inputs=None):
         """Method for computing both 2D and 3D fluxes.
@@ -6,6 +6,7 @@ Stage to implement the old PISA/oscfit flux systematics
 
 from __future__ import absolute_import, print_function, division
 
+from collections import OrderedDict
 import math
 import os
 import sys
@@ -21,6 +22,10 @@ from pisa.utils.resources import find_resource
 from pisa.utils.barr_parameterization import modRatioNuBar, modRatioUpHor
 
 
+ENERGY_PIVOT = 24.0900951261
+"""Energy (in GeV) about which the spectral index is shifted"""
+
+
 class pi_barr_simple(PiStage):  # pylint: disable=invalid-name
     """
     stage to apply Barr style flux uncertainties
@@ -117,6 +122,28 @@ class pi_barr_simple(PiStage):  # pylint: disable=invalid-name
             )
             container["nu_flux"].mark_changed(WHERE)
 
+    def get_weight_scales(self, param_values):
+        """Only `delta_index` scales the fluxes (and hence the weights)
+        multiplicatively, by a power of the true energy"""
+        if self.calc_specs != "events":
+            return None
+        for values in param_values:
+            for name, value in values.items():
+                if name != "delta_index" and value != self.params[name].value:
+                    return None
+        delta_index = self.params.delta_index.value.m_as("dimensionless")
+        delta_shifts = self._batch_magnitudes(
+            param_values, "delta_index", "dimensionless"
+        ) - delta_index
+        weight_scales = OrderedDict()
+        for container in self.data:
+            true_energy = container.array_data["true_energy"].get("host")
+            weight_scales[container.name] = ("events", np.power(
+                true_energy[np.newaxis, :] / ENERGY_PIVOT,
+                delta_shifts[:, np.newaxis],
+            ))
+        return weight_scales
+
 
 @myjit
 def apply_ratio_scale(ratio_scale, sum_constant, in1, in2, out):
@@ -188,7 +215,7 @@ def apply_sys_kernel(
 
     # apply flux systematics
     # spectral idx
-    idx_scale = spectral_index_scale(true_energy, 24.0900951261, delta_index)
+    idx_scale = spectral_index_scale(true_energy, ENERGY_PIVOT, delta_index)
     new_nu_flux[0] *= idx_scale
     new_nu_flux[1] *= idx_scale
     new_nubar_flux[0] *= idx_scale
@@ -12,14 +12,17 @@ from __future__ import absolute_import, print_function, division
 
 from bz2 import BZ2File
 import collections
+import hashlib
+import math
+import os
 import pickle
 
 import numpy as np
 from numba import guvectorize
 
-from pisa import FTYPE, TARGET
+from pisa import CACHE_DIR, FTYPE, TARGET, numba_jit
 from pisa.core.pi_stage import PiStage
-from pisa.utils.log import logging
+from pisa.utils.log import logging, set_verbosity
 from pisa.utils.profiler import profile
 from pisa.utils.numba_tools import WHERE, myjit
 from pisa.utils.resources import find_resource
@@ -32,6 +35,232 @@ def antipion_production(barr_var, pion_ratio):
     return ((1 + barr_var) / (1 + pion_ratio)) - 1
 
 
+DENSE_TABLE_SUFFIX = ".dense.npz"
+"""Suffix of the file in `CACHE_DIR` (or, if provided by the user, next to a
+pickled MCEq spline table) holding the table's dense version"""
+
+FLUX_CACHE_MAX_BYTES = 2 * 1024**3
+"""Maximum total size of the per-event-sample flux files cached by
+`pi_mceq_barr` (with `cache_fluxes`); least recently used ones are removed
+beyond this"""
+
+_DENSE_TABLE_VERSION = 1
+
+GRADIENT_STORAGE_MODES = ("dense", "float32", "grid")
+"""Ways `pi_mceq_barr` can store the Barr gradients, see its docstring"""
+
+
+def _cache_fpaths(fpath, suffix):
+    """Candidate locations of a file derived from `fpath`: next to it (only
+    read, never written) and in `CACHE_DIR`"""
+    basename = os.path.basename(fpath) + suffix
+    path_hash = hashlib.md5(fpath.encode()).hexdigest()[:8]
+    return [
+        fpath + suffix,
+        os.path.join(CACHE_DIR, "mceq_barr", path_hash + "_" + basename),
+    ]
+
+
+def _prune_cache(dirpath, prefix, max_bytes):
+    """Remove the least recently used files starting with `prefix` in
+    `dirpath` until their total size is at most `max_bytes`"""
+    entries = []
+    for fname in os.listdir(dirpath):
+        if not fname.startswith(prefix):
+            continue
+        try:
+            stat = os.stat(os.path.join(dirpath, fname))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, fname))
+    total = sum(size for _, size, _ in entries)
+    for _, size, fname in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(dirpath, fname))
+        except OSError:
+            continue
+        logging.debug("Removed cached MCEq fluxes %s", fname)
+        total -= size
+
+
+def _save_npz(fpath, arrays):
+    """Save `arrays` to `fpath` via a temporary file, such that concurrent jobs
+    never read a partially written file; returns False if not writeable"""
+    try:
+        dirpath = os.path.dirname(fpath)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        tmp_fpath = "%s.%d.tmp" % (fpath, os.getpid())
+        with open(tmp_fpath, "wb") as tmp_file:
+            np.savez(tmp_file, **arrays)
+        os.replace(tmp_fpath, fpath)
+    except OSError:
+        return False
+    return True
+
+
+def dense_spline_tables(spline_tables_dict):
+    """Convert the `RectBivariateSpline`s of an MCEq spline table into dense
+    arrays.
+
+    All splines of a table are fit on the same (cosZenith, ln(energy)) grid and
+    hence share their knots, so only the coefficients are stored per spline.
+
+    Parameters
+    ----------
+    spline_tables_dict : Mapping
+        As created by `pisa/scripts/create_barr_sys_tables_mceq.py`, i.e.
+        {gradient param name: {flux key: RectBivariateSpline}} (plus
+        "metadata")
+
+    Returns
+    -------
+    dense_tables : dict
+        "param_names" and "flux_keys" (string arrays), knots "tx", "ty",
+        degrees "kx", "ky", and "coeffs" of shape (n params, n flux keys,
+        len(tx) - kx - 1, len(ty) - ky - 1)
+
+    """
+    param_names = [n for n in spline_tables_dict.keys() if n != "metadata"]
+    flux_keys = list(spline_tables_dict[param_names[0]].keys())
+    tx, ty = spline_tables_dict[param_names[0]][flux_keys[0]].get_knots()
+    kx, ky = spline_tables_dict[param_names[0]][flux_keys[0]].degrees
+    shape = (len(tx) - kx - 1, len(ty) - ky - 1)
+
+    coeffs = np.empty((len(param_names), len(flux_keys)) + shape)
+    for param_idx, param_name in enumerate(param_names):
+        splines = spline_tables_dict[param_name]
+        if list(splines.keys()) != flux_keys:
+            raise ValueError(
+                "Splines of param '%s' (%s) differ from those of param '%s' (%s)"
+                % (param_name, list(splines.keys()), param_names[0], flux_keys)
+            )
+        for key_idx, flux_key in enumerate(flux_keys):
+            spline = splines[flux_key]
+            spline_tx, spline_ty = spline.get_knots()
+            if not (
+                spline.degrees == (kx, ky)
+                and np.array_equal(spline_tx, tx)
+                and np.array_equal(spline_ty, ty)
+            ):
+                raise ValueError(
+                    "Spline '%s' of param '%s' has different knots than the "
+                    "others" % (flux_key, param_name)
+                )
+            coeffs[param_idx, key_idx] = spline.get_coeffs().reshape(shape)
+
+    return dict(
+        param_names=np.array(param_names),
+        flux_keys=np.array(flux_keys),
+        tx=tx,
+        ty=ty,
+        kx=kx,
+        ky=ky,
+        coeffs=coeffs,
+    )
+
+
+def load_dense_spline_tables(table_file, use_cache=True):
+    """Load an MCEq spline table in its dense form (see `dense_spline_tables`).
+
+    `table_file` can either be a pickled (bz2) spline table, which is then
+    converted and the result cached in `CACHE_DIR` (see
+    `DENSE_TABLE_SUFFIX`), or such a converted file itself.
+
+    Returns
+    -------
+    dense_tables : dict
+        See `dense_spline_tables`, plus the "key" identifying the table
+
+    """
+    fpath = find_resource(table_file)
+    with open(fpath, "rb") as table:
+        key = "%s_%d" % (hashlib.md5(table.read()).hexdigest(), _DENSE_TABLE_VERSION)
+
+    fpaths = [fpath]
+    if not fpath.endswith(".npz"):
+        fpaths = _cache_fpaths(fpath, DENSE_TABLE_SUFFIX) if use_cache else []
+
+    for dense_fpath in fpaths:
+        if not os.path.isfile(dense_fpath):
+            continue
+        with np.load(dense_fpath) as dense_file:
+            dense_tables = {name: dense_file[name] for name in dense_file.files}
+        # Converted files are identified by the key of their source
+        if dense_fpath == fpath:
+            dense_tables["key"] = key
+        elif str(dense_tables["key"]) != key:
+            continue
+        logging.info("Loaded dense MCEq spline tables from : %s", dense_fpath)
+        dense_tables["kx"] = int(dense_tables["kx"])
+        dense_tables["ky"] = int(dense_tables["ky"])
+        dense_tables["key"] = str(dense_tables["key"])
+        return dense_tables
+
+    logging.info("Converting MCEq spline tables from : %s", fpath)
+    # Encoding is to support pickle files created with python v2
+    dense_tables = dense_spline_tables(
+        pickle.load(BZ2File(fpath), encoding="latin1")
+    )
+    dense_tables["key"] = key
+    if use_cache and _save_npz(fpaths[-1], dense_tables):
+        logging.debug("Cached dense MCEq spline tables to %s", fpaths[-1])
+    return dense_tables
+
+
+@numba_jit(nopython=True, nogil=True, cache=True)
+def _bspline_basis(t, k, x, basis):
+    """Find the knot interval `l` containing `x` (clipped to the domain of the
+    spline) and fill `basis` with the k+1 B-splines that are non-zero there,
+    as done by FITPACK's fpbspl; returns `l`"""
+    n = len(t)
+    x = min(max(x, t[k]), t[n - k - 1])
+    l = np.searchsorted(t, x, side="right") - 1
+    l = min(max(l, k), n - k - 2)
+    hh = np.empty(k)
+    basis[0] = 1.0
+    for j in range(1, k + 1):
+        hh[:j] = basis[:j]
+        basis[0] = 0.0
+        for i in range(1, j + 1):
+            li = l + i
+            lj = li - j
+            f = hh[i - 1] / (t[li] - t[lj])
+            basis[i - 1] += f * (t[li] - x)
+            basis[i] = f * (x - t[lj])
+    return l
+
+
+@numba_jit(nopython=True, nogil=True, cache=True)
+def eval_dense_splines(x, y, tx, ty, kx, ky, coeffs, out):
+    """Evaluate many bivariate splines sharing the knots `tx`, `ty` at the
+    points (`x`, `y`) in a single pass; `out[i, s]` is what
+    `RectBivariateSpline.__call__(x[i], y[i], grid=False)` returns for the
+    spline with coefficients `coeffs[s]`. The basis functions are computed once
+    per point rather than once per spline and point.
+
+    Array dimensions :
+        x, y : [A]
+        coeffs : [S, len(tx) - kx - 1, len(ty) - ky - 1]
+        out : [A, S]
+    """
+    bx = np.empty(kx + 1)
+    by = np.empty(ky + 1)
+    for i in range(len(x)):
+        lx = _bspline_basis(tx, kx, x[i], bx) - kx
+        ly = _bspline_basis(ty, ky, y[i], by) - ky
+        for s in range(coeffs.shape[0]):
+            result = 0.0
+            for ix in range(kx + 1):
+                partial = 0.0
+                for iy in range(ky + 1):
+                    partial += by[iy] * coeffs[s, lx + ix, ly + iy]
+                result += bx[ix] * partial
+            out[i, s] = result
+
+
 class pi_mceq_barr(PiStage):
     """
     Stage to generate nominal flux from MCEq and apply Barr style flux uncertainties.
@@ -39,6 +268,34 @@ class pi_mceq_barr(PiStage):
     Parameters
     ----------
     table_file : pickle file containing pre-generated tables from MCEq
+        (or its dense version, see `load_dense_spline_tables`)
+
+    include_nutau_flux : bool
+
+    precomputed : bool
+        If True (default), convert the splines into dense coefficient arrays
+        once (cached in `CACHE_DIR`) and evaluate the nominal fluxes and all
+        gradients for all events in one pass. If False, evaluate each pickled
+        scipy spline on its own (slow, for validation).
+
+    cache_fluxes : bool
+        With `precomputed`, also cache the fluxes and gradients evaluated for
+        each event sample in `CACHE_DIR`, such that jobs on the same events
+        skip the evaluation; the cache is limited to `FLUX_CACHE_MAX_BYTES`.
+        Off by default.
+
+    gradient_storage : str
+        One of `GRADIENT_STORAGE_MODES`: "dense" (default) stores the
+        gradients of each event in FTYPE; "float32" stores them in single
+        precision; "grid" stores them only on a grid regularly spaced in
+        ln(true_energy) and abs(true_coszen) (they depend on nothing else),
+        relative to the nominal flux, where the relative Barr modifications
+        of the flux are computed and then bilinearly interpolated for each
+        event. The latter needs no per-event gradients at all; its accuracy
+        is set by `gradient_grid_shape`. Requires `precomputed`.
+
+    gradient_grid_shape : tuple of two ints
+        Number of (energy, coszen) nodes of the grid in "grid" mode
 
     params : ParamSet
         Must exclusively have parameters: .. ::
@@ -88,6 +345,10 @@ class pi_mceq_barr(PiStage):
         self,
         table_file,
         include_nutau_flux=False,
+        precomputed=True,
+        cache_fluxes=False,
+        gradient_storage="dense",
+        gradient_grid_shape=(200, 50),
         data=None,
         params=None,
         input_names=None,
@@ -183,6 +444,24 @@ class pi_mceq_barr(PiStage):
         # store args
         self.table_file = table_file
         self.include_nutau_flux = include_nutau_flux
+        self.precomputed = precomputed
+        self.cache_fluxes = cache_fluxes
+        if gradient_storage not in GRADIENT_STORAGE_MODES:
+            raise ValueError(
+                "`gradient_storage` must be one of %s, got '%s'"
+                % (GRADIENT_STORAGE_MODES, gradient_storage)
+            )
+        if gradient_storage == "grid":
+            if not precomputed:
+                raise ValueError('`gradient_storage` "grid" requires `precomputed`')
+            gradient_grid_shape = tuple(int(n) for n in gradient_grid_shape)
+            if len(gradient_grid_shape) != 2 or min(gradient_grid_shape) < 2:
+                raise ValueError(
+                    "`gradient_grid_shape` must be two ints >= 2, got %s"
+                    % (gradient_grid_shape,)
+                )
+        self.gradient_storage = gradient_storage
+        self.gradient_grid_shape = gradient_grid_shape
 
 
         # init base class
@@ -240,7 +519,18 @@ class pi_mceq_barr(PiStage):
                 flux_container_shape, np.NaN, dtype=FTYPE
             )
             container["nu_flux"] = np.full(flux_container_shape, np.NaN, dtype=FTYPE)
-            container["gradients"] = np.full(gradients_shape, np.NaN, dtype=FTYPE)
+            if self.gradient_storage == "float32":
+                container["gradients"] = np.full(
+                    gradients_shape, np.NaN, dtype=np.float32
+                )
+            elif self.gradient_storage == "dense":
+                container["gradients"] = np.full(gradients_shape, np.NaN, dtype=FTYPE)
+
+        # Gradients relative to the nominal flux (of shape [N energy, N coszen,
+        # N flavors, N gradients]) and their (ln(energy), abs(coszen)) bounds
+        # by container in "grid" mode
+        self.gradient_grids = collections.OrderedDict()
+        self.gradient_grid_bounds = collections.OrderedDict()
 
         # Also create an array container to hold the gradient parameter values
         # Only want this once, e.g. not once per container
@@ -267,6 +557,10 @@ class pi_mceq_barr(PiStage):
         # Note that doing this all on CPUs, since the splines reside on the CPUs
         # The actual `compute_function` computation can be done on GPUs though
 
+        if self.precomputed:
+            self.setup_precomputed()
+            return
+
         # Load the MCEq splines
         spline_file = find_resource(self.table_file)
         logging.info("Loading MCEq spline tables from : %s", spline_file)
@@ -361,35 +655,159 @@ class pi_mceq_barr(PiStage):
             # Tell the smart arrays we've changed the flux gradient values on the host
             container["gradients"].mark_changed("host")
 
-    @profile
-    def compute_function(self):
+    def setup_precomputed(self):
+        """Fill the nominal fluxes and gradients of all containers from the
+        dense spline tables, or (with `cache_fluxes`) from the on-disk cache
+        of a previous job with the same tables and events"""
+        dense_tables = load_dense_spline_tables(self.table_file)
+        param_indices = {n: i for i, n in enumerate(dense_tables["param_names"])}
+        key_indices = {n: i for i, n in enumerate(dense_tables["flux_keys"])}
+        missing = set(self.gradient_param_names).difference(param_indices)
+        if missing:
+            raise KeyError(
+                "Gradient params %s missing from MCEq spline tables"
+                % sorted(missing)
+            )
 
-        self.data.data_specs = self.calc_specs
+        flavs = ["nue", "numu", "nutau"][: 3 if self.include_nutau_flux else 2]
+        arb_param_idx = param_indices[self.gradient_param_names[0]]
 
-        #
-        # Get params
-        #
+        for container in self.data:
+            nubar = container["nubar"]
+            flux_keys = [f if nubar > 0 else f + "bar" for f in flavs]
+            num_flavs = len(flux_keys)
+
+            # Nominal flux is stored once per Barr parameter, choose an
+            # arbitrary one
+            nominal_indices = [(arb_param_idx, key_indices[f]) for f in flux_keys]
+            # Gradients ordered as [flavor, param]
+            gradient_indices = [
+                (param_indices[n], key_indices["d" + f])
+                for f in flux_keys
+                for n in self.gradient_param_names
+            ]
 
-        # Spectral index (and required energy pivot)
-        delta_index = self.params.delta_index.value.m_as("dimensionless")
-        energy_pivot = self.params.energy_pivot.value.m_as("GeV")
+            true_energy = container["true_energy"].get("host")
+            true_coszen = container["true_coszen"].get("host")
+            nu_flux_nominal = container["nu_flux_nominal"].get("host")
+            nu_flux_nominal[:] = self._eval_cached(
+                dense_tables, nominal_indices, true_energy, true_coszen
+            )
+            container["nu_flux_nominal"].mark_changed("host")
+
+            if self.gradient_storage == "grid":
+                log_energy = np.log(true_energy)
+                abs_coszen = np.abs(true_coszen)
+                bounds = np.array(
+                    [log_energy.min(), log_energy.max(),
+                     abs_coszen.min(), abs_coszen.max()],
+                    dtype=FTYPE,
+                )
+                # Avoid degenerate grids for samples of identical values
+                bounds[1] = max(bounds[1], bounds[0] + 1e-6)
+                bounds[3] = max(bounds[3], bounds[2] + 1e-6)
+                grid_log_energy, grid_abs_coszen = np.meshgrid(
+                    np.linspace(bounds[0], bounds[1], self.gradient_grid_shape[0]),
+                    np.linspace(bounds[2], bounds[3], self.gradient_grid_shape[1]),
+                    indexing="ij",
+                )
+                grid_energy = np.exp(grid_log_energy.ravel())
+                grid_abs_coszen = grid_abs_coszen.ravel()
+                grid_nominal = self._eval_cached(
+                    dense_tables, nominal_indices, grid_energy, grid_abs_coszen
+                )
+                grid_gradients = self._eval_cached(
+                    dense_tables, gradient_indices, grid_energy, grid_abs_coszen
+                ).reshape(len(grid_energy), num_flavs, -1)
+                # The gradients roughly follow the (steeply falling) flux, so
+                # their ratio is much smoother and better interpolated
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    rel_gradients = np.where(
+                        grid_nominal[:, :, np.newaxis] > 0,
+                        grid_gradients / grid_nominal[:, :, np.newaxis],
+                        0.0,
+                    )
+                self.gradient_grid_bounds[container.name] = bounds
+                self.gradient_grids[container.name] = rel_gradients.reshape(
+                    self.gradient_grid_shape + rel_gradients.shape[1:]
+                ).astype(FTYPE)
+                continue
+
+            gradients = container["gradients"].get("host")
+            gradients[:] = self._eval_cached(
+                dense_tables, gradient_indices, true_energy, true_coszen
+            ).reshape(gradients.shape)
+            container["gradients"].mark_changed("host")
+
+    def _eval_cached(self, dense_tables, spline_indices, true_energy, true_coszen):
+        """Evaluate the selected splines at the events, or load the result of a
+        previous evaluation from disk (if `cache_fluxes`)"""
+        if not self.cache_fluxes:
+            return self._eval(dense_tables, spline_indices, true_energy,
+                              true_coszen)
+        hasher = hashlib.md5(dense_tables["key"].encode())
+        hasher.update(np.asarray(spline_indices).tobytes())
+        hasher.update(np.dtype(FTYPE).str.encode())
+        hasher.update(np.ascontiguousarray(true_energy).tobytes())
+        hasher.update(np.ascontiguousarray(true_coszen).tobytes())
+        cache_dirpath = os.path.join(CACHE_DIR, "mceq_barr")
+        cache_fpath = os.path.join(
+            cache_dirpath, "fluxes_%s.npz" % hasher.hexdigest()
+        )
+        if os.path.isfile(cache_fpath):
+            logging.debug("Loading MCEq fluxes from %s", cache_fpath)
+            with np.load(cache_fpath) as cache:
+                values = cache["values"]
+            try:
+                # Mark as recently used
+                os.utime(cache_fpath)
+            except OSError:
+                pass
+            return values
+
+        values = self._eval(dense_tables, spline_indices, true_energy,
+                            true_coszen)
+        if _save_npz(cache_fpath, dict(values=values)):
+            logging.debug("Cached MCEq fluxes to %s", cache_fpath)
+            _prune_cache(cache_dirpath, "fluxes_", FLUX_CACHE_MAX_BYTES)
+        return values
+
+    @staticmethod
+    def _eval(dense_tables, spline_indices, true_energy, true_coszen):
+        """Evaluate the selected splines at the events"""
+        coeffs = dense_tables["coeffs"][tuple(np.transpose(spline_indices))]
+        values = np.empty((len(true_energy), len(spline_indices)), dtype=FTYPE)
+        eval_dense_splines(
+            np.abs(true_coszen).astype(np.float64),
+            np.log(true_energy).astype(np.float64),
+            dense_tables["tx"],
+            dense_tables["ty"],
+            dense_tables["kx"],
+            dense_tables["ky"],
+            np.ascontiguousarray(coeffs),
+            values,
+        )
+        return values
 
+    def _gradient_params_mapping(self, value_of):
+        """Map the user parameters into the Barr +/- params, where `value_of`
+        returns the (dimensionless) magnitude of a user param by name; these
+        may be scalars or arrays"""
         # Grab the pion ratio
-        pion_ratio = self.params.pion_ratio.value.m_as("dimensionless")
+        pion_ratio = value_of("pion_ratio")
 
-        # Map the user parameters into the Barr +/- params
         # pi- production rates is restricted by the pi-ratio, just as in arXiv:0611266
         # TODO might want dedicated priors for pi- params (but without corresponding free params)
         gradient_params_mapping = collections.OrderedDict()
-        gradient_params_mapping["a+"] = self.params.barr_a_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["b+"] = self.params.barr_b_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["c+"] = self.params.barr_c_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["d+"] = self.params.barr_d_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["e+"] = self.params.barr_e_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["f+"] = self.params.barr_f_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["g+"] = self.params.barr_g_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["h+"] = self.params.barr_h_Pi.value.m_as("dimensionless")
-        gradient_params_mapping["i+"] = self.params.barr_i_Pi.value.m_as("dimensionless")
+        gradient_params_mapping["a+"] = value_of("barr_a_Pi")
+        gradient_params_mapping["b+"] = value_of("barr_b_Pi")
+        gradient_params_mapping["c+"] = value_of("barr_c_Pi")
+        gradient_params_mapping["d+"] = value_of("barr_d_Pi")
+        gradient_params_mapping["e+"] = value_of("barr_e_Pi")
+        gradient_params_mapping["f+"] = value_of("barr_f_Pi")
+        gradient_params_mapping["g+"] = value_of("barr_g_Pi")
+        gradient_params_mapping["h+"] = value_of("barr_h_Pi")
+        gradient_params_mapping["i+"] = value_of("barr_i_Pi")
         for k in list(gradient_params_mapping.keys()):
             gradient_params_mapping[k.replace("+", "-")] = antipion_production(
                 gradient_params_mapping[k], pion_ratio
@@ -397,14 +815,33 @@ class pi_mceq_barr(PiStage):
 
         # kaons
         # as the kaon ratio is unknown, K- production is not restricted
-        gradient_params_mapping["w+"] = self.params.barr_w_K.value.m_as("dimensionless")
-        gradient_params_mapping["w-"] = self.params.barr_w_antiK.value.m_as("dimensionless")
-        gradient_params_mapping["x+"] = self.params.barr_x_K.value.m_as("dimensionless")
-        gradient_params_mapping["x-"] = self.params.barr_x_antiK.value.m_as("dimensionless")
-        gradient_params_mapping["y+"] = self.params.barr_y_K.value.m_as("dimensionless")
-        gradient_params_mapping["y-"] = self.params.barr_y_antiK.value.m_as("dimensionless")
-        gradient_params_mapping["z+"] = self.params.barr_z_K.value.m_as("dimensionless")
-        gradient_params_mapping["z-"] = self.params.barr_z_antiK.value.m_as("dimensionless")
+        gradient_params_mapping["w+"] = value_of("barr_w_K")
+        gradient_params_mapping["w-"] = value_of("barr_w_antiK")
+        gradient_params_mapping["x+"] = value_of("barr_x_K")
+        gradient_params_mapping["x-"] = value_of("barr_x_antiK")
+        gradient_params_mapping["y+"] = value_of("barr_y_K")
+        gradient_params_mapping["y-"] = value_of("barr_y_antiK")
+        gradient_params_mapping["z+"] = value_of("barr_z_K")
+        gradient_params_mapping["z-"] = value_of("barr_z_antiK")
+
+        return gradient_params_mapping
+
+    @profile
+    def compute_function(self):
+
+        self.data.data_specs = self.calc_specs
+
+        #
+        # Get params
+        #
+
+        # Spectral index (and required energy pivot)
+        delta_index = self.params.delta_index.value.m_as("dimensionless")
+        energy_pivot = self.params.energy_pivot.value.m_as("GeV")
+
+        gradient_params_mapping = self._gradient_params_mapping(
+            lambda name: self.params[name].value.m_as("dimensionless")
+        )
 
         # Populate array Barr param array
         for (
@@ -424,6 +861,25 @@ class pi_mceq_barr(PiStage):
 
         for container in self.data:
 
+            if self.gradient_storage == "grid":
+                # Relative Barr modifications of the flux on the (coarse)
+                # grid, then interpolated for each event
+                grid_rel_delta = np.dot(
+                    self.gradient_grids[container.name], self.gradient_params
+                )
+                apply_sys_grid_vectorized(
+                    container["true_energy"].get(WHERE),
+                    container["true_coszen"].get(WHERE),
+                    delta_index,
+                    energy_pivot,
+                    container["nu_flux_nominal"].get(WHERE),
+                    grid_rel_delta,
+                    self.gradient_grid_bounds[container.name],
+                    out=container["nu_flux"].get(WHERE),
+                )
+                container["nu_flux"].mark_changed(WHERE)
+                continue
+
             apply_sys_vectorized(
                 container["true_energy"].get(WHERE),
                 container["true_coszen"].get(WHERE),
@@ -437,6 +893,152 @@ class pi_mceq_barr(PiStage):
             
             container["nu_flux"].mark_changed(WHERE)
 
+    def get_log_gradients(self, param_names):
+        """The flux is linear in the Barr params, so its derivatives are the
+        stored gradients. These are turned into derivatives of the event
+        weights using the oscillation probabilities `prob_e` and `prob_mu` of a
+        downstream oscillation stage (weights ~ flux_e * prob_e + flux_mu *
+        prob_mu); without those (or outside of events mode), all params are
+        left to numerical differentiation."""
+        log_gradients = collections.OrderedDict()
+        if self.calc_specs != "events":
+            return log_gradients
+
+        pion_ratio = self.params.pion_ratio.value.m_as("dimensionless")
+        delta_index = self.params.delta_index.value.m_as("dimensionless")
+        energy_pivot = self.params.energy_pivot.value.m_as("GeV")
+
+        # d(gradient param)/d(user param) for all gradient params
+        jacobian = collections.OrderedDict()
+        for n in self.barr_param_names[:9]:
+            barr_var = self.params["barr_%s_Pi" % n].value.m_as("dimensionless")
+            jacobian["barr_%s_Pi" % n] = {n + "+": 1., n + "-": 1. / (1 + pion_ratio)}
+            jacobian.setdefault("pion_ratio", {})[n + "-"] = (
+                -(1 + barr_var) / (1 + pion_ratio)**2
+            )
+        for n in self.barr_param_names[9:]:
+            jacobian["barr_%s_K" % n] = {n + "+": 1.}
+            jacobian["barr_%s_antiK" % n] = {n + "-": 1.}
+
+        for container in self.data:
+            if not ("prob_e" in container.array_data and "prob_mu" in container.array_data):
+                return collections.OrderedDict()
+
+        for name in param_names:
+            if name not in jacobian and name != "delta_index":
+                continue
+            per_container = collections.OrderedDict()
+            for container in self.data:
+                nu_flux = container["nu_flux"].get("host")
+                probs = np.stack(
+                    [container["prob_e"].get("host"), container["prob_mu"].get("host")],
+                    axis=1,
+                )
+                if name == "delta_index":
+                    true_energy = container["true_energy"].get("host")
+                    d_flux = (
+                        container["nu_flux_nominal"].get("host")
+                        * np.power(true_energy / energy_pivot, delta_index)[:, np.newaxis]
+                        * np.log(true_energy / energy_pivot)[:, np.newaxis]
+                    )
+                elif self.gradient_storage == "grid":
+                    grid = self.gradient_grids[container.name]
+                    d_flux_grid = np.zeros(grid.shape[:-1])
+                    for gradient_param_name, coeff in jacobian[name].items():
+                        idx = self.gradient_param_indices[gradient_param_name]
+                        d_flux_grid += coeff * grid[..., idx]
+                    d_flux = container["nu_flux_nominal"].get("host") * grid_lookup(
+                        d_flux_grid,
+                        self.gradient_grid_bounds[container.name],
+                        container["true_energy"].get("host"),
+                        container["true_coszen"].get("host"),
+                    )
+                else:
+                    gradients = container["gradients"].get("host")
+                    d_flux = np.zeros_like(nu_flux)
+                    for gradient_param_name, coeff in jacobian[name].items():
+                        idx = self.gradient_param_indices[gradient_param_name]
+                        d_flux += coeff * gradients[:, :, idx]
+                # the flux is clipped at zero
+                d_flux[nu_flux <= 0.] = 0.
+                weight_flux = np.sum(nu_flux[:, :2] * probs, axis=1)
+                d_weight_flux = np.sum(d_flux[:, :2] * probs, axis=1)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    d_log_weights = np.where(
+                        weight_flux > 0, d_weight_flux / weight_flux, 0.
+                    )
+                per_container[container.name] = ("events", d_log_weights)
+            log_gradients[name] = per_container
+
+        return log_gradients
+
+    def get_weight_scales(self, param_values):
+        """The fluxes for a batch of params follow from the stored gradients
+        (and the spectral index scale) all at once; as in `get_log_gradients`,
+        they are turned into scales of the event weights using the oscillation
+        probabilities of a downstream oscillation stage"""
+        if self.calc_specs != "events":
+            return None
+        for container in self.data:
+            if not ("prob_e" in container.array_data and "prob_mu" in container.array_data):
+                return None
+
+        def batch(name, units="dimensionless"):
+            return self._batch_magnitudes(param_values, name, units)
+
+        delta_index = batch("delta_index")[:, np.newaxis]
+        energy_pivot = batch("energy_pivot", "GeV")[:, np.newaxis]
+        gradient_params_mapping = self._gradient_params_mapping(batch)
+        gradient_params = np.empty(
+            (len(param_values), len(self.gradient_param_indices)), dtype=FTYPE
+        )
+        for gradient_param_name, idx in self.gradient_param_indices.items():
+            gradient_params[:, idx] = gradient_params_mapping[gradient_param_name]
+
+        weight_scales = collections.OrderedDict()
+        for container in self.data:
+            true_energy = container.array_data["true_energy"].get("host")
+            # only the nue and numu fluxes enter the weights
+            nu_flux_nominal = container.array_data["nu_flux_nominal"].get("host")[:, :2]
+            scale = np.power(true_energy / energy_pivot, delta_index)
+            if self.gradient_storage == "grid":
+                rel_gradients = grid_lookup(
+                    self.gradient_grids[container.name][:, :, :2],
+                    self.gradient_grid_bounds[container.name],
+                    true_energy,
+                    container.array_data["true_coszen"].get("host"),
+                )
+                nu_flux = nu_flux_nominal * (
+                    scale[:, :, np.newaxis]
+                    + np.einsum("nbc,kc->knb", rel_gradients, gradient_params)
+                )
+            else:
+                gradients = container.array_data["gradients"].get("host")[:, :2]
+                nu_flux = (
+                    nu_flux_nominal * scale[:, :, np.newaxis]
+                    + np.einsum("nbc,kc->knb", gradients, gradient_params)
+                )
+            # the flux is clipped at zero
+            nu_flux = np.maximum(nu_flux, 0.)
+
+            probs = np.stack(
+                [container.array_data["prob_e"].get("host"),
+                 container.array_data["prob_mu"].get("host")],
+                axis=1,
+            )
+            weight_flux = np.sum(
+                container.array_data["nu_flux"].get("host")[:, :2] * probs, axis=1
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scales = np.where(
+                    weight_flux > 0,
+                    np.einsum("knb,nb->kn", nu_flux, probs) / weight_flux,
+                    0.,
+                )
+            weight_scales[container.name] = ("events", scales)
+
+        return weight_scales
+
 
 @myjit
 def spectral_index_scale(true_energy, energy_pivot, delta_index):
@@ -484,8 +1086,11 @@ def apply_sys_kernel(
     # Nominal flux + spectral index change
     result = nu_flux_nominal * spectral_index_scale(true_energy, energy_pivot, delta_index)
 
-    # Apply bar params
-    result += np.dot(gradients, gradient_params)
+    # Apply barr params (explicit loop rather than np.dot such that the
+    # gradients can be stored with lower precision than FTYPE)
+    for b in range(result.shape[0]):
+        for c in range(gradient_params.shape[0]):
+            result[b] += gradients[b, c] * gradient_params[c]
 
     # Check for negative results from spline (np.clip not supported by vectorization)
     result[result < 0.0] = 0.0
@@ -496,11 +1101,16 @@ def apply_sys_kernel(
 # vectorized function to apply
 # must be outside class
 SIGNATURE = "(f4, f4, f4, f4, f4[:], f4[:,:], f4[:], f4[:])"
+SIGNATURES = [SIGNATURE]
 if FTYPE == np.float64:
-    SIGNATURE = SIGNATURE.replace("f4", "f8")
+    SIGNATURES = [
+        SIGNATURE.replace("f4", "f8"),
+        # gradients stored in single precision
+        SIGNATURE.replace("f4", "f8").replace("f8[:,:]", "f4[:,:]"),
+    ]
 
 
-@guvectorize([SIGNATURE], "(),(),(),(),(b),(b,c),(c)->(b)", target=TARGET)
+@guvectorize(SIGNATURES, "(),(),(),(),(b),(b,c),(c)->(b)", target=TARGET)
 def apply_sys_vectorized(
     true_energy,
     true_coszen,
@@ -521,3 +1131,225 @@ def apply_sys_vectorized(
         gradient_params=gradient_params,
         out=out,
     )
+
+
+@myjit
+def grid_position(value, low, high, num):
+    """Index of the grid cell of `value` on a grid of `num` nodes regularly
+    spaced from `low` to `high` (clipped to the grid), and the fractional
+    position within the cell"""
+    pos = (value - low) / (high - low) * (num - 1)
+    pos = min(max(pos, 0.0), num - 1.0)
+    idx = min(int(pos), num - 2)
+    return idx, pos - idx
+
+
+@myjit
+def apply_sys_grid_kernel(
+    true_energy,
+    true_coszen,
+    delta_index,
+    energy_pivot,
+    nu_flux_nominal,
+    grid_rel_delta,
+    grid_bounds,
+    out,
+):
+    """
+    Like `apply_sys_kernel`, but with the contributions of the Barr params
+    relative to the nominal flux (gradients . gradient_params / nominal)
+    precomputed on a grid regularly spaced in ln(true_energy) and
+    abs(true_coszen) and bilinearly interpolated
+
+    Array dimensions :
+        nu_flux_nominal : [B]
+        grid_rel_delta : [N energy, N coszen, B]
+        grid_bounds : [4] (ln(energy) and abs(coszen) bounds of the grid)
+        out : [B]
+    """
+    i, fi = grid_position(
+        math.log(true_energy), grid_bounds[0], grid_bounds[1], grid_rel_delta.shape[0]
+    )
+    j, fj = grid_position(
+        abs(true_coszen), grid_bounds[2], grid_bounds[3], grid_rel_delta.shape[1]
+    )
+    scale = spectral_index_scale(true_energy, energy_pivot, delta_index)
+    for b in range(out.shape[0]):
+        rel_delta = (1.0 - fi) * (
+            (1.0 - fj) * grid_rel_delta[i, j, b] + fj * grid_rel_delta[i, j + 1, b]
+        ) + fi * (
+            (1.0 - fj) * grid_rel_delta[i + 1, j, b]
+            + fj * grid_rel_delta[i + 1, j + 1, b]
+        )
+        # Check for negative results from spline
+        out[b] = max(nu_flux_nominal[b] * (scale + rel_delta), 0.0)
+
+
+GRID_SIGNATURE = "(f4, f4, f4, f4, f4[:], f4[:,:,:], f4[:], f4[:])"
+if FTYPE == np.float64:
+    GRID_SIGNATURE = GRID_SIGNATURE.replace("f4", "f8")
+
+
+@guvectorize(
+    [GRID_SIGNATURE], "(),(),(),(),(b),(i,j,b),(d)->(b)", target=TARGET
+)
+def apply_sys_grid_vectorized(
+    true_energy,
+    true_coszen,
+    delta_index,
+    energy_pivot,
+    nu_flux_nominal,
+    grid_rel_delta,
+    grid_bounds,
+    out,
+):
+    apply_sys_grid_kernel(
+        true_energy=true_energy,
+        true_coszen=true_coszen,
+        delta_index=delta_index,
+        energy_pivot=energy_pivot,
+        nu_flux_nominal=nu_flux_nominal,
+        grid_rel_delta=grid_rel_delta,
+        grid_bounds=grid_bounds,
+        out=out,
+    )
+
+
+def grid_lookup(grid, grid_bounds, true_energy, true_coszen):
+    """Bilinear interpolation of `grid` (of shape [N energy, N coszen, ...])
+    at the events, as done in `apply_sys_grid_kernel`"""
+    positions = []
+    for value, low, high, num in [
+        (np.log(true_energy), grid_bounds[0], grid_bounds[1], grid.shape[0]),
+        (np.abs(true_coszen), grid_bounds[2], grid_bounds[3], grid.shape[1]),
+    ]:
+        pos = np.clip((value - low) / (high - low) * (num - 1), 0, num - 1)
+        idx = np.minimum(pos.astype(int), num - 2)
+        frac = (pos - idx).reshape((-1,) + (1,) * (grid.ndim - 2))
+        positions.append((idx, frac))
+    (i, fi), (j, fj) = positions
+    return (1 - fi) * ((1 - fj) * grid[i, j] + fj * grid[i, j + 1]) + fi * (
+        (1 - fj) * grid[i + 1, j] + fj * grid[i + 1, j + 1]
+    )
+
+
+def test_eval_dense_splines():
+    """Unit tests for the dense evaluation of MCEq spline tables"""
+    from scipy.interpolate import RectBivariateSpline
+
+    rand = np.random.RandomState(0)
+    cos_theta = np.linspace(0, 1, 11)
+    log_energy = np.linspace(0, 12, 40)
+    spline_tables_dict = collections.OrderedDict()
+    for param_name in ["a+", "a-", "w+"]:
+        spline_tables_dict[param_name] = collections.OrderedDict(
+            (flux_key, RectBivariateSpline(
+                cos_theta, log_energy,
+                rand.uniform(0, 1, (len(cos_theta), len(log_energy)))
+            ))
+            for flux_key in ["numu", "dnumu", "nue", "dnue"]
+        )
+    spline_tables_dict["metadata"] = {"barr_variables": ["a", "w"]}
+
+    dense_tables = dense_spline_tables(spline_tables_dict)
+    assert list(dense_tables["param_names"]) == ["a+", "a-", "w+"]
+    assert dense_tables["coeffs"].shape[:2] == (3, 4)
+
+    # include points outside of the domain, where the splines are clipped
+    x = rand.uniform(-0.1, 1.1, 10000)
+    y = rand.uniform(-1, 13, 10000)
+    coeffs = dense_tables["coeffs"]
+    out = np.empty((len(x), 12))
+    eval_dense_splines(
+        x,
+        y,
+        dense_tables["tx"],
+        dense_tables["ty"],
+        dense_tables["kx"],
+        dense_tables["ky"],
+        coeffs.reshape((-1,) + coeffs.shape[2:]),
+        out,
+    )
+    for param_idx, param_name in enumerate(dense_tables["param_names"]):
+        for key_idx, flux_key in enumerate(dense_tables["flux_keys"]):
+            ref = spline_tables_dict[param_name][flux_key](x, y, grid=False)
+            assert np.allclose(
+                out[:, 4 * param_idx + key_idx], ref, rtol=1e-12, atol=1e-14
+            )
+
+    logging.info("<< PASS : test_eval_dense_splines >>")
+
+
+def test_apply_sys_storage():
+    """Unit tests for applying the Barr gradients stored in single precision or
+    on a grid"""
+    rand = np.random.RandomState(0)
+    true_energy = np.exp(rand.uniform(0, 8, 10000)).astype(FTYPE)
+    true_coszen = rand.uniform(-1, 1, 10000).astype(FTYPE)
+    nu_flux_nominal = rand.uniform(1, 2, (10000, 2)).astype(FTYPE)
+    gradient_params = rand.uniform(-0.3, 0.3, 4).astype(FTYPE)
+
+    # Smooth gradients, depending only on energy and abs(coszen)
+    def gradients_at(energy, coszen):
+        log_energy = np.log(energy)[:, np.newaxis, np.newaxis]
+        abs_coszen = np.abs(coszen)[:, np.newaxis, np.newaxis]
+        freq = np.arange(1, 9).reshape(1, 2, 4) / 8.0
+        return np.cos(freq * log_energy) * (1 + abs_coszen**2) / 4
+
+    gradients = gradients_at(true_energy, true_coszen).astype(FTYPE)
+    ref = np.maximum(
+        nu_flux_nominal * (true_energy / 10.0)[:, np.newaxis] ** 0.05
+        + np.dot(gradients, gradient_params),
+        0,
+    )
+
+    out = np.empty_like(nu_flux_nominal)
+    apply_sys_vectorized(
+        true_energy, true_coszen, 0.05, 10.0, nu_flux_nominal,
+        gradients, gradient_params, out=out,
+    )
+    assert np.allclose(out, ref, rtol=1e-5)
+
+    apply_sys_vectorized(
+        true_energy, true_coszen, 0.05, 10.0, nu_flux_nominal,
+        gradients.astype(np.float32), gradient_params, out=out,
+    )
+    assert np.allclose(out, ref, rtol=1e-5)
+
+    bounds = np.array([0, 8, 0, 1], dtype=FTYPE)
+    grid_log_energy, grid_abs_coszen = np.meshgrid(
+        np.linspace(0, 8, 200), np.linspace(0, 1, 50), indexing="ij"
+    )
+    grid = gradients_at(
+        np.exp(grid_log_energy.ravel()), grid_abs_coszen.ravel()
+    ).reshape(200, 50, 2, 4).astype(FTYPE)
+    # relative to a nominal flux that is constant per flavor
+    nu_flux_nominal[:] = [1.5, 2.0]
+    grid_rel_delta = np.dot(grid, gradient_params) / nu_flux_nominal[0]
+    ref = np.maximum(
+        nu_flux_nominal * (true_energy / 10.0)[:, np.newaxis] ** 0.05
+        + np.dot(gradients, gradient_params),
+        0,
+    )
+    apply_sys_grid_vectorized(
+        true_energy, true_coszen, 0.05, 10.0, nu_flux_nominal,
+        grid_rel_delta, bounds, out=out,
+    )
+    assert np.allclose(out, ref, rtol=1e-4)
+    lookup = grid_lookup(grid_rel_delta, bounds, true_energy, true_coszen)
+    assert np.allclose(
+        out,
+        np.maximum(
+            nu_flux_nominal * ((true_energy / 10.0)[:, np.newaxis] ** 0.05 + lookup),
+            0,
+        ),
+        rtol=1e-5,
+    )
+
+    logging.info("<< PASS : test_apply_sys_storage >>")
+
+
+if __name__ == "__main__":
+    set_verbosity(1)
+    test_eval_dense_splines()
+    test_apply_sys_storage()
@@ -11,7 +11,7 @@ try:
 except ImportError:
     numba = None
 
-from pisa import FTYPE
+from pisa import FTYPE, ITYPE
 from pisa.utils.fileio import from_file
 from pisa.utils.log import logging, set_verbosity
 
@@ -247,6 +247,15 @@ class Layers(object):
     distance : 1d float array of length (max_layers * len(cz))
             containing distance values and filled up with 0s otherwise
 
+    table_coszen : 1d float array
+            unique coszen values of the layer table (see `calcLayerTable`)
+
+    table_density : 2d float array of shape (len(table_coszen), max_layers)
+            densities (times electron fractions) of the layer table
+
+    table_distance : 2d float array of shape (len(table_coszen), max_layers)
+            distances of the layer table
+
     References
     ----------
     [1] A.M. Dziewonski and D.L. Anderson (1981) "Preliminary reference
@@ -287,6 +296,12 @@ class Layers(object):
             # Compute coszen limit
             self.computeMinLengthToLayers()
 
+        self.table_coszen = None
+        self._table_rho = None
+        self._table_elec_frac_idx = None
+        self._table_density = None
+        self._table_distance = None
+
 
     def setElecFrac(self, YeI, YeO, YeM):
         """Set electron fractions of inner core, outer core, and mantle.
@@ -308,6 +323,10 @@ class Layers(object):
         self.YeOuterRadius = np.array([1221.5, 3480.0, self.r_detector],
                                       dtype=FTYPE)
 
+        # only the electron fractions of the (fixed) layer table change
+        if self.table_coszen is not None:
+            self._update_table_density()
+
     def computeMinLengthToLayers(self):
         # Compute which layer is tangeted at which angle
         coszen_limit = []
@@ -350,6 +369,92 @@ class Layers(object):
             radii=self.radii
         )
 
+    def _ext_calc_layers(self, cz, YeFrac, default_elec_frac):
+        return extCalcLayers(
+            cz=cz,
+            r_detector=self.r_detector,
+            prop_height=self.prop_height,
+            detector_depth=self.detector_depth,
+            max_layers=self.max_layers,
+            min_detector_depth=self.min_detector_depth,
+            rhos=self.rhos,
+            YeFrac=np.asarray(YeFrac, dtype=FTYPE),
+            YeOuterRadius=self.YeOuterRadius,
+            default_elec_frac=default_elec_frac,
+            coszen_limit=self.coszen_limit,
+            radii=self.radii
+        )
+
+    def calcLayerTable(self, cz_arrays, coszen_resolution=None):
+        """Compute the layers once for the unique coszen values found in
+        any of `cz_arrays`, instead of separately for each coszen value (as
+        `calcLayers` does).
+
+        Densities of the table are stored as matter densities and the index
+        of the electron fraction (YeI, YeO, YeM or default) of each layer,
+        such that a change of electron fractions (`setElecFrac`) only
+        rescales the densities.
+
+        Parameters
+        ----------
+        cz_arrays : sequence of 1d float arrays
+            Coszen values, e.g. one array per container
+
+        coszen_resolution : float or None
+            If set, coszen values are rounded to multiples of this before
+            finding the unique ones, bounding the size of the table to
+            2/coszen_resolution + 1 rows
+
+        Returns
+        -------
+        indices : list of 1d int arrays
+            Row of `table_density`/`table_distance` for every coszen value
+            in each of `cz_arrays`
+
+        """
+        if not self.using_earth_model:
+            raise ValueError("Cannot calculate layers when not using an Earth model")
+
+        cz_arrays = [np.asarray(cz, dtype=FTYPE) for cz in cz_arrays]
+        all_cz = np.concatenate(cz_arrays)
+        if coszen_resolution is not None:
+            all_cz = np.clip(
+                np.round(all_cz / coszen_resolution) * coszen_resolution, -1, 1
+            ).astype(FTYPE)
+        self.table_coszen, inverse = np.unique(all_cz, return_inverse=True)
+        inverse = inverse.astype(ITYPE)
+        logging.debug('Layer table with %d rows for %d coszen values',
+                      len(self.table_coszen), len(all_cz))
+
+        shape = (len(self.table_coszen), self.max_layers)
+        _, rho, distance = self._ext_calc_layers(self.table_coszen, [1, 1, 1], 1)
+        self._table_rho = rho.reshape(shape)
+        self._table_distance = distance.reshape(shape)
+
+        # densities are linear in each electron fraction, so find which one
+        # applies to a layer by switching on one at a time (index 3 is the
+        # default electron fraction)
+        self._table_elec_frac_idx = np.full(shape, 3, dtype=np.int8)
+        for idx, YeFrac in enumerate(np.eye(3)):
+            _, density, _ = self._ext_calc_layers(self.table_coszen, YeFrac, 0)
+            self._table_elec_frac_idx[density.reshape(shape) > 0] = idx
+        self._update_table_density()
+
+        split_points = np.cumsum([len(cz) for cz in cz_arrays])[:-1]
+        return np.split(inverse, split_points)
+
+    def _update_table_density(self):
+        elec_fracs = np.append(self.YeFrac, self.default_elec_frac).astype(FTYPE)
+        self._table_density = self._table_rho * elec_fracs[self._table_elec_frac_idx]
+
+    @property
+    def table_density(self):
+        return self._table_density
+
+    @property
+    def table_distance(self):
+        return self._table_distance
+
     @property
     def n_layers(self):
         if not self.using_earth_model:
@@ -413,6 +518,23 @@ def test_Layers():
     logging.info('density  = %s' %layer.density)
     logging.info('distance = %s' %layer.distance)
 
+    logging.info('Test layer table calculation:')
+    cz_arrays = [cz[::2], cz[1::2], cz[:100]]
+    indices = layer.calcLayerTable(cz_arrays)
+    assert len(layer.table_coszen) == len(cz)
+    density = layer.density.reshape(len(cz), layer.max_layers)
+    distance = layer.distance.reshape(len(cz), layer.max_layers)
+    for sel, index in zip([slice(None, None, 2), slice(1, None, 2), slice(100)], indices):
+        assert np.allclose(layer.table_density[index], density[sel])
+        assert np.allclose(layer.table_distance[index], distance[sel])
+    layer.setElecFrac(0.5, 0.4, 0.3)
+    layer.calcLayers(cz)
+    density = layer.density.reshape(len(cz), layer.max_layers)
+    assert np.allclose(layer.table_density[indices[0]], density[::2])
+    indices = layer.calcLayerTable([cz], coszen_resolution=0.01)
+    assert len(layer.table_coszen) == 201
+    assert np.max(np.abs(layer.table_coszen[indices[0]] - cz)) <= 0.005 + 1e-6
+
     logging.info('Test path length calculation:')
     layer = Layers(None)
     cz = np.array([1.,0.,-1.])
@@ -8,21 +8,37 @@ and an osc. stage....todo
 
 from __future__ import absolute_import, print_function, division
 
+from collections import OrderedDict
+
 import numpy as np
-from numba import guvectorize
+from numba import guvectorize, SmartArray
+from scipy.interpolate import RectBivariateSpline
 
-from pisa import FTYPE, TARGET, ureg
+from pisa import FTYPE, ITYPE, OMP_NUM_THREADS, TARGET, ureg
+from pisa.core.binning import MultiDimBinning
 from pisa.core.pi_stage import PiStage
 from pisa.utils.log import logging
 from pisa.utils.profiler import profile
 from pisa.stages.osc.nsi_params import StdNSIParams, VacuumLikeNSIParams
 from pisa.stages.osc.pi_osc_params import OscParams
 from pisa.stages.osc.layers import Layers
-from pisa.stages.osc.prob3numba.numba_osc_hostfuncs import propagate_array, fill_probs
+from pisa.stages.osc.prob3numba.numba_osc_hostfuncs import (
+    balanced_chunks,
+    check_num_threads,
+    fill_probs,
+    propagate_array_indexed,
+    propagate_array_threaded,
+)
 from pisa.utils.numba_tools import WHERE
+from pisa.utils.random_numbers import get_random_state
 from pisa.utils.resources import find_resource
 
 
+LOWPASS_SAMPLES = 5
+"""Number of energies averaged over for the low-pass filtered probability at
+each interpolation node"""
+
+
 class pi_prob3(PiStage):
     """
     Prob3-like oscillation PISA Pi class
@@ -62,6 +78,44 @@ class pi_prob3(PiStage):
             eps_mutau_phase : quantity (angle)
             eps_tautau : quantity (dimensionless)
 
+    layer_coszen_resolution : float or None
+        Earth layers are computed once for all unique coszen values, and
+        events only store an index into this table. If set, coszen values are
+        rounded to multiples of this first (e.g. 1e-4), which bounds the size
+        of the table.
+
+    node_specs : MultiDimBinning or None
+        If set, probabilities are computed exactly only on a grid of nodes in
+        (log10(true_energy), true_coszen), placed at the bin edges of
+        `node_specs`, and are evaluated for all events (or bins of
+        calc_specs) by bicubic spline interpolation. The node grid must
+        encompass the entire range of calc_specs. If None, probabilities are
+        computed exactly for each event.
+
+    node_tolerance : float or None
+        If set, the node grid is adaptively refined during setup (for the
+        nominal parameter values) by halving node intervals along either
+        dimension until the interpolated probabilities at interval midpoints
+        deviate by less than this (absolute) amount from the exact ones. This
+        places the nodes densely where oscillations are fast (low energies,
+        up-going directions).
+
+    node_max_refinements : int
+        Maximum number of refinement passes, each of which at most halves
+        the node spacing
+
+    node_lowpass_width : float or None
+        If set, node probabilities are averaged over an interval of this
+        width in log10(true_energy) around each node, which removes
+        oscillations too fast to be resolved by the detector (and by the node
+        grid).
+
+    num_threads : int or None
+        Number of CPU threads for the propagation; defaults to
+        `pisa.OMP_NUM_THREADS`. With more than one thread, events are
+        propagated in chunks of equal total number of layers, one chunk per
+        thread (see `propagate_array_threaded`). Ignored on GPUs.
+
     **kwargs
         Other kwargs are handled by PiStage
     -----
@@ -72,6 +126,12 @@ class pi_prob3(PiStage):
       self,
       nsi_type=None,
       reparam_mix_matrix=False,
+      layer_coszen_resolution=None,
+      node_specs=None,
+      node_tolerance=None,
+      node_max_refinements=6,
+      node_lowpass_width=None,
+      num_threads=None,
       data=None,
       params=None,
       input_names=None,
@@ -172,7 +232,41 @@ class pi_prob3(PiStage):
         assert self.calc_mode is not None
         assert self.output_mode is not None
 
+        self.layer_coszen_resolution = layer_coszen_resolution
+
+        if node_specs is not None:
+            if not isinstance(node_specs, MultiDimBinning):
+                raise TypeError('`node_specs` must be a MultiDimBinning; got %s'
+                                % type(node_specs))
+            if set(node_specs.names) != {'true_energy', 'true_coszen'}:
+                raise ValueError('`node_specs` must have dimensions true_energy'
+                                 ' and true_coszen; got %s' % (node_specs.names,))
+        if node_lowpass_width is not None and node_lowpass_width < 0:
+            raise ValueError('`node_lowpass_width` cannot be negative')
+        self.node_specs = node_specs
+        self.node_tolerance = node_tolerance
+        self.node_max_refinements = int(node_max_refinements)
+        self.node_lowpass_width = node_lowpass_width
+        self.node_log_e = None
+        """log10 of node energies (GeV), when interpolating"""
+        self.node_coszen = None
+        """coszen of nodes, when interpolating"""
+        self.node_splines = None
+
+        if num_threads is None:
+            num_threads = OMP_NUM_THREADS
+        if int(num_threads) < 1:
+            raise ValueError('`num_threads` must be at least 1')
+        self.num_threads = int(num_threads)
+        if TARGET != 'cuda':
+            check_num_threads(self.num_threads)
+        self.chunk_bounds = {}
+        """Chunks of events of equal cost, by container name, for
+        multi-threaded propagation"""
+
         self.layers = None
+        self.layer_densities = None
+        self.layer_distances = None
         self.osc_params = None
         self.nsi_params = None
         # Note that the interaction potential (Hamiltonian) just scales with the
@@ -218,6 +312,13 @@ class pi_prob3(PiStage):
         # set the correct data mode
         self.data.data_specs = self.calc_specs
 
+        if self.node_specs is not None:
+            self.setup_nodes()
+            for container in self.data:
+                container['prob_e'] = np.empty((container.size), dtype=FTYPE)
+                container['prob_mu'] = np.empty((container.size), dtype=FTYPE)
+            return
+
         # --- calculate the layers ---
         if self.calc_mode == 'binned':
             # speed up calculation by adding links
@@ -227,10 +328,16 @@ class pi_prob3(PiStage):
                                              'nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                              'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
 
-        for container in self.data:
-            self.layers.calcLayers(container['true_coszen'].get('host'))
-            container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
-            container['distances'] = self.layers.distance.reshape((container.size, self.layers.max_layers))
+        # one table of layers for all containers, which only hold indices
+        containers = list(self.data)
+        layer_indices = self.layers.calcLayerTable(
+            [container['true_coszen'].get('host') for container in containers],
+            coszen_resolution=self.layer_coszen_resolution,
+        )
+        for container, layer_index in zip(containers, layer_indices):
+            container['layer_index'] = layer_index
+        self.layer_densities = SmartArray(self.layers.table_density)
+        self.layer_distances = SmartArray(self.layers.table_distance)
 
         # don't forget to un-link everything again
         self.data.unlink_containers()
@@ -241,8 +348,14 @@ class pi_prob3(PiStage):
                                              'nue_nc', 'numu_nc', 'nutau_nc'])
             self.data.link_containers('nubar', ['nuebar_cc', 'numubar_cc', 'nutaubar_cc',
                                                 'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
+        layer_costs = np.count_nonzero(self.layers.table_distance > 0, axis=1) + 1
         for container in self.data:
             container['probability'] = np.empty((container.size, 3, 3), dtype=FTYPE)
+            if self.use_threads:
+                layer_index = container['layer_index'].get('host').astype(ITYPE)
+                self.chunk_bounds[container.name] = balanced_chunks(
+                    layer_costs[layer_index], self.num_threads
+                )
         self.data.unlink_containers()
 
         # setup more empty arrays
@@ -250,47 +363,256 @@ class pi_prob3(PiStage):
             container['prob_e'] = np.empty((container.size), dtype=FTYPE)
             container['prob_mu'] = np.empty((container.size), dtype=FTYPE)
 
-    def calc_probs(self, nubar, e_array, rho_array, len_array, out):
-        ''' wrapper to execute osc. calc '''
+    def setup_nodes(self):
+        """Place the interpolation nodes at the bin edges of `node_specs` and,
+        if `node_tolerance` is set, refine them for the nominal parameters"""
+        log_e = np.log10(self.node_specs['true_energy'].bin_edges.m_as('GeV'))
+        coszen = self.node_specs['true_coszen'].bin_edges.m_as('dimensionless')
+        log_e = np.sort(log_e).astype(np.float64)
+        coszen = np.sort(coszen).astype(np.float64)
+        if len(log_e) < 4 or len(coszen) < 4:
+            raise ValueError('Bicubic interpolation needs at least 4 nodes (3'
+                             ' bins of `node_specs`) in each dimension')
+
+        for container in self.data:
+            for var, nodes in [('true_energy', 10**log_e), ('true_coszen', coszen)]:
+                values = container[var].get('host')
+                if np.min(values) < nodes[0] or np.max(values) > nodes[-1]:
+                    raise ValueError(
+                        'The outer edges of the node_specs must encompass the'
+                        ' entire range of %s in calc_specs to avoid'
+                        ' extrapolation' % var
+                    )
+
+        if self.node_tolerance is not None:
+            self.update_osc_params()
+            log_e, coszen = self.refine_nodes(log_e, coszen)
+        self.node_log_e = log_e
+        self.node_coszen = coszen
+        logging.debug('Interpolating oscillation probabilities from %d x %d'
+                      ' (energy x coszen) nodes', len(log_e), len(coszen))
+
+    def refine_nodes(self, log_e, coszen):
+        """Halve node intervals (along energy or coszen) for which the
+        interpolated probabilities at the interval midpoints deviate by more
+        than `node_tolerance` from the exact ones"""
+        for _ in range(self.node_max_refinements):
+            splines = self.make_splines(log_e, coszen,
+                                        self.calc_node_probs(log_e, coszen))
+
+            mid_log_e = 0.5 * (log_e[:-1] + log_e[1:])
+            error = np.abs(self.calc_node_probs(mid_log_e, coszen)
+                           - self.eval_splines(splines, mid_log_e, coszen))
+            refine_e = np.max(error, axis=(0, 1, 2, 4)) > self.node_tolerance
+
+            mid_coszen = 0.5 * (coszen[:-1] + coszen[1:])
+            error = np.abs(self.calc_node_probs(log_e, mid_coszen)
+                           - self.eval_splines(splines, log_e, mid_coszen))
+            refine_cz = np.max(error, axis=(0, 1, 2, 3)) > self.node_tolerance
+
+            if not (np.any(refine_e) or np.any(refine_cz)):
+                break
+            log_e = np.sort(np.concatenate([log_e, mid_log_e[refine_e]]))
+            coszen = np.sort(np.concatenate([coszen, mid_coszen[refine_cz]]))
+        else:
+            logging.warning('Oscillation probabilities on node grid did not'
+                            ' reach tolerance of %s after %d refinements',
+                            self.node_tolerance, self.node_max_refinements)
+        return log_e, coszen
+
+    def propagate(self, nubar, energies, layer_index, densities, distances):
+        """Exact probabilities (n, 3, 3) on the host, with `densities` and
+        `distances` of the layers looked up through `layer_index`"""
         if self.reparam_mix_matrix:
             mix_matrix = self.osc_params.mix_matrix_reparam_complex
         else:
             mix_matrix = self.osc_params.mix_matrix_complex
-        propagate_array(self.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
-                        mix_matrix,
-                        self.gen_mat_pot_matrix_complex,
-                        nubar,
-                        e_array.get(WHERE),
-                        rho_array.get(WHERE),
-                        len_array.get(WHERE),
-                        out=out.get(WHERE)
-                       )
-        out.mark_changed(WHERE)
-
-    @profile
-    def compute_function(self):
-
-        # set the correct data mode
+        probability = np.empty((len(energies), 3, 3), dtype=FTYPE)
+        args = (self.osc_params.dm_matrix,
+                mix_matrix,
+                self.gen_mat_pot_matrix_complex,
+                nubar,
+                np.asarray(energies, dtype=FTYPE),
+                np.asarray(layer_index, dtype=ITYPE),
+                densities,
+                distances)
+        if self.use_threads:
+            propagate_array_threaded(*args, probability,
+                                     num_threads=self.num_threads)
+        else:
+            propagate_array_indexed(*args, out=probability) # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+        return probability
+
+    def calc_node_probs(self, log_e, coszen):
+        """Probabilities on the grid of nodes `log_e` x `coszen`.
+
+        Returns
+        -------
+        probs : array of shape (2, 2, 3, len(log_e), len(coszen))
+            Indexed by (nu/nubar, initial e/mu, final flavour, energy, coszen)
+
+        """
+        self.layers.calcLayers(np.asarray(coszen, dtype=FTYPE))
+        shape = (len(coszen), self.layers.max_layers)
+        densities = self.layers.density.reshape(shape)
+        distances = self.layers.distance.reshape(shape)
+        layer_index = np.tile(np.arange(len(coszen), dtype=ITYPE), len(log_e))
+
+        if self.node_lowpass_width:
+            offsets = np.linspace(-0.5, 0.5, LOWPASS_SAMPLES) * self.node_lowpass_width
+        else:
+            offsets = [0.]
+
+        probs = np.zeros((2, 2, 3, len(log_e), len(coszen)), dtype=np.float64)
+        for i, nubar in enumerate((1, -1)):
+            for offset in offsets:
+                energies = np.repeat(10**(log_e + offset), len(coszen))
+                probability = self.propagate(nubar, energies, layer_index,
+                                             densities, distances)
+                probs[i] += probability[:, :2, :].reshape(
+                    len(log_e), len(coszen), 2, 3).transpose(2, 3, 0, 1)
+        probs /= len(offsets)
+        return probs
+
+    @staticmethod
+    def make_splines(log_e, coszen, probs):
+        """Bicubic splines through node probabilities, indexed like `probs`"""
+        return [[[RectBivariateSpline(log_e, coszen, probs[i, j, k], kx=3, ky=3)
+                  for k in range(3)] for j in range(2)] for i in range(2)]
+
+    @staticmethod
+    def eval_splines(splines, log_e, coszen):
+        """Evaluate all `splines` on the grid `log_e` x `coszen`"""
+        return np.array([[[spline(log_e, coszen) for spline in row]
+                          for row in block] for block in splines])
+
+    def compute_interpolated(self):
+        """Probabilities for all containers, interpolated between nodes"""
+        self.node_splines = self.make_splines(
+            self.node_log_e, self.node_coszen,
+            self.calc_node_probs(self.node_log_e, self.node_coszen)
+        )
+        for container in self.data:
+            block = self.node_splines[0 if container['nubar'] > 0 else 1]
+            log_e = np.log10(container['true_energy'].get('host'))
+            coszen = container['true_coszen'].get('host')
+            for initial_flav, key in enumerate(('prob_e', 'prob_mu')):
+                spline = block[initial_flav][int(container['flav'])]
+                out = container[key].get('host')
+                out[:] = np.clip(spline(log_e, coszen, grid=False), 0, 1)
+                container[key].mark_changed('host')
+
+    def interpolation_error(self, max_events=10000, random_state=0):
+        """Compare the interpolated probabilities with the exact ones for (a
+        random subset of) the events of each container.
+
+        Must be called after `compute_function`.
+
+        Parameters
+        ----------
+        max_events : int or None
+            Maximum number of events per container to check; None for all
+
+        random_state : None or type accepted by `pisa.utils.random_numbers.get_random_state`
+
+        Returns
+        -------
+        errors : OrderedDict
+            For each container, a dict with the maximum and root mean square
+            absolute deviation of `prob_e` and `prob_mu` from the exact values
+
+        """
+        if self.node_specs is None:
+            raise ValueError('Probabilities are computed exactly, not'
+                             ' interpolated, as `node_specs` is None')
+        random_state = get_random_state(random_state)
         self.data.data_specs = self.calc_specs
 
-        if self.calc_mode == 'binned':
-            # speed up calculation by adding links
-            self.data.link_containers('nu', ['nue_cc', 'numu_cc', 'nutau_cc',
-                                             'nue_nc', 'numu_nc', 'nutau_nc'])
-            self.data.link_containers('nubar', ['nuebar_cc', 'numubar_cc', 'nutaubar_cc',
-                                                'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
+        errors = OrderedDict()
+        for container in self.data:
+            energies = container['true_energy'].get('host')
+            coszen = container['true_coszen'].get('host')
+            if max_events is not None and len(energies) > max_events:
+                sel = random_state.choice(len(energies), max_events, replace=False)
+            else:
+                sel = slice(None)
+            coszen = np.asarray(coszen[sel], dtype=FTYPE)
+            self.layers.calcLayers(coszen)
+            shape = (len(coszen), self.layers.max_layers)
+            probability = self.propagate(
+                container['nubar'], energies[sel],
+                np.arange(len(coszen), dtype=ITYPE),
+                self.layers.density.reshape(shape),
+                self.layers.distance.reshape(shape),
+            )
+            flav = int(container['flav'])
+            deviations = np.concatenate([
+                container['prob_e'].get('host')[sel] - probability[:, 0, flav],
+                container['prob_mu'].get('host')[sel] - probability[:, 1, flav],
+            ])
+            errors[container.name] = dict(
+                max=np.max(np.abs(deviations)),
+                rms=np.sqrt(np.mean(deviations**2)),
+            )
+            logging.debug('Interpolation error of oscillation probabilities'
+                          ' for %s: max %.3g, rms %.3g', container.name,
+                          errors[container.name]['max'],
+                          errors[container.name]['rms'])
+        return errors
+
+    @property
+    def use_threads(self):
+        """Whether to use the multi-threaded propagation"""
+        return self.num_threads > 1 and TARGET != 'cuda'
+
+    def calc_probs(self, nubar, e_array, layer_index, out, chunk_bounds=None):
+        ''' wrapper to execute osc. calc '''
+        # binned data is always stored as floats
+        if layer_index.get('host').dtype != ITYPE:
+            layer_index = SmartArray(layer_index.get('host').astype(ITYPE))
+        if self.reparam_mix_matrix:
+            mix_matrix = self.osc_params.mix_matrix_reparam_complex
+        else:
+            mix_matrix = self.osc_params.mix_matrix_complex
+        if self.use_threads:
+            propagate_array_threaded(self.osc_params.dm_matrix,
+                                     mix_matrix,
+                                     self.gen_mat_pot_matrix_complex,
+                                     nubar,
+                                     e_array.get('host'),
+                                     layer_index.get('host'),
+                                     self.layer_densities.get('host'),
+                                     self.layer_distances.get('host'),
+                                     out.get('host'),
+                                     num_threads=self.num_threads,
+                                     chunk_bounds=chunk_bounds,
+                                    )
+            out.mark_changed('host')
+            return
+        propagate_array_indexed(self.osc_params.dm_matrix, # pylint: disable = unexpected-keyword-arg, no-value-for-parameter
+                                mix_matrix,
+                                self.gen_mat_pot_matrix_complex,
+                                nubar,
+                                e_array.get(WHERE),
+                                layer_index.get(WHERE),
+                                self.layer_densities.get(WHERE),
+                                self.layer_distances.get(WHERE),
+                                out=out.get(WHERE)
+                               )
+        out.mark_changed(WHERE)
 
-        # this can be done in a more clever way (don't have to recalculate all paths)
+    def update_osc_params(self):
+        """Update oscillation and NSI parameters, the electron fractions and
+        the generalised matter potential from the stage's params"""
+        # only the densities of the layer table depend on the electron fractions
         YeI = self.params.YeI.value.m_as('dimensionless')
         YeO = self.params.YeO.value.m_as('dimensionless')
         YeM = self.params.YeM.value.m_as('dimensionless')
         if YeI != self.YeI or YeO != self.YeO or YeM != self.YeM:
             self.YeI = YeI; self.YeO = YeO; self.YeM = YeM
             self.layers.setElecFrac(self.YeI, self.YeO, self.YeM)
-            for container in self.data:
-                self.layers.calcLayers(container['true_coszen'].get('host'))
-                container['densities'] = self.layers.density.reshape((container.size, self.layers.max_layers))
-                container['distances'] = self.layers.distance.reshape((container.size, self.layers.max_layers))
+            if self.layers.table_density is not None:
+                self.layer_densities = SmartArray(self.layers.table_density)
 
         # some safety checks on units
         # trying to avoid issue of angles with no dimension being assumed to be radians
@@ -348,12 +670,33 @@ class pi_prob3(PiStage):
             logging.debug('Using standard matter potential:\n%s'
                           % self.gen_mat_pot_matrix_complex)
 
+    @profile
+    def compute_function(self):
+
+        self.update_osc_params()
+
+        # set the correct data mode
+        self.data.data_specs = self.calc_specs
+
+        if self.node_specs is not None:
+            self.compute_interpolated()
+            if self.debug_mode:
+                self.interpolation_error()
+            return
+
+        if self.calc_mode == 'binned':
+            # speed up calculation by adding links
+            self.data.link_containers('nu', ['nue_cc', 'numu_cc', 'nutau_cc',
+                                             'nue_nc', 'numu_nc', 'nutau_nc'])
+            self.data.link_containers('nubar', ['nuebar_cc', 'numubar_cc', 'nutaubar_cc',
+                                                'nuebar_nc', 'numubar_nc', 'nutaubar_nc'])
+
         for container in self.data:
             self.calc_probs(container['nubar'],
                             container['true_energy'],
-                            container['densities'],
-                            container['distances'],
+                            container['layer_index'],
                             out=container['probability'],
+                            chunk_bounds=self.chunk_bounds.get(container.name),
                            )
 
         # the following is flavour specific, hence unlink
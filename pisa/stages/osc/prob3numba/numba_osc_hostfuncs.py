@@ -12,12 +12,24 @@ types as defined in signatures here) from a host, whether TARGET is "host" or
 
 from __future__ import absolute_import, print_function, division
 
-__all__ = ["FX", "CX", "IX", "propagate_array", "fill_probs"]
+__all__ = [
+    "FX",
+    "CX",
+    "IX",
+    "propagate_array",
+    "propagate_array_indexed",
+    "propagate_array_threaded",
+    "check_num_threads",
+    "balanced_chunks",
+    "fill_probs",
+]
 
 import numpy as np
-from numba import guvectorize, njit
+import numba
+from numba import guvectorize, njit, prange
 
-from pisa import FTYPE, ITYPE, TARGET
+from pisa import FTYPE, ITYPE, OMP_NUM_THREADS, TARGET
+from pisa.utils.log import logging
 from pisa.stages.osc.prob3numba.numba_osc_kernels import (
     # osc_probs_vacuum_kernel,
     osc_probs_layers_kernel,
@@ -42,6 +54,9 @@ CX = "c8" if FTYPE == np.float32 else "c16"
 IX = "i4" if ITYPE == np.int32 else "i8"
 """Signed integer string code to use, understood by both Numba and Numpy"""
 
+_WARNED_NUM_THREADS = set()
+"""Requested thread counts that have already been warned about"""
+
 
 # @guvectorize(
 #    [f"({FX}[:,:], {CX}[:,:], {IX}, {FX}, {FX}[:], {FX}[:,:])"],
@@ -74,6 +89,160 @@ def propagate_array(dm, mix, mat_pot, nubar, energy, densities, distances, proba
     )
 
 
+@guvectorize(
+    [
+        f"({FX}[:,:], {CX}[:,:], {CX}[:,:], {IX}, {FX}, {IX}, {FX}[:,:], {FX}[:,:], {FX}[:,:])"
+    ],
+    "(a,a), (a,a), (b,c), (), (), (), (n,i), (n,i) -> (a,a)",
+    target=TARGET,
+)
+def propagate_array_indexed(
+    dm, mix, mat_pot, nubar, energy, layer_index, densities, distances, probability
+):
+    """wrapper to run `osc_probs_layers_kernel` from host (whether TARGET
+    is "cuda" or "host"), with densities and distances looked up in a layer
+    table (see `Layers.calcLayerTable`) shared by all events"""
+    osc_probs_layers_kernel(
+        dm,
+        mix,
+        mat_pot,
+        nubar,
+        energy,
+        densities[layer_index],
+        distances[layer_index],
+        probability,
+    )
+
+
+if TARGET != "cuda":
+
+    @njit(
+        [
+            f"({FX}[:,:], {CX}[:,:], {CX}[:,:], {IX}, {FX}[:], {IX}[:], {FX}[:,:], "
+            f"{FX}[:,:], i8[:], {FX}[:,:,:])"
+        ],
+        parallel=True,
+    )
+    def _propagate_chunks(
+        dm, mix, mat_pot, nubar, energy, layer_index, densities, distances,
+        chunk_bounds, probability
+    ):
+        """Run `osc_probs_layers_kernel` for the events in each chunk
+        [chunk_bounds[i], chunk_bounds[i + 1]), one chunk per thread"""
+        for chunk in prange(len(chunk_bounds) - 1):  # pylint: disable=not-an-iterable
+            for i in range(chunk_bounds[chunk], chunk_bounds[chunk + 1]):
+                osc_probs_layers_kernel(
+                    dm,
+                    mix,
+                    mat_pot,
+                    nubar,
+                    energy[i],
+                    densities[layer_index[i]],
+                    distances[layer_index[i]],
+                    probability[i],
+                )
+
+
+def check_num_threads(num_threads):
+    """Warn (only once per value) if `num_threads` exceeds the number of
+    threads numba runs concurrently"""
+    if (
+        num_threads > numba.config.NUMBA_NUM_THREADS
+        and num_threads not in _WARNED_NUM_THREADS
+    ):
+        _WARNED_NUM_THREADS.add(num_threads)
+        logging.warning(
+            "Requested %d threads but numba only runs %d; set NUMBA_NUM_THREADS",
+            num_threads,
+            numba.config.NUMBA_NUM_THREADS,
+        )
+
+
+def balanced_chunks(costs, num_chunks):
+    """Split events into `num_chunks` contiguous chunks of (nearly) equal
+    total cost.
+
+    Parameters
+    ----------
+    costs : 1d array
+        Relative computational cost of each event, e.g. its number of layers
+        plus one
+
+    num_chunks : int
+
+    Returns
+    -------
+    chunk_bounds : 1d int64 array of length `num_chunks` + 1
+        Chunk `i` contains events `chunk_bounds[i]` to `chunk_bounds[i + 1]`
+
+    """
+    cumulative_cost = np.cumsum(costs, dtype=np.float64)
+    if len(cumulative_cost) == 0:
+        return np.zeros(num_chunks + 1, dtype=np.int64)
+    targets = cumulative_cost[-1] * np.arange(1, num_chunks) / num_chunks
+    inner_bounds = np.searchsorted(cumulative_cost, targets, side="right")
+    return np.concatenate([[0], inner_bounds, [len(costs)]]).astype(np.int64)
+
+
+def propagate_array_threaded(
+    dm,
+    mix,
+    mat_pot,
+    nubar,
+    energy,
+    layer_index,
+    densities,
+    distances,
+    probability,
+    num_threads=None,
+    chunk_bounds=None,
+):
+    """Multi-threaded equivalent of `propagate_array_indexed` (for TARGET
+    "cpu" or "parallel") with explicit control of the number of threads.
+
+    Events are split into `num_threads` contiguous chunks of equal total
+    number of layers traversed (which the cost of the propagation is
+    proportional to), and each chunk is processed by one thread.
+
+    Parameters
+    ----------
+    dm, mix, mat_pot, nubar, energy, layer_index, densities, distances, probability
+        See `propagate_array_indexed`; `energy`, `layer_index` and
+        `probability` must be arrays
+
+    num_threads : int or None
+        Number of threads to use; defaults to `pisa.OMP_NUM_THREADS`. At most
+        `numba.config.NUMBA_NUM_THREADS` (set via the environment variable
+        of the same name) threads run concurrently.
+
+    chunk_bounds : 1d int64 array or None
+        Pass the result of `balanced_chunks` to avoid recomputing the chunks
+        in repeated calls with the same layers
+
+    """
+    if TARGET == "cuda":
+        raise ValueError("Multi-threaded propagation is not available on GPUs")
+    if num_threads is None:
+        num_threads = OMP_NUM_THREADS
+    check_num_threads(num_threads)
+    layer_index = np.asarray(layer_index, dtype=ITYPE)
+    if chunk_bounds is None:
+        costs = np.count_nonzero(distances > 0, axis=1)[layer_index] + 1
+        chunk_bounds = balanced_chunks(costs, num_threads)
+    _propagate_chunks(
+        dm,
+        mix,
+        mat_pot,
+        nubar,
+        np.asarray(energy, dtype=FTYPE),
+        layer_index,
+        densities,
+        distances,
+        chunk_bounds,
+        probability,
+    )
+
+
 @njit(
     [f"({FX}[:,:], {CX}[:,:], {CX}[:,:], {IX}, {FX}, {FX}[:], {FX}[:], {FX}[:,:])"],
     target=TARGET,
@@ -4,12 +4,14 @@ Please ignore unless you are the author
 """
 from __future__ import print_function
 
+from argparse import ArgumentParser
 import time
 
 import numpy as np
+import numba
 from numba import guvectorize, SmartArray
 
-from pisa import TARGET
+from pisa import FTYPE, ITYPE, TARGET
 from pisa.utils.numba_tools import (
     WHERE,
     cuda,
@@ -69,5 +71,79 @@ def main():
     print(out.get("host"))
 
 
+def benchmark_propagate_threaded(n_events=1000000, max_threads=None):
+    """Time `propagate_array_threaded` on random events for an increasing
+    number of threads (powers of two) and print speedup and efficiency
+    relative to a single thread"""
+    # pylint: disable=import-outside-toplevel
+    from pisa.stages.osc.layers import Layers
+    from pisa.stages.osc.pi_osc_params import OscParams
+    from pisa.stages.osc.prob3numba.numba_osc_hostfuncs import (
+        propagate_array_threaded,
+    )
+
+    if max_threads is None:
+        max_threads = numba.config.NUMBA_NUM_THREADS
+
+    rand = np.random.RandomState(0)
+    energy = np.power(10, rand.uniform(0, 2, n_events)).astype(FTYPE)
+    coszen = rand.uniform(-1, 1, n_events).astype(FTYPE)
+
+    layers = Layers("osc/PREM_12layer.dat", detector_depth=2, prop_height=20)
+    layers.setElecFrac(0.4656, 0.4656, 0.4957)
+    layer_index = layers.calcLayerTable([coszen], coszen_resolution=1e-4)[0]
+
+    osc_params = OscParams()
+    osc_params.theta12 = 0.5903
+    osc_params.theta13 = 0.1503
+    osc_params.theta23 = 0.8571
+    osc_params.dm21 = 7.5e-5
+    osc_params.dm31 = 2.5e-3
+    osc_params.deltacp = 0.0
+    mat_pot = np.zeros((3, 3), dtype=FTYPE) + 1.0j * np.zeros((3, 3), dtype=FTYPE)
+    mat_pot[0, 0] = 1.0
+    probability = np.empty((n_events, 3, 3), dtype=FTYPE)
+
+    def run(num_threads):
+        propagate_array_threaded(
+            osc_params.dm_matrix,
+            osc_params.mix_matrix_complex,
+            mat_pot,
+            ITYPE(1),
+            energy,
+            layer_index,
+            layers.table_density,
+            layers.table_distance,
+            probability,
+            num_threads=num_threads,
+        )
+
+    run(1)  # compile
+    print("%d events, numba runs up to %d threads"
+          % (n_events, numba.config.NUMBA_NUM_THREADS))
+    print("threads   time [s]   speedup   efficiency")
+    num_threads = 1
+    while num_threads <= max_threads:
+        start_t = time.time()
+        run(num_threads)
+        took = time.time() - start_t
+        if num_threads == 1:
+            single = took
+        print("%7d   %8.3f   %7.2f   %10.2f"
+              % (num_threads, took, single / took, single / took / num_threads))
+        num_threads *= 2
+
+
 if __name__ == "__main__":
-    main()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--benchmark-threads", action="store_true",
+        help="""Benchmark scaling of multi-threaded propagation""",
+    )
+    parser.add_argument("--n-events", type=int, default=1000000)
+    parser.add_argument("--max-threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.benchmark_threads:
+        benchmark_propagate_threaded(args.n_events, args.max_threads)
+    else:
+        main()
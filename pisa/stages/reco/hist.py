@@ -8,9 +8,12 @@ transforms.
 from __future__ import division
 
 import numpy as np
+from scipy import sparse
+from uncertainties import unumpy as unp
 
 from pisa.core.stage import Stage
-from pisa.core.transform import BinnedTensorTransform, TransformSet
+from pisa.core.transform import (SparseBinnedTensorTransform,
+                                 SparseKernelBuilder, TransformSet)
 from pisa.utils.flavInt import flavintGroupsFromString, NuFlavIntGroup
 from pisa.utils.log import logging
 
@@ -256,15 +259,27 @@ class hist(Stage):
                 )
 
             # True (input) + reco {+ PID} (output)-dimensional histogram
-            # is the basis for the transformation
-            reco_kernel = self.events.histogram(
-                kinds=xform_flavints,
-                binning=input_binning * output_binning,
-                weights_col=self.params.reco_weights_name.value,
-                errors=(self.error_method not in [None, False])
-            )
-            # Extract just the numpy array to work with
-            reco_kernel = reco_kernel.hist
+            # is the basis for the transformation. Since events from one true
+            # bin only populate the reco bins within the resolution, it is
+            # filled directly into a sparse (input bin, output bin) matrix.
+            errors = self.error_method not in [None, False]
+            events = self.events[repr_flavint]
+            weights_col = self.params.reco_weights_name.value
+            weights = None if weights_col is None else events[weights_col]
+            input_sample = {dim: events[dim] for dim in input_binning.names}
+            output_sample = {dim: events[dim] for dim in output_binning.names}
+
+            builder = SparseKernelBuilder(input_binning, output_binning)
+            builder.add_events(input_sample, output_sample, weights=weights)
+            reco_kernel = builder.tocsr()
+            if errors:
+                # Sum of squared weights per kernel element
+                builder = SparseKernelBuilder(input_binning, output_binning)
+                builder.add_events(
+                    input_sample, output_sample,
+                    weights=None if weights is None else np.square(weights)
+                )
+                reco_kernel_sumw2 = builder.tocsr()
 
             # This takes into account the correct kernel normalization:
             # What this means is that we have to normalise the reco map
@@ -284,10 +299,13 @@ class hist(Stage):
                 kinds=xform_flavints,
                 binning=input_binning,
                 weights_col=self.params.reco_weights_name.value,
-                errors=(self.error_method not in [None, False])
+                errors=errors
             )
-            # Extract just the numpy array to work with
-            true_event_counts = true_event_counts.hist
+            # Extract just the numpy array, flattened to the order of the
+            # kernel's rows, to work with
+            true_event_counts = true_event_counts.hist.ravel()
+            true_event_counts_sumw2 = unp.std_devs(true_event_counts)**2
+            true_event_counts = unp.nominal_values(true_event_counts)
 
             # If there weren't any events in the input (true_*) bin, make this
             # bin have no effect -- i.e., populate all output bins
@@ -297,23 +315,24 @@ class hist(Stage):
                 norm_factors = 1.0 / true_event_counts
                 norm_factors = np.nan_to_num(norm_factors)
 
-            # Numpy broadcasts lower-dimensional things to higher dimensions
-            # from last dimension to first; if we simply mult the reco_kernel
-            # by norm_factors, this will apply the normalization to the
-            # __output__ dimensions rather than the input dimensions. Add
-            # "dummy" dimensions to norm_factors where we want the "extra
-            # dimensions": at the end.
-            for dim in self.output_binning:
-                norm_factors = np.expand_dims(norm_factors, axis=-1)
-
-            # Apply the normalization to the kernels
-            reco_kernel *= norm_factors
-
-            assert np.all(reco_kernel >= 0), \
+            # Apply the normalization to the kernel's rows, i.e. to the input
+            # (rather than the output) dimensions
+            reco_kernel = sparse.diags(norm_factors).dot(reco_kernel).tocsr()
+
+            # Errors of the histogram and of the normalization are propagated
+            # as uncorrelated, i.e. var(K) = sumw2 / N^2 + K^2 var(N) / N^2
+            reco_kernel_errors = None
+            if errors:
+                reco_kernel_errors = (
+                    sparse.diags(norm_factors**2).dot(reco_kernel_sumw2)
+                    + sparse.diags(true_event_counts_sumw2 * norm_factors**2)
+                    .dot(reco_kernel.power(2))
+                ).sqrt()
+
+            assert np.all(reco_kernel.data >= 0), \
                     'number of elements less than 0 = %d' \
-                    % np.sum(reco_kernel < 0)
-            sum_over_axes = tuple(range(-len(self.output_binning), 0))
-            totals = np.sum(reco_kernel, axis=sum_over_axes)
+                    % np.sum(reco_kernel.data < 0)
+            totals = np.asarray(reco_kernel.sum(axis=1)).ravel()
             assert np.all(totals <= 1+1e-14), 'max = ' + str(np.max(totals)-1)
 
             # Now populate this transform to each input for which it applies.
@@ -328,12 +347,13 @@ class hist(Stage):
                 for output_name in self.output_names:
                     if output_name not in xform_flavints:
                         continue
-                    xform = BinnedTensorTransform(
+                    xform = SparseBinnedTensorTransform(
                         input_names=xform_input_names,
                         output_name=output_name,
                         input_binning=self.input_binning,
                         output_binning=self.output_binning,
                         xform_array=reco_kernel,
+                        error_array=reco_kernel_errors,
                         sum_inputs=self.sum_grouped_flavints
                     )
                     xforms.append(xform)
@@ -347,12 +367,13 @@ class hist(Stage):
                 for input_name in self.input_names:
                     if input_name not in xform_flavints:
                         continue
-                    xform = BinnedTensorTransform(
+                    xform = SparseBinnedTensorTransform(
                         input_names=input_name,
                         output_name=input_name,
                         input_binning=self.input_binning,
                         output_binning=self.output_binning,
                         xform_array=reco_kernel,
+                        error_array=reco_kernel_errors,
                     )
                     xforms.append(xform)
 
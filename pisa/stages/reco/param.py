@@ -17,7 +17,8 @@ from scipy.stats import norm
 from scipy import stats
 
 from pisa.core.stage import Stage
-from pisa.core.transform import BinnedTensorTransform, TransformSet
+from pisa.core.transform import (SparseBinnedTensorTransform,
+                                 SparseKernelBuilder, TransformSet)
 from pisa.core.binning import basename
 from pisa.utils.fileio import from_file
 from pisa.utils.flavInt import flavintGroupsFromString, NuFlavIntGroup
@@ -809,8 +810,6 @@ class param(Stage):
 
         n_e_in = len(en_centers_in)
         n_cz_in = len(cz_centers_in)
-        n_e_out = len(en_edges_out)-1
-        n_cz_out = len(cz_edges_out)-1
 
         if self.coszen_flipback:
             cz_edges_out, flipback_mask, keep = \
@@ -821,7 +820,11 @@ class param(Stage):
             logging.debug("Working on %s reco kernel..." %xform_flavints)
 
             this_params = eval_dict[xform_flavints]
-            reco_kernel = np.zeros((n_e_in, n_cz_in, n_e_out, n_cz_out))
+            # The kernel is assembled as a sparse (input bin, output bin)
+            # matrix, dropping the entries numerically compatible with zero
+            # (i.e., the far tails of the resolution functions)
+            builder = SparseKernelBuilder(self.input_binning,
+                                          self.output_binning)
 
             for (i,j) in itertools.product(range(n_e_in), range(n_cz_in)):
                 e_kern_cdf = self.make_cdf(
@@ -846,36 +849,30 @@ class param(Stage):
                                       cz_kern_cdf, flipback_mask, keep
                                   )
 
-                reco_kernel[i,j] = np.outer(e_kern_cdf, cz_kern_cdf)
+                # Dimensions are identified by name, so this also holds for
+                # binnings where 'coszen' is the first dimension
+                builder.add_separable(
+                    input_index=dict(true_energy=i, true_coszen=j),
+                    factors=dict(reco_energy=e_kern_cdf,
+                                 reco_coszen=cz_kern_cdf),
+                    threshold=EQUALITY_PREC
+                )
+            reco_kernel = builder.tocsr()
 
             # Sanity check of reco kernels - intolerable negative values?
             logging.trace(" Ensuring reco kernel sanity...")
-            kern_neg_invalid = reco_kernel < -EQUALITY_PREC
+            kern_neg_invalid = reco_kernel.data < -EQUALITY_PREC
             if np.any(kern_neg_invalid):
                 raise ValueError("Detected intolerable negative entries in"
                                  " reco kernel! Min.: %.15e"
-                                 % np.min(reco_kernel))
+                                 % np.min(reco_kernel.data))
 
-            # Set values numerically compatible with zero to zero
-            np.where(
-                (np.abs(reco_kernel) < EQUALITY_PREC), reco_kernel, 0
-            )
-            sum_over_axes = tuple(range(-len(self.output_binning), 0))
-            totals = np.sum(reco_kernel, axis=sum_over_axes)
+            totals = np.asarray(reco_kernel.sum(axis=1)).ravel()
             totals_large = totals > (1 + EQUALITY_PREC)
             if np.any(totals_large):
                 raise ValueError("Detected overflow in reco kernel! Max.:"
                                  " %0.15e" % (np.max(totals)))
 
-            if self.input_binning.basenames[0] == "coszen":
-                # The reconstruction kernel has been set up with energy as its
-                # first dimension, so swap axes if it is applied to an input
-                # binning where 'coszen' is the first
-                logging.trace(" Swapping kernel dimensions since 'coszen' has"
-                              " been requested as the first.")
-                reco_kernel = np.swapaxes(reco_kernel, 0, 1)
-                reco_kernel = np.swapaxes(reco_kernel, 2, 3)
-
 
             if self.sum_grouped_flavints:
                 xform_input_names = []
@@ -887,7 +884,7 @@ class param(Stage):
                 for output_name in self.output_names:
                     if output_name not in xform_flavints:
                         continue
-                    xform = BinnedTensorTransform(
+                    xform = SparseBinnedTensorTransform(
                         input_names=xform_input_names,
                         output_name=output_name,
                         input_binning=self.input_binning,
@@ -910,7 +907,7 @@ class param(Stage):
                         logging.trace('  input: %s, output: %s, xform: %s',
                                       input_name, output_name, xform_flavints)
 
-                        xform = BinnedTensorTransform(
+                        xform = SparseBinnedTensorTransform(
                             input_names=input_name,
                             output_name=output_name,
                             input_binning=self.input_binning,
@@ -34,29 +34,32 @@ from collections import OrderedDict, namedtuple
 from copy import deepcopy
 from os import path
 from math import exp, log
+import multiprocessing
 import threading
-import traceback
 
 import numpy as np
 from numpy import inf # pylint: disable=unused-import
 
-from pisa import EPSILON, FTYPE, OMP_NUM_THREADS, numba_jit
+from pisa import EPSILON, FTYPE, OMP_NUM_THREADS, TARGET, numba_jit
 from pisa.core.binning import MultiDimBinning
 from pisa.core.stage import Stage
-from pisa.core.transform import BinnedTensorTransform, TransformSet
+from pisa.core.transform import (SparseBinnedTensorTransform,
+                                 SparseKernelBuilder, TransformSet)
 
+from pisa.utils.cache import DiskCache
 from pisa.utils.comparisons import EQUALITY_SIGFIGS, isscalar
 from pisa.utils.fileio import mkdir, to_file
 from pisa.utils.flavInt import flavintGroupsFromString, NuFlavIntGroup
 from pisa.utils.gaussians import gaussians
 from pisa.utils.hash import hash_obj
-from pisa.utils.parallel import parallel_run
+from pisa.utils.parallel import ReplicaPool, parallel_run
 from pisa.utils.vbwkde import vbwkde as vbwkde_func
 from pisa.utils.log import logging, set_verbosity
 
 
-__all__ = ['KDEProfile', 'collect_enough_events', 'weight_coszen_tails',
-           'coszen_error_edges', 'vbwkde']
+__all__ = ['KDEProfile', 'KDE_PROFILE_CACHE_DEPTH', 'collect_enough_events',
+           'weight_coszen_tails', 'coszen_error_edges', 'kde_profile',
+           'vbwkde']
 
 __author__ = 'J.L. Lanfranchi'
 
@@ -505,6 +508,172 @@ def fast_histogram(a, bins, weights):
     return hist, bins
 
 
+KDE_PROFILE_CACHE_DEPTH = 10000
+"""Maximum number of KDE profiles (one per transform group and
+characterization bin) kept in the on-disk profile cache of a `vbwkde`
+service"""
+
+
+def kde_profile(char_dim, feature, weights, cz_bin_edges=None):
+    """Characterize the resolution of the events in one bin along dimension
+    `char_dim` via VBW-KDE.
+
+    Parameters
+    ----------
+    char_dim : string
+        One of "pid", "energy", or "coszen"
+
+    feature : array
+        PID values for "pid", log(reco_energy / true_energy) for "energy", and
+        reco_coszen - true_coszen for "coszen"
+
+    weights : None or array
+        Weights of the events, normalized to their number
+
+    cz_bin_edges : None or array
+        True-coszen bin edges of the bin; required for "coszen"
+
+    Returns
+    -------
+    profile : KDEProfile
+
+    feature, weights : array
+        Datapoints and weights that went into the KDE (including mirrored
+        datapoints for "coszen")
+
+    """
+    if char_dim == 'pid':
+        fmin, fmax = min(feature), max(feature)
+        half_width = (fmax - fmin)/2
+        lowerlim = fmin - half_width
+        upperlim = fmax + half_width
+        vbwkde_kwargs = dict(
+            n_dct=int(2**6),
+            min=lowerlim, max=upperlim,
+            evaluate_at=np.linspace(lowerlim, upperlim, int(1e4))
+        )
+
+    elif char_dim == 'energy':
+        fmin, fmax = min(feature), max(feature)
+        lowerlim = fmin
+        upperlim = fmax
+        # Note that this only evaluates the KDE profile within the range of
+        # datapoints, so as to not extrapolate
+        vbwkde_kwargs = dict(
+            n_dct=int(2**6),
+            min=lowerlim, max=upperlim,
+            evaluate_at=np.linspace(lowerlim, upperlim, int(1e4))
+        )
+
+    elif char_dim == 'coszen':
+        if weights is not None:
+            w = weights
+        else:
+            w = np.array([], dtype=FTYPE)
+        weights, error_limits = weight_coszen_tails(
+            cz_diff=feature,
+            cz_bin_edges=cz_bin_edges,
+            input_weights=w
+        )
+
+        # TODO: try the following to fix the tails falling off too abruptly:
+        # 1. Simply mirror half the points about the error limits, KDE, then
+        #    take the central portion
+        # 2. Mirror about mode (but only place "new" datapoints *outside* the
+        #    current error limits)
+        # 3. Evaluate KDE as now, but evaluate a range outside the allowed
+        #    limits; fold the shapes in by reflecting at the limits and adding
+        #    this in.
+
+        # Trying combination of methods 1+3 now: compute bandwidths with half
+        # of dataset mirrored about upper limit, and half mirrored about lower
+        # limit. Then only evaluate gaussians attached datapoints within the
+        # limits, but fold their tails in at the limits & sum
+
+        error_width = error_limits[1] - error_limits[0]
+        lower_mask = feature <= error_limits[0] + error_width/2
+        upper_mask = feature > error_limits[0] + error_width/2
+
+        orig_feature = feature
+        orig_weights = weights
+
+        feature_to_cat = [orig_feature]
+        weights_to_cat = [orig_weights]
+        if np.sum(lower_mask) > 0:
+            feature_to_cat.append(2*error_limits[0] - feature[lower_mask])
+            weights_to_cat.append(weights[lower_mask])
+        if np.sum(upper_mask) > 0:
+            feature_to_cat.append(2*error_limits[1] - feature[upper_mask])
+            weights_to_cat.append(weights[upper_mask])
+        feature = np.concatenate(feature_to_cat)
+        weights = np.concatenate(weights_to_cat)
+
+        extended_lower_lim = error_limits[0] - 0.5*error_width
+        extended_upper_lim = error_limits[1] + 0.5*error_width
+
+        vbwkde_kwargs = dict(
+            n_dct=int(2**6),
+            min=extended_lower_lim,
+            max=extended_upper_lim,
+            evaluate_dens=False,
+            evaluate_at=None
+        )
+
+    else:
+        raise NotImplementedError(
+            'Applying KDEs to dimension "%s" is not implemented.' % char_dim
+        )
+
+    bw, x, counts = vbwkde_func(feature, weights=weights, **vbwkde_kwargs)
+
+    if char_dim == 'coszen':
+        x = np.linspace(extended_lower_lim, extended_upper_lim, int(2e4))
+        counts = gaussians(x=x, mu=orig_feature, sigma=bw[:len(orig_feature)],
+                           weights=orig_weights)
+
+        mirrored_length = len(x) // 4
+        below_range_mask = x < error_limits[0]
+        above_range_mask = x > error_limits[1]
+        in_range_mask = ~(below_range_mask | above_range_mask)
+
+        x_in_range = x[in_range_mask]
+        counts_in_range = counts[in_range_mask]
+
+        counts_in_range[:mirrored_length] += (
+            counts[below_range_mask][-mirrored_length:][::-1]
+        )
+        counts_in_range[-mirrored_length:] += (
+            counts[above_range_mask][:mirrored_length][::-1]
+        )
+
+        x = x_in_range
+        counts = counts_in_range
+
+    # NOTE: removed this sort such that convolution version of the code works
+    # (which assumes profile counts are sorted by x).
+
+    ## Sort according to ascending weight to improve numerical precision of
+    ## "poor-man's" histogram
+    #sortind = counts.argsort()
+    #x = x[sortind]
+    #counts = counts[sortind]
+
+    return KDEProfile(x=x, counts=counts), feature, weights
+
+
+def _kde_profile_task(_, task):
+    """Compute the KDE profile of a task defined by `characterize_resolutions`
+    (in a `ReplicaPool` worker)"""
+    key, char_dim, feature, weights, cz_bin_edges, keep_data = task
+    profile, feature, weights = kde_profile(
+        char_dim=char_dim, feature=feature, weights=weights,
+        cz_bin_edges=cz_bin_edges
+    )
+    if not keep_data:
+        feature = weights = None
+    return key, profile, feature, weights
+
+
 class vbwkde(Stage): # pylint: disable=invalid-name
     r"""
     From simulated events, a set of transforms are created which map
@@ -630,7 +799,9 @@ class vbwkde(Stage): # pylint: disable=invalid-name
         respectively, but other inputs are possible (see docs for
         `pisa.core.stage.Stage` class for more info). The KDE profiles are
         cached to disk by this service, _not_ the full transform (since the
-        latter can be multiple GB, depending on input/output binning).
+        latter can be multiple GB, depending on input/output binning). Each
+        profile is stored separately (in a file next to the stage's disk
+        cache), keyed on the events it was computed from.
 
     transforms_cache_depth : int >= 0
         Default is 1 since transforms for this service can be huge (gigabytes)
@@ -945,8 +1116,22 @@ class vbwkde(Stage): # pylint: disable=invalid-name
 
         self._kde_hashes = dict()
 
+        self._kde_profiles_by_key = dict()
+        """KDE profiles in use, by the hash of their events and settings"""
+
+        self._kde_profile_keys = dict()
+
+        self.kde_profile_cache = None
+        """On-disk cache of individual KDE profiles"""
+        if self.disk_cache is not None:
+            self.kde_profile_cache = DiskCache(
+                path.splitext(self.disk_cache_path)[0] + '_kde_profiles.sqlite',
+                max_depth=KDE_PROFILE_CACHE_DEPTH, is_lru=False
+            )
+
         self.xform_kernels = dict()
-        """Storage of the N-dim smearing kernels, one per flavintgroup"""
+        """Storage of the smearing kernels (sparse matrices of shape
+        (input_binning.size, output_binning.size)), one per flavintgroup"""
 
         self._xform_kernels_lock = threading.Lock()
 
@@ -1013,12 +1198,12 @@ class vbwkde(Stage): # pylint: disable=invalid-name
                 logging.trace('  inputs: %s, output: %s, xform: %s',
                               xform_input_names, output_name, xform_flavints)
 
-                xform = BinnedTensorTransform(
+                xform = SparseBinnedTensorTransform(
                     input_names=xform_input_names,
                     output_name=output_name,
                     input_binning=self.input_binning,
                     output_binning=self.output_binning,
-                    xform_array=self.xform_kernels[xform_flavints].hist,
+                    xform_array=self.xform_kernels[xform_flavints],
                     sum_inputs=True
                 )
                 xforms.append(xform)
@@ -1030,8 +1215,13 @@ class vbwkde(Stage): # pylint: disable=invalid-name
         is just (E). The results are propagated to each (pid, E, cz) bin, as
         the transforms are assumed to not be cz-dependent.
 
-        The results are cached to disk and simply loaded from that cache to
-        avoid re-computation.
+        The KDE of each (transform group, characterization bin) is a separate
+        task, identified by a hash of the events selected for it and of the KDE
+        settings. Profiles already computed for the same hash (previously in
+        this session or, if `disk_cache` is enabled, stored in the on-disk
+        profile cache) are reused, so that e.g. changing the binning only
+        recomputes the bins that changed. The remaining tasks are run in
+        parallel worker processes.
 
         """
         weights_name = self.params.reco_weights_name.value
@@ -1054,6 +1244,13 @@ class vbwkde(Stage): # pylint: disable=invalid-name
             for key, value in data_node.items():
                 sorted_events[flavintgroup][key] = value[sortind]
 
+        new_hashes = OrderedDict()
+        # {(char_dim, flavintgroup, bin_coord): profile key}
+        profile_keys = OrderedDict()
+        tasks = []
+        debug_labels = dict()
+        found = dict()
+
         for char_dim, dep_dims_binning in self.char_binning.items():
             logging.debug('Working on KDE dimension "%s"', char_dim)
             new_hash = hash_obj(deepcopy(hash_items) + [dep_dims_binning.hash])
@@ -1064,40 +1261,15 @@ class vbwkde(Stage): # pylint: disable=invalid-name
                 logging.debug('  > Already have KDEs for "%s"', char_dim)
                 continue
 
-            # Try to load from disk cache
-            if self.disk_cache is not None:
-                try:
-                    if new_hash in self.disk_cache:
-                        logging.debug(
-                            '  > Loading KDEs for "%s" from disk cache',
-                            char_dim
-                        )
-                        self.kde_profiles[char_dim] = self.disk_cache[new_hash]
-                        self._kde_hashes[char_dim] = new_hash
-                        continue
-                except Exception:
-                    logging.error('Loading from disk cache failed.')
-
             # Reset the hash for this dim so if anything fails below, the wrong
             # info won't be loaded
             self._kde_hashes[char_dim] = None
-
-            # Clear out all previous kde info
-            self.kde_profiles[char_dim] = OrderedDict()
-            for flavintgroup in self.transform_groups:
-                self.kde_profiles[char_dim][flavintgroup] = OrderedDict()
-
-            if FTYPE == np.float64:
-                ftype_bytes = 8
-            elif FTYPE == np.float32:
-                ftype_bytes = 4
-
-            sizeof_kde_profiles = 0
+            new_hashes[char_dim] = new_hash
 
             for bin_num, bin_binning in enumerate(dep_dims_binning.iterbins()):
                 bin_dims = bin_binning.dims
                 bin_coord = dep_dims_binning.index2coord(bin_num)
-                logging.debug('  > characterizing bin %s (%d of %d)',
+                logging.trace('  > selecting events for bin %s (%d of %d)',
                               bin_coord, bin_num+1, dep_dims_binning.size)
 
                 # Formulate a single cut string that can be evaluated for
@@ -1115,6 +1287,10 @@ class vbwkde(Stage): # pylint: disable=invalid-name
                 last_dim_name = last_dim.name
                 last_dim_is_log = last_dim.is_log
 
+                cz_bin_edges = None
+                if char_dim == 'coszen':
+                    cz_bin_edges = bin_binning.true_coszen.bin_edges.m
+
                 for flavintgroup in self.transform_groups:
                     logging.trace('    > flavintgroup = %s', flavintgroup)
 
@@ -1158,178 +1334,118 @@ class vbwkde(Stage): # pylint: disable=invalid-name
 
                     if char_dim == 'pid':
                         feature = flav_events['pid'][mask1][mask2]
-                        fmin, fmax = min(feature), max(feature)
-                        half_width = (fmax - fmin)/2
-                        lowerlim = fmin - half_width
-                        upperlim = fmax + half_width
-                        vbwkde_kwargs = dict(
-                            n_dct=int(2**6),
-                            min=lowerlim, max=upperlim,
-                            evaluate_at=np.linspace(lowerlim, upperlim,
-                                                    int(1e4))
-                        )
-
                     elif char_dim == 'energy':
                         feature = np.log(
                             flav_events['reco_energy'][mask1][mask2]
                             / flav_events['true_energy'][mask1][mask2]
                         )
-
-                        fmin, fmax = min(feature), max(feature)
-                        lowerlim = fmin
-                        upperlim = fmax
-                        # Note that this only evaluates the KDE profile within
-                        # the range of datapoints, so as to not extrapolate
-                        vbwkde_kwargs = dict(
-                            n_dct=int(2**6),
-                            min=lowerlim, max=upperlim,
-                            evaluate_at=np.linspace(lowerlim, upperlim,
-                                                    int(1e4))
-                        )
-
                     elif char_dim == 'coszen':
                         feature = (flav_events['reco_coszen'][mask1][mask2]
                                    - flav_events['true_coszen'][mask1][mask2])
-                        if weights is not None:
-                            w = weights
-                        else:
-                            w = np.array([], dtype=FTYPE)
-                        weights, error_limits = weight_coszen_tails(
-                            cz_diff=feature,
-                            cz_bin_edges=bin_binning.true_coszen.bin_edges.m,
-                            input_weights=w
-                        )
-
-                        # TODO: try the following to fix the tails falling off
-                        # too abruptly:
-                        # 1. Simply mirror half the points about the error
-                        #    limits, KDE, then take the central portion
-                        # 2. Mirror about mode (but only place "new" datapoints
-                        #    *outside* the current error limits)
-                        # 3. Evaluate KDE as now, but evaluate a range outside
-                        #    the allowed limits; fold the shapes in by
-                        #    reflecting at the limits and adding this in.
-
-                        # Trying combination of methods 1+3 now: compute
-                        # bandwidths with half of dataset mirrored about upper
-                        # limit, and half mirrored about lower limit. Then only
-                        # evaluate gaussians attached datapoints within the
-                        # limits, but fold their tails in at the limits & sum
-
-                        error_width = error_limits[1] - error_limits[0]
-                        lower_mask = feature <= error_limits[0] + error_width/2
-                        upper_mask = feature > error_limits[0] + error_width/2
-
-                        orig_feature = feature
-                        orig_weights = weights
-
-                        feature_to_cat = [orig_feature]
-                        weights_to_cat = [orig_weights]
-                        if np.sum(lower_mask) > 0:
-                            feature_to_cat.append(
-                                2*error_limits[0] - feature[lower_mask]
-                            )
-                            weights_to_cat.append(weights[lower_mask])
-                        if np.sum(upper_mask) > 0:
-                            feature_to_cat.append(
-                                2*error_limits[1] - feature[upper_mask]
-                            )
-                            weights_to_cat.append(weights[upper_mask])
-                        feature = np.concatenate(feature_to_cat)
-                        weights = np.concatenate(weights_to_cat)
-
-                        extended_lower_lim = error_limits[0] - 0.5*error_width
-                        extended_upper_lim = error_limits[1] + 0.5*error_width
-
-                        vbwkde_kwargs = dict(
-                            n_dct=int(2**6),
-                            min=extended_lower_lim,
-                            max=extended_upper_lim,
-                            evaluate_dens=False,
-                            evaluate_at=None
-                        )
-
                     else:
                         raise NotImplementedError(
                             'Applying KDEs to dimension "%s" is not'
                             ' implemented.' % char_dim
                         )
 
-                    bw, x, counts = vbwkde_func(
-                        feature, weights=weights, **vbwkde_kwargs
-                    )
+                    key = hash_obj([FTYPE, self.source_code_hash, char_dim,
+                                    feature, weights, cz_bin_edges])
+                    profile_keys[(char_dim, flavintgroup, bin_coord)] = key
+                    if self.debug_mode == 'plot':
+                        debug_labels[key] = (char_dim, flavintgroup,
+                                             bin_coord, bin_binning)
+                    if key in self._kde_profiles_by_key or key in found:
+                        continue
 
-                    if char_dim == 'coszen':
-                        x = np.linspace(extended_lower_lim, extended_upper_lim,
-                                        2e4)
-                        counts = gaussians(x=x, mu=orig_feature,
-                                           sigma=bw[:len(orig_feature)],
-                                           weights=orig_weights)
+                    if self.kde_profile_cache is not None:
+                        try:
+                            if key in self.kde_profile_cache:
+                                found[key] = self.kde_profile_cache[key]
+                                continue
+                        except Exception:
+                            logging.error('Loading from disk cache failed.')
 
-                        mirrored_length = len(x) // 4
-                        below_range_mask = x < error_limits[0]
-                        above_range_mask = x > error_limits[1]
-                        in_range_mask = ~(below_range_mask | above_range_mask)
+                    found[key] = None
+                    tasks.append((key, char_dim, feature, weights,
+                                  cz_bin_edges, self.debug_mode == 'plot'))
 
-                        x_in_range = x[in_range_mask]
-                        counts_in_range = counts[in_range_mask]
+        logging.debug('Computing %d of %d KDE profiles', len(tasks),
+                      len(profile_keys))
 
-                        counts_in_range[:mirrored_length] += (
-                            counts[below_range_mask][-mirrored_length:][::-1]
-                        )
-                        counts_in_range[-mirrored_length:] += (
-                            counts[above_range_mask][:mirrored_length][::-1]
-                        )
+        for key, profile, feature, weights in self._run_kde_tasks(tasks):
+            found[key] = profile
 
-                        x = x_in_range
-                        counts = counts_in_range
-
-                    # NOTE: removed this sort such that convolution version of
-                    # the code works (which assumes profile counts are sorted
-                    # by x).
+            if self.kde_profile_cache is not None:
+                try:
+                    self.kde_profile_cache[key] = profile
+                except Exception as exc:
+                    logging.error(
+                        'Failed to write KDE profile to disk cache. To debug'
+                        ' issue, see exception message below.'
+                    )
+                    logging.exception(exc)
 
-                    ## Sort according to ascending weight to improve numerical
-                    ## precision of "poor-man's" histogram
-                    #sortind = counts.argsort()
-                    #x = x[sortind]
-                    #counts = counts[sortind]
+            if self.debug_mode == 'plot':
+                char_dim, flavintgroup, bin_coord, bin_binning = \
+                        debug_labels[key]
+                info = dict(
+                    bin_binning=bin_binning,
+                    x=profile.x,
+                    counts=profile.counts,
+                    weights=weights,
+                    feature=feature
+                )
+                debug_info_basename = path.join(
+                    self.debug_dir,
+                    'profile_%s_%s_%s' % (char_dim, flavintgroup, bin_coord)
+                )
+                to_file(obj=info, fname=debug_info_basename + '.pkl')
 
-                    self.kde_profiles[char_dim][flavintgroup][bin_coord] = (
-                        KDEProfile(x=x, counts=counts)
-                    )
+        found.update(self._kde_profiles_by_key)
 
-                    sizeof_kde_profiles += 2*len(x) * ftype_bytes
+        # Clear out all previous kde info for the recomputed dims, then fill
+        # in the profiles in order of the bins
+        for char_dim in new_hashes:
+            self.kde_profiles[char_dim] = OrderedDict()
+            for flavintgroup in self.transform_groups:
+                self.kde_profiles[char_dim][flavintgroup] = OrderedDict()
+            self._kde_profile_keys[char_dim] = set()
 
-                    if self.debug_mode == 'plot':
-                        info = dict(
-                            bin_binning=bin_binning,
-                            x=x,
-                            counts=counts,
-                            weights=weights,
-                            feature=feature
-                        )
-                        debug_info_basename = path.join(
-                            self.debug_dir,
-                            'profile_%s_%s_%s' % (char_dim, flavintgroup,
-                                                  bin_coord)
-                        )
-                        to_file(obj=info, fname=debug_info_basename + '.pkl')
+        for (char_dim, flavintgroup, bin_coord), key in profile_keys.items():
+            self.kde_profiles[char_dim][flavintgroup][bin_coord] = found[key]
+            self._kde_profile_keys[char_dim].add(key)
 
+        for char_dim, new_hash in new_hashes.items():
             self._kde_hashes[char_dim] = new_hash
 
-            if self.disk_cache is not None:
-                try:
-                    self.disk_cache[new_hash] = self.kde_profiles[char_dim]
-                except Exception as exc:
-                    logging.error(
-                        'Failed to write KDE profiles for dimension %s'
-                        ' (%d bytes) to disk cache. To debug issue, see'
-                        ' exception message below.',
-                        char_dim, sizeof_kde_profiles
-                    )
-                    traceback.format_exc()
-                    logging.exception(exc)
-                    logging.warning('Proceeding without disk caching.')
+        # Only keep profiles that are in use in memory
+        self._kde_profiles_by_key = {
+            key: found[key]
+            for keys in self._kde_profile_keys.values() for key in keys
+        }
+
+    def _run_kde_tasks(self, tasks):
+        """Compute the KDE profiles of `tasks`, in parallel worker processes
+        if possible.
+
+        Yields
+        ------
+        key, profile, feature, weights
+            In order of completion
+
+        """
+        num_workers = min(OMP_NUM_THREADS, len(tasks))
+        # Daemonic processes (e.g. workers of another pool) can't fork
+        if (num_workers <= 1 or TARGET == 'cuda'
+                or multiprocessing.current_process().daemon):
+            for task in tasks:
+                yield _kde_profile_task(None, task)
+            return
+
+        with ReplicaPool(obj=None, func=_kde_profile_task,
+                         num_workers=num_workers) as pool:
+            for result in pool.imap_unordered(tasks):
+                yield result
 
     def generate_all_kernels(self):
         """Dispatches `generate_single_kernel` for all specified transform
@@ -1350,32 +1466,20 @@ class vbwkde(Stage): # pylint: disable=invalid-name
         )
 
     def generate_single_kernel(self, flavintgroup):
-        """Construct a smearing kernel for the flavintgroup specified.
-
-        The resulting array can be indexed for clarity using two indexes,
-        one for input and one for output dimensions. E.g.:
-           kernel[true_energy_i, true_coszen_j][reco_energy_k, reco_coszen_l]
-        or if PID is included,
-           kernel[true_energy_i, true_coszen_j][reco_energy_k, reco_coszen_l, pid_m]
-        where ordering within the two sets of brackets is arbitrary.
+        """Construct a smearing kernel for the flavintgroup specified and
+        store it in `self.xform_kernels`.
 
-        In other words, the indices point from a single MC-true histogram bin
-        indexed by (i,j) to a single reco histogram bin indexed by (k,l{,m}).
+        The kernel maps a single MC-true histogram bin, indexed e.g. by
+        (true_energy_i, true_coszen_j), to a single reco histogram bin indexed
+        by (reco_energy_k, reco_coszen_l, pid_m). It is stored as a sparse
+        matrix with one row per flat input bin index and one column per flat
+        output bin index, as only the reco bins within the resolution of each
+        true bin are populated.
 
         Parameters
         ----------
         flavintgroup
 
-        Returns
-        -------
-        kernel : MxN-dimensional array of float
-            Mapping from the number of events in each bin of the 2D
-            MC-true-events histogram to the number of events reconstructed in
-            each bin of the 2D reconstructed-events histogram. Dimensions are
-                input_binning.shape x output_binning.shape
-            Note that PID binning can optionally be included, and behaves as
-            another output (reco) dimension.
-
         """
         logging.debug('Generating smearing kernel for %s', flavintgroup)
 
@@ -1389,8 +1493,7 @@ class vbwkde(Stage): # pylint: disable=invalid-name
         # To characterize the smearing, get the KDE profile from each input
         # dimension that was created from events closest to this input bin.
 
-        kernel_binning = self.input_binning * self.output_binning
-        kernel = kernel_binning.empty(name='kernel')
+        kernel = SparseKernelBuilder(self.input_binning, self.output_binning)
 
         # Shortcut names
         true_energy = self.input_binning.true_energy
@@ -1413,6 +1516,7 @@ class vbwkde(Stage): # pylint: disable=invalid-name
         )
 
         num_pid_bins = len(pid)
+        pid_onehots = np.eye(num_pid_bins, dtype=FTYPE)
 
         e_res_scale = self.params.e_res_scale.value.m
 
@@ -1505,15 +1609,10 @@ class vbwkde(Stage): # pylint: disable=invalid-name
             for pid_bin_num in range(num_pid_bins):
                 pid_fraction = pid_fractions[pid_bin_num]
 
-                energy_indexer = kernel_binning.indexer(
-                    true_energy=true_e_bin_num,
-                    pid=pid_bin_num
-                )
-
                 # If PID is zero, no need to figure out anything further for
-                # (..., true_energy=this, ..., pid=this, ...) bins
+                # (..., true_energy=this, ..., pid=this, ...) bins, which
+                # remain zero
                 if not np.any(np.abs(pid_fraction) > EPSILON):
-                    kernel[energy_indexer] = 0
                     continue
 
                 # Get the energy smearing for this (PID, true-energy) bin
@@ -1579,14 +1678,9 @@ class vbwkde(Stage): # pylint: disable=invalid-name
                         assert np.sum(reco_energy_fractions < 1 + EPSILON), \
                                 str(reco_energy_fractions)
 
-                # pid and true_energy are covered by the `energy_indexer`;
-                # then we broadcast reco_energy to
-                # (true_coszen, reco_coszen, reco_energy)
-                kernel[energy_indexer] = kernel_binning.broadcast(
-                    pid_fraction * reco_energy_fractions,
-                    from_dim='reco_energy',
-                    to_dims=['true_coszen', 'reco_coszen']
-                )
+                # Energy smearing of this (pid, true_energy) bin; the same for
+                # all true_coszen bins
+                energy_factor = pid_fraction * reco_energy_fractions
 
                 # Do this just once for the energy bin, prior to looping over
                 # coszen
@@ -1675,26 +1769,20 @@ class vbwkde(Stage): # pylint: disable=invalid-name
                         assert np.sum(reco_coszen_fractions) <= 1 + EPSILON, \
                                 str(reco_coszen_fractions)
 
-                    # Here we index directly into (i.e. the smearing profile
-                    # applies direclty to) a single
-                    # `(true_energy, true_coszen, pid)` coordinate.
-                    coszen_indexer = kernel_binning.indexer(
-                        true_energy=true_e_bin_num,
-                        true_coszen=true_cz_bin_num,
-                        pid=pid_bin_num
-                    )
-
-                    # At that coordinate, we broadcast the information from
-                    # the `reco_coszen` dimension into the entire `reco_energy`
-                    # dimension.
-                    kernel.hist[coszen_indexer] *= kernel_binning.broadcast(
-                        reco_coszen_fractions,
-                        from_dim='reco_coszen',
-                        to_dims=['reco_energy']
+                    # The smearing profile of a single
+                    # `(true_energy, true_coszen, pid)` coordinate is the
+                    # product of the energy and coszen smearing (in the
+                    # single pid bin)
+                    kernel.add_separable(
+                        input_index=dict(true_energy=true_e_bin_num,
+                                         true_coszen=true_cz_bin_num),
+                        factors=dict(reco_energy=energy_factor,
+                                     reco_coszen=reco_coszen_fractions,
+                                     pid=pid_onehots[pid_bin_num])
                     )
 
         with self._xform_kernels_lock:
-            self.xform_kernels[flavintgroup] = kernel
+            self.xform_kernels[flavintgroup] = kernel.tocsr()
 
 
 def test_coszen_error_edges():
@@ -11,7 +11,7 @@ from pisa.core.pi_stage import PiStage
 from pisa.utils.log import logging
 from pisa.utils.profiler import profile
 from pisa.utils import vectorizer
-from pisa.utils.kde_hist import kde_histogramdd
+from pisa.utils.kde_hist import BinnedKDE, kde_histogramdd
 
 class pi_kde(PiStage):
     """stage to KDE-map events
@@ -26,6 +26,13 @@ class pi_kde(PiStage):
         treatment for reflection
     oversample : int
         Evaluate KDE at more points per bin, takes longer, but is more accurate
+    binned : bool
+        Use the fast binned approximation (`pisa.utils.kde_hist.BinnedKDE`):
+        fixed bandwidths derived from the unweighted events, linear binning
+        onto a fine grid and FFT convolution. Everything that does not depend
+        on the weights is computed only once per container (and redone only
+        if the events change), so re-weighting is cheap. `oversample` is
+        ignored in this mode.
 
     Notes
     -----
@@ -38,6 +45,7 @@ class pi_kde(PiStage):
                  bw_method='silverman',
                  coszen_name='reco_coszen',
                  oversample=10,
+                 binned=False,
                  data=None,
                  params=None,
                  input_names=None,
@@ -52,6 +60,8 @@ class pi_kde(PiStage):
         self.bw_method = bw_method
         self.coszen_name = coszen_name
         self.oversample = int(oversample)
+        self.binned = bool(binned)
+        self._binned_kdes = {}
 
         expected_params = ()
         input_names = ()
@@ -100,17 +110,36 @@ class pi_kde(PiStage):
             sample = np.stack([container[n].get('host') for n in binning.names]).T
             weights = container['weights'].get('host')
 
-            kde_map = kde_histogramdd(sample=sample,
-                            binning=binning,
-                            weights=weights,
-                            bw_method=self.bw_method,
-                            coszen_name=self.coszen_name,
-                            oversample=self.oversample,
-                            use_cuda=False,
-                            stack_pid=True)
+            if self.binned:
+                kde_map = self.get_binned_kde(container.name, sample)(weights)
+            else:
+                kde_map = kde_histogramdd(sample=sample,
+                                binning=binning,
+                                weights=weights,
+                                bw_method=self.bw_method,
+                                coszen_name=self.coszen_name,
+                                oversample=self.oversample,
+                                use_cuda=False,
+                                stack_pid=True)
 
             kde_map = np.ascontiguousarray(kde_map.ravel())
 
             self.data.data_specs = self.output_specs
             container['weights'] = kde_map
             container['weights'].mark_changed('host')
+
+    def get_binned_kde(self, name, sample):
+        """Return the `BinnedKDE` of container `name`, (re-)creating it only
+        if the events in `sample` changed"""
+        if name in self._binned_kdes:
+            cached_sample, binned_kde = self._binned_kdes[name]
+            if np.array_equal(cached_sample, sample):
+                return binned_kde
+        logging.debug('Setting up binned KDE for "%s"', name)
+        binned_kde = BinnedKDE(sample=sample,
+                               binning=self.output_specs,
+                               bw_method=self.bw_method,
+                               coszen_name=self.coszen_name,
+                               stack_pid=True)
+        self._binned_kdes[name] = (np.copy(sample), binned_kde)
+        return binned_kde
@@ -14,7 +14,8 @@ from copy import copy
 import sys
 
 import numpy as np
-from scipy.optimize import minimize
+
+from pisa.utils.likelihood_functions import barlow_beeston_solve
 
 __all__ = ['Likelihoods']
 __author__ = 'Michael Larson'
@@ -202,11 +203,9 @@ of best-fit weighted histograms for each sample).
         unweighted histograms. You can choose between "Poisson" and "Barlow"
         likelihoods at the moment.
 
-        If using the "Barlow" LLH, note that the method is picked to be Powell
-        with 25 iterations maximum per step. This is not optimized at all and
-        was explicitly chosen simply because it "worked". This doesn't work
-        with the bounds set in the normal way, so the positive-definiteness of
-        the rates is enforced in the get_llh_barlow_bin method.
+        If using the "Barlow" LLH, the expected rates of all MC samples in all
+        bins are found simultaneously with the vectorized solver
+        `pisa.utils.likelihood_functions.barlow_beeston_solve`.
 
         """
         llh_type = llh_type.lower()
@@ -219,24 +218,17 @@ of best-fit weighted histograms for each sample).
             return poisson_llh
 
         # The more complicated case: The Barlow LLH
-        # This requires a separate minimization step in each bin to estimate
-        #  the expected rate in each bin from each MC sample using constraints
-        #  from the data and the observed MC distribution.
+        # This requires estimating the expected rate in each bin from each MC
+        #  sample using constraints from the data and the observed MC
+        #  distribution.
         elif llh_type == "barlow":
-            llh = 0
-            for bin_n in range(len(self.data_histogram)):
-                self.current_bin = bin_n
-                bin_result = minimize(
-                    fun=self.get_llh_barlow_bin,
-                    x0=self.bestfit_plots[:, bin_n],
-                    method="Powell",
-                    options={'maxiter': 25, 'disp': False}
-                )
-                self.bestfit_plots[:, bin_n] = bin_result.x
-                llh += bin_result.fun
-
+            self.bestfit_plots, _ = barlow_beeston_solve(
+                data=self.data_histogram,
+                unweighted_mc=self.unweighted_histograms,
+                weights=self.mc_histograms
+            )
             self.current_bin = None
-            return llh
+            return self.get_llh_barlow()
 
         raise ArgValueError(
             'Unknown `llh_type` "{}". Choose either "Poisson" (ideal) or'
@@ -244,6 +236,28 @@ of best-fit weighted histograms for each sample).
             .format(llh_type)
         )
 
+    def get_llh_barlow(self):
+        """Vectorized equivalent of summing `get_llh_barlow_bin` over all bins
+        at the best-fit expected MC rates stored in `bestfit_plots`."""
+        di = self.data_histogram
+        a_i = self.bestfit_plots
+        ai = self.unweighted_histograms
+        fi = np.sum(np.multiply(self.mc_histograms, a_i), axis=0)
+
+        llh = 0
+
+        cut = fi > 0
+        llh += np.sum(di[cut] * np.log(fi[cut]) - fi[cut])
+        cut = di > 0
+        llh -= np.sum(di[cut] * np.log(di[cut]) - di[cut])
+
+        cut = a_i > 0
+        llh += np.sum(ai[cut] * np.log(a_i[cut]) - a_i[cut])
+        cut = ai > 0
+        llh -= np.sum(ai[cut] * np.log(ai[cut]) - ai[cut])
+
+        return -llh
+
     def get_llh_barlow_bin(self, a_i):
         """The Barlow LLH finds the best-fit "expected" MC distribution using
         both the data and observed MC as constraints. Each bin is independent
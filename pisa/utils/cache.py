@@ -5,20 +5,28 @@ MemoryCache and DiskCache classes to store long-to-compute results.
 
 from __future__ import absolute_import
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 import copy
+import itertools
+import numbers
 import os
 import pickle
 import re
 import sqlite3
 import shutil
+import sys
 import tempfile
 import time
+import types
+import weakref
+
+import numpy as np
 
 from pisa.utils.log import logging, set_verbosity
 
 
-__all__ = ['MemoryCache', 'DiskCache',
+__all__ = ['nbytes_of', 'CacheBudget', 'MemoryCache', 'DiskCache',
            'test_MemoryCache', 'test_DiskCache']
 
 __author__ = 'J.L. Lanfranchi'
@@ -38,10 +46,168 @@ __license__ = '''Copyright (c) 2014-2017, The IceCube Collaboration
  limitations under the License.'''
 
 
+NBYTES_MAX_DEPTH = 16
+"""Maximum depth of references followed by `nbytes_of`"""
+
+NBYTES_OBJECT_SAMPLE = 64
+"""Number of elements of object arrays `nbytes_of` looks at"""
+
+_ACCESS_CLOCK = itertools.count()
+"""Global access counter, making recency comparable between caches"""
+
+
+def nbytes_of(obj, _seen=None, _depth=0):
+    """Approximate memory footprint of `obj` in bytes.
+
+    NumPy arrays count with their data buffers; containers, mappings and
+    objects' attributes (e.g. of Maps, MapSets and Transforms) are traversed
+    recursively, with objects referenced more than once counted only once.
+    Elements of object arrays (e.g. ufloats) are estimated from a sample.
+
+    Parameters
+    ----------
+    obj : object
+
+    Returns
+    -------
+    nbytes : int
+
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or _depth > NBYTES_MAX_DEPTH:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, (type, types.ModuleType, types.FunctionType,
+                        types.MethodType, types.BuiltinFunctionType)):
+        return 0
+
+    if isinstance(obj, np.ndarray):
+        nbytes = sys.getsizeof(obj) if obj.base is None else obj.nbytes
+        if obj.dtype == object and obj.size > 0:
+            sample = obj.flat[:NBYTES_OBJECT_SAMPLE]
+            sample_nbytes = sum(nbytes_of(x, _seen, _depth + 1) for x in sample)
+            nbytes += int(sample_nbytes * obj.size / len(sample))
+        return nbytes
+
+    nbytes = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, numbers.Number)):
+        return nbytes
+    if isinstance(obj, Mapping):
+        for key, value in obj.items():
+            nbytes += nbytes_of(key, _seen, _depth + 1)
+            nbytes += nbytes_of(value, _seen, _depth + 1)
+        return nbytes
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return nbytes + sum(nbytes_of(x, _seen, _depth + 1) for x in obj)
+    if hasattr(obj, '__dict__'):
+        nbytes += nbytes_of(vars(obj), _seen, _depth + 1)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            nbytes += nbytes_of(getattr(obj, slot), _seen, _depth + 1)
+    return nbytes
+
+
+class _CacheEntry(object):
+    __slots__ = ('value', 'nbytes', 'cost', 'last_access', 'priority')
+
+    def __init__(self, value, nbytes, cost):
+        self.value = value
+        self.nbytes = nbytes
+        self.cost = cost
+        self.last_access = None
+        self.priority = None
+
+
+class CacheBudget(object):
+    """Memory budget shared by several `MemoryCache`s, e.g. all caches of the
+    stages in a pipeline.
+
+    Whenever the total size of the entries of all caches attached to the
+    budget exceeds `max_bytes`, entries are evicted from whichever cache
+    holds the least valuable one.
+
+    Parameters
+    ----------
+    max_bytes : int >= 0
+
+    cost_aware : bool
+        Evict by least-recently-used (False) or by cost-aware (True) logic;
+        see `MemoryCache`
+
+    """
+    def __init__(self, max_bytes, cost_aware=False):
+        max_bytes = int(max_bytes)
+        assert max_bytes >= 0, '`max_bytes` must be >= 0; got %s' % max_bytes
+        self.max_bytes = max_bytes
+        self.cost_aware = cost_aware
+        self.inflation = 0.
+        self.evictions = 0
+        self._caches = weakref.WeakSet()
+
+    def __str__(self):
+        return 'CacheBudget(max_bytes=%d, cost_aware=%s)' % (self.max_bytes,
+                                                             self.cost_aware)
+
+    def __repr__(self):
+        return str(self) + '; %d caches using %d bytes' % (len(self._caches),
+                                                            self.nbytes)
+
+    @property
+    def caches(self):
+        """list of MemoryCache : caches sharing this budget"""
+        return list(self._caches)
+
+    @property
+    def nbytes(self):
+        """int : total size of all entries in all caches"""
+        return sum(cache.nbytes for cache in self._caches)
+
+    def register(self, cache):
+        """Attach `cache` to the budget (use `MemoryCache.budget` instead)"""
+        self._caches.add(cache)
+
+    def unregister(self, cache):
+        """Detach `cache` from the budget"""
+        self._caches.discard(cache)
+
+    def enforce(self, protect=None):
+        """Evict entries until all caches fit into the budget.
+
+        Parameters
+        ----------
+        protect : None or tuple (MemoryCache, key)
+            Entry not to evict (e.g. the one just stored)
+
+        """
+        nbytes = self.nbytes
+        while nbytes > self.max_bytes:
+            victims = []
+            for cache in self._caches:
+                victim = cache.eviction_candidate(
+                    cost_aware=self.cost_aware,
+                    exclude=protect[1] if protect and protect[0] is cache else None
+                )
+                if victim is not None:
+                    victims.append((victim[0], id(cache), cache, victim[1]))
+            if not victims:
+                break
+            _, _, cache, key = min(victims, key=lambda v: v[:2])
+            nbytes -= cache.evict(key)
+            self.evictions += 1
+
+
 class MemoryCache(object):
     """Simple implementation of a first-in-first-out (FIFO) or least-recently-
     used (LRU) in-memory cache, with a subset of the dict interface.
 
+    Entries are bounded in number by `max_depth` and, optionally, in total
+    size by `max_bytes` and/or a `CacheBudget` shared with other caches. The
+    size of entries is estimated by `nbytes_of` (unless passed to `set`), once
+    per entry; caches without a size limit only do so when `nbytes` is
+    requested.
+
     Parameters
     ----------
     max_depth : int >= 0
@@ -58,73 +224,272 @@ class MemoryCache(object):
         returned from the cache. This can guard aganst an object in the cache
         being modifed after it has been stored to the cache.
 
+    max_bytes : None or int >= 0
+        Maximum total size of the entries in the cache (no limit if None).
+        Objects larger than this are not cached at all.
+
+    cost_aware : bool
+        If True, evict the entry with the lowest recompute time per byte
+        first (GreedyDual-Size logic, which also ages entries such that
+        expensive but unused ones eventually make room). Recompute times are
+        passed to `set`; entries without one count as free to recompute. If
+        False, evict by FIFO or LRU logic (see `is_lru`).
+
+    budget : None or CacheBudget
+        Memory budget shared with other caches
+
     Attributes
     ----------
     GLOBAL_MEMCACHE_DEPTH_OVERRIDE : None or int >= 0
         Set to an integer to override the cache depth for *all* memory caches.
         E.g., set this to 0 to disable caching everywhere.
 
+    hits, misses, evictions : int
+        Number of successful and failed lookups (with `[]`, `get` or `in`)
+        and number of entries evicted to make room for others
+
     Notes
     -----
     Based off of code at www.kunxi.org/blog/2014/05/lru-cache-in-python
 
     """
     GLOBAL_MEMCACHE_DEPTH_OVERRIDE = None
-    def __init__(self, max_depth, is_lru=True, deepcopy=False):
+    def __init__(self, max_depth, is_lru=True, deepcopy=False, max_bytes=None,
+                 cost_aware=False, budget=None):
         self.__cache = OrderedDict()
         self.__max_depth = max_depth
         self.__is_lru = is_lru
         self.__deepcopy = deepcopy
+        self.__max_bytes = None if max_bytes is None else int(max_bytes)
+        self.__cost_aware = cost_aware
+        self.__budget = None
+        self.__nbytes = 0
+        self.__inflation = 0.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
         if self.GLOBAL_MEMCACHE_DEPTH_OVERRIDE is not None:
             self.__max_depth = self.GLOBAL_MEMCACHE_DEPTH_OVERRIDE
         assert isinstance(self.__max_depth, int), \
                 '`max_depth` must be int; got %s' % type(self.__max_depth)
         assert self.__max_depth >= 0, \
                 '`max_depth` must be >= 0; got %s' % self.__max_depth
+        assert self.__max_bytes is None or self.__max_bytes >= 0, \
+                '`max_bytes` must be >= 0; got %s' % self.__max_bytes
+        self.budget = budget
 
     def __str__(self):
-        return 'MemoryCache(max_depth=%d, is_lru=%s)' % (self.__max_depth,
-                                                         self.__is_lru)
+        return ('MemoryCache(max_depth=%d, is_lru=%s, max_bytes=%s,'
+                ' cost_aware=%s)' % (self.__max_depth, self.__is_lru,
+                                     self.__max_bytes, self.__cost_aware))
 
     def __repr__(self):
         return str(self) + '; %d keys:\n%s' % (len(self.__cache),
                                                self.__cache.keys())
 
+    @property
+    def budget(self):
+        """None or CacheBudget : memory budget shared with other caches"""
+        return self.__budget
+
+    @budget.setter
+    def budget(self, budget):
+        if self.__budget is not None:
+            self.__budget.unregister(self)
+        self.__budget = budget
+        if budget is not None:
+            budget.register(self)
+            budget.enforce()
+
+    @property
+    def nbytes(self):
+        """int : estimated total size of all entries"""
+        for entry in self.__cache.values():
+            self.__size(entry)
+        return self.__nbytes
+
+    @property
+    def __is_bounded(self):
+        return (self.__max_bytes is not None or self.__cost_aware
+                or self.__budget is not None)
+
+    def __size(self, entry):
+        """Size of `entry`, estimated on first use"""
+        if entry.nbytes is None:
+            entry.nbytes = nbytes_of(entry.value)
+            self.__nbytes += entry.nbytes
+        return entry.nbytes
+
+    @property
+    def stats(self):
+        """OrderedDict : hits, misses, evictions, number of entries and their
+        total size"""
+        return OrderedDict([
+            ('hits', self.hits),
+            ('misses', self.misses),
+            ('evictions', self.evictions),
+            ('entries', len(self)),
+            ('nbytes', self.nbytes),
+        ])
+
+    def reset_stats(self):
+        """Set hit, miss and eviction counters to zero"""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __touch(self, entry):
+        entry.last_access = next(_ACCESS_CLOCK)
+        inflation = self.__inflation if self.__budget is None else self.__budget.inflation
+        entry.priority = inflation + entry.cost / max(entry.nbytes or 0, 1)
+
     def __getitem__(self, key):
         if key is None:
             raise KeyError(
                 '`None` is not a valid cache key, so nothing can live there.'
             )
-        value = self.__cache[key]
+        try:
+            entry = self.__cache[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
         if self.__is_lru:
-            del self.__cache[key]
-            self.__cache[key] = value
+            self.__cache.move_to_end(key)
+            self.__touch(entry)
+        value = entry.value
         if self.__deepcopy:
             value = copy.deepcopy(value)
         return value
 
     def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, cost=None, nbytes=None):
+        """Store `value` under `key`.
+
+        Parameters
+        ----------
+        key : hashable, not None
+
+        value : object
+
+        cost : None or float
+            Time it takes to recompute `value` (e.g. in seconds), used for
+            cost-aware eviction
+
+        nbytes : None or int
+            Size of `value` in bytes, if known (e.g. from the `nbytes` of the
+            arrays it consists of); otherwise estimated by `nbytes_of` if the
+            cache is bounded in size, and only when needed if it is not
+
+        """
         if key is None:
             raise KeyError(
                 '`None` is not a valid cache key, so nothing can live there.'
             )
         if self.__max_depth == 0:
             return
-        # Same logic here for LRU and FIFO
-        try:
-            del self.__cache[key]
-        except KeyError:
-            if len(self) >= self.__max_depth:
-                self.__cache.popitem(last=False)
+        if key in self.__cache:
+            self.__remove(key)
         if self.__deepcopy:
             value = copy.deepcopy(value)
-        self.__cache[key] = value
+        if nbytes is None and self.__is_bounded:
+            nbytes = nbytes_of(value)
+        entry = _CacheEntry(value, None if nbytes is None else int(nbytes),
+                            0. if cost is None else float(cost))
+
+        limits = [self.__max_bytes]
+        if self.__budget is not None:
+            limits.append(self.__budget.max_bytes)
+        limits = [limit for limit in limits if limit is not None]
+        if limits and entry.nbytes > min(limits):
+            logging.debug('Not caching object of %d bytes in %s',
+                          entry.nbytes, self)
+            return
+
+        while len(self) >= self.__max_depth:
+            self.__evict_one()
+        self.__touch(entry)
+        self.__cache[key] = entry
+        if entry.nbytes is not None:
+            self.__nbytes += entry.nbytes
+
+        if self.__max_bytes is not None:
+            while self.__nbytes > self.__max_bytes:
+                self.__evict_one(exclude=key)
+        if self.__budget is not None:
+            self.__budget.enforce(protect=(self, key))
+
+    def eviction_candidate(self, cost_aware=None, exclude=None):
+        """Entry to be evicted next.
+
+        Parameters
+        ----------
+        cost_aware : None or bool
+            Whether to apply cost-aware logic; defaults to that of the cache
+
+        exclude : hashable
+            Key not to consider
+
+        Returns
+        -------
+        candidate : None or tuple (score, key)
+            None if there is no candidate; the lower the `score`, the
+            earlier the entry is to be evicted
+
+        """
+        if cost_aware is None:
+            cost_aware = self.__cost_aware
+        if cost_aware:
+            candidates = ((entry.priority, entry.last_access, key)
+                          for key, entry in self.__cache.items()
+                          if key != exclude)
+            candidate = min(candidates, default=None, key=lambda c: c[:2])
+            return None if candidate is None else (candidate[0], candidate[2])
+        for key, entry in self.__cache.items():
+            if key != exclude:
+                return (entry.last_access, key)
+        return None
+
+    def evict(self, key):
+        """Remove the entry `key`, counting it as evicted.
+
+        Returns
+        -------
+        nbytes : int
+            Size of the entry removed
+
+        """
+        entry = self.__remove(key)
+        self.evictions += 1
+        if self.__cost_aware:
+            self.__inflation = entry.priority
+        if self.__budget is not None and self.__budget.cost_aware:
+            self.__budget.inflation = max(self.__budget.inflation, entry.priority)
+        if entry.nbytes is None:
+            return nbytes_of(entry.value)
+        return entry.nbytes
+
+    def __evict_one(self, exclude=None):
+        candidate = self.eviction_candidate(exclude=exclude)
+        if candidate is not None:
+            self.evict(candidate[1])
+
+    def __remove(self, key):
+        entry = self.__cache.pop(key)
+        if entry.nbytes is not None:
+            self.__nbytes -= entry.nbytes
+        return entry
 
     def __contains__(self, key):
-        return key in self.__cache
+        if key in self.__cache:
+            return True
+        self.misses += 1
+        return False
 
     def __delitem__(self, key):
-        return self.__cache.__delitem__(self, key)
+        self.__remove(key)
 
     def __iter__(self):
         return iter(self.__cache)
@@ -136,24 +501,27 @@ class MemoryCache(object):
         return reversed(self.__cache)
 
     def clear(self):
+        self.__nbytes = 0
         return self.__cache.clear()
 
     def get(self, key, dflt=None):
         if key in self.__cache:
             return self[key]
+        self.misses += 1
         return dflt
 
     def keys(self):
         return self.__cache.keys()
 
     def pop(self, k):
-        value = self.__cache.pop(k)
+        value = self.__remove(k).value
         if self.__deepcopy:
             value = copy.deepcopy(value)
         return value
 
     def popitem(self, last=True):
-        return self.pop(last)
+        key = next(reversed(self.__cache)) if last else next(iter(self.__cache))
+        return key, self.pop(key)
 
     def setdefault(self, key, default=None):
         if not key in self:
@@ -161,7 +529,7 @@ class MemoryCache(object):
         return self[key]
 
     def values(self):
-        vals = self.__cache.values()
+        vals = [entry.value for entry in self.__cache.values()]
         if self.__deepcopy:
             vals = [copy.deepcopy(v) for v in vals]
         return vals
@@ -504,6 +872,53 @@ def test_MemoryCache():
         y = mc[4]
         assert (y == x_ref) == deepcopy
 
+    # Size limit, statistics
+    array = np.zeros(1000)
+    assert array.nbytes <= nbytes_of(array) < array.nbytes + 1000
+    assert nbytes_of([array, array, {'a': array}]) < 2 * array.nbytes
+    mc = MemoryCache(max_depth=10, is_lru=True, max_bytes=3.5 * array.nbytes)
+    for i in range(4):
+        mc[i] = np.zeros(1000)
+    assert list(mc.keys()) == [1, 2, 3]
+    assert mc.evictions == 1
+    assert 0 not in mc and mc.get(0) is None
+    _ = mc[1]
+    mc[4] = np.zeros(1000)
+    assert list(mc.keys()) == [3, 1, 4]
+    mc[5] = np.zeros(10000)
+    assert 5 not in mc
+    assert mc.stats == OrderedDict([('hits', 1), ('misses', 3), ('evictions', 2),
+                                    ('entries', 3), ('nbytes', mc.nbytes)])
+    assert mc.nbytes == sum(nbytes_of(v) for v in mc.values())
+
+    # Unbounded caches estimate sizes only on demand, sizes passed are used
+    mc = MemoryCache(max_depth=10)
+    mc['a'] = [array, {'b': array}]
+    mc.set('c', array, nbytes=array.nbytes)
+    assert mc.nbytes == nbytes_of([array, {'b': array}]) + array.nbytes
+    del mc['a']
+    assert mc.nbytes == array.nbytes
+
+    # Cost-aware eviction keeps entries that are expensive to recompute
+    mc = MemoryCache(max_depth=3, is_lru=True, cost_aware=True)
+    mc.set('expensive', np.zeros(1000), cost=10)
+    mc.set('cheap', np.zeros(1000), cost=0.1)
+    mc.set('cheap_small', np.zeros(10), cost=0.1)
+    mc.set('new', np.zeros(1000), cost=1)
+    assert 'expensive' in mc and 'cheap' not in mc and 'cheap_small' in mc
+
+    # Budget shared by several caches evicts the least recently used entry
+    budget = CacheBudget(max_bytes=3.5 * array.nbytes)
+    mc0 = MemoryCache(max_depth=10, budget=budget)
+    mc1 = MemoryCache(max_depth=10, budget=budget)
+    mc0['a'] = np.zeros(1000)
+    mc1['b'] = np.zeros(1000)
+    mc0['c'] = np.zeros(1000)
+    _ = mc0['a']
+    mc1['d'] = np.zeros(1000)
+    assert 'b' not in mc1 and 'a' in mc0 and 'c' in mc0 and 'd' in mc1
+    assert budget.nbytes <= budget.max_bytes and budget.evictions == 1
+
     logging.info('<< PASS : test_MemoryCache >>')
 
 
@@ -72,7 +72,11 @@ required, in addition to a ``[binning]`` section:
 * ``#include resource as xyz`` statements behave similarly, but prepend the
   included file's text with a setion header containing ``xyz`` in this case.
 * ``pipeline`` is the top-most section that defines the hierarchy of stages and
-  what services to be instantiated.
+  what services to be instantiated. Optionally, ``cache_budget`` (e.g.
+  ``2 GB``) limits the total memory used by the memory caches of all stages
+  of the pipeline, and ``cache_cost_aware = True`` makes the budget evict
+  entries that are cheap to recompute per byte first (instead of the least
+  recently used ones).
 * ``binning`` can contain different binning definitions, that are then later
   referred to from within the ``stage.service`` sections.
 * ``stage.service`` one such section per stage.service is necessary. It
@@ -627,6 +631,19 @@ def parse_pipeline_config(config):
     if config.has_option(section, 'detector_name'):
         detector_name = config.get(section, 'detector_name')
 
+    cache_budget = None
+    if config.has_option(section, 'cache_budget'):
+        cache_budget = parse_string_literal(config.get(section, 'cache_budget'))
+        if cache_budget is not None:
+            cache_budget = ureg.Quantity(cache_budget)
+            if cache_budget.unitless:
+                cache_budget = cache_budget.magnitude
+            else:
+                cache_budget = cache_budget.m_as('byte')
+        cache_cost_aware = False
+        if config.has_option(section, 'cache_cost_aware'):
+            cache_cost_aware = config.getboolean(section, 'cache_cost_aware')
+
     # Parse [stage.<stage_name>] sections and store to stage_dicts
     stage_dicts = OrderedDict()
     for stage, service in order:  # pylint: disable=too-many-nested-blocks
@@ -766,6 +783,10 @@ def parse_pipeline_config(config):
         stage_dicts[(stage, service)] = service_kwargs
 
     stage_dicts['detector_name'] = detector_name
+    if cache_budget is not None:
+        stage_dicts['cache_budget'] = OrderedDict(
+            [('max_bytes', int(cache_budget)), ('cost_aware', cache_cost_aware)]
+        )
     return stage_dicts
 
 
@@ -0,0 +1,353 @@
+"""
+Parsing and evaluation of cut expressions (e.g. "(true_energy >= 1) &
+(true_coszen <= 0)") on columns of event data.
+
+Expressions are evaluated with numexpr (multi-threaded, without full-size
+temporaries) if it is installed and supports the expression; otherwise with
+numpy, chunk by chunk for purely element-wise expressions and on the full
+columns for expressions with reductions (e.g. "energy > np.median(energy)").
+"""
+
+
+from __future__ import absolute_import, division
+
+import ast
+import builtins
+from functools import lru_cache
+
+import numpy as np
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+from pisa.utils.log import logging, set_verbosity
+
+
+__all__ = ['CUT_CHUNK_SIZE', 'CutExpression', 'compile_cut', 'test_CutExpression']
+
+__license__ = '''Copyright (c) 2014-2020, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+CUT_CHUNK_SIZE = 2**16
+"""Number of events evaluated at once; bounds the memory needed for
+intermediate results"""
+
+_SAFE_BUILTINS = {
+    name: getattr(builtins, name) for name in (
+        'abs', 'min', 'max', 'round', 'len', 'sum', 'any', 'all', 'pow',
+        'int', 'float', 'bool', 'True', 'False', 'None',
+    )
+}
+"""Builtins available in cut expressions; anything else (in particular
+`__import__`, `open`, `eval`) is not"""
+
+_GLOBALS = {'__builtins__': _SAFE_BUILTINS, 'np': np, 'numpy': np,
+            'inf': np.inf, 'nan': np.nan}
+
+_ELEMENTWISE_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.Name, ast.Load, ast.Constant, ast.operator, ast.unaryop, ast.boolop,
+    ast.cmpop,
+)
+
+_NUMEXPR_FUNCS = {
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh',
+    'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh', 'log', 'log10', 'log1p',
+    'exp', 'expm1', 'sqrt', 'abs', 'where',
+}
+"""numpy functions (called as `np.<name>`) numexpr supports under the same
+name"""
+
+_NUMEXPR_OPS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**',
+    ast.Mod: '%', ast.BitAnd: '&', ast.BitOr: '|', ast.USub: '-',
+    ast.Invert: '~', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+    ast.Eq: '==', ast.NotEq: '!=',
+}
+
+
+def _np_attr(node):
+    """Name of the numpy attribute `node` refers to (as in `np.log10`), or
+    None"""
+    if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+            and node.value.id in ('np', 'numpy')):
+        return node.attr
+    return None
+
+
+def _is_elementwise(tree):
+    """Whether the expression `tree` operates element by element, i.e. can be
+    evaluated on chunks of the columns; anything but operators and numpy
+    ufuncs (e.g. reductions, indexing, attributes) is assumed not to"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if node.keywords:
+                return False
+            if isinstance(node.func, ast.Name) and node.func.id == 'abs':
+                continue
+            if not isinstance(getattr(np, _np_attr(node.func) or '', None),
+                              np.ufunc):
+                return False
+        elif isinstance(node, ast.Attribute):
+            # `np.<ufunc>` as the function of a call (checked above) or a
+            # numpy constant such as `np.pi`
+            value = getattr(np, _np_attr(node) or '', None)
+            if not isinstance(value, (np.ufunc, float)):
+                return False
+        elif not isinstance(node, _ELEMENTWISE_NODES):
+            return False
+    return True
+
+
+def _to_numexpr(node):
+    """Translate the expression `node` into a numexpr string, or raise
+    ValueError if numexpr does not support it"""
+    if isinstance(node, ast.Expression):
+        return _to_numexpr(node.body)
+    if isinstance(node, ast.Name):
+        if node.id in _GLOBALS or node.id in _SAFE_BUILTINS:
+            raise ValueError(node.id)
+        return node.id
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value,
+                                                          (int, float)):
+            raise ValueError(repr(node.value))
+        return repr(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _NUMEXPR_OPS:
+        return '(%s %s %s)' % (_to_numexpr(node.left), _NUMEXPR_OPS[type(node.op)],
+                               _to_numexpr(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _NUMEXPR_OPS:
+        return '(%s%s)' % (_NUMEXPR_OPS[type(node.op)], _to_numexpr(node.operand))
+    if (isinstance(node, ast.Compare) and len(node.ops) == 1
+            and type(node.ops[0]) in _NUMEXPR_OPS):
+        return '(%s %s %s)' % (_to_numexpr(node.left),
+                               _NUMEXPR_OPS[type(node.ops[0])],
+                               _to_numexpr(node.comparators[0]))
+    if isinstance(node, ast.Call) and not node.keywords:
+        if isinstance(node.func, ast.Name) and node.func.id == 'abs':
+            func = 'abs'
+        else:
+            func = _np_attr(node.func)
+            func = {'absolute': 'abs'}.get(func, func)
+        if func in _NUMEXPR_FUNCS:
+            return '%s(%s)' % (func, ', '.join(_to_numexpr(arg)
+                                               for arg in node.args))
+    raise ValueError(ast.dump(node))
+
+
+class CutExpression(object):
+    """Cut expression, parsed and compiled once, that can be evaluated on any
+    set of columns.
+
+    Names in the expression refer to columns; the numpy namespace is
+    available via `np` (as well as `inf` and `nan`), as are a few safe
+    builtins such as `abs`, `min` and `max`.
+
+    Parameters
+    ----------
+    expr : str
+        Any string interpretable as numpy boolean expression
+
+    use_numexpr : bool
+        Evaluate with numexpr where possible (see module docstring)
+
+    """
+    def __init__(self, expr, use_numexpr=True):
+        if not isinstance(expr, str):
+            raise TypeError('Cut expression must be a string; got %s'
+                            % type(expr))
+        self.expr = expr
+        tree = ast.parse(expr.strip(), mode='eval')
+        self.variables = frozenset(
+            node.id for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id not in _GLOBALS
+            and node.id not in _SAFE_BUILTINS
+        )
+        self._code = compile(tree, '<cut %r>' % expr, 'eval')
+        self.elementwise = _is_elementwise(tree)
+        """Whether the expression can be evaluated chunk by chunk"""
+        self._numexpr = None
+        if use_numexpr and numexpr is not None and self.variables:
+            try:
+                self._numexpr = _to_numexpr(tree)
+            except ValueError:
+                pass
+
+    def __repr__(self):
+        return 'CutExpression(%r)' % self.expr
+
+    def mask(self, columns, chunk_size=CUT_CHUNK_SIZE):
+        """Evaluate the expression, with numexpr or chunk by chunk where
+        possible (see module docstring).
+
+        Parameters
+        ----------
+        columns : Mapping
+            Arrays of equal length (along the first axis) by name; only the
+            ones referenced in the expression are accessed
+
+        chunk_size : int
+            Number of events per chunk when evaluating an element-wise
+            expression with numpy
+
+        Returns
+        -------
+        mask : numpy.ndarray of bool
+
+        """
+        missing = self.variables.difference(columns.keys())
+        if missing:
+            raise KeyError('Variable(s) %s of cut "%s" not found'
+                           % (sorted(missing), self.expr))
+        arrays = {name: columns[name] for name in self.variables}
+        lengths = set(len(array) for array in arrays.values())
+        if len(lengths) > 1:
+            raise ValueError('Variables of cut "%s" have different lengths'
+                             % self.expr)
+        if not lengths:
+            raise ValueError('Cut "%s" does not depend on any variable'
+                             % self.expr)
+        length = lengths.pop()
+
+        if self._numexpr is not None:
+            try:
+                mask = numexpr.evaluate(self._numexpr, local_dict=arrays,
+                                        global_dict={})
+            except (KeyError, TypeError, ValueError, NotImplementedError) as err:
+                # e.g. unsupported dtypes; don't try again
+                logging.debug('numexpr cannot evaluate cut "%s" (%s), using'
+                              ' numpy', self.expr, err)
+                self._numexpr = None
+            else:
+                if mask.dtype == bool and mask.shape == (length,):
+                    return mask
+                self._numexpr = None
+
+        if not self.elementwise:
+            # reductions etc. need to see all events at once
+            mask = eval(self._code, _GLOBALS, dict(arrays)) # pylint: disable=eval-used
+            return np.broadcast_to(np.asarray(mask, dtype=bool), (length,)).copy()
+
+        mask = np.empty(length, dtype=bool)
+        for start in range(0, length, chunk_size):
+            stop = min(start + chunk_size, length)
+            namespace = {name: array[start:stop] for name, array in arrays.items()}
+            mask[start:stop] = eval(self._code, _GLOBALS, namespace) # pylint: disable=eval-used
+        return mask
+
+    def indices(self, columns, chunk_size=CUT_CHUNK_SIZE):
+        """Indices of the events passing the cut, see `mask`"""
+        return np.flatnonzero(self.mask(columns, chunk_size=chunk_size))
+
+    def apply(self, columns, chunk_size=CUT_CHUNK_SIZE):
+        """Select events passing the cut from all `columns`, copying each
+        column exactly once.
+
+        Returns
+        -------
+        selected : dict
+
+        """
+        indices = self.indices(columns, chunk_size=chunk_size)
+        return {name: np.take(column, indices, axis=0)
+                for name, column in columns.items()}
+
+
+@lru_cache(maxsize=256)
+def compile_cut(expr):
+    """Return the (cached) `CutExpression` for `expr`"""
+    logging.trace('Compiling cut expression "%s"', expr)
+    return CutExpression(expr)
+
+
+def test_CutExpression():
+    """Unit tests for CutExpression"""
+    rand = np.random.RandomState(0)
+    columns = dict(
+        true_energy=rand.uniform(0.5, 100, 100001),
+        energy=rand.uniform(0.5, 100, 100001),
+        true_coszen=rand.uniform(-1, 1, 100001),
+        stacked=rand.uniform(0, 1, (100001, 3)),
+    )
+    true_energy = columns['true_energy']
+    energy = columns['energy']
+    true_coszen = columns['true_coszen']
+
+    cut = compile_cut('(true_energy >= 1) & (true_energy <= 80)')
+    assert cut is compile_cut('(true_energy >= 1) & (true_energy <= 80)')
+    assert cut.variables == {'true_energy'}
+    ref = (true_energy >= 1) & (true_energy <= 80)
+    assert np.all(cut.mask(columns) == ref)
+    assert np.all(cut.mask(columns, chunk_size=7) == ref)
+
+    # no confusion between names that are substrings of one another
+    cut = CutExpression('(energy < 10) & ~(true_energy > 50)')
+    ref = (energy < 10) & ~(true_energy > 50)
+    assert np.all(cut.mask(columns) == ref)
+
+    cut = CutExpression('(np.log10(true_energy) >= 1) & (true_coszen < 0)')
+    ref = (np.log10(true_energy) >= 1) & (true_coszen < 0)
+    selected = cut.apply(columns)
+    assert np.all(selected['energy'] == energy[ref])
+    assert selected['stacked'].shape == (np.count_nonzero(ref), 3)
+    assert np.all(selected['stacked'] == columns['stacked'][ref])
+
+    cut = CutExpression('(abs(true_coszen) < 0.5) & (energy > max(1, 2))'
+                        ' & (min(energy.shape) > 0)')
+    assert cut.variables == {'true_coszen', 'energy'}
+    ref = (np.abs(true_coszen) < 0.5) & (energy > 2)
+    assert np.all(cut.mask(columns) == ref)
+
+    # reductions see all events, however the expression is evaluated
+    for expr in ['true_energy > np.max(true_energy) / 2',
+                 '(true_energy > np.median(true_energy)) & (true_coszen < 0)']:
+        ref = eval(expr, _GLOBALS, columns) # pylint: disable=eval-used
+        for use_numexpr in [True, False]:
+            cut = CutExpression(expr, use_numexpr=use_numexpr)
+            assert not cut.elementwise
+            assert np.all(cut.mask(columns, chunk_size=1000) == ref)
+
+    # numexpr and numpy evaluation agree
+    for expr in ['(np.log10(true_energy) >= 1) & (true_coszen < 0)',
+                 '(abs(true_coszen) < 0.5) | ~(energy**2 > 1e3)',
+                 '(np.sqrt(energy) * 2 > np.cos(true_coszen)) & (energy != 50)']:
+        cut = CutExpression(expr)
+        assert cut.elementwise
+        assert (cut._numexpr is not None) == (numexpr is not None) # pylint: disable=protected-access
+        ref = CutExpression(expr, use_numexpr=False).mask(columns, chunk_size=7)
+        assert np.all(cut.mask(columns) == ref)
+
+    # other builtins are taken to be (missing) columns
+    try:
+        CutExpression('__import__("os")').mask(columns)
+    except KeyError:
+        pass
+    else:
+        raise AssertionError('Unsafe builtin available in cut expression')
+
+    try:
+        CutExpression('reco_energy > 1').mask(columns)
+    except KeyError:
+        pass
+    else:
+        raise AssertionError('Missing variable not detected')
+
+    logging.info('<< PASS : test_CutExpression >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_CutExpression()
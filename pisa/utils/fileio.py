@@ -62,7 +62,7 @@ __license__ = '''Copyright (c) 2014-2017, The IceCube Collaboration
 
 PKL_EXTS = ['pickle', 'pckl', 'pkl', 'p']
 CFG_EXTS = ['ini', 'cfg']
-ZIP_EXTS = ['bz2']
+ZIP_EXTS = ['bz2', 'gz', 'zst', 'lz4']
 TXT_EXTS = ['txt', 'dat']
 XOR_EXTS = ['xor']
 
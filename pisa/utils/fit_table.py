@@ -0,0 +1,483 @@
+"""
+Columnar table of the fit results stored (one JSON file per fit) by e.g.
+`hypo_testing.py`, loaded in parallel and cached to a single file such that
+only new or modified fit files have to be parsed again.
+"""
+
+
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+import multiprocessing
+import os
+
+import numpy as np
+
+from pisa import TARGET
+from pisa.utils.fileio import from_file, to_file
+from pisa.utils.log import logging, set_verbosity
+from pisa.utils.parallel import ReplicaPool
+
+
+__all__ = ['FIT_TABLE_FNAME', 'FIT_FILE_EXTS', 'MINIMIZER_METADATA_KEYS',
+           'read_fit', 'FitTable', 'test_FitTable']
+
+__license__ = '''Copyright (c) 2014-2020, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.'''
+
+
+FIT_TABLE_FNAME = 'fit_table.pckl'
+"""Name of the file (in the root directory of a `FitTable`) the table is
+cached to"""
+
+FIT_FILE_EXTS = ('.json', '.json.bz2', '.json.gz', '.json.zst', '.json.lz4')
+
+MINIMIZER_METADATA_KEYS = ('nit', 'nfev', 'status')
+"""Minimizer metadata kept in the table"""
+
+_SCALAR_COLUMNS = OrderedDict([
+    ('fpath', object),
+    ('mtime', np.float64),
+    ('size', np.int64),
+    ('metric', object),
+    ('metric_val', np.float64),
+    ('minimizer_time', object),
+    ('nit', np.float64),
+    ('nfev', np.float64),
+    ('status', np.float64),
+])
+
+
+def read_fit(fpath):
+    """Read a fit file and reduce it to what is stored in a `FitTable`.
+
+    Parameters
+    ----------
+    fpath : string
+
+    Returns
+    -------
+    fit : OrderedDict or None
+        Keys are `metric`, `metric_val`, `params` (values as strings with
+        units, as stored in the file), `minimizer_time` and the
+        `MINIMIZER_METADATA_KEYS`; missing entries are None. None if the file
+        does not contain a fit (i.e. has no `metric_val`).
+
+    """
+    info = from_file(fpath)
+    if not isinstance(info, dict) or 'metric_val' not in info:
+        return None
+    metadata = info.get('minimizer_metadata') or {}
+    fit = OrderedDict()
+    fit['metric'] = info.get('metric')
+    fit['metric_val'] = info['metric_val']
+    fit['params'] = OrderedDict(info.get('params') or {})
+    fit['minimizer_time'] = info.get('minimizer_time')
+    for key in MINIMIZER_METADATA_KEYS:
+        fit[key] = metadata.get(key)
+    return fit
+
+
+def _read_fit_task(_, fpath):
+    """`ReplicaPool` function reading one fit file"""
+    return fpath, read_fit(fpath)
+
+
+class FitTable(object):
+    """Fit results of all fit files below `rootdir`, stored column-wise: one
+    array per quantity (metric value, each fitted parameter, minimizer
+    iterations, ...) with one entry per fit file.
+
+    Fit files are parsed in parallel worker processes, and the table is
+    cached to `FIT_TABLE_FNAME` in `rootdir`. When the table is instantiated
+    (or `update`d) again, only fit files that are new or were modified since
+    are parsed; rows of files that vanished are dropped.
+
+    Parameters
+    ----------
+    rootdir : string
+        Directory to (recursively) search for files ending in one of
+        `FIT_FILE_EXTS`
+
+    cache : bool
+        Whether to read and write the cached table
+
+    num_workers : int or None
+        Number of worker processes parsing fit files; defaults to the number
+        of CPUs. Files are parsed serially if 1.
+
+    Examples
+    --------
+    >>> table = FitTable('~/hypo_testing_output')
+    >>> metric_vals = table['metric_val']
+    >>> theta23 = table.param_values('theta23')
+    >>> fit = table.record(fpath, keys=['metric_val', 'params'])
+
+    """
+    def __init__(self, rootdir, cache=True, num_workers=None):
+        self.rootdir = os.path.abspath(
+            os.path.expanduser(os.path.expandvars(rootdir))
+        )
+        self.cache_fpath = None
+        if cache:
+            self.cache_fpath = os.path.join(self.rootdir, FIT_TABLE_FNAME)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.num_workers = int(num_workers)
+
+        self.columns = OrderedDict(
+            (name, np.empty(0, dtype=dtype))
+            for name, dtype in _SCALAR_COLUMNS.items()
+        )
+        self.params = OrderedDict()
+        """Parameter values (strings with units, or None if a fit did not
+        have the parameter free) by parameter name"""
+        self.skipped = {}
+        """(mtime, size) of files that do not contain a fit, by path"""
+        self.num_read = 0
+        """Number of files parsed by the last `update`"""
+        self._index = {}
+
+        if self.cache_fpath is not None and os.path.isfile(self.cache_fpath):
+            try:
+                self._set_state(from_file(self.cache_fpath))
+            except Exception: # pylint: disable=broad-except
+                logging.warning('Could not read cached fit table "%s"; it will'
+                                ' be regenerated.', self.cache_fpath)
+        self.update()
+
+    def __len__(self):
+        return len(self.columns['fpath'])
+
+    def __contains__(self, fpath):
+        return self._relpath(fpath) in self._index
+
+    def __getitem__(self, name):
+        """Column `name`, one of the keys of `columns`"""
+        return self.columns[name]
+
+    @property
+    def fpaths(self):
+        """list of string : absolute paths of the fit files, one per row"""
+        return [os.path.join(self.rootdir, fpath)
+                for fpath in self.columns['fpath']]
+
+    def _relpath(self, fpath):
+        return os.path.relpath(os.path.abspath(fpath), self.rootdir)
+
+    def _set_state(self, state):
+        self.columns = state['columns']
+        self.params = state['params']
+        self.skipped = state['skipped']
+        self._index = {fpath: row
+                       for row, fpath in enumerate(self.columns['fpath'])}
+
+    def _find_files(self):
+        """(mtime, size) of all candidate fit files, by path relative to
+        `rootdir`"""
+        found = {}
+        for dirpath, _, fnames in os.walk(self.rootdir):
+            for fname in fnames:
+                if not fname.endswith(FIT_FILE_EXTS):
+                    continue
+                fpath = os.path.join(dirpath, fname)
+                stat = os.stat(fpath)
+                found[os.path.relpath(fpath, self.rootdir)] = (stat.st_mtime,
+                                                               stat.st_size)
+        return found
+
+    def _read_fits(self, fpaths):
+        """Parse the files `fpaths` (relative to `rootdir`), in parallel if
+        possible.
+
+        Yields
+        ------
+        fpath, fit
+            In order of completion; see `read_fit`
+
+        """
+        abs_fpaths = [os.path.join(self.rootdir, fpath) for fpath in fpaths]
+        num_workers = min(self.num_workers, len(fpaths))
+        # Daemonic processes (e.g. workers of another pool) can't fork
+        if (num_workers <= 1 or TARGET == 'cuda'
+                or multiprocessing.current_process().daemon):
+            for fpath in abs_fpaths:
+                yield self._relpath(fpath), read_fit(fpath)
+            return
+
+        with ReplicaPool(None, _read_fit_task, num_workers) as pool:
+            for fpath, fit in pool.imap_unordered(abs_fpaths):
+                yield self._relpath(fpath), fit
+
+    def update(self):
+        """Parse new and modified fit files and drop rows of removed ones;
+        write the table to the cache file if anything changed.
+
+        Returns
+        -------
+        changed : bool
+
+        """
+        found = self._find_files()
+        if self.cache_fpath is not None:
+            found.pop(FIT_TABLE_FNAME, None)
+
+        columns = self.columns
+        keep = np.array(
+            [found.get(fpath) == (mtime, size)
+             for fpath, mtime, size in zip(columns['fpath'], columns['mtime'],
+                                           columns['size'])],
+            dtype=bool
+        )
+        skipped = {fpath: stat for fpath, stat in self.skipped.items()
+                   if found.get(fpath) == stat}
+        known = set(np.asarray(columns['fpath'])[keep]).union(skipped)
+        to_read = sorted(fpath for fpath in found if fpath not in known)
+
+        self.num_read = len(to_read)
+        if not to_read and np.all(keep) and len(skipped) == len(self.skipped):
+            return False
+
+        if to_read:
+            logging.info('Reading %d new or modified fit file(s) below %s',
+                         len(to_read), self.rootdir)
+        fits = OrderedDict()
+        for fpath, fit in self._read_fits(to_read):
+            if fit is None:
+                skipped[fpath] = found[fpath]
+            else:
+                fits[fpath] = fit
+        new_fpaths = sorted(fits.keys())
+
+        new_columns = OrderedDict()
+        for name, dtype in _SCALAR_COLUMNS.items():
+            if name == 'fpath':
+                new_vals = new_fpaths
+            elif name == 'mtime':
+                new_vals = [found[fpath][0] for fpath in new_fpaths]
+            elif name == 'size':
+                new_vals = [found[fpath][1] for fpath in new_fpaths]
+            else:
+                new_vals = [fits[fpath][name] for fpath in new_fpaths]
+                if dtype is not object:
+                    new_vals = [np.nan if val is None else val
+                                for val in new_vals]
+            new_col = np.empty(len(new_fpaths), dtype=dtype)
+            new_col[:] = new_vals
+            new_columns[name] = np.concatenate([columns[name][keep], new_col])
+
+        param_names = list(self.params.keys())
+        for fpath in new_fpaths:
+            for name in fits[fpath]['params']:
+                if name not in param_names:
+                    param_names.append(name)
+        new_params = OrderedDict()
+        num_kept = np.count_nonzero(keep)
+        for name in param_names:
+            col = np.full(num_kept + len(new_fpaths), None, dtype=object)
+            if name in self.params:
+                col[:num_kept] = self.params[name][keep]
+            col[num_kept:] = [fits[fpath]['params'].get(name)
+                              for fpath in new_fpaths]
+            if any(val is not None for val in col):
+                new_params[name] = col
+
+        self._set_state(dict(columns=new_columns, params=new_params,
+                             skipped=skipped))
+        if self.cache_fpath is not None:
+            to_file(dict(columns=self.columns, params=self.params,
+                         skipped=self.skipped),
+                    self.cache_fpath, warn=False)
+        return True
+
+    def param_values(self, name):
+        """Values (without units) of parameter `name`, NaN where it was not
+        fit.
+
+        Returns
+        -------
+        values : numpy.ndarray of float
+        units : string or None
+
+        """
+        values = np.full(len(self), np.nan)
+        units = None
+        for row, val in enumerate(self.params[name]):
+            if val is None:
+                continue
+            magnitude, _, units = val.partition(' ')
+            values[row] = float(magnitude)
+        return values, units
+
+    def record(self, fpath, keys=None):
+        """Fit stored in file `fpath`, in the form of the contents of the file
+        (restricted to what the table holds).
+
+        Parameters
+        ----------
+        fpath : string
+            Absolute path or path relative to the current directory
+
+        keys : None, string, or iterable of strings
+            Keys to return (if present); any of 'metric', 'metric_val',
+            'params', 'minimizer_time', and 'minimizer_metadata'. If None, all
+            of these are returned.
+
+        Returns
+        -------
+        fit : OrderedDict
+
+        Raises
+        ------
+        KeyError
+            If the table does not contain `fpath`
+
+        """
+        row = self._index[self._relpath(fpath)]
+        if keys is None:
+            keys = ['metric', 'metric_val', 'params', 'minimizer_time',
+                    'minimizer_metadata']
+        elif isinstance(keys, str):
+            keys = [keys]
+
+        fit = OrderedDict()
+        for key in keys:
+            if key == 'params':
+                fit[key] = OrderedDict(
+                    (name, vals[row]) for name, vals in self.params.items()
+                    if vals[row] is not None
+                )
+            elif key == 'minimizer_metadata':
+                metadata = OrderedDict()
+                for name in MINIMIZER_METADATA_KEYS:
+                    val = self.columns[name][row]
+                    if not np.isnan(val):
+                        metadata[name] = int(val)
+                fit[key] = metadata
+            elif key in ('metric', 'metric_val', 'minimizer_time'):
+                val = self.columns[key][row]
+                if key == 'metric_val':
+                    val = float(val)
+                if val is not None:
+                    fit[key] = val
+        return fit
+
+
+def test_FitTable():
+    """Unit tests for FitTable"""
+    from shutil import rmtree
+    from tempfile import mkdtemp
+
+    rootdir = mkdtemp()
+    try:
+        rand = np.random.RandomState(0)
+        to_file(dict(h0_name='no', h1_name='io'),
+                os.path.join(rootdir, 'config_summary.json'), warn=False)
+        fits = {}
+        for trial in range(20):
+            subdir = os.path.join(rootdir, 'toy_trial%d' % (trial // 10))
+            if not os.path.isdir(subdir):
+                os.makedirs(subdir)
+            for hypo in ['no', 'io']:
+                fpath = os.path.join(
+                    subdir, 'hypo_%s_fit_to_fid_%d.json.bz2' % (hypo, trial)
+                )
+                fit = OrderedDict([
+                    ('metric', 'chi2'),
+                    ('metric_val', rand.uniform(0, 10)),
+                    ('params', OrderedDict([
+                        ('theta23', '%r degree' % rand.uniform(40, 50)),
+                        ('aeff_scale', '%r dimensionless' % rand.uniform()),
+                    ])),
+                    ('minimizer_time', '%r second' % rand.uniform(1, 10)),
+                    ('minimizer_metadata', dict(
+                        nit=int(rand.randint(1, 100)),
+                        nfev=int(rand.randint(100, 1000)), status=0,
+                        hess_inv=rand.uniform(size=(2, 2)).tolist(),
+                    )),
+                    ('detailed_metric_info', dict(maps=list(range(100)))),
+                ])
+                if hypo == 'io':
+                    fit['params']['deltam31'] = '-0.0025 electron_volt ** 2'
+                to_file(fit, fpath, warn=False)
+                fits[fpath] = fit
+
+        def check(table):
+            assert len(table) == len(fits)
+            assert 'config_summary.json' in table.skipped
+            for fpath, fit in fits.items():
+                assert fpath in table
+                fit_rec = table.record(fpath)
+                for key in ['metric', 'metric_val', 'params',
+                            'minimizer_time']:
+                    assert fit_rec.get(key) == fit.get(key), key
+                metadata = fit.get('minimizer_metadata', {})
+                for key in MINIMIZER_METADATA_KEYS:
+                    assert (fit_rec['minimizer_metadata'].get(key)
+                            == metadata.get(key))
+                assert list(table.record(fpath, 'params').keys()) == ['params']
+            rows = [table.fpaths.index(fpath) for fpath in fits]
+            assert np.all(table['metric_val'][rows]
+                          == [fit['metric_val'] for fit in fits.values()])
+            vals, units = table.param_values('theta23')
+            assert units == 'degree'
+            assert np.all(vals[rows] == [
+                float(fit['params']['theta23'].split(' ')[0])
+                for fit in fits.values()
+            ])
+            assert np.sum(~np.isnan(table.param_values('deltam31')[0])) \
+                    == sum('deltam31' in fit['params'] for fit in fits.values())
+
+        serial = FitTable(rootdir, cache=False, num_workers=1)
+        assert serial.num_read == 41
+        check(serial)
+
+        table = FitTable(rootdir, num_workers=4)
+        assert table.num_read == 41
+        check(table)
+        assert os.path.isfile(os.path.join(rootdir, FIT_TABLE_FNAME))
+
+        # Only new or modified files are read again
+        table = FitTable(rootdir, num_workers=4)
+        assert table.num_read == 0
+        check(table)
+
+        fpath = sorted(fits.keys())[3]
+        fits[fpath]['metric_val'] = -1.
+        fits[fpath]['params']['theta23'] = '45.0 degree'
+        to_file(fits[fpath], fpath, warn=False)
+        os.utime(fpath, (0, 0))
+        new_fpath = os.path.join(rootdir, 'toy_trial1',
+                                 'hypo_no_fit_to_fid_100.json')
+        fits[new_fpath] = OrderedDict(metric='chi2', metric_val=1.5,
+                                      params=OrderedDict(theta23='42 degree'))
+        to_file(fits[new_fpath], new_fpath, warn=False)
+        removed = sorted(fits.keys())[0]
+        os.remove(removed)
+        fits.pop(removed)
+
+        table = FitTable(rootdir, num_workers=4)
+        assert table.num_read == 2
+        check(table)
+        assert table.record(new_fpath, 'minimizer_metadata') == \
+                OrderedDict(minimizer_metadata=OrderedDict())
+    finally:
+        rmtree(rootdir, ignore_errors=True)
+
+    logging.info('<< PASS : test_FitTable >>')
+
+
+if __name__ == '__main__':
+    set_verbosity(1)
+    test_FitTable()
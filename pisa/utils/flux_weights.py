@@ -11,16 +11,24 @@ accidentally do the wrong thing with that script.
 
 from __future__ import absolute_import, division
 
+from collections import OrderedDict
+import hashlib
+import os
+
 import numpy as np
 import scipy.interpolate as interpolate
 
+from pisa import CACHE_DIR
 from pisa.utils.log import logging
-from pisa.utils.resources import open_resource
+from pisa.utils.resources import find_resource, open_resource
 
 
-__all__ = ['load_2d_honda_table', 'load_2d_bartol_table', 'load_2d_table',
+__all__ = ['SPLINE_CACHE_SUFFIX', 'HONDA_LOGENERGY_EDGES',
+           'BARTOL_LOGENERGY_EDGES', 'read_flux_table',
+           'integral_preserving_splines', 'load_spline_arrays',
+           'load_2d_honda_table', 'load_2d_bartol_table', 'load_2d_table',
            'calculate_2d_flux_weights', 'load_3d_honda_table', 'load_3d_table',
-           'calculate_3d_flux_weights', ]
+           'calculate_3d_flux_weights', 'test_load_spline_arrays']
 
 __author__ = 'S. Wren'
 
@@ -43,154 +51,254 @@ PRIMARIES = ['numu', 'numubar', 'nue', 'nuebar']
 TEXPRIMARIES = [r'$\nu_{\mu}$', r'$\bar{\nu}_{\mu}$', r'$\nu_{e}$',
                 r'$\bar{\nu}_{e}$']
 
+SPLINE_CACHE_SUFFIX = '.splines.npz'
+"""Suffix of the file next to a flux table (or in `CACHE_DIR`, if the table's
+directory is not writeable) in which its integral-preserving splines are
+cached"""
 
-def load_2d_honda_table(flux_file, enpow=1, return_table=False):
+_SPLINE_CACHE_VERSION = 1
 
-    logging.debug("Loading atmospheric flux table %s", flux_file)
+# Energy bin edges of the integral-preserving splines; must be the edges of
+# those of the tables
+HONDA_LOGENERGY_EDGES = np.linspace(-1.025, 4.025, 102)
+# Honda did a 3D calculation at the lower energies with smaller bins. Above
+# this the calculation is 1D and the bin width doubles.
+BARTOL_LOGENERGY_EDGES = np.concatenate(
+    [np.linspace(-1, 1, 41), np.linspace(1.1, 4, 30)]
+)
 
-    # columns in Honda files are in the same order
-    cols = ['energy'] + PRIMARIES
+# Keys of the table cosZenith values (in table order) in the spline dicts
+_CZ_KEYS = ['%.2f'%(1.05-cz_iter*0.1) for cz_iter in range(1, 21)]
+_AZ_KEYS = np.linspace(15, 345, 12)
 
-    # Load the data table
+
+def read_flux_table(flux_file, num_azimuth=1):
+    """Read a (Honda-format) flux table into dense arrays.
+
+    Parameters
+    ----------
+    flux_file : string
+    num_azimuth : int
+        Number of azimuth bins in the table; 1 for azimuth-averaged tables
+
+    Returns
+    -------
+    energy : numpy.ndarray of shape (n_energy,)
+    fluxes : OrderedDict
+        Flux of each of the `PRIMARIES`, of shape (20, num_azimuth, n_energy)
+        with cosZenith and azimuth in table order (i.e. cosZenith descending
+        from 0.95, azimuth ascending from 15 deg)
+
+    """
+    cols = ['energy'] + PRIMARIES
     table = np.genfromtxt(open_resource(flux_file),
                           usecols=list(range(len(cols))))
     mask = np.all(np.isnan(table) | np.equal(table, 0), axis=1)
-    table = table[~mask].T
-
-    flux_dict = dict(zip(cols, table))
-    for key in flux_dict.keys():
-        # There are 20 lines per zenith range
-        flux_dict[key] = np.array(np.split(flux_dict[key], 20))
-
-    # Set the zenith and energy range as they are in the tables
-    # The energy may change, but the zenith should always be
-    # 20 bins, full sky.
-    flux_dict['energy'] = flux_dict['energy'][0]
-    flux_dict['coszen'] = np.linspace(-0.95, 0.95, 20)
-
-    # Now get a spline representation of the flux table.
-    logging.debug('Make spline representation of flux')
-    logging.debug('Doing this integral-preserving.')
-
-    spline_dict = {}
-
-    # Do integral-preserving method as in IceCube's NuFlux
-    # This one will be based purely on SciPy rather than ROOT
-    # Stored splines will be 1D in integrated flux over energy
-    int_flux_dict = {}
-    # Energy and CosZenith bins needed for integral-preserving
-    # method must be the edges of those of the normal tables
-    int_flux_dict['logenergy'] = np.linspace(-1.025, 4.025, 102)
-    int_flux_dict['coszen'] = np.linspace(-1, 1, 21)
-    for nutype in PRIMARIES:
-        # spline_dict now wants to be a set of splines for
-        # every table cosZenith value.
-        splines = {}
-        cz_iter = 1
-        for energyfluxlist in flux_dict[nutype]:
-            int_flux = []
-            tot_flux = 0.0
-            int_flux.append(tot_flux)
-            for energyfluxval, energyval in zip(energyfluxlist,
-                                                flux_dict['energy']):
-                # Spline works best if you integrate flux * energy
-                tot_flux += energyfluxval*np.power(energyval, enpow)*0.05
-                int_flux.append(tot_flux)
-
-            spline = interpolate.splrep(int_flux_dict['logenergy'],
-                                        int_flux, s=0)
-            cz_value = '%.2f'%(1.05-cz_iter*0.1)
-            splines[cz_value] = spline
-            cz_iter += 1
-
-        spline_dict[nutype] = splines
-
-    for prim in PRIMARIES:
-        flux_dict[prim] = flux_dict[prim][::-1]
+    # There are 20 blocks of lines per zenith range, each with one block per
+    # azimuth range
+    table = table[~mask].reshape(20, num_azimuth, -1, len(cols))
+    energy = table[0, 0, :, 0]
+    fluxes = OrderedDict(
+        (prim, np.ascontiguousarray(table[..., col]))
+        for col, prim in enumerate(PRIMARIES, start=1)
+    )
+    return energy, fluxes
 
-    if return_table:
-        return spline_dict, flux_dict
 
-    return spline_dict
+def integral_preserving_splines(log_energy_edges, energy, flux, enpow=1,
+                                bin_widths=0.05):
+    """Splines of the integrated flux * energy**enpow over log10(energy) for
+    any number of flux slices at once (as in IceCube's NuFlux).
 
+    Parameters
+    ----------
+    log_energy_edges : numpy.ndarray of shape (n_energy + 1,)
+    energy : numpy.ndarray of shape (n_energy,)
+    flux : numpy.ndarray of shape (..., n_energy)
+    enpow : integer
+    bin_widths : float or numpy.ndarray of shape (n_energy,)
+        Widths of the energy bins in log10(energy)
 
-def load_2d_bartol_table(flux_file, enpow=1, return_table=False):
+    Returns
+    -------
+    t : numpy.ndarray
+        Knots, shared by all splines (since these are fully determined by
+        `log_energy_edges`)
+    c : numpy.ndarray of shape (..., len(t))
+        Coefficients of each spline
+    k : int
+        Degree of the splines; (t, c[...], k) is what `splrep` returns for
+        the integrated flux of each slice
 
-    logging.debug("Loading atmospheric flux table %s", flux_file)
+    """
+    flux = np.asarray(flux, dtype=np.float64)
+    weighted = flux*np.power(energy, enpow)*bin_widths
+    int_flux = np.zeros(flux.shape[:-1] + (flux.shape[-1] + 1,))
+    np.cumsum(weighted, axis=-1, out=int_flux[..., 1:])
+    int_flux = int_flux.reshape(-1, int_flux.shape[-1])
+
+    t, _, k = interpolate.splrep(log_energy_edges, int_flux[0], s=0)
+    spline = interpolate.make_interp_spline(log_energy_edges, int_flux.T,
+                                            k=k, t=t)
+    # Pad like splrep does
+    c = np.zeros((int_flux.shape[0], len(t)))
+    c[:, :spline.c.shape[0]] = spline.c.T
+    return t, c.reshape(flux.shape[:-1] + (len(t),)), k
+
+
+def _spline_cache_fpaths(table_fpath):
+    """Candidate locations of the spline cache file of a table"""
+    basename = os.path.basename(table_fpath) + SPLINE_CACHE_SUFFIX
+    path_hash = hashlib.md5(table_fpath.encode()).hexdigest()[:8]
+    return [table_fpath + SPLINE_CACHE_SUFFIX,
+            os.path.join(CACHE_DIR, 'flux_splines', path_hash + '_' + basename)]
+
+
+def load_spline_arrays(flux_file, num_azimuth=1, enpow=1, bartol=False,
+                       use_cache=True):
+    """Dense flux table and integral-preserving splines in energy of all of
+    its cosZenith (and azimuth) slices.
+
+    The result is cached in a binary file next to the table (see
+    `SPLINE_CACHE_SUFFIX`), so subsequent calls neither parse the table nor
+    fit splines as long as the table is unchanged.
 
-    # Bartol tables have been modified to look like Honda tables
-    cols = ['energy'] + PRIMARIES
+    Parameters
+    ----------
+    flux_file : string
+    num_azimuth : int
+        Number of azimuth bins in the table; 1 for azimuth-averaged tables
+    enpow : integer
+        The power to which the energy will be raised in the construction of
+        the splines
+    bartol : bool
+        Whether the table has Bartol energy binning (see
+        `BARTOL_LOGENERGY_EDGES`)
+    use_cache : bool
+
+    Returns
+    -------
+    energy, fluxes
+        See `read_flux_table`
+    t, coeffs, k
+        Knots, dict of coefficients (of shape (20, num_azimuth, len(t))) by
+        primary, and degree of the splines; see `integral_preserving_splines`
 
-    # Load the data table
-    table = np.genfromtxt(open_resource(flux_file),
-                          usecols=list(range(len(cols))))
-    mask = np.all(np.isnan(table) | np.equal(table, 0), axis=1)
-    table = table[~mask].T
-
-    flux_dict = dict(zip(cols, table))
-    for key in flux_dict.keys():
-        # There are 20 lines per zenith range
-        flux_dict[key] = np.array(np.split(flux_dict[key], 20))
-
-    # Set the zenith and energy range as they are in the tables
-    # The energy may change, but the zenith should always be
-    # 20 bins, full sky.
-    flux_dict['energy'] = flux_dict['energy'][0]
-    flux_dict['coszen'] = np.linspace(-0.95, 0.95, 20)
-
-    # Now get a spline representation of the flux table.
-    logging.debug('Make spline representation of flux')
-    logging.debug('Doing this integral-preserving.')
-
-    spline_dict = {}
-
-    # Do integral-preserving method as in IceCube's NuFlux
-    # This one will be based purely on SciPy rather than ROOT
-    # Stored splines will be 1D in integrated flux over energy
-    int_flux_dict = {}
-    # Energy and CosZenith bins needed for integral-preserving
-    # method must be the edges of those of the normal tables
-    low_log_energy = np.linspace(-1, 1, 41)
-    high_log_energy = np.linspace(1.1, 4, 30)
-    int_flux_dict['logenergy'] = np.concatenate(
-        [low_log_energy, high_log_energy]
+    """
+    table_fpath = find_resource(flux_file)
+    with open(table_fpath, 'rb') as table_file:
+        key = '%s_%d_%d_%d_%d' % (
+            hashlib.md5(table_file.read()).hexdigest(), num_azimuth, enpow,
+            bartol, _SPLINE_CACHE_VERSION
+        )
+
+    if use_cache:
+        for cache_fpath in _spline_cache_fpaths(table_fpath):
+            if not os.path.isfile(cache_fpath):
+                continue
+            try:
+                with np.load(cache_fpath) as cache:
+                    if str(cache['key']) == key:
+                        logging.debug('Loading flux splines from %s',
+                                      cache_fpath)
+                        fluxes = OrderedDict(
+                            (prim, cache['flux_' + prim]) for prim in PRIMARIES
+                        )
+                        coeffs = OrderedDict(
+                            (prim, cache['c_' + prim]) for prim in PRIMARIES
+                        )
+                        return (cache['energy'], fluxes, cache['t'], coeffs,
+                                int(cache['k']))
+            except Exception: # pylint: disable=broad-except
+                logging.warning('Ignoring unreadable flux spline cache %s',
+                                cache_fpath)
+
+    energy, fluxes = read_flux_table(table_fpath, num_azimuth=num_azimuth)
+    if bartol:
+        log_energy_edges = BARTOL_LOGENERGY_EDGES
+        bin_widths = np.where(energy < 10.0, 0.05, 0.1)
+    else:
+        log_energy_edges = HONDA_LOGENERGY_EDGES
+        bin_widths = 0.05
+    coeffs = OrderedDict()
+    for prim, flux in fluxes.items():
+        t, coeffs[prim], k = integral_preserving_splines(
+            log_energy_edges, energy, flux, enpow=enpow, bin_widths=bin_widths
+        )
+
+    if use_cache:
+        arrays = dict(key=key, energy=energy, t=t, k=k)
+        for prim in PRIMARIES:
+            arrays['flux_' + prim] = fluxes[prim]
+            arrays['c_' + prim] = coeffs[prim]
+        for cache_fpath in _spline_cache_fpaths(table_fpath):
+            try:
+                cache_dir = os.path.dirname(cache_fpath)
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                # Write to a temporary file first such that concurrent jobs
+                # never read a partially written cache
+                tmp_fpath = '%s.%d.tmp' % (cache_fpath, os.getpid())
+                with open(tmp_fpath, 'wb') as cache_file:
+                    np.savez(cache_file, **arrays)
+                os.replace(tmp_fpath, cache_fpath)
+            except OSError:
+                continue
+            logging.debug('Cached flux splines to %s', cache_fpath)
+            break
+
+    return energy, fluxes, t, coeffs, k
+
+
+def _spline_dict_2d(t, coeffs, k):
+    """Dict of (t, c, k) tuples by primary and table cosZenith key"""
+    return {prim: {czkey: (t, c[cz_ind, 0], k)
+                   for cz_ind, czkey in enumerate(_CZ_KEYS)}
+            for prim, c in coeffs.items()}
+
+
+def _spline_dict_3d(t, coeffs, k):
+    """Dict of (t, c, k) tuples by primary, table azimuth and table cosZenith
+    key"""
+    return {prim: {az: {czkey: (t, c[cz_ind, az_ind], k)
+                        for cz_ind, czkey in enumerate(_CZ_KEYS)}
+                   for az_ind, az in enumerate(_AZ_KEYS)}
+            for prim, c in coeffs.items()}
+
+
+def _load_2d_table(flux_file, enpow, return_table, bartol):
+    logging.debug("Loading atmospheric flux table %s", flux_file)
+
+    # Get a spline representation of the flux table, integral-preserving
+    # as in IceCube's NuFlux (based purely on SciPy rather than ROOT).
+    # Stored splines will be 1D in integrated flux over energy, one for every
+    # table cosZenith value.
+    energy, fluxes, t, coeffs, k = load_spline_arrays(
+        flux_file, num_azimuth=1, enpow=enpow, bartol=bartol
     )
-    int_flux_dict['coszen'] = np.linspace(-1, 1, 21)
-    for nutype in PRIMARIES:
-        # spline_dict now wants to be a set of splines for
-        # every table cosZenith value.
-        splines = {}
-        cz_iter = 1
-        for energyfluxlist in flux_dict[nutype]:
-            int_flux = []
-            tot_flux = 0.0
-            int_flux.append(tot_flux)
-            for energyfluxval, energyval in zip(energyfluxlist,
-                                                flux_dict['energy']):
-                # Spline works best if you integrate flux * energy
-                if energyval < 10.0:
-                    tot_flux += energyfluxval*np.power(energyval, enpow)*0.05
-                else:
-                    tot_flux += energyfluxval*np.power(energyval, enpow)*0.1
-                int_flux.append(tot_flux)
-
-            spline = interpolate.splrep(int_flux_dict['logenergy'],
-                                        int_flux, s=0)
-            cz_value = '%.2f'%(1.05-cz_iter*0.1)
-            splines[cz_value] = spline
-            cz_iter += 1
-
-        spline_dict[nutype] = splines
-
-    for prim in PRIMARIES:
-        flux_dict[prim] = flux_dict[prim][::-1]
+    spline_dict = _spline_dict_2d(t, coeffs, k)
 
     if return_table:
+        # The zenith should always be 20 bins, full sky.
+        flux_dict = {'energy': energy, 'coszen': np.linspace(-0.95, 0.95, 20)}
+        for prim in PRIMARIES:
+            flux_dict[prim] = fluxes[prim][::-1, 0]
         return spline_dict, flux_dict
 
     return spline_dict
 
 
+def load_2d_honda_table(flux_file, enpow=1, return_table=False):
+    return _load_2d_table(flux_file, enpow=enpow, return_table=return_table,
+                          bartol=False)
+
+
+def load_2d_bartol_table(flux_file, enpow=1, return_table=False):
+    # Bartol tables have been modified to look like Honda tables
+    return _load_2d_table(flux_file, enpow=enpow, return_table=return_table,
+                          bartol=True)
+
+
 def load_2d_table(flux_file, enpow=1, return_table=False):
     """Manipulate 2 dimensional flux tables.
 
@@ -335,77 +443,22 @@ def load_3d_honda_table(flux_file, enpow=1, return_table=False):
 
     logging.debug("Loading atmospheric flux table %s", flux_file)
 
-    # columns in Honda files are in the same order
-    cols = ['energy'] + PRIMARIES
-
-    # Load the data table
-    table = np.genfromtxt(open_resource(flux_file),
-                          usecols=list(range(len(cols))))
-    mask = np.all(np.isnan(table) | np.equal(table, 0), axis=1)
-    table = table[~mask].T
-
-    flux_dict = dict(zip(cols, table))
-    for key in flux_dict.keys():
-        # There are 20 lines per zenith range
-        coszenith_lists = np.array(np.split(flux_dict[key], 20))
-        azimuth_lists = []
-        for coszenith_list in coszenith_lists:
-            azimuth_lists.append(np.array(np.split(coszenith_list, 12)).T)
-        flux_dict[key] = np.array(azimuth_lists)
-        if not key == 'energy':
-            flux_dict[key] = flux_dict[key].T
-
-    # Set the zenith and energy range as they are in the tables
-    # The energy may change, but the zenith should always be
-    # 20 bins and the azimuth should always be 12 bins, full sky
-    flux_dict['energy'] = flux_dict['energy'][0].T[0]
-    flux_dict['coszen'] = np.linspace(0.95, -0.95, 20)
-    flux_dict['azimuth'] = np.linspace(15, 345, 12)
-
-    # Now get a spline representation of the flux table.
-    logging.debug('Make spline representation of flux')
-    logging.debug('Doing this integral-preserving.')
-
-    spline_dict = {}
-
-    # Do integral-preserving method as in IceCube's NuFlux
-    # This one will be based purely on SciPy rather than ROOT
-    # Stored splines will be 1D in integrated flux over energy
-    int_flux_dict = {}
-    # Energy and CosZenith bins needed for integral-preserving
-    # method must be the edges of those of the normal tables
-    int_flux_dict['logenergy'] = np.linspace(-1.025, 4.025, 102)
-    int_flux_dict['coszen'] = np.linspace(1, -1, 21)
-    for nutype in PRIMARIES:
-        # spline_dict now wants to be a set of splines for
-        # every table cosZenith value.
-        # In 3D mode we have a set of these sets for every
-        # table azimuth value.
-        az_splines = {}
-        for az, f in zip(flux_dict['azimuth'], flux_dict[nutype]):
-            splines = {}
-            cz_iter = 1
-            for energyfluxlist in f.T:
-                int_flux = []
-                tot_flux = 0.0
-                int_flux.append(tot_flux)
-                for energyfluxval, energyval in zip(energyfluxlist,
-                                                    flux_dict['energy']):
-                    # Spline works best if you integrate flux * energy
-                    tot_flux += energyfluxval*np.power(energyval, enpow)*0.05
-                    int_flux.append(tot_flux)
-
-                spline = interpolate.splrep(int_flux_dict['logenergy'],
-                                            int_flux, s=0)
-                cz_value = '%.2f'%(1.05-cz_iter*0.1)
-                splines[cz_value] = spline
-                cz_iter += 1
-
-            az_splines[az] = splines
-
-        spline_dict[nutype] = az_splines
+    # Integral-preserving splines in energy for every table cosZenith value
+    # and every table azimuth value
+    energy, fluxes, t, coeffs, k = load_spline_arrays(
+        flux_file, num_azimuth=12, enpow=enpow
+    )
+    spline_dict = _spline_dict_3d(t, coeffs, k)
 
     if return_table:
+        # The zenith should always be 20 bins and the azimuth should always
+        # be 12 bins, full sky
+        flux_dict = {'energy': energy,
+                     'coszen': np.linspace(0.95, -0.95, 20),
+                     'azimuth': np.linspace(15, 345, 12)}
+        # Shape (azimuth, energy, cosZenith)
+        for prim in PRIMARIES:
+            flux_dict[prim] = np.transpose(fluxes[prim], (1, 2, 0))
         return spline_dict, flux_dict
 
     return spline_dict
@@ -599,6 +652,66 @@ def calculate_3d_flux_weights(true_energies, true_coszens, true_azimuths,
     return flux_weights
 
 
+def test_load_spline_arrays():
+    """Unit tests for load_spline_arrays"""
+    import shutil
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for flux_file, num_azimuth, bartol in [
+                ('flux/honda-2015-spl-solmax-aa.d', 1, False),
+                ('flux/bartol-2004-sno-solmax-aa.d', 1, True),
+                ('flux/honda-2015-spl-solmax.d', 12, False)]:
+            table_fpath = os.path.join(tmpdir, os.path.basename(flux_file))
+            shutil.copy(find_resource(flux_file), table_fpath)
+
+            energy, fluxes, t, coeffs, k = load_spline_arrays(
+                table_fpath, num_azimuth=num_azimuth, enpow=1, bartol=bartol
+            )
+            assert os.path.isfile(table_fpath + SPLINE_CACHE_SUFFIX)
+            edges = BARTOL_LOGENERGY_EDGES if bartol else HONDA_LOGENERGY_EDGES
+            assert len(edges) == len(energy) + 1
+
+            # Compare to integrating and splining every slice on its own
+            for prim in PRIMARIES:
+                assert fluxes[prim].shape == (20, num_azimuth, len(energy))
+                for cz_ind in (0, 7, 19):
+                    for az_ind in range(0, num_azimuth, 5):
+                        int_flux = [0.0]
+                        for fluxval, energyval in zip(
+                                fluxes[prim][cz_ind, az_ind], energy):
+                            width = 0.1 if bartol and energyval >= 10 else 0.05
+                            int_flux.append(int_flux[-1] + fluxval*energyval*width)
+                        ref_t, ref_c, ref_k = interpolate.splrep(
+                            edges, int_flux, s=0
+                        )
+                        assert k == ref_k
+                        assert np.allclose(t, ref_t, rtol=0, atol=1e-12)
+                        assert np.allclose(
+                            coeffs[prim][cz_ind, az_ind], ref_c, rtol=1e-10,
+                            atol=1e-12*np.max(np.abs(ref_c))
+                        )
+
+            # A second load is served from the cache
+            cached = load_spline_arrays(table_fpath, num_azimuth=num_azimuth,
+                                        enpow=1, bartol=bartol)
+            assert np.array_equal(cached[0], energy)
+            assert np.array_equal(cached[2], t)
+            for prim in PRIMARIES:
+                assert np.array_equal(cached[1][prim], fluxes[prim])
+                assert np.array_equal(cached[3][prim], coeffs[prim])
+
+            # ...but not if the splines are requested for another power
+            other = load_spline_arrays(table_fpath, num_azimuth=num_azimuth,
+                                       enpow=2, bartol=bartol)
+            assert not np.allclose(other[3]['numu'], coeffs['numu'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    logging.info('<< PASS : test_load_spline_arrays >>')
+
+
 def main():
     """This is a slightly longer example than that given in the docstring of
     the calculate_flux_weights function. This will make a quick plot of the
@@ -635,4 +748,5 @@ def main():
 
 
 if __name__ == '__main__':
+    test_load_spline_arrays()
     main()
@@ -60,6 +60,9 @@ Hypersurface functional forms
          `p`, `<coefficient 0>`, ..., `<coefficient N>`, `out` where `p` is the
          systematic parameter, `out is the array to write the results to, and there are
          N coefficients of the parameterisation.
+     - Provide `grad` (derivatives w.r.t. the coefficients, used for uncertainty
+       propagation) and `param_grad` (derivative w.r.t. `p`, used for analytic
+       gradients of the fit metric) methods following the same convention.
 
    The format of these arguments depends on the use case, of which there are two:
      - When fitting the function coefficients. This is done bin-wise using multiple
@@ -95,6 +98,10 @@ class linear_hypersurface_func(object):
         result = np.broadcast_to(p, foo.shape)[..., np.newaxis]
         np.copyto(src=result, dst=out)
 
+    def param_grad(self, p, m, out):
+        result = m * np.ones_like(p)
+        np.copyto(src=result, dst=out)
+
 
 class quadratic_hypersurface_func(object):
     '''
@@ -122,6 +129,10 @@ class quadratic_hypersurface_func(object):
                           )
         np.copyto(src=result, dst=out)
 
+    def param_grad(self, p, m1, m2, out):
+        result = m1 + 2.*m2*p
+        np.copyto(src=result, dst=out)
+
 class exponential_hypersurface_func(object):
     '''
     Exponential hypersurface functional form
@@ -144,6 +155,10 @@ class exponential_hypersurface_func(object):
         result = np.array([p*np.exp(b*p)])[..., np.newaxis]
         np.copyto(src=result, dst=out)
 
+    def param_grad(self, p, b, out):
+        result = b*np.exp(b*p)
+        np.copyto(src=result, dst=out)
+
 class scaled_exponential_hypersurface_func(object):
     '''
     Exponential hypersurface functional form
@@ -168,6 +183,10 @@ class scaled_exponential_hypersurface_func(object):
         result = np.stack([np.exp(b*p) - 1., (a + 1.)*p*np.exp(b*p)], axis=-1)
         np.copyto(src=result, dst=out)
 
+    def param_grad(self, p, a, b, out):
+        result = (a + 1.)*b*np.exp(b*p)
+        np.copyto(src=result, dst=out)
+
 class logarithmic_hypersurface_func(object):
     '''
     Logarithmic hypersurface functional form
@@ -192,6 +211,10 @@ class logarithmic_hypersurface_func(object):
         result = np.array(p/(1 + m*p))[..., np.newaxis]
         np.copyto(src=result, dst=out)
 
+    def param_grad(self, p, m, out):
+        result = m/(1 + m*p)
+        np.copyto(src=result, dst=out)
+
 
 # Container holding all possible functions
 HYPERSURFACE_PARAM_FUNCTIONS = collections.OrderedDict()
@@ -757,6 +780,49 @@ class Hypersurface(object):
         else:
             return output_factors
 
+    def evaluate_log_gradients(self, param_values, param_names=None):
+        '''
+        Evaluate the derivatives of the logarithm of the hypersurface w.r.t. the
+        systematic parameters, for all bins simultaneously.
+
+        Since the hypersurface scales the bin contents multiplicatively, these are
+        the relative changes of the bin contents per unit change of each parameter.
+
+        Parameters
+        ----------
+        param_values : dict
+            Same format as for `evaluate`, scalar values only.
+
+        param_names : sequence of str or None
+            Parameters for which to compute the derivatives (default: all)
+
+        Returns
+        -------
+        log_gradients : OrderedDict
+            { sys_param_name : array of d(log(hypersurface))/d(sys_param) per bin }
+        '''
+        assert self._initialized, "Cannot evaluate hypersurface, it haas not been initialized"
+
+        if param_names is None:
+            param_names = list(self.params.keys())
+
+        if not self.log:
+            output_factors = self.evaluate(param_values)
+
+        log_gradients = collections.OrderedDict()
+        for k in param_names:
+            p = self.params[k]
+            param_val = param_values[k] if self.using_legacy_data else param_values[k] - p.nominal_value
+            grad = np.full(self.binning.shape, np.NaN, dtype=FTYPE)
+            p.param_gradient(param_val, out=grad)
+            # In log-mode, the exponent is exactly the log of the output
+            if not self.log:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    grad = grad / output_factors
+            log_gradients[k] = grad
+
+        return log_gradients
+
     def fit(self, nominal_map, nominal_param_values, sys_maps, sys_param_values,
             norm=True, method="L-BFGS-B", fix_intercept=False, intercept_bounds=None,
             intercept_sigma=None, include_empty=False):
@@ -1628,6 +1694,23 @@ class HypersurfaceParam(object):
         # Copy to wherever the gradient is to be stored
         np.copyto(src=this_out, dst=out)
 
+    def param_gradient(self, param, out, bin_idx=None):
+        '''
+        Evaluate the derivative of the functional form w.r.t. the systematic parameter
+        for the given `param` values. Uses the current values of the fit coefficients.
+
+        By default evaluates all bins, but optionally can specify a particular bin.
+        '''
+        this_out = np.full_like(out, np.NaN, dtype=FTYPE)
+
+        args = [param]
+        for cft_idx in range(self.num_fit_coeffts):
+            args += [self.get_fit_coefft(bin_idx=bin_idx, coefft_idx=cft_idx)]
+        args += [this_out]
+
+        self._hypersurface_func.param_grad(*args)
+        np.copyto(src=this_out, dst=out)
+
     def get_fit_coefft_idx(self, bin_idx=None, coefft_idx=None):
         '''
         Indexing the fit_coefft matrix is a bit of a pain
@@ -6,9 +6,11 @@ objects to JSON files.
 
 from __future__ import absolute_import, division
 
+import base64
 import bz2
 from collections import OrderedDict
 from collections.abc import Iterable, Mapping, Sequence
+import gzip
 from numbers import Integral, Number, Real
 import os
 import tempfile
@@ -16,6 +18,14 @@ import tempfile
 import numpy as np
 import simplejson as json
 from six import string_types
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
 
 from pisa import ureg
 from pisa.utils.log import logging, set_verbosity
@@ -24,6 +34,8 @@ __all__ = [
     'JSON_EXTS',
     'ZIP_EXTS',
     'XOR_EXTS',
+    'DEFAULT_COMPRESSION_LEVELS',
+    'FAST_ZIP_EXT',
     'json_string',
     'dumps',
     'loads',
@@ -31,7 +43,9 @@ __all__ = [
     'to_json',
     'NumpyEncoder',
     'NumpyDecoder',
+    'BinaryNumpyEncoder',
     'test_to_json_from_json',
+    'test_binary_arrays',
 ]
 
 __author__ = 'S. Boeser, J.L. Lanfranchi'
@@ -52,19 +66,79 @@ __license__ = '''Copyright (c) 2014-2019, The IceCube Collaboration
 
 
 JSON_EXTS = ['json']
-ZIP_EXTS = ['bz2']
+ZIP_EXTS = ['bz2', 'gz', 'zst', 'lz4']
 XOR_EXTS = ['xor']
 
+DEFAULT_COMPRESSION_LEVELS = {'bz2': 9, 'gz': 1, 'zst': 3, 'lz4': 0}
+"""Compression level used for each of the `ZIP_EXTS` unless specified"""
+
+if zstandard is not None:
+    FAST_ZIP_EXT = 'zst'
+elif lz4_frame is not None:
+    FAST_ZIP_EXT = 'lz4'
+else:
+    FAST_ZIP_EXT = 'gz'
+"""Extension of the fastest compression available (zstd via the `zstandard`
+module, lz4 via the `lz4` module, or else gzip)"""
+
+NDARRAY_KEY = '__ndarray__'
+"""Key identifying a (base64-encoded) binary array; see `BinaryNumpyEncoder`"""
+
+
+def compress(data, ext, level=None):
+    """Compress bytes `data` with the method indicated by extension `ext`
+    (one of `ZIP_EXTS`) at `level` (defaults to
+    `DEFAULT_COMPRESSION_LEVELS[ext]`)"""
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS[ext]
+    if ext == 'bz2':
+        return bz2.compress(data, level)
+    if ext == 'gz':
+        return gzip.compress(data, compresslevel=level)
+    if ext == 'zst':
+        if zstandard is None:
+            raise ImportError('Module `zstandard` is required for zstd'
+                              ' compression')
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if ext == 'lz4':
+        if lz4_frame is None:
+            raise ImportError('Module `lz4` is required for lz4 compression')
+        return lz4_frame.compress(data, compression_level=level)
+    raise ValueError('Unknown compression "%s"' % ext)
+
+
+def decompress(data, ext):
+    """Decompress bytes `data` compressed with the method indicated by
+    extension `ext` (one of `ZIP_EXTS`)"""
+    if ext == 'bz2':
+        return bz2.decompress(data)
+    if ext == 'gz':
+        return gzip.decompress(data)
+    if ext == 'zst':
+        if zstandard is None:
+            raise ImportError('Module `zstandard` is required for zstd'
+                              ' decompression')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if ext == 'lz4':
+        if lz4_frame is None:
+            raise ImportError('Module `lz4` is required for lz4'
+                              ' decompression')
+        return lz4_frame.decompress(data)
+    raise ValueError('Unknown compression "%s"' % ext)
+
 
 def json_string(string):
     """Decode a json string"""
     return json.loads(string)
 
 
-def dumps(content, indent=2):
-    """Dump object to JSON-encoded string"""
-    return json.dumps(content, cls=NumpyEncoder, indent=indent,
-                      sort_keys=False)
+def dumps(content, indent=2, binary_arrays=False):
+    """Dump object to JSON-encoded string; see `to_json` for
+    `binary_arrays`"""
+    return json.dumps(
+        content, indent=indent, sort_keys=False,
+        cls=BinaryNumpyEncoder if binary_arrays else NumpyEncoder
+    )
 
 
 def loads(s):
@@ -73,8 +147,8 @@ def loads(s):
 
 
 def from_json(filename, cls=None):
-    """Open a file in JSON format (optionally compressed with bz2 or
-    xor-scrambled) and parse the content into Python objects.
+    """Open a file in JSON format (optionally compressed or xor-scrambled)
+    and parse the content into Python objects.
 
     Parameters
     ----------
@@ -116,7 +190,11 @@ def from_json(filename, cls=None):
         myfile.json.xor
 
     represent a bsic JSON file, a bzip-compressed JSON, and an xor-scrambled
-    JSON, respectively.
+    JSON, respectively. Files compressed with gzip, zstd or lz4 end in
+    ".json.gz", ".json.zst" or ".json.lz4".
+
+    Arrays stored in binary form (see `to_json`) are recognized
+    automatically.
 
     """
     # Import here to avoid circular imports
@@ -143,14 +221,14 @@ def from_json(filename, cls=None):
     ext = ext.replace('.', '').lower()
     assert ext in JSON_EXTS or ext in ZIP_EXTS + XOR_EXTS
     try:
-        if ext == 'bz2':
+        if ext in ZIP_EXTS:
             fobj = open_resource(filename, 'rb')
             try:
-                bz2_content = fobj.read()
+                compressed = fobj.read()
             finally:
                 fobj.close()
-            decompressed = bz2.decompress(bz2_content).decode()
-            del bz2_content
+            decompressed = decompress(compressed, ext).decode()
+            del compressed
             content = json.loads(
                 decompressed,
                 cls=NumpyDecoder,
@@ -195,13 +273,17 @@ def from_json(filename, cls=None):
 
 
 def to_json(content, filename, indent=2, overwrite=True, warn=True,
-            sort_keys=False):
+            sort_keys=False, binary_arrays=False, compression_level=None):
     """Write `content` to a JSON file at `filename`.
 
-    Uses a custom parser that automatically converts numpy arrays to lists.
+    Uses a custom parser that automatically converts numpy arrays to lists
+    (or binary blocks, see `binary_arrays`).
 
     If `filename` has a ".bz2" extension, the contents will be compressed
-    (using bz2 and highest-level of compression, i.e., -9).
+    (using bz2 and highest-level of compression, i.e., -9). Extensions ".gz",
+    ".zst" and ".lz4" select gzip (level 1), zstd and lz4 compression (the
+    latter two require the `zstandard` and `lz4` modules, respectively); see
+    `FAST_ZIP_EXT` for the fastest one available.
 
     If `filename` has a ".xor" extension, the contents will be xor-scrambled to
     make them human-unreadable (this is useful for, e.g., blind fits).
@@ -232,6 +314,14 @@ def to_json(content, filename, indent=2, overwrite=True, warn=True,
         Output of dictionaries will be sorted by key if set to `True`.
         Default is `False`. Cf. json.dump() or json.dumps().
 
+    binary_arrays : bool
+        Store numerical numpy arrays as base64-encoded binary blocks (see
+        `BinaryNumpyEncoder`) instead of lists of numbers. This is much faster
+        to write and read and preserves the dtype, but is not human-readable.
+
+    compression_level : int or None
+        Compression level; default is `DEFAULT_COMPRESSION_LEVELS[ext]`
+
     """
     # Import here to avoid circular imports
     from pisa.utils.fileio import check_file_exists
@@ -239,7 +329,9 @@ def to_json(content, filename, indent=2, overwrite=True, warn=True,
 
     if hasattr(content, 'to_json'):
         return content.to_json(filename, indent=indent, overwrite=overwrite,
-                               warn=warn, sort_keys=sort_keys)
+                               warn=warn, sort_keys=sort_keys,
+                               binary_arrays=binary_arrays,
+                               compression_level=compression_level)
 
     check_file_exists(fname=filename, overwrite=overwrite, warn=warn)
 
@@ -247,19 +339,23 @@ def to_json(content, filename, indent=2, overwrite=True, warn=True,
     ext = ext.replace('.', '').lower()
     assert ext == 'json' or ext in ZIP_EXTS + XOR_EXTS
 
+    encoder = BinaryNumpyEncoder if binary_arrays else NumpyEncoder
+
     with open(filename, 'wb') as outfile:
-        if ext == 'bz2':
+        if ext in ZIP_EXTS:
             outfile.write(
-                bz2.compress(
+                compress(
                     json.dumps(
-                        content, outfile, indent=indent, cls=NumpyEncoder,
+                        content, indent=indent, cls=encoder,
                         sort_keys=sort_keys, allow_nan=True, ignore_nan=False
-                    ).encode()
+                    ).encode(),
+                    ext=ext,
+                    level=compression_level
                 )
             )
         elif ext == 'xor':
             json_bytes = json.dumps(
-                content, indent=indent, cls=NumpyEncoder,
+                content, indent=indent, cls=encoder,
                 sort_keys=sort_keys, allow_nan=True, ignore_nan=False
                 ).encode()
 
@@ -272,7 +368,7 @@ def to_json(content, filename, indent=2, overwrite=True, warn=True,
         else:
             outfile.write(
                 json.dumps(
-                    content, indent=indent, cls=NumpyEncoder,
+                    content, indent=indent, cls=encoder,
                     sort_keys=sort_keys, allow_nan=True, ignore_nan=False
                 ).encode()
             )
@@ -333,9 +429,46 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+class BinaryNumpyEncoder(NumpyEncoder):
+    """
+    Subclass of ::class::`NumpyEncoder` that writes numerical (bool, integer,
+    and floating point) numpy arrays as objects .. ::
+
+        {"__ndarray__": "<base64-encoded bytes>", "dtype": "<f8", "shape": [2, 3]}
+
+    which `NumpyDecoder` turns back into arrays of the same dtype and shape.
+    """
+    def default(self, obj):  # pylint: disable=method-hidden
+        """Encode numerical arrays as binary blocks, everything else as
+        `NumpyEncoder` does."""
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+            return OrderedDict([
+                (NDARRAY_KEY,
+                 base64.b64encode(np.ascontiguousarray(obj).data).decode()),
+                ('dtype', obj.dtype.str),
+                ('shape', list(obj.shape)),
+            ])
+        return super().default(obj)
+
+
+def _decode_ndarray(pairs):
+    """Array encoded by `BinaryNumpyEncoder` from the (key, value) pairs of a
+    JSON object, or None if the object is not such an array"""
+    if len(pairs) != 3 or pairs[0][0] != NDARRAY_KEY:
+        return None
+    state = dict(pairs)
+    if set(state) != {NDARRAY_KEY, 'dtype', 'shape'}:
+        return None
+    shape = [int(dim) for dim in state['shape']]
+    # bytearray makes the array writeable
+    data = bytearray(base64.b64decode(state[NDARRAY_KEY]))
+    return np.frombuffer(data, dtype=np.dtype(state['dtype'])).reshape(shape)
+
+
 class NumpyDecoder(json.JSONDecoder):
-    """Decode JSON array(s) as numpy.ndarray; also returns python strings
-    instead of unicode."""
+    """Decode JSON array(s) as numpy.ndarray (including binary arrays written
+    by `BinaryNumpyEncoder`); also returns python strings instead of
+    unicode."""
     def __init__(
         self,
         encoding=None,
@@ -346,6 +479,16 @@ class NumpyDecoder(json.JSONDecoder):
         strict=True,
         object_pairs_hook=None,
     ):
+        def pairs_hook(pairs):
+            ndarray = _decode_ndarray(pairs)
+            if ndarray is not None:
+                return ndarray
+            if object_pairs_hook is not None:
+                return object_pairs_hook(pairs)
+            if object_hook is not None:
+                return object_hook(dict(pairs))
+            return dict(pairs)
+
         super().__init__(
             encoding=encoding,
             object_hook=object_hook,
@@ -353,7 +496,7 @@ class NumpyDecoder(json.JSONDecoder):
             parse_int=parse_int,
             parse_constant=parse_constant,
             strict=strict,
-            object_pairs_hook=object_pairs_hook,
+            object_pairs_hook=pairs_hook,
         )
         # Only need to override the default array handler
         self.parse_array = self.json_array_numpy
@@ -538,6 +681,87 @@ def test_to_json_from_json():
     logging.info('<< PASS : test_to_json_from_json >>')
 
 
+def test_binary_arrays():
+    """Unit tests for writing arrays in binary form (`binary_arrays=True`) with
+    the different compression methods"""
+    from shutil import rmtree
+    from pisa.core.binning import OneDimBinning
+    from pisa.core.map import Map, MapSet
+    from pisa.utils.comparisons import recursiveEquality
+
+    rand = np.random.RandomState(0)
+    orig = OrderedDict([
+        ('float64', rand.normal(size=(3, 4, 5))),
+        ('float32', rand.normal(size=7).astype(np.float32)),
+        ('special', np.array([-np.inf, np.nan, np.inf, -0.0, 1e-300])),
+        ('int64', rand.randint(-100, 100, size=(2, 3)).astype(np.int64)),
+        ('uint8', np.arange(10, dtype=np.uint8)),
+        ('bool', rand.uniform(size=6) > 0.5),
+        ('empty', np.zeros((0, 3))),
+        ('fortran', np.asfortranarray(rand.normal(size=(4, 3)))),
+        ('strings', np.array(['a', 'bc'])),
+        ('quantity', rand.uniform(size=4) * ureg.GeV),
+        ('nested', [np.arange(3.), {'x': np.arange(4)}]),
+        ('lookalike', OrderedDict([(NDARRAY_KEY, 1), ('dtype', 2)])),
+    ])
+
+    def check(loaded):
+        for key in ['float64', 'float32', 'int64', 'uint8', 'bool', 'empty',
+                    'fortran']:
+            assert isinstance(loaded[key], np.ndarray)
+            assert loaded[key].dtype == orig[key].dtype, key
+            assert loaded[key].shape == orig[key].shape, key
+            assert np.array_equal(loaded[key], orig[key]), key
+        assert np.array_equal(loaded['special'], orig['special'],
+                              equal_nan=True)
+        assert np.signbit(loaded['special'][3])
+        assert list(loaded['strings']) == ['a', 'bc']
+        assert np.all(loaded['quantity'] == orig['quantity'])
+        assert np.array_equal(loaded['nested'][0], orig['nested'][0])
+        assert np.array_equal(loaded['nested'][1]['x'], np.arange(4))
+        assert loaded['lookalike'] == orig['lookalike']
+        loaded['float64'][0, 0, 0] = 0
+
+    check(loads(dumps(orig, binary_arrays=True)))
+    check(loads(dumps(orig, indent=None, binary_arrays=True)))
+
+    binning = OneDimBinning(name='energy', num_bins=100, is_log=True,
+                            domain=[1, 80]*ureg.GeV)
+    binning = binning * OneDimBinning(name='coszen', num_bins=100, is_lin=True,
+                                      domain=[-1, 1])
+    maps = MapSet([
+        Map(name='a', hist=rand.uniform(size=binning.shape), binning=binning),
+        Map(name='b', hist=rand.uniform(size=binning.shape), binning=binning),
+    ])
+
+    exts = ['', '.bz2', '.gz', '.xor']
+    if FAST_ZIP_EXT not in exts:
+        exts.append('.' + FAST_ZIP_EXT)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for ext in exts:
+            fname = os.path.join(temp_dir, 'arrays.json' + ext)
+            to_json(orig, fname, binary_arrays=True, warn=False)
+            check(from_json(fname))
+
+            fname = os.path.join(temp_dir, 'maps.json' + ext)
+            maps.to_json(fname, binary_arrays=True, warn=False)
+            loaded = MapSet.from_json(fname)
+            assert loaded == maps
+            assert recursiveEquality(loaded.serializable_state,
+                                     maps.serializable_state)
+
+            # Same contents as when written without binary arrays
+            fname = os.path.join(temp_dir, 'lists.json' + ext)
+            to_json(maps, fname, compression_level=1, warn=False)
+            assert MapSet.from_json(fname) == loaded
+    finally:
+        rmtree(temp_dir)
+
+    logging.info('<< PASS : test_binary_arrays >>')
+
+
 if __name__ == '__main__':
     set_verbosity(1)
     test_to_json_from_json()
+    test_binary_arrays()
@@ -7,13 +7,17 @@ from __future__ import absolute_import, division
 
 from kde.cudakde import gaussian_kde
 import numpy as np
+from scipy import signal
 from uncertainties import unumpy as unp
 import copy
+import itertools
 
 from pisa.core.binning import OneDimBinning, MultiDimBinning
 
 
-__all__ = ['get_hist', 'kde_histogramdd', 'test_kde_histogramdd']
+__all__ = ['KDE_CUTOFF', 'GRID_POINTS_PER_BW', 'MAX_GRID_CELLS', 'get_hist',
+           'kde_histogramdd', 'kde_bandwidth_factor', 'BinnedKDE',
+           'test_kde_histogramdd', 'test_BinnedKDE']
 
 __author__ = 'P. Eller'
 
@@ -304,6 +308,264 @@ def kde_histogramdd(sample, binning, weights=None, bw_method='scott',
     return hist
 
 
+KDE_CUTOFF = 4.
+"""Gaussian kernels are truncated at this many bandwidths in binned KDEs"""
+
+GRID_POINTS_PER_BW = 4
+"""Default number of grid cells per bandwidth for binned KDEs"""
+
+MAX_GRID_CELLS = 2**12
+"""Maximum number of grid cells per dimension for binned KDEs"""
+
+
+def kde_bandwidth_factor(n_events, n_dims, bw_method):
+    """Bandwidth relative to the standard deviation of the sample, as in
+    `scipy.stats.gaussian_kde`
+
+    Parameters
+    ----------
+    n_events : int
+    n_dims : int
+    bw_method : string or float
+        'scott', 'silverman', or a scalar factor
+
+    Returns
+    -------
+    factor : float
+
+    """
+    if bw_method == 'scott':
+        return n_events**(-1./(n_dims + 4))
+    if bw_method == 'silverman':
+        return (n_events*(n_dims + 2)/4.)**(-1./(n_dims + 4))
+    if np.isscalar(bw_method) and not isinstance(bw_method, str):
+        return float(bw_method)
+    raise ValueError('Unknown `bw_method` "%s"' % bw_method)
+
+
+class _BinnedKDESlice(object):
+    """Fixed-bandwidth KDE of one set of events on a regular grid, see
+    `BinnedKDE`"""
+    def __init__(self, sample, bin_edges, reflect, bw_method,
+                 grid_points_per_bw):
+        n_events, n_dims = sample.shape
+        self.n_dims = n_dims
+        self.shape = tuple(len(edges) - 1 for edges in bin_edges)
+        self.empty = n_events == 0
+        if self.empty:
+            return
+
+        factor = kde_bandwidth_factor(max(n_events, 2), n_dims, bw_method)
+        std = np.std(sample, axis=0) if n_events > 1 else np.zeros(n_dims)
+
+        self.bandwidths = []
+        self.overlaps = []
+        self.folds = []
+        kernels_1d = []
+        cell_inds = []
+        cell_fracs = []
+        grid_shape = []
+        valid = np.ones(n_events, dtype=bool)
+        for dim_num, edges in enumerate(bin_edges):
+            edges = np.asarray(edges, dtype=np.float64)
+            width = edges[-1] - edges[0]
+            bandwidth = factor*std[dim_num]
+            if not bandwidth > 0:
+                bandwidth = np.min(np.diff(edges))
+            self.bandwidths.append(bandwidth)
+
+            # Cell size such that the outer bin edges are cell boundaries
+            dx = max(bandwidth/grid_points_per_bw,
+                     (width + 2*KDE_CUTOFF*bandwidth)/MAX_GRID_CELLS)
+            n_inner = int(np.ceil(width/dx))
+            dx = width/n_inner
+            n_pad = int(np.ceil(KDE_CUTOFF*bandwidth/dx))
+            n_cells = n_inner + 2*n_pad
+            lower = edges[0] - n_pad*dx
+            grid_shape.append(n_cells)
+
+            # Linear binning: split each event between the two nearest cell
+            # centers
+            pos = (sample[:, dim_num] - lower)/dx - 0.5
+            left = np.floor(pos).astype(np.int64)
+            valid &= (left >= 0) & (left < n_cells - 1)
+            cell_inds.append(left)
+            cell_fracs.append(pos - left)
+
+            offsets = np.arange(-n_pad, n_pad + 1)*dx
+            kernel = np.exp(-0.5*(offsets/bandwidth)**2)
+            kernels_1d.append(kernel / np.sum(kernel))
+
+            # Fraction of each cell falling into each bin
+            cell_edges = lower + np.arange(n_cells + 1)*dx
+            overlap = (
+                np.minimum(cell_edges[np.newaxis, 1:], edges[1:, np.newaxis])
+                - np.maximum(cell_edges[np.newaxis, :-1], edges[:-1, np.newaxis])
+            )
+            self.overlaps.append(np.clip(overlap/dx, 0, 1))
+
+            reflect_lower, reflect_upper = reflect[dim_num]
+            self.folds.append((n_pad if reflect_lower else 0,
+                               n_pad if reflect_upper else 0))
+
+        self.grid_shape = tuple(grid_shape)
+        strides = np.cumprod((1,) + self.grid_shape[:0:-1])[::-1]
+        inds = [ind[valid] for ind in cell_inds]
+        fracs = [frac[valid] for frac in cell_fracs]
+        self.valid = valid
+
+        # Flat grid indices and fractions for each of the 2**n_dims corners
+        self.corner_inds = []
+        self.corner_fracs = []
+        for corner in itertools.product((0, 1), repeat=n_dims):
+            flat_ind = np.zeros(len(inds[0]), dtype=np.int64)
+            frac = np.ones(len(inds[0]), dtype=np.float64)
+            for dim_num, upper in enumerate(corner):
+                flat_ind += (inds[dim_num] + upper)*strides[dim_num]
+                frac *= fracs[dim_num] if upper else 1 - fracs[dim_num]
+            self.corner_inds.append(flat_ind)
+            self.corner_fracs.append(frac)
+        self.corner_inds = np.concatenate(self.corner_inds)
+        self.corner_fracs = np.concatenate(self.corner_fracs)
+
+        kernel = kernels_1d[0]
+        for kernel_1d in kernels_1d[1:]:
+            kernel = np.multiply.outer(kernel, kernel_1d)
+        self.kernel = kernel
+
+    def __call__(self, weights):
+        if self.empty:
+            return np.zeros(self.shape)
+
+        if weights is None:
+            corner_weights = self.corner_fracs
+        else:
+            weights = np.asarray(weights, dtype=np.float64)[self.valid]
+            corner_weights = self.corner_fracs * np.tile(weights, 2**self.n_dims)
+        grid = np.bincount(self.corner_inds, weights=corner_weights,
+                           minlength=int(np.prod(self.grid_shape)))
+        grid = grid.reshape(self.grid_shape)
+
+        grid = signal.fftconvolve(grid, self.kernel, mode='same')
+        # Remove round-off from the FFT in empty regions
+        np.maximum(grid, 0, out=grid)
+
+        # Reflect what is beyond reflecting edges back in, then integrate
+        # over the bins
+        for dim_num, (n_lower, n_upper) in enumerate(self.folds):
+            grid = np.moveaxis(grid, dim_num, 0)
+            n_cells = grid.shape[0]
+            if n_lower:
+                n_fold = min(n_lower, n_cells - n_lower)
+                grid[n_lower:n_lower + n_fold] += \
+                        grid[n_lower - n_fold:n_lower][::-1]
+            if n_upper:
+                n_fold = min(n_upper, n_cells - n_upper)
+                grid[n_cells - n_upper - n_fold:n_cells - n_upper] += \
+                        grid[n_cells - n_upper:n_cells - n_upper + n_fold][::-1]
+            grid = np.moveaxis(grid, 0, dim_num)
+
+        hist = grid
+        for dim_num, overlap in enumerate(self.overlaps):
+            hist = np.moveaxis(
+                np.tensordot(overlap, hist, axes=([1], [dim_num])), 0, dim_num
+            )
+        return hist
+
+
+class BinnedKDE(object):
+    """Weighted Gaussian KDE histograms via binned approximation.
+
+    Event weights are deposited on a regular grid (finer than the bandwidth)
+    by linear binning, convolved with the Gaussian kernel via FFT, reflected
+    at coszen edges of -1 and +1, and integrated over the bins. Everything
+    that depends only on the sample (bandwidths, grid positions of the events,
+    kernels) is computed once on instantiation, so histogramming with new
+    weights only costs a `numpy.bincount`, a convolution of the grid, and a
+    few small matrix products.
+
+    Unlike `kde_histogramdd`, bandwidths are fixed (not adaptive), the kernel
+    covariance is diagonal, and bandwidths are derived from the (unweighted)
+    sample, so that they do not change with the weights.
+
+    Parameters
+    ----------
+    sample : array
+        Shape (N_evts, vars), with vars in the order of the binning dimensions
+
+    binning : MultiDimBinning
+
+    bw_method : string or float
+        'scott', 'silverman', or a scalar factor; see `kde_bandwidth_factor`
+
+    coszen_name : string
+        Name of the dimension to reflect at edges of -1 and/or +1
+
+    stack_pid : bool
+        Treat each pid bin separately, not as another dimension of the KDEs.
+        The pid dimension must be named `pid`.
+
+    grid_points_per_bw : int
+        Grid cells per bandwidth (in each dimension)
+
+    Examples
+    --------
+    >>> kde = BinnedKDE(sample, binning, bw_method='silverman',
+    ...                 coszen_name='reco_coszen')
+    >>> hist = kde(weights)
+
+    """
+    def __init__(self, sample, binning, bw_method='scott',
+                 coszen_name='coszen', stack_pid=True,
+                 grid_points_per_bw=GRID_POINTS_PER_BW):
+        sample = np.asarray(sample, dtype=np.float64)
+        assert sample.ndim == 2 and sample.shape[1] == len(binning)
+        self.shape = binning.shape
+
+        bin_edges = [b.bin_edges.m for b in binning]
+        reflect = [(b.name == coszen_name and b.bin_edges.m[0] == -1,
+                    b.name == coszen_name and b.bin_edges.m[-1] == 1)
+                   for b in binning]
+
+        self.pid_dim = None
+        if stack_pid:
+            self.pid_dim = binning.names.index('pid')
+            kde_dims = [d for d in range(len(binning)) if d != self.pid_dim]
+            pid_edges = bin_edges[self.pid_dim]
+            pid = sample[:, self.pid_dim]
+            self.masks = [(pid >= pid_edges[i]) & (pid < pid_edges[i + 1])
+                          for i in range(len(pid_edges) - 1)]
+        else:
+            kde_dims = list(range(len(binning)))
+            self.masks = [slice(None)]
+
+        self.slices = [
+            _BinnedKDESlice(
+                sample=sample[mask][:, kde_dims],
+                bin_edges=[bin_edges[d] for d in kde_dims],
+                reflect=[reflect[d] for d in kde_dims],
+                bw_method=bw_method,
+                grid_points_per_bw=grid_points_per_bw
+            )
+            for mask in self.masks
+        ]
+
+    def __call__(self, weights=None):
+        """Histogram the events with `weights` (None for unit weights).
+
+        Returns
+        -------
+        hist : numpy.ndarray of the shape of `binning`
+
+        """
+        hists = []
+        for mask, kde_slice in zip(self.masks, self.slices):
+            hists.append(kde_slice(None if weights is None else weights[mask]))
+        if self.pid_dim is None:
+            return hists[0]
+        return np.stack(hists, axis=self.pid_dim)
+
+
 # TODO: make the plotting optional but add comparisons against some known
 # results. This can be accomplished by seeding before calling random to obtain
 # a reference result, and check that the same values are returned when run
@@ -380,5 +642,64 @@ def test_kde_histogramdd():
         )
 
 
+def test_BinnedKDE():
+    """Compare binned KDE histograms with exact integrals of the
+    (fixed-bandwidth, reflected) KDE over the bins"""
+    from scipy.special import ndtr
+    from pisa import ureg
+    from pisa.utils.log import logging
+
+    b1 = OneDimBinning(name='coszen', num_bins=20, is_lin=True,
+                       domain=[-1, 1])
+    b2 = OneDimBinning(name='energy', num_bins=10, is_log=True,
+                       domain=[1, 80]*ureg.GeV)
+    b3 = OneDimBinning(name='pid', num_bins=2, bin_edges=[0, 1, 2])
+    binning = b1 * b2 * b3
+
+    rand = np.random.RandomState(0)
+    n_events = 20000
+    cz = np.clip(rand.normal(0.5, 0.6, n_events), -1, 1)
+    energy = rand.lognormal(2.5, 1, n_events)
+    pid = rand.uniform(0, 2, n_events)
+    sample = np.array([cz, energy, pid]).T
+    weights = rand.uniform(0, 2, n_events)
+
+    kde = BinnedKDE(sample, binning, bw_method='silverman',
+                    coszen_name='coszen', grid_points_per_bw=8)
+
+    for wts in [None, weights, 2*weights]:
+        hist = kde(wts)
+        assert hist.shape == binning.shape
+        assert np.all(hist >= 0)
+
+        # Exact reference: each event contributes the integral of its
+        # Gaussian kernel (and of its reflections at coszen = -1 and +1)
+        ref = np.zeros(binning.shape)
+        for pid_bin, kde_slice in enumerate(kde.slices):
+            mask = kde.masks[pid_bin]
+            w = np.ones(np.count_nonzero(mask)) if wts is None else wts[mask]
+            cz_bw, e_bw = kde_slice.bandwidths
+            cz_edges = b1.bin_edges.m
+            e_edges = b2.bin_edges.m
+            cz_mass = 0
+            for mu in [cz[mask], -2 - cz[mask], 2 - cz[mask]]:
+                cz_mass = cz_mass + np.diff(
+                    ndtr((cz_edges[np.newaxis, :] - mu[:, np.newaxis])/cz_bw),
+                    axis=1
+                )
+            e_mass = np.diff(
+                ndtr((e_edges[np.newaxis, :] - energy[mask][:, np.newaxis])
+                     / e_bw),
+                axis=1
+            )
+            ref[:, :, pid_bin] = np.einsum('i,ij,ik->jk', w, cz_mass, e_mass)
+
+        assert np.allclose(hist, ref, rtol=0.02, atol=1e-3*np.max(ref))
+        assert np.isclose(np.sum(hist), np.sum(ref), rtol=2e-3)
+
+    logging.info('<< PASS : test_BinnedKDE >>')
+
+
 if __name__ == '__main__':
     test_kde_histogramdd()
+    test_BinnedKDE()
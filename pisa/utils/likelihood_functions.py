@@ -13,7 +13,6 @@ from __future__ import print_function
 
 import numpy as np
 from scipy import special
-from scipy import optimize
 
 __author__ = "Ahnaf Tahmid"
 __email__ = "tahmid@ualberta.ca"
@@ -77,63 +76,210 @@ def poissonLLH(data, mc):
     """
     return data*np.log(mc) - mc - special.loggamma(data + 1)
 
-def barlowLLH(data, unweighted_mc, weights):
+def barlow_beeston_solve(data, unweighted_mc, weights, fixed_mc=None,
+                         tol=1e-10, max_iter=100):
+    """
+    Find the Barlow-Beeston nuisance parameters for all bins simultaneously
+    Link to paper: https://doi.org/10.1016/0010-4655(93)90005-W
+    -- Input variables --
+    data = data histogram, shape (n_bins,)
+    unweighted_mc = unweighted MC counts per source, shape (n_sources, n_bins)
+                    or (n_bins,) for a single source
+    weights = average weight per event of each source, same shape as
+              unweighted_mc
+    fixed_mc = optional expectation per bin that carries no MC uncertainty
+               (e.g. sources with vanishing sigma), shape (n_bins,)
+    tol = relative tolerance on the Lagrange multiplier `t`
+    max_iter = maximum number of safeguarded Newton iterations
+
+    -- Output --
+    A = best-fit expected unweighted counts, same shape as unweighted_mc
+    converged = boolean mask of bins for which the solver converged
+
+    -- Notes --
+    Maximising the likelihood w.r.t. the A_j of each source j yields
+    A_j = a_j / (1 + w_j t) with the single per-bin unknown t = 1 - d/f, where
+    f = sum_j w_j A_j (+ fixed_mc). t is the root of the monotonically
+    decreasing function
+        g(t) = sum_j w_j a_j / (1 + w_j t) + fixed_mc - d / (1 - t)
+    on the interval (-1/max_j(w_j), 1), which is solved with Newton steps
+    safeguarded by bisection in all bins at once. Bins without data have the
+    closed-form solution t = 1. If a source without MC events in a bin has a
+    larger weight than all populated sources, the root may be clamped at
+    t = -1/w_k and that source absorbs the excess (special case in the paper).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    a = np.asarray(unweighted_mc, dtype=np.float64)
+    w = np.asarray(weights, dtype=np.float64)
+    single_source = a.ndim == data.ndim
+    a, w = np.broadcast_arrays(np.atleast_2d(a), np.atleast_2d(w))
+    if a.shape[1:] != data.shape:
+        raise ValueError(
+            'Shape mismatch: data.shape = %s, unweighted_mc.shape = %s'
+            % (data.shape, a.shape)
+        )
+    if fixed_mc is None:
+        fixed_mc = np.zeros_like(data)
+    else:
+        fixed_mc = np.broadcast_to(np.asarray(fixed_mc, dtype=np.float64),
+                                   data.shape)
+
+    active = (a > 0) & (w > 0)
+    aw = np.where(active, a*w, 0.)
+
+    # Lower boundary of the domain of t from the populated sources, and the
+    # clamping point from the largest weight among the empty sources
+    w_max_active = np.max(np.where(active, w, 0.), axis=0)
+    w_max_empty = np.max(np.where(~active & (w > 0), w, 0.), axis=0)
+    with np.errstate(divide='ignore'):
+        lo = np.where(w_max_active > 0, -1./w_max_active, -np.inf)
+        t_clamp = np.where(w_max_empty > w_max_active, -1./w_max_empty, -np.inf)
+    hi = np.ones_like(data)
+
+    t = np.ones_like(data)
+    converged = data == 0
+
+    # Bins without any free or fixed expectation cannot be solved for; the
+    # data forces t -> -inf in that case (i.e. A = 0)
+    no_mc = (w_max_active == 0) & (fixed_mc <= 0)
+    t[no_mc & ~converged] = -np.inf
+    converged |= no_mc
+
+    # Bins with only a fixed expectation have a closed-form solution
+    only_fixed = ~converged & (w_max_active == 0)
+    t[only_fixed] = 1. - data[only_fixed]/fixed_mc[only_fixed]
+    converged |= only_fixed
+
+    todo = ~converged
+    if np.any(todo):
+        # Seed with the exact solution for a single source (or equal weights)
+        sum_aw = np.sum(aw, axis=0)[todo]
+        sum_a = np.sum(np.where(active, a, 0.), axis=0)[todo]
+        d = data[todo]
+        t0 = (sum_aw - d) / (sum_aw/sum_a * (sum_a + d))
+        lo_t, hi_t = lo[todo], hi[todo]
+        t0 = np.where((t0 > lo_t) & (t0 < hi_t), t0, 0.5*(np.maximum(lo_t, -1.) + hi_t))
+        t[todo] = t0
+
+    for _ in range(max_iter):
+        if not np.any(todo):
+            break
+        idx = np.flatnonzero(todo)
+        t_i, d, c = t[idx], data[idx], fixed_mc[idx]
+        denom = 1. + w[:, idx]*t_i
+        terms = aw[:, idx] / denom
+        g = np.sum(terms, axis=0) + c - d/(1. - t_i)
+        dg = -np.sum(terms * w[:, idx] / denom, axis=0) - d/(1. - t_i)**2
+
+        # Shrink the bracket around the root (g is decreasing in t)
+        pos = g > 0
+        lo[idx] = np.where(pos, t_i, lo[idx])
+        hi[idx] = np.where(pos, hi[idx], t_i)
+
+        t_new = t_i - g/dg
+        outside = ~((t_new > lo[idx]) & (t_new < hi[idx]))
+        t_new[outside] = 0.5*(lo[idx] + hi[idx])[outside]
+
+        done = np.abs(t_new - t_i) <= tol*(1. + np.abs(t_i))
+        t[idx] = t_new
+        converged[idx[done]] = True
+        todo[idx[done]] = False
+
+    # Special case: an empty source with the largest weight takes up the
+    # expectation not covered by the populated sources
+    clamp = t < t_clamp
+    t = np.where(clamp, t_clamp, t)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A = np.where(active, a / (1. + w*t), np.where(a > 0, a, 0.))
+        if np.any(clamp):
+            f = data / (1. - t)
+            excess = np.maximum(f - np.sum(w*A, axis=0) - fixed_mc, 0.)
+            k = np.argmax(np.where(active, 0., w), axis=0)
+            cols = np.flatnonzero(clamp)
+            A[k[cols], cols] = excess[cols] / w[k[cols], cols]
+
+    if single_source:
+        A = A[0]
+    return A, converged
+
+
+def barlowLLH(data, unweighted_mc, weights, fixed_mc=None):
     """
     Barlow-Beeston log-likelihood (constant terms not omitted)
     Link to paper: https://doi.org/10.1016/0010-4655(93)90005-W
     -- Input variables --
     data = data histogram
-    mc = weighted MC histogram
-    unweighted_mc = unweighted MC histogream
-    weights = weight of each bin
+    unweighted_mc = unweighted MC histogram, optionally with a leading axis
+                    for multiple MC sources
+    weights = weight of each bin (and source)
+    fixed_mc = optional expectation per bin without MC uncertainty
 
     -- Output --
     llh = LLH values in each bin
 
     -- Notes --
-    Shape of data, mc, unweighted_mc, weights and llh must be identical
+    Shape of data and llh must be identical; unweighted_mc and weights are
+    either of the same shape or have an additional leading source axis.
+    The nuisance parameters are found by `barlow_beeston_solve` for all bins
+    at once.
     """
+    SMALL_VAL = 1.e-10
+
+    data = np.asarray(data, dtype=np.float64)
+    a = np.atleast_2d(np.asarray(unweighted_mc, dtype=np.float64))
+    w = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+
+    A, converged = barlow_beeston_solve(data, a, w, fixed_mc=fixed_mc)
+    if not np.all(converged):
+        print("Something went wrong...")
+        print("Barlow-Beeston solver did not converge in %d bin(s)"
+              % np.sum(~converged))
+        return -np.inf
+
+    f = np.sum(w*A, axis=0)
+    if fixed_mc is not None:
+        f = f + fixed_mc
+    f = np.maximum(f, SMALL_VAL)
+
+    # The loggamma() terms takes care of the log(value!) for non-integer values
+    llh = special.xlogy(data, f) - f - special.loggamma(data + 1)
+    llh += np.sum(
+        special.xlogy(a, A) - A - special.loggamma(a + 1), axis=0
+    )
 
-    # The actual barlow LLH
-    def llh(A_, k, w, a):
-        SMALL_VAL = 1.e-10
-
-        f = w*A_
-
-        # Takes care of log(0) problems
-        if not len(A_) > 1:
-            f = max((f, SMALL_VAL))
-            A_ = max((A_, SMALL_VAL))
-
-        # The loggamma() terms takes care of the log(value!) for non-integer values
-        return -1.*(k*np.log(f) - f + a*np.log(A_) - A_ - special.loggamma(k+1) - special.loggamma(a+1))
-
-    A = np.array(unweighted_mc) # Expected unweighted counts in a bin
-    # For each bin the appropriate 'A' will now be found using the current counts as a seed
-    # This will be done by using a minimiser to ensure that the value of 'A' found minimises the -LLH
-
-    # Find values of A such that llh in each bin is a maximum
-    for i, val in enumerate(A):
-        # If the unweighted MC counts in the bin is 0, A = 0
-        if val == 0:
-            continue
-        # Otherwise, find the value of A
-        arg = (data[i], weights[i], unweighted_mc[i])
-        # Powell works fast and is fine for our purposes
-        result = optimize.minimize(fun=llh, x0=val, args=arg, method='Powell')
-
-        # Check that the minimisation ran properly
-        if result.success:
-            A[i] = result.x
-        else:
-            print("Something went wrong...")
-            print("Minimiser message: ")
-            print("------------------")
-            print(result.message)
-            return -np.inf
-
-    LLH = llh(A, data, weights, unweighted_mc)
-
-    return -1*LLH # Return LLH (not negative LLH)
+    return llh
 
 
+def test_barlow_beeston_solve():
+    """Unit tests for `barlow_beeston_solve`"""
+    rng = np.random.RandomState(0)
+    n_bins = 100
+
+    # Single source: compare to the closed-form solution
+    a = rng.randint(1, 50, n_bins).astype(np.float64)
+    w = rng.uniform(0.01, 3, n_bins)
+    d = rng.poisson(a*w).astype(np.float64)
+    A, converged = barlow_beeston_solve(d, a, w)
+    t = (a*w - d) / (w*(a + d))
+    assert np.all(converged)
+    assert np.allclose(A, a/(1 + w*t), rtol=1e-8)
+
+    # Multiple sources, including empty ones: the solution must be a
+    # stationary point of the likelihood for every populated source
+    a = rng.randint(0, 20, (3, n_bins)).astype(np.float64)
+    w = rng.uniform(0.01, 3, (3, n_bins))
+    d = rng.poisson(np.sum(a*w, axis=0) + 1).astype(np.float64)
+    A, converged = barlow_beeston_solve(d, a, w)
+    assert np.all(converged)
+    f = np.sum(w*A, axis=0)
+    populated = a > 0
+    grad = d*w/f - w + a/np.where(populated, A, 1.) - 1
+    assert np.allclose(grad[populated], 0, atol=1e-6)
+    assert np.all(np.isfinite(barlowLLH(d, a, w)))
+
+    print('<< PASS : test_barlow_beeston_solve >>')
+
+
+if __name__ == '__main__':
+    test_barlow_beeston_solve()
@@ -11,15 +11,18 @@ from __future__ import division
 
 from copy import copy
 from functools import reduce
+import multiprocessing
+from multiprocessing.connection import wait
 import queue
 import threading
 import time
+import traceback
 
-from pisa import OMP_NUM_THREADS
+from pisa import OMP_NUM_THREADS, TARGET
 from pisa.utils.log import logging, set_verbosity
 
 
-__all__ = ['parallel_run']
+__all__ = ['parallel_run', 'ReplicaPool']
 
 __author__ = 'J.L. Lanfranchi'
 
@@ -277,6 +280,267 @@ def parallel_run(func, kind, num_parallel, scalar_func, divided_args_mask,
     return return_values
 
 
+def _replica_worker(conn, func, replica):
+    """Event loop of a `ReplicaPool` worker process: receive chunks of
+    `(points, args)`, evaluate `func(replica, point, *args)` for each point
+    and send back the list of results (or the formatted traceback of the
+    first exception encountered)."""
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        points, args = msg
+        try:
+            results = [func(replica, point, *args) for point in points]
+        except Exception: # pylint: disable=broad-except
+            conn.send((False, traceback.format_exc()))
+        else:
+            conn.send((True, results))
+    conn.close()
+
+
+class ReplicaPool(object):
+    """Pool of worker processes, each holding its own replica of `obj`, on
+    which `func` can be evaluated at many points in parallel.
+
+    Workers are forked from the current process when the pool is created, so
+    the replicas are fully initialized copies of `obj` (no pickling or
+    re-instantiation involved). Memory is shared copy-on-write with the
+    parent, i.e. large read-only arrays (e.g. the event arrays held by the
+    containers of a `DistributionMaker`) are not duplicated; only what a
+    worker writes to (e.g. weights) is copied into the worker. Copy-on-write
+    works per page, though, and reference counting or the garbage collector
+    touching the objects can still trigger copies; objects passed via
+    `shared` therefore move their read-only arrays into shared memory
+    before the workers are forked.
+
+    Parameters
+    ----------
+    obj : object
+        Object to replicate, e.g. a `DistributionMaker`
+
+    func : callable
+        Called as `func(replica, point, *args)` within the workers. Since
+        workers are forked, `func` (as well as `obj`) does not need to be
+        pickle-able, but the points, `args` and return values do.
+
+    num_workers : int or None
+        Number of worker processes. If None, default is
+        `pisa.OMP_NUM_THREADS`.
+
+    shared : sequence
+        Objects with methods `share_arrays` and `release_shared_arrays`
+        (e.g. `obj` itself, if a `DistributionMaker`), the former being
+        called before forking the workers and the latter once the workers
+        have been shut down (see `close`)
+
+    Raises
+    ------
+    ValueError
+        If the platform does not support forking, or if PISA is running on a
+        GPU (CUDA contexts cannot be shared with forked processes).
+
+    """
+    def __init__(self, obj, func, num_workers=None, shared=()):
+        if TARGET == 'cuda':
+            raise ValueError('Cannot fork worker processes with PISA_TARGET'
+                             ' "cuda".')
+        if num_workers is None:
+            num_workers = OMP_NUM_THREADS
+        num_workers = int(num_workers)
+        if num_workers < 1:
+            raise ValueError('`num_workers` must be >= 1; got %d.'
+                             % num_workers)
+        ctx = multiprocessing.get_context('fork')
+
+        self.obj = obj
+        self._conns = []
+        self._processes = []
+        self._pending = None
+        self._shared = []
+        for shared_obj in shared:
+            shared_obj.share_arrays()
+            self._shared.append(shared_obj)
+        for _ in range(num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_replica_worker,
+                                  args=(child_conn, func, obj))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        logging.debug('Started %d replica worker processes', num_workers)
+
+    @property
+    def num_workers(self):
+        """int : number of worker processes"""
+        return len(self._processes)
+
+    def submit(self, points, args=()):
+        """Dispatch `points` to the workers without waiting for the results,
+        such that the caller can do other work in the meantime; retrieve the
+        results with `collect`.
+
+        Points are split into contiguous chunks, one per worker (at most).
+
+        Parameters
+        ----------
+        points : sequence
+        args : tuple
+            Additional arguments passed to `func` for all points
+
+        """
+        if self._pending is not None:
+            raise ValueError('Results of previous submission not collected')
+        if not self._processes:
+            raise ValueError('Pool has been closed')
+        points = list(points)
+        chunksize, singles = divmod(len(points), self.num_workers)
+        start = 0
+        self._pending = []
+        for conn in self._conns:
+            stop = start + chunksize + (1 if singles > 0 else 0)
+            singles -= 1
+            if stop == start:
+                break
+            conn.send((points[start:stop], args))
+            self._pending.append(conn)
+            start = stop
+
+    def collect(self):
+        """Wait for and return the results of the last `submit`.
+
+        Returns
+        -------
+        results : list
+            One return value of `func` per point, in the order of the points
+
+        Raises
+        ------
+        RuntimeError
+            If `func` raised an exception in any of the workers
+
+        """
+        if self._pending is None:
+            raise ValueError('Nothing has been submitted')
+        pending, self._pending = self._pending, None
+        results = []
+        errors = []
+        for conn in pending:
+            success, retval = conn.recv()
+            if success:
+                results.extend(retval)
+            else:
+                errors.append(retval)
+        if errors:
+            raise RuntimeError('Worker process(es) failed:\n%s'
+                               % '\n'.join(errors))
+        return results
+
+    def map(self, points, args=()):
+        """Evaluate `func` on all `points` in parallel and return the
+        results in the order of the points; see `submit` and `collect`."""
+        self.submit(points, args)
+        return self.collect()
+
+    def imap_unordered(self, points, args=()):
+        """Evaluate `func` on `points`, handing out one point at a time to
+        whichever worker is idle, and yield the results as they complete.
+
+        Unlike `map`, which splits the points into one contiguous chunk per
+        worker, this balances the load when the evaluation time varies a lot
+        between points (e.g. fits), and lets the caller process (e.g. store)
+        each result as soon as it is available.
+
+        Parameters
+        ----------
+        points : iterable
+            Consumed lazily
+        args : tuple
+            Additional arguments passed to `func` for all points
+
+        Yields
+        ------
+        result
+            Return value of `func` for a point, in order of completion
+
+        Raises
+        ------
+        RuntimeError
+            If `func` raised an exception in any of the workers; points still
+            being evaluated are waited for, but no new ones are dispatched
+
+        """
+        if self._pending is not None:
+            raise ValueError('Results of previous submission not collected')
+        if not self._processes:
+            raise ValueError('Pool has been closed')
+        points = iter(points)
+        idle = list(self._conns)
+        busy = []
+        errors = []
+        try:
+            while True:
+                while idle and not errors:
+                    try:
+                        point = next(points)
+                    except StopIteration:
+                        break
+                    conn = idle.pop()
+                    conn.send(([point], args))
+                    busy.append(conn)
+                if not busy:
+                    break
+                for conn in wait(busy):
+                    busy.remove(conn)
+                    idle.append(conn)
+                    success, retval = conn.recv()
+                    if success:
+                        yield retval[0]
+                    else:
+                        errors.append(retval)
+        finally:
+            # Don't leave results behind for the next submission if the caller
+            # stops iterating early
+            for conn in busy:
+                conn.recv()
+        if errors:
+            raise RuntimeError('Worker process(es) failed:\n%s'
+                               % '\n'.join(errors))
+
+    def close(self):
+        """Shut down all worker processes and release the arrays shared by
+        the objects in `shared`."""
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join()
+        self._conns = []
+        self._processes = []
+        self._pending = None
+        for shared_obj in self._shared:
+            shared_obj.release_shared_arrays()
+        self._shared = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, '_processes', None) or getattr(self, '_shared', None):
+            self.close()
+
+
 def test_parallel_run():
     """Unit test the parallel_run function"""
     def delay(sec):
@@ -319,6 +583,88 @@ def test_parallel_run():
     logging.info('<< PASS : test_parallel_run >>')
 
 
+def test_ReplicaPool():
+    """Unit test the ReplicaPool class"""
+    class Replica(object):
+        """object holding state that is modified by each evaluation"""
+        def __init__(self):
+            self.offset = 1
+            self.calls = 0
+
+    def func(replica, point, scale):
+        """returns point-dependent value; fails for negative points"""
+        if point < 0:
+            raise ValueError('negative point')
+        replica.calls += 1
+        return replica.offset + scale*point
+
+    replica = Replica()
+    points = list(range(11))
+    with ReplicaPool(replica, func, num_workers=4) as pool:
+        assert pool.num_workers == 4
+        results = pool.map(points, args=(2,))
+        assert results == [1 + 2*p for p in points], results
+
+        # fewer points than workers
+        assert pool.map([3], args=(1,)) == [4]
+
+        pool.submit(points[::-1], args=(0,))
+        assert pool.collect() == [1]*len(points)
+
+        try:
+            pool.map([1, -1, 2], args=(1,))
+        except RuntimeError as err:
+            assert 'negative point' in str(err)
+        else:
+            raise AssertionError('Worker exception not raised')
+
+        # pool remains usable after a worker exception
+        assert pool.map(points, args=(1,)) == [1 + p for p in points]
+
+        results = pool.imap_unordered(iter(points), args=(2,))
+        assert sorted(results) == [1 + 2*p for p in points]
+
+        try:
+            list(pool.imap_unordered([1, -1, 2, 3, 4, 5, 6], args=(1,)))
+        except RuntimeError as err:
+            assert 'negative point' in str(err)
+        else:
+            raise AssertionError('Worker exception not raised')
+
+        # stopping early does not leave stale results in the pipes
+        for _ in pool.imap_unordered(points, args=(1,)):
+            break
+        assert pool.map(points, args=(3,)) == [1 + 3*p for p in points]
+
+    # evaluations happened in the replicas, not on the original object
+    assert replica.calls == 0
+
+    class SharedReplica(Replica):
+        """object sharing its (here: pretend) array data with the workers"""
+        def __init__(self):
+            super().__init__()
+            self.shared = False
+
+        def share_arrays(self):
+            self.shared = True
+
+        def release_shared_arrays(self):
+            self.shared = False
+
+    def is_shared(replica, point): # pylint: disable=unused-argument
+        """returns sharing state seen by the worker"""
+        return replica.shared
+
+    replica = SharedReplica()
+    with ReplicaPool(replica, is_shared, num_workers=2,
+                     shared=[replica]) as pool:
+        assert replica.shared
+        assert pool.map(points) == [True]*len(points)
+    assert not replica.shared
+    logging.info('<< PASS : test_ReplicaPool >>')
+
+
 if __name__ == '__main__':
     set_verbosity(1)
     test_parallel_run()
+    test_ReplicaPool()
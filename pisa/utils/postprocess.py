@@ -16,6 +16,7 @@ from scipy.stats import spearmanr
 from pisa import ureg
 from pisa.analysis.hypo_testing import Labels
 from pisa.utils.fileio import from_file, mkdir, nsort, to_file
+from pisa.utils.fit_table import FitTable
 from pisa.utils.log import logging
 
 __author__ = 'S. Wren'
@@ -87,11 +88,18 @@ class Postprocessor(object):
         contour like a 2D scatter plot.
     inj_param_units : string
         The units used in the hypo_testing injparamscan for plots.
+    num_workers : int
+        Number of processes reading the fit files of hypo_testing output, see
+        `pisa.utils.fit_table.FitTable`. Defaults to the number of CPUs.
 
     Note that a single `logdir` can have different kinds of analyses run
     and results be logged within, so `fluctuate_fid` and `fluctuate_data`
     allows these to be separated from one another.
     """
+    # Keys of fit files that `extract_fit` can take from the fit table (of
+    # the minimizer metadata, only nit, nfev and status are kept)
+    FIT_TABLE_KEYS = ('metric', 'metric_val', 'params', 'minimizer_time',
+                      'minimizer_metadata')
 
     def __init__(self, analysis_type, detector, selection,
                  outdir, formats, test_type=None, logdir=None,
@@ -99,7 +107,8 @@ class Postprocessor(object):
                  scan_file=None, best_fit_file=None,
                  extra_points=None, extra_points_labels=None,
                  other_contours=None, projection_files=None,
-                 pseudo_experiments=None, inj_param_units=None):
+                 pseudo_experiments=None, inj_param_units=None,
+                 num_workers=None):
         expected_analysis_types = ['hypo_testing', 'profile_scan', None]
         if analysis_type not in expected_analysis_types:
             raise ValueError(
@@ -132,6 +141,8 @@ class Postprocessor(object):
         )
         self.fluctuate_fid = fluctuate_fid
         self.fluctuate_data = fluctuate_data
+        self.num_workers = num_workers
+        self.fit_table = None
         # Things to initialise for hypo_testing
         if analysis_type == 'hypo_testing':
             self.test_type = test_type
@@ -982,18 +993,30 @@ class Postprocessor(object):
             Keys to extract. If None, all keys are extracted.
 
         """
+        if isinstance(keys, str):
+            keys = [keys]
+        # Everything but the full file contents can come from the fit table
+        if (keys is not None and self.fit_table is not None
+                and fpath in self.fit_table
+                and set(keys).issubset(self.FIT_TABLE_KEYS)):
+            return self.fit_table.record(fpath, keys)
         try:
             info = from_file(fpath)
         except:
             raise RuntimeError("Cannot read from file located at %s."%fpath)
         if keys is None:
             return info
-        if isinstance(keys, str):
-            keys = [keys]
-        for key in info.keys():
-            if key not in keys:
-                info.pop(key)
-        return info
+        return OrderedDict((key, info[key]) for key in info if key in keys)
+
+    def load_fit_table(self):
+        """Load the fit results of all files below the logdir into
+        `self.fit_table` (once per logdir), parsing only those files that are
+        not in the table cached by a previous run of this processing yet."""
+        logdir = os.path.abspath(
+            os.path.expanduser(os.path.expandvars(self.logdir))
+        )
+        if self.fit_table is None or self.fit_table.rootdir != logdir:
+            self.fit_table = FitTable(logdir, num_workers=self.num_workers)
 
     def get_hypo_from_fiducial_hypo_key(self, fhkey):
         """Returns the hypo from the fiducial/fit-hypothesis key"""
@@ -3712,6 +3735,7 @@ class Postprocessor(object):
     def get_data(self, injparam=None, trueordering=None,
                  systematic=None, direction=None):
         """Get all of the data from the logdir"""
+        self.load_fit_table()
         data_sets = OrderedDict()
         minimiser_info = OrderedDict()
         if injparam is not None:
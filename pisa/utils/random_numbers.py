@@ -81,7 +81,7 @@ def get_random_state(random_state, jumpahead=0):
         state).
 
     """
-    if random_state is None:
+    if random_state is None or random_state is np.random:
         new_random_state = np.random
 
     elif isinstance(random_state, np.random.RandomState):
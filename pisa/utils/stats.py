@@ -18,7 +18,8 @@ __all__ = ['SMALL_POS', 'CHI2_METRICS', 'LLH_METRICS', 'ALL_METRICS',
            'maperror_logmsg',
            'chi2', 'llh', 'log_poisson', 'log_smear', 'conv_poisson',
            'norm_conv_poisson', 'conv_llh', 'barlow_llh', 'mod_chi2', 
-           'mcllh_mean', 'mcllh_eff','generalized_poisson_llh']
+           'mcllh_mean', 'mcllh_eff','generalized_poisson_llh',
+           'METRIC_GRADIENTS', 'chi2_gradient', 'llh_gradient']
 
 __author__ = 'P. Eller, T. Ehrhardt, J.L. Lanfranchi, E. Bourbeau'
 
@@ -143,6 +144,63 @@ def chi2(actual_values, expected_values):
     return chi2_val
 
 
+def chi2_gradient(actual_values, expected_values):
+    """Compute the derivative of `chi2` w.r.t. each of the `expected_values`.
+
+    Parameters
+    ----------
+    actual_values, expected_values : numpy.ndarrays of same shape
+
+    Returns
+    -------
+    chi2_gradient : numpy.ndarray of same shape as inputs
+
+    Notes
+    -----
+    * Uncertainties are not propagated through this calculation.
+    * Values in expectation are clipped to the range [SMALL_POS, inf] as in
+      `chi2`.
+
+    """
+    actual_values = unp.nominal_values(actual_values)
+    expected_values = np.clip(unp.nominal_values(expected_values),
+                              a_min=SMALL_POS, a_max=np.inf)
+    with np.errstate(invalid='ignore'):
+        grad = 1 - np.square(actual_values / expected_values)
+    return np.where(np.isfinite(grad), grad, 0.)
+
+
+def llh_gradient(actual_values, expected_values):
+    """Compute the derivative of `llh` w.r.t. each of the `expected_values`.
+
+    Parameters
+    ----------
+    actual_values, expected_values : numpy.ndarrays of same shape
+
+    Returns
+    -------
+    llh_gradient : numpy.ndarray of same shape as inputs
+
+    Notes
+    -----
+    * Uncertainties are not propagated through this calculation.
+    * Values in `expected_values` are clipped to the range [SMALL_POS, inf] as
+      in `llh`.
+
+    """
+    actual_values = unp.nominal_values(actual_values)
+    expected_values = np.clip(unp.nominal_values(expected_values),
+                              a_min=SMALL_POS, a_max=np.inf)
+    with np.errstate(invalid='ignore'):
+        grad = actual_values / expected_values - 1
+    return np.where(np.isfinite(grad), grad, 0.)
+
+
+METRIC_GRADIENTS = {'chi2': chi2_gradient, 'llh': llh_gradient}
+"""Metrics for which the derivative w.r.t. the expected values is defined,
+mapped to the function computing it"""
+
+
 def llh(actual_values, expected_values):
     """Compute the log-likelihoods (llh) that each count in `actual_values`
     came from the the corresponding expected value in `expected_values`.
@@ -470,53 +528,57 @@ def conv_llh(actual_values, expected_values):
 def barlow_llh(actual_values, expected_values):
     """Compute the Barlow LLH taking into account finite statistics.
     The likelihood is described in this paper: https://doi.org/10.1016/0010-4655(93)90005-W
+
+    The nuisance parameters (expected unweighted MC counts) of all bins are
+    found simultaneously by a vectorized solver, see
+    `pisa.utils.likelihood_functions.barlow_beeston_solve`.
+
     Parameters
     ----------
-    actual_values, expected_values : numpy.ndarrays of same shape
+    actual_values : numpy.ndarray
+
+    expected_values : numpy.ndarray of same shape as `actual_values`, or a
+        sequence of such arrays (one per MC source contributing to each bin)
 
     Returns
     -------
     barlow_llh: numpy.ndarray
 
     """
-     
     actual_values = unp.nominal_values(actual_values).ravel()
-    sigmas = unp.std_devs(expected_values).ravel()
-    expected_values = unp.nominal_values(expected_values).ravel()
-
-    with np.errstate(invalid='ignore'):
-        # Mask off any nan expected values (these are assumed to be ok)
-        actual_values = np.ma.masked_invalid(actual_values)
-        expected_values = np.ma.masked_invalid(expected_values)
-
-        # Check that new array contains all valid entries
-        if np.any(actual_values < 0):
-            msg = ('`actual_values` must all be >= 0...\n'
-                   + maperror_logmsg(actual_values))
-            raise ValueError(msg)
-
-        # TODO: How should we handle nan / masked values in the "data"
-        # (actual_values) distribution? How about negative numbers?
-
-        # Make sure actual values (aka "data") are valid -- no infs, no nans,
-        # etc.
-        if np.any((actual_values < 0) | ~np.isfinite(actual_values)):
-            msg = ('`actual_values` must be >= 0 and neither inf nor nan...\n'
-                   + maperror_logmsg(actual_values))
-            raise ValueError(msg)
-
-        # Check that new array contains all valid entries
-        if np.any(expected_values < 0.0):
-            msg = ('`expected_values` must all be >= 0...\n'
-                   + maperror_logmsg(expected_values))
-            raise ValueError(msg)
-    
-    # TODO(tahmid): Run checks in case expected_values and/or corresponding sigma == 0
-    # and handle these appropriately. If sigma/ev == 0 the code below will fail.
-    unweighted = np.array([(ev/s)**2 for ev, s in zip(expected_values, sigmas)])
-    weights = np.array([s**2/ev for ev, s in zip(expected_values, sigmas)])
+    if isinstance(expected_values, np.ndarray):
+        expected_values = [expected_values]
+    sigmas = np.stack([unp.std_devs(ev).ravel() for ev in expected_values])
+    expected_values = np.stack(
+        [unp.nominal_values(ev).ravel() for ev in expected_values]
+    )
 
-    llh = likelihood_functions.barlowLLH(actual_values, unweighted, weights)
+    # Make sure actual values (aka "data") are valid -- no infs, no nans,
+    # etc.
+    if np.any((actual_values < 0) | ~np.isfinite(actual_values)):
+        msg = ('`actual_values` must be >= 0 and neither inf nor nan...\n'
+               + maperror_logmsg(actual_values))
+        raise ValueError(msg)
+
+    # Check that new array contains all valid entries (nan expected values
+    # are assumed to be ok and are treated as empty)
+    expected_values = np.where(np.isnan(expected_values), 0., expected_values)
+    if np.any(expected_values < 0.0):
+        msg = ('`expected_values` must all be >= 0...\n'
+               + maperror_logmsg(expected_values))
+        raise ValueError(msg)
+
+    # Each source is described by an equivalent number of unweighted events
+    # and a mean weight per event; sources without uncertainty enter the
+    # likelihood as a fixed expectation instead
+    free = (expected_values > 0) & (sigmas > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unweighted = np.where(free, (expected_values/sigmas)**2, 0.)
+        weights = np.where(free, sigmas**2/expected_values, 0.)
+    fixed = np.sum(np.where(free, 0., expected_values), axis=0)
+
+    llh = likelihood_functions.barlowLLH(actual_values, unweighted, weights,
+                                         fixed_mc=fixed)
     return llh
 
 def mod_chi2(actual_values, expected_values):
@@ -43,7 +43,9 @@ from pisa.utils.log import logging, set_verbosity, tprofile
 
 
 __all__ = ['OPT_TYPE', 'FIXED_POINT_IMPL',
-           'fbwkde', 'vbwkde', 'isj_bandwidth', 'test_fbwkde', 'test_vbwkde']
+           'fbwkde', 'vbwkde', 'fbwkde_batch', 'vbwkde_batch',
+           'isj_bandwidth', 'isj_bandwidth_batch',
+           'test_fbwkde', 'test_vbwkde', 'test_fbwkde_batch']
 
 __author__ = 'Z. Botev, J.L. Lanfranchi'
 
@@ -379,6 +381,227 @@ def vbwkde(data, weights=None, n_dct=None, min=None, max=None, n_addl_iter=0,
     return kernel_bandwidths, evaluate_at, density
 
 
+def _sample_bounds(data, offsets, min, max):
+    """Per-sample (min, max) of the range over which densities are computed;
+    defaults are the same as for `fbwkde`"""
+    n_samples = len(offsets) - 1
+    starts = offsets[:-1]
+    minimum = np.minimum.reduceat(data, starts)
+    maximum = np.maximum.reduceat(data, starts)
+    data_range = maximum - minimum
+    if min is None:
+        min = minimum - data_range/2
+    if max is None:
+        max = maximum + data_range/2
+    min = np.broadcast_to(np.asarray(min, dtype=np.float64), (n_samples,))
+    max = np.broadcast_to(np.asarray(max, dtype=np.float64), (n_samples,))
+    return min, max, minimum, maximum
+
+
+def fbwkde_batch(data, offsets, weights=None, n_dct=None, min=None, max=None,
+                 evaluate_dens=True):
+    """Fixed-bandwidth Gaussian KDEs with the Improved Sheather-Jones
+    bandwidth for many samples at once.
+
+    Equivalent to calling `fbwkde` (with `evaluate_at=None`) on each sample,
+    but histogramming, DCTs, and the ISJ root finding are done on arrays
+    covering all samples, which avoids the per-call overhead when there are
+    many small samples.
+
+    Parameters
+    ----------
+    data : array
+        Datapoints of all samples, concatenated
+
+    offsets : array of int
+        Sample `i` is `data[offsets[i]:offsets[i+1]]`; i.e., there are
+        `len(offsets) - 1` samples. Each sample must have at least two
+        datapoints.
+
+    weights : array or None
+        Weights of the datapoints (same layout as `data`)
+
+    n_dct : None or int
+        Number of DCT grid points, shared by all samples. If None, uses the
+        next-highest-power-of-2 above 10 times the size of the largest sample.
+
+    min, max : None, float, or array of float
+        Range over which to compute each sample's density; see `fbwkde` for
+        defaults
+
+    evaluate_dens : bool
+
+    Returns
+    -------
+    bandwidths : array of shape (n_samples,)
+
+    grid : array of shape (n_samples, n_dct)
+        Points at which densities are evaluated (centers of the DCT grid)
+
+    densities : None or array of shape (n_samples, n_dct)
+        Normalized densities on `grid`
+
+    """
+    data = np.asarray(data, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_samples = len(offsets) - 1
+    n_datapoints = np.diff(offsets)
+    if n_samples < 1 or np.any(n_datapoints < 2) or offsets[-1] != len(data):
+        raise ValueError('`offsets` must define samples that cover `data` and'
+                         ' have at least 2 datapoints each')
+    if n_dct is None:
+        n_dct = int(2**np.ceil(np.log2(np.max(n_datapoints)*10)))
+    assert int(n_dct) == n_dct
+    n_dct = int(n_dct)
+
+    min, max, minimum, maximum = _sample_bounds(data, offsets, min, max)
+    hist_range = max - min
+
+    # Histogram all samples into one (n_samples, n_dct) array, assigning
+    # datapoints to bins exactly like `numpy.histogram` does
+    sample_ind = np.repeat(np.arange(n_samples), n_datapoints)
+    in_range = (data >= min[sample_ind]) & (data <= max[sample_ind])
+    sample_ind_in_range = sample_ind[in_range]
+    data_in_range = data[in_range]
+    bin_edges = np.linspace(min, max, n_dct + 1, axis=-1)
+    bin_ind = (
+        (data_in_range - min[sample_ind_in_range])
+        * (n_dct / hist_range[sample_ind_in_range])
+    ).astype(np.int64)
+    bin_ind[bin_ind == n_dct] -= 1
+    bin_ind -= data_in_range < bin_edges[sample_ind_in_range, bin_ind]
+    bin_ind += ((data_in_range >= bin_edges[sample_ind_in_range, bin_ind + 1])
+                & (bin_ind != n_dct - 1))
+    flat_ind = sample_ind_in_range*n_dct + bin_ind
+    if weights is None:
+        data_hist = np.bincount(flat_ind, minlength=n_samples*n_dct)
+        norm = n_datapoints
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        data_hist = np.bincount(flat_ind, weights=weights[in_range],
+                                minlength=n_samples*n_dct)
+        norm = np.add.reduceat(weights, offsets[:-1])
+    data_hist = data_hist.reshape(n_samples, n_dct) / norm[:, np.newaxis]
+
+    # Minimum bandwidth relative to mean of distances between points (which
+    # is the range of the datapoints divided by the number of distances)
+    min_bandwidth = 2*np.pi*(maximum - minimum)/(n_datapoints - 1)
+
+    isj_bw, t_star, dct_data = isj_bandwidth_batch(
+        y=data_hist, n_datapoints=n_datapoints, x_range=hist_range,
+        min_bandwidth=min_bandwidth
+    )
+
+    dx = hist_range / n_dct
+    grid = min[:, np.newaxis] + dx[:, np.newaxis]*(np.arange(n_dct) + 0.5)
+
+    if not evaluate_dens:
+        return isj_bw, grid, None
+
+    # Smooth the discrete-cosine-transformed data using t_star and inverse
+    # DCT to get the densities
+    sm_dct_data = dct_data * np.exp(
+        -np.outer(t_star, np.arange(n_dct)**2) * _PISQ/2
+    )
+    densities = (fftpack.idct(sm_dct_data, norm=None, axis=1)
+                 * (n_dct / hist_range)[:, np.newaxis])
+
+    # Fall back to a sum of Gaussians where the IDCT is numerically unstable
+    for sample_num in np.flatnonzero(np.any(densities < 0, axis=1)):
+        logging.trace(
+            'ISJ encountered numerical instability in IDCT for sample %d;'
+            ' computing its density without the IDCT.', sample_num
+        )
+        sl = slice(offsets[sample_num], offsets[sample_num + 1])
+        densities[sample_num] = gaussians(
+            x=grid[sample_num].astype(FTYPE),
+            mu=data[sl].astype(FTYPE),
+            sigma=np.full(n_datapoints[sample_num], isj_bw[sample_num],
+                          dtype=FTYPE),
+            weights=None if weights is None else weights[sl]
+        )
+
+    # Normalize (trapezoidal rule on the regular grid)
+    integrals = dx * (np.sum(densities, axis=1)
+                      - (densities[:, 0] + densities[:, -1])/2)
+    densities /= integrals[:, np.newaxis]
+
+    return isj_bw, grid, densities
+
+
+def vbwkde_batch(data, offsets, weights=None, n_dct=None, min=None, max=None,
+                 n_addl_iter=0):
+    """Kernel bandwidths of variable-bandwidth Gaussian KDEs for many samples
+    at once, using `fbwkde_batch` for the pilot density estimates.
+
+    The bandwidths are the same as those returned by `vbwkde`; densities can
+    then be evaluated (at arbitrary points) for each sample via
+    `pisa.utils.gaussians.gaussians`.
+
+    Parameters
+    ----------
+    data, offsets, weights, n_dct, min, max
+        See `fbwkde_batch`
+
+    n_addl_iter : int >= 0
+        See `vbwkde`; note that additional iterations are computed one sample
+        at a time
+
+    Returns
+    -------
+    kernel_bandwidths : array
+        One bandwidth per datapoint (same layout as `data`)
+
+    """
+    assert n_addl_iter >= 0 and int(n_addl_iter) == n_addl_iter
+    data = np.asarray(data, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_datapoints = np.diff(offsets)
+
+    min, max, _, _ = _sample_bounds(data, offsets, min, max)
+    isj_bw, grid, pilot_dens = fbwkde_batch(
+        data=data, offsets=offsets, weights=weights, n_dct=n_dct, min=min,
+        max=max, evaluate_dens=True
+    )
+    n_samples, n_dct = pilot_dens.shape
+
+    # Linear interpolation of the pilot densities (on the regular grid, and
+    # constant from the outermost grid points to `min` and `max`) at the
+    # datapoints, for all samples at once
+    sample_ind = np.repeat(np.arange(n_samples), n_datapoints)
+    dx = (max - min) / n_dct
+    pos = (data - grid[sample_ind, 0]) / dx[sample_ind]
+    left = np.clip(np.floor(pos).astype(np.int64), 0, n_dct - 2)
+    frac = np.clip(pos - left, 0, 1)
+    flat_dens = pilot_dens.ravel()
+    left += sample_ind*n_dct
+    pilot_dens_at_datapoints = (flat_dens[left]*(1 - frac)
+                                + flat_dens[left + 1]*frac)
+
+    for _ in range(int(n_addl_iter)):
+        kernel_bandwidths = _abramson_bandwidths(
+            isj_bw, pilot_dens_at_datapoints, offsets, sample_ind
+        )
+        for sample_num in range(n_samples):
+            sl = slice(offsets[sample_num], offsets[sample_num + 1])
+            pilot_dens_at_datapoints[sl] = gaussians(
+                x=data[sl], mu=data[sl], sigma=kernel_bandwidths[sl],
+                weights=None if weights is None else weights[sl]
+            )
+
+    return _abramson_bandwidths(isj_bw, pilot_dens_at_datapoints, offsets,
+                                sample_ind)
+
+
+def _abramson_bandwidths(isj_bw, pilot_dens_at_datapoints, offsets,
+                         sample_ind):
+    """Per-datapoint bandwidths, scaled such that the bandwidth at each
+    sample's maximum density is its ISJ bandwidth (see `vbwkde`)"""
+    max_dens = np.maximum.reduceat(pilot_dens_at_datapoints, offsets[:-1])
+    return (isj_bw[sample_ind] * np.sqrt(max_dens[sample_ind])
+            / np.sqrt(pilot_dens_at_datapoints))
+
+
 def isj_bandwidth(y, n_datapoints, x_range, min_bandwidth):
     """
     Parameters
@@ -467,6 +690,69 @@ def isj_bandwidth(y, n_datapoints, x_range, min_bandwidth):
     return bandwidth, t_star, dct_data
 
 
+def isj_bandwidth_batch(y, n_datapoints, x_range, min_bandwidth):
+    """Vectorized version of `isj_bandwidth` for many histograms at once.
+
+    The fixed point is found by bisection (in log(t)) simultaneously for all
+    rows of `y`, to the same relative precision as `isj_bandwidth`.
+
+    Parameters
+    ----------
+    y : array of float, shape (n_samples, n_dct)
+    n_datapoints : array of int, shape (n_samples,)
+    x_range : array of float, shape (n_samples,)
+    min_bandwidth : array of float, shape (n_samples,)
+
+    Returns
+    -------
+    bandwidth : array of float, shape (n_samples,)
+    t_star : array of float, shape (n_samples,)
+    dct_data : array of float, shape (n_samples, n_dct)
+
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n_datapoints = np.asarray(n_datapoints, dtype=np.float64)
+    x_range = np.asarray(x_range, dtype=np.float64)
+    min_bandwidth = np.asarray(min_bandwidth, dtype=np.float64)
+
+    n_dct = y.shape[1]
+    min_t_star = (min_bandwidth/x_range)**2
+
+    i_range = np.arange(1, n_dct, dtype=np.float64)**2
+    log_i_range = np.log(i_range)
+
+    dct_data = fftpack.dct(y, norm=None, axis=1)
+    dct_data_sq = 0.25 * (dct_data * dct_data)[:, 1:]
+
+    args = n_datapoints, i_range, log_i_range, dct_data_sq
+    tol = np.finfo(np.float64).eps*1e2
+    with np.errstate(all='ignore'):
+        log_lo = np.log(min_t_star/1000)
+        log_hi = np.full_like(log_lo, np.log(0.5))
+        f_lo = _fixed_point_batch(np.exp(log_lo), *args)
+        f_hi = _fixed_point_batch(np.exp(log_hi), *args)
+        bracketed = np.sign(f_lo) * np.sign(f_hi) < 0
+        for _ in range(200):
+            if np.all(log_hi - log_lo < tol):
+                break
+            log_mid = (log_lo + log_hi) / 2
+            f_mid = _fixed_point_batch(np.exp(log_mid), *args)
+            same_as_lo = np.sign(f_mid) == np.sign(f_lo)
+            log_lo = np.where(same_as_lo, log_mid, log_lo)
+            f_lo = np.where(same_as_lo, f_mid, f_lo)
+            log_hi = np.where(same_as_lo, log_hi, log_mid)
+        t_star = np.exp((log_lo + log_hi) / 2)
+
+    if not np.all(bracketed):
+        logging.error('Improved Sheather-Jones bandwidth root-finding failed'
+                      ' for %d of %d samples; using `min_bandwidth` for'
+                      ' these.', np.count_nonzero(~bracketed), len(bracketed))
+    t_star = np.where(bracketed, np.maximum(t_star, min_t_star), min_t_star)
+    bandwidth = np.where(bracketed, np.sqrt(t_star)*x_range, min_bandwidth)
+
+    return bandwidth, t_star, dct_data
+
+
 if OPT_TYPE == 'root':
     def optfunc(f):
         """No-op decorator"""
@@ -483,11 +769,28 @@ elif OPT_TYPE == 'minimum':
 
 _ELL = 7
 _TWOPI2ELL = 2 * _PI**(2*_ELL)
+# Indexed by s (only s = 2, ..., _ELL-1 are used)
 _K0 = np.array([
     (1 + 0.5**(_S + 0.5)) * np.prod(np.arange(1, 2*_S, 2)) * 2/(3*_SQRT2PI)
-    for _S in range(_ELL-1, 1, -1)
+    for _S in range(_ELL)
 ])
 
+
+def _fixed_point_batch(t, n_datapoints, i_range, log_i_range, a2):
+    """ISJ fixed-point calculation as per Botev et al. for many samples at
+    once: `t` and `n_datapoints` are of shape (n_samples,), `a2` of shape
+    (n_samples, len(i_range))"""
+    ex = np.exp(_ELL*log_i_range - np.outer(t, i_range)*_PISQ)
+    eff = _TWOPI2ELL * np.einsum('ij,ij->i', a2, ex)
+
+    for s in range(_ELL-1, 1, -1):
+        t_elap = (_K0[s] / (n_datapoints * eff))**(2 / (3 + 2*s))
+        ex = np.exp(s*log_i_range - np.outer(t_elap, i_range)*_PISQ)
+        eff = 2 * _PI**(2*s) * np.einsum('ij,ij->i', a2, ex)
+
+    return t - (2*n_datapoints*_SQRTPI*eff)**-0.4
+
+
 @optfunc
 @numba_jit(nopython=True, nogil=True, cache=True, fastmath=False)
 def fixed_point_numba_np(t, n_datapoints, i_range, log_i_range, a2):
@@ -689,8 +992,47 @@ def test_weighted_vbwkde():
     logging.info('<< PASS : test_weighted_vbwkde >>')
 
 
+def test_fbwkde_batch():
+    """Test that batched KDEs match those computed one sample at a time"""
+    rand = np.random.RandomState(0)
+    samples = [rand.normal(size=100), rand.noncentral_chisquare(3, 1, 500),
+               rand.uniform(-1, 1, 50), rand.normal(size=2000)]
+    weights = [rand.rand(len(s)) for s in samples]
+    data = np.concatenate(samples)
+    offsets = np.concatenate([[0], np.cumsum([len(s) for s in samples])])
+    n_dct = 2**8
+
+    for wts in [None, weights]:
+        cat_weights = None if wts is None else np.concatenate(wts)
+        bws, grid, dens = fbwkde_batch(data, offsets, weights=cat_weights,
+                                       n_dct=n_dct)
+        kbws = vbwkde_batch(data, offsets, weights=cat_weights, n_dct=n_dct)
+        for num, sample in enumerate(samples):
+            w = None if wts is None else wts[num]
+            ref_bw, ref_x, ref_dens = fbwkde(sample, weights=w, n_dct=n_dct)
+            assert np.isclose(bws[num], ref_bw, rtol=1e-8, atol=0)
+            assert np.allclose(grid[num], ref_x, rtol=1e-12)
+            assert np.allclose(dens[num], ref_dens, rtol=1e-8, atol=1e-12)
+            ref_kbw, _, _ = vbwkde(sample, weights=w, n_dct=n_dct,
+                                   evaluate_dens=False)
+            sl = slice(offsets[num], offsets[num + 1])
+            assert np.allclose(kbws[sl], ref_kbw, rtol=1e-8)
+
+    # Shared range
+    bws, grid, _ = fbwkde_batch(data, offsets, n_dct=n_dct, min=-10, max=20,
+                                evaluate_dens=False)
+    for num, sample in enumerate(samples):
+        ref_bw, _, _ = fbwkde(sample, n_dct=n_dct, min=-10, max=20,
+                              evaluate_dens=False)
+        assert np.isclose(bws[num], ref_bw, rtol=1e-8, atol=0)
+    assert grid[0, 0] == -10 + 30/n_dct/2
+
+    logging.info('<< PASS : test_fbwkde_batch >>')
+
+
 if __name__ == "__main__":
     set_verbosity(2)
+    test_fbwkde_batch()
     test_fbwkde()
     test_vbwkde()
     test_weighted_vbwkde()